@@ -0,0 +1,212 @@
+import os
+import re
+import json
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import (
+    asdict,
+    dataclass,
+    field,
+)
+from typing import (
+    Dict,
+    List,
+    Optional,
+)
+
+import boto3
+from botocore.exceptions import ClientError
+
+# file name of the manifest stored next to each day file
+DAY_MANIFEST = "manifest.json"
+# folder, next to each day file, holding appended fragments of the day
+FRAGMENT_FOLDER = "fragments"
+# seconds that compacted fragments are kept on s3 after they were removed from
+# the day manifest, so readers holding the previous manifest can still read
+# them
+SUPERSEDED_GRACE_SECONDS = 60 * 15
+# concurrent manifest reads when expanding day paths
+MANIFEST_READ_THREADS = 16
+
+# daily gtfs-rt files are named after the start of their day
+# i.e. lamp/RT_VEHICLE_POSITIONS/year=2024/month=5/day=8/2024-05-08T00:00:00.parquet
+DAY_FILE_PATTERN = re.compile(r"day=\d{1,2}/\d{4}-\d{2}-\d{2}T00:00:00\.parquet$")
+FRAGMENT_PATTERN = re.compile(rf"(day=\d{{1,2}})/{FRAGMENT_FOLDER}/[^/]+\.parquet$")
+
+
+@dataclass
+class DayFragment:
+    """
+    a parquet file holding records appended to a day between compactions
+
+    name: file name of the fragment, relative to the day's FRAGMENT_FOLDER
+    num_rows: number of records in the fragment
+    min_feed_timestamp: smallest feed_timestamp in the fragment
+    max_feed_timestamp: largest feed_timestamp in the fragment
+    """
+
+    name: str
+    num_rows: int
+    min_feed_timestamp: int
+    max_feed_timestamp: int
+
+
+@dataclass
+class SupersededFragment:
+    """
+    a fragment that was compacted into the day file, but is kept on s3 until
+    readers of the previous manifest are done with it
+
+    name: file name of the fragment, relative to the day's FRAGMENT_FOLDER
+    superseded_timestamp: time the fragment was removed from the manifest
+    """
+
+    name: str
+    superseded_timestamp: int
+
+
+@dataclass
+class DayManifest:
+    """
+    manifest of all parquet files that make up a day of gtfs-rt records
+
+    compacted: True if the sorted day file exists
+    compacted_max_feed_timestamp: largest feed_timestamp in the day file
+    fragments: appended fragments that have not been compacted into the day
+        file yet
+    superseded: compacted fragments waiting to be deleted from s3, they are
+        not part of the day
+    """
+
+    compacted: bool = False
+    compacted_max_feed_timestamp: Optional[int] = None
+    fragments: List[DayFragment] = field(default_factory=list)
+    superseded: List[SupersededFragment] = field(default_factory=list)
+
+    def to_json(self) -> str:
+        """serialize manifest to a json string"""
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, manifest_json: str) -> "DayManifest":
+        """deserialize manifest from a json string"""
+        manifest = json.loads(manifest_json)
+        return cls(
+            compacted=manifest["compacted"],
+            compacted_max_feed_timestamp=manifest["compacted_max_feed_timestamp"],
+            fragments=[DayFragment(**fragment) for fragment in manifest["fragments"]],
+            superseded=[SupersededFragment(**fragment) for fragment in manifest.get("superseded", [])],
+        )
+
+    def file_paths(self, day_path: str) -> List[str]:
+        """
+        paths of all parquet files in the manifest
+
+        :param day_path: path of the day file the manifest belongs to
+        """
+        paths = [fragment_path(day_path, fragment.name) for fragment in self.fragments]
+        if self.compacted:
+            paths.insert(0, day_path)
+
+        return paths
+
+
+def manifest_path(day_path: str) -> str:
+    """path of the manifest for a day file"""
+    return os.path.join(os.path.dirname(day_path), DAY_MANIFEST)
+
+
+def fragment_path(day_path: str, name: str) -> str:
+    """path of a fragment for a day file"""
+    return os.path.join(os.path.dirname(day_path), FRAGMENT_FOLDER, name)
+
+
+def is_day_path(path: str) -> bool:
+    """check if path is a daily gtfs-rt file that may have a manifest"""
+    return DAY_FILE_PATTERN.search(path) is not None
+
+
+def day_path_from_folder(day_folder: str) -> str:
+    """path of the day file in a year=/month=/day= partitioned day folder"""
+    year = re.findall(r"year=(\d{4})", day_folder)[0]
+    month = re.findall(r"month=(\d{1,2})", day_folder)[0]
+    day = re.findall(r"day=(\d{1,2})", day_folder)[0]
+
+    return os.path.join(day_folder, f"{year}-{int(month):02}-{int(day):02}T00:00:00.parquet")
+
+
+def day_path_from_fragment(path: str) -> str:
+    """
+    convert a fragment path into the path of the day file it belongs to,
+    other paths are returned unchanged
+    """
+    match = FRAGMENT_PATTERN.search(path)
+    if match is None:
+        return path
+
+    return day_path_from_folder(path[: match.end(1)])
+
+
+def read_day_manifest(day_path: str) -> Optional[DayManifest]:
+    """
+    read the manifest of a day file, if it exists
+
+    absolute paths are read from the local filesystem, all other paths are
+    treated as s3 objects, with or without a leading 's3://'
+
+    :return DayManifest if one exists, otherwise None
+    """
+    path = manifest_path(day_path)
+
+    if os.path.isabs(path):
+        if not os.path.exists(path):
+            return None
+        with open(path, "r", encoding="utf8") as manifest_file:
+            return DayManifest.from_json(manifest_file.read())
+
+    bucket, key = path.replace("s3://", "").split("/", 1)
+    try:
+        response = boto3.client("s3").get_object(Bucket=bucket, Key=key)
+    except ClientError as error:
+        if error.response["Error"]["Code"] in ("404", "NoSuchKey"):
+            return None
+        raise
+
+    return DayManifest.from_json(response["Body"].read().decode("utf8"))
+
+
+def read_day_manifests(day_paths: List[str]) -> Dict[str, Optional[DayManifest]]:
+    """
+    read the manifests of several day files concurrently, each manifest is
+    only read once
+
+    :return dict of day path to its DayManifest, or None if it has none
+    """
+    day_paths = list(dict.fromkeys(day_paths))
+    if len(day_paths) < 2:
+        return {path: read_day_manifest(path) for path in day_paths}
+
+    with ThreadPoolExecutor(max_workers=min(MANIFEST_READ_THREADS, len(day_paths))) as executor:
+        return dict(zip(day_paths, executor.map(read_day_manifest, day_paths)))
+
+
+def expand_day_paths(paths: List[str]) -> List[str]:
+    """
+    replace each daily gtfs-rt file path, that has a manifest, with the paths
+    of all parquet files listed in the manifest. fragment paths are resolved to
+    the day file they belong to, so each file is only returned once.
+
+    days without a manifest were written as a single sorted file and are
+    returned unchanged.
+    """
+    resolved_paths = list(dict.fromkeys(day_path_from_fragment(p) for p in paths))
+    manifests = read_day_manifests([path for path in resolved_paths if is_day_path(path)])
+
+    expanded: List[str] = []
+    for path in resolved_paths:
+        manifest = manifests.get(path)
+        if manifest is None:
+            expanded.append(path)
+        else:
+            expanded += manifest.file_paths(path)
+
+    return expanded
@@ -1,10 +1,11 @@
+import math
 import os
+import random
 import re
 import time
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from io import BytesIO
-from threading import current_thread
 from typing import (
     Callable,
     Dict,
@@ -18,6 +19,7 @@ from typing import (
 
 import boto3
 import botocore
+import botocore.config
 import botocore.exceptions
 from botocore.exceptions import ClientError
 import pandas
@@ -28,12 +30,13 @@ import pyarrow.dataset as pd
 from pyarrow import Table, fs
 from pyarrow.util import guid
 
+from lamp_py.aws.day_manifest import expand_day_paths
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
 
-def get_s3_client() -> boto3.client:
+def get_s3_client(max_pool_connections: int = 10) -> boto3.client:
     """Thin function needed for stubbing tests"""
-    return boto3.client("s3")
+    return boto3.client("s3", config=botocore.config.Config(max_pool_connections=max_pool_connections))
 
 
 def upload_file(file_name: str, object_path: str, extra_args: Optional[Dict] = None) -> bool:
@@ -217,6 +220,35 @@ def object_exists(obj: str) -> bool:
         raise exception
 
 
+def object_version(obj: str) -> Optional[str]:
+    """
+    identify the current version of an s3 object, from its ETag and
+    LastModified time
+
+    will raise on any error other than "NoSuchKey"
+
+    :param obj - expected as 's3://my_bucket/object' or 'my_bucket/object'
+
+    :return: "ETag:LastModified" of the object, or None if it does not exist
+    """
+    try:
+        s3_client = get_s3_client()
+
+        # trim off leading s3://
+        obj = obj.replace("s3://", "")
+
+        # split into bucket and object name
+        bucket, obj = obj.split("/", 1)
+
+        object_head = s3_client.head_object(Bucket=bucket, Key=obj)
+        return f"{object_head['ETag']}:{object_head['LastModified'].isoformat()}"
+
+    except botocore.exceptions.ClientError as exception:
+        if exception.response["Error"]["Code"] == "404":
+            return None
+        raise exception
+
+
 def version_check(obj: str, version: str) -> bool:
     """
     compare an s3 file's lamp version to a given version
@@ -372,142 +404,227 @@ def get_last_modified_object(bucket_name: str, file_prefix: str, version: Option
     return None
 
 
-def _move_s3_object(filename: str, to_bucket: str) -> Optional[str]:
-    """
-    move a single s3 file to the to_bucket bucket. break the incoming s3 path
-    into parts that are used for copying. each process will have it's own
-    boto session and resource available, from the _init_process_session function
-    to avoid multi-processing issues
+# s3 delete_objects accepts at most 1000 keys per request
+S3_DELETE_BATCH_SIZE = 1000
 
-    :param filename - expected as 's3://my_bucket/the/path/to/the/file.json
-    :param to_bucket bucket name
 
-    :return - 'None' if exception occured during move, otherwise 'filename'
+def _jittered_backoff(retry_attempt: int, base_seconds: float = 7.5, max_seconds: float = 30.0) -> None:
     """
-    try:
-        process_logger = ProcessLogger("move_s3_object", filename=filename)
-        process_logger.log_start()
+    sleep for a random time between half of and an exponentially growing
+    limit, so objects failing at the same time do not retry at the same time.
 
-        s3_resource = current_thread().__dict__["boto_s3_resource"]
+    with the default of 4 attempts, an object is retried over 26 to 52
+    seconds, in line with the 3 x 15 second retry window moves had before
+    per object retries.
+    """
+    limit = min(max_seconds, base_seconds * 2**retry_attempt)
+    time.sleep(random.uniform(limit / 2, limit))
 
-        # trim off leading s3://
-        copy_key = filename.replace("s3://", "")
-
-        # string before first delimiter is the bucket name
-        from_bucket = copy_key.split("/")[0]
-
-        # trim off bucket name
-        copy_key = copy_key.replace(f"{from_bucket}/", "")
-
-        # json args for cop
-        destination_bucket = s3_resource.Bucket(to_bucket)
-        destination_object = destination_bucket.Object(copy_key)
-        destination_object.copy(
-            {
-                "Bucket": from_bucket,
-                "Key": copy_key,
-            }
-        )
 
-        # delete the source object
-        source_bucket = s3_resource.Bucket(from_bucket)
-        source_object = source_bucket.Object(copy_key)
-        response = source_object.delete()
-        process_logger.add_metadata(**response)
+def _copy_s3_object(
+    s3_client: boto3.client,
+    from_bucket: str,
+    key: str,
+    to_bucket: str,
+    max_attempts: int,
+) -> Optional[Exception]:
+    """
+    server side copy of a single s3 object to to_bucket, retaining its key.
 
-    except Exception as error:
-        _init_process_session()
-        process_logger.log_failure(error)
-        return None
+    objects too large for a single copy_object call (over 5GB) are copied
+    with a managed multipart copy. failed copies are retried with jittered
+    backoff.
 
-    process_logger.log_complete()
-    return filename
+    :return - None if copy succeeded, otherwise the last exception raised
+    """
+    copy_source = {"Bucket": from_bucket, "Key": key}
+    exception: Optional[Exception] = None
+    for retry_attempt in range(max_attempts):
+        try:
+            try:
+                s3_client.copy_object(CopySource=copy_source, Bucket=to_bucket, Key=key)
+            except ClientError as error:
+                if error.response["Error"]["Code"] != "InvalidRequest":
+                    raise
+                s3_client.copy(copy_source, to_bucket, key)
+            return None
+        except Exception as error:
+            exception = error
+            if retry_attempt + 1 < max_attempts:
+                _jittered_backoff(retry_attempt)
+
+    return exception
+
+
+def _delete_s3_objects(
+    s3_client: boto3.client,
+    bucket: str,
+    keys: List[str],
+    max_attempts: int,
+) -> Dict[str, str]:
+    """
+    delete a batch of up to 1000 objects from a bucket with a single
+    delete_objects call. keys that fail to delete are retried with jittered
+    backoff.
+
+    :return - dictionary of keys that could not be deleted to their error
+    """
+    failed = {key: "not attempted" for key in keys}
+    for retry_attempt in range(max_attempts):
+        try:
+            response = s3_client.delete_objects(
+                Bucket=bucket,
+                Delete={
+                    "Objects": [{"Key": key} for key in failed],
+                    "Quiet": True,
+                },
+            )
+            failed = {error["Key"]: error.get("Code", "unknown") for error in response.get("Errors", [])}
+        except Exception as exception:
+            failed = {key: str(exception) for key in failed}
+
+        if len(failed) == 0:
+            break
+        if retry_attempt + 1 < max_attempts:
+            _jittered_backoff(retry_attempt)
 
+    return failed
 
-def _init_process_session() -> None:
+
+def _delete_copied_objects(
+    pool: ThreadPoolExecutor,
+    s3_client: boto3.client,
+    copied_keys: Dict[str, List[str]],
+    max_attempts: int,
+) -> Dict[str, str]:
     """
-    initialization function for any process in multi processing pool needing to
-    use a boto session object
+    delete copied objects from their source buckets in batches of up to 1000
+    keys, run concurrently in pool
 
-    this avoids the expensive operation of creating a new session for every unti of work
-    in the pool
+    :param copied_keys: dictionary of source bucket to copied object keys
 
-    not totally sure this is the best way to retain the session on process initialization
-    but it seems to work
+    :return - dictionary of s3 filepath uris that could not be deleted to
+        their error
     """
-    process_data = current_thread()
-    process_data.__dict__["boto_session"] = boto3.session.Session()
-    process_data.__dict__["boto_s3_resource"] = process_data.__dict__["boto_session"].resource("s3")
+    deletes = []
+    for from_bucket, keys in copied_keys.items():
+        for batch_start in range(0, len(keys), S3_DELETE_BATCH_SIZE):
+            batch = keys[batch_start : batch_start + S3_DELETE_BATCH_SIZE]
+            deletes.append((from_bucket, pool.submit(_delete_s3_objects, s3_client, from_bucket, batch, max_attempts)))
+
+    failed_files: Dict[str, str] = {}
+    for from_bucket, delete_result in deletes:
+        for key, error in delete_result.result().items():
+            failed_files[f"s3://{from_bucket}/{key}"] = error
+
+    return failed_files
 
 
 # pylint: disable=R0914
 # pylint too many local variables (more than 15)
-def move_s3_objects(files: List[str], to_bucket: str) -> List[str]:
+def move_s3_objects(files: List[str], to_bucket: str, max_attempts: int = 4) -> List[str]:
     """
     Move list of S3 objects to to_bucket bucket, retaining the object path.
 
+    objects are copied server side in a pool of threads sharing a single,
+    connection pooled, s3 client. copied objects are then deleted from their
+    source bucket in batches of 1000 keys. copies and deletes are retried per
+    object, with jittered backoff, up to max_attempts times.
+
     :param files: list of s3 filepath uris
     :param destination: directory or S3 bucket to move to formatted without
         leading 's3://'
+    :param max_attempts: attempts to copy or delete each object
 
     :reutrn - list of 3s objects that failed to move
     """
     to_bucket = to_bucket.split("/")[0]
 
-    files_to_move = set(files)
-    found_exception = Exception("No exception reported from s3 move pool.")
-
     # this is the default pool size for a ThreadPoolExecutor as of py3.8
     cpu_count = cast(int, os.cpu_count() if os.cpu_count() is not None else 1)
-    # make sure each pool will have at least 50 files to move
-    files_per_pool = 50
-    # retry attempts on failed file moves
-    retry_count = 3
+    # make sure each thread will have at least 50 files to move
+    files_per_thread = 50
+
+    files_to_move = list(dict.fromkeys(files))
+    pool_size = max(1, min(32, cpu_count + 4, int(len(files_to_move) / files_per_thread)))
 
     process_logger = ProcessLogger(
         "move_s3_objects",
         to_bucket=to_bucket,
-        file_count=len(files),
+        file_count=len(files_to_move),
+        pool_size=pool_size,
     )
     process_logger.log_start()
 
-    for retry_attempt in range(retry_count):
-        max_pool_size = max(1, int(len(files_to_move) / files_per_pool))
-        pool_size = min(32, cpu_count + 4, max_pool_size)
-        process_logger.add_metadata(pool_size=pool_size)
-        results = []
-        try:
-            with ThreadPoolExecutor(max_workers=pool_size, initializer=_init_process_session) as pool:
-                for filename in files_to_move:
-                    results.append(pool.submit(_move_s3_object, filename, to_bucket))
-            for result in results:
-                current_result = result.result()
-                if isinstance(current_result, str):
-                    files_to_move.discard(current_result)
+    failed_files: Dict[str, str] = {}
+    copied_keys: Dict[str, List[str]] = {}
+    try:
+        s3_client = get_s3_client(max_pool_connections=pool_size)
+
+        with ThreadPoolExecutor(max_workers=pool_size) as pool:
+            copies = {}
+            for filename in files_to_move:
+                # expected as 's3://my_bucket/the/path/to/the/file.json
+                from_bucket, _, key = filename.replace("s3://", "").partition("/")
+                if key == "":
+                    failed_files[filename] = "no object key in path"
+                    continue
+                copies[filename] = (
+                    from_bucket,
+                    key,
+                    pool.submit(_copy_s3_object, s3_client, from_bucket, key, to_bucket, max_attempts),
+                )
 
-        except Exception as exception:
-            found_exception = exception
+            for filename, (from_bucket, key, copy_result) in copies.items():
+                copy_exception = copy_result.result()
+                if copy_exception is None:
+                    copied_keys.setdefault(from_bucket, []).append(key)
+                else:
+                    failed_files[filename] = str(copy_exception)
 
-        # all files moved, exit retry loop
-        if len(files_to_move) == 0:
-            break
+            failed_files.update(_delete_copied_objects(pool, s3_client, copied_keys, max_attempts))
 
-        # wait for gremlins to disappear
-        time.sleep(15)
+    except Exception as exception:
+        process_logger.log_failure(exception)
+        return files_to_move
+
+    for filename, error in failed_files.items():
+        file_logger = ProcessLogger("move_s3_object", filename=filename)
+        file_logger.log_start()
+        file_logger.log_failure(Exception(error))
 
-    process_logger.add_metadata(failed_count=len(files_to_move), retry_attempts=retry_attempt)
+    process_logger.add_metadata(
+        failed_count=len(failed_files),
+        delete_batch_count=sum(math.ceil(len(keys) / S3_DELETE_BATCH_SIZE) for keys in copied_keys.values()),
+    )
 
-    if len(files_to_move) == 0:
+    if len(failed_files) == 0:
         process_logger.log_complete()
     else:
-        process_logger.log_failure(exception=found_exception)
+        process_logger.log_failure(exception=Exception(f"{len(failed_files)} objects failed to move"))
 
-    return list(files_to_move)
+    return list(failed_files)
 
 
 # pylint: enable=R0914
 
 
+def move_s3_objects_async(files: List[str], to_bucket: str, max_attempts: int = 4) -> "Future[List[str]]":
+    """
+    run move_s3_objects in a background thread, so callers can continue
+    working while objects are moved
+
+    :return - future resolving to the list of s3 objects that failed to move
+    """
+    # the executor is shut down without waiting, its thread exits once the
+    # move is complete
+    executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="move_s3_objects")
+    try:
+        return executor.submit(move_s3_objects, files, to_bucket, max_attempts)
+    finally:
+        executor.shutdown(wait=False)
+
+
 # pylint: disable=R0913
 # pylint too many arguments (more than 5)
 def write_parquet_file(
@@ -650,22 +767,40 @@ def _get_pyarrow_dataset(
     return ds
 
 
-def read_parquet(
+def _expand_day_paths(filename: Union[str, List[str]]) -> List[str]:
+    """
+    resolve daily gtfs-rt files, that are made up of a compacted day file and
+    appended fragments, into the list of parquet files to read
+    """
+    if isinstance(filename, str):
+        filename = [filename]
+
+    return expand_day_paths(filename)
+
+
+def read_parquet_table(
     filename: Union[str, List[str]],
     columns: Optional[List[str]] = None,
     filters: Optional[pd.Expression] = None,
-) -> pandas.core.frame.DataFrame:
+) -> Table:
     """
-    read parquet file or files from s3 and return it as a pandas dataframe
+    read parquet file or files from s3 and return it as a pyarrow table
+
+    daily gtfs-rt files with a day manifest are read as the compacted day file
+    plus all of its appended fragments
 
     if requested column from "columns" does not exist in parquet file then
     the column will be added as all nulls, this was added to capture
     vehicle.trip.revenue field from VehiclePosition files starting december 2023
     """
+    # day manifests are read once per call, fragments they list stay on s3
+    # for a grace period after compaction, so they can be reused on retry
+    paths = _expand_day_paths(filename)
+
     retry_attempts = 2
     for retry_attempt in range(retry_attempts + 1):
         try:
-            ds = _get_pyarrow_dataset(filename, filters)
+            ds = _get_pyarrow_dataset(paths, filters)
             if columns is None:
                 table = ds.to_table(columns=columns)
 
@@ -674,15 +809,47 @@ def read_parquet(
                 table = ds.to_table(columns=read_columns)
                 for null_column in set(columns).difference(ds.schema.names):
                     table = table.append_column(null_column, pa.nulls(table.num_rows))
+                table = table.select(columns)
 
-            df = table.to_pandas(self_destruct=True)
             break
         except Exception as exception:
             if retry_attempt == retry_attempts:
                 raise exception
             time.sleep(1)
 
-    return df
+    return table
+
+
+def read_parquet(
+    filename: Union[str, List[str]],
+    columns: Optional[List[str]] = None,
+    filters: Optional[pd.Expression] = None,
+) -> pandas.core.frame.DataFrame:
+    """
+    read parquet file or files from s3 and return it as a pandas dataframe
+
+    see read_parquet_table for handling of day manifests and missing columns
+    """
+    return read_parquet_table(filename, columns=columns, filters=filters).to_pandas(self_destruct=True)
+
+
+def read_parquet_batches(
+    filename: Union[str, List[str]],
+    max_rows: int = 100_000,
+    columns: Optional[List[str]] = None,
+    filters: Optional[pd.Expression] = None,
+) -> Iterator[pa.RecordBatch]:
+    """
+    read parquet file or files from s3 IN CHUNKS
+    return chunks as pyarrow record batches
+
+    batches have at most max_rows rows, and may be smaller because of the row
+    group layout of the parquet files
+    """
+    yield from _get_pyarrow_dataset(_expand_day_paths(filename), filters).to_batches(
+        columns=columns,
+        batch_size=max_rows,
+    )
 
 
 def read_parquet_chunks(
@@ -698,8 +865,5 @@ def read_parquet_chunks(
     chunk size attempts to be close to max_rows parameter, but may sometimes
     overshoot because of chunk layout of pyarrow table
     """
-    for batch in _get_pyarrow_dataset(filename, filters).to_batches(
-        columns=columns,
-        batch_size=max_rows,
-    ):
+    for batch in read_parquet_batches(filename, max_rows=max_rows, columns=columns, filters=filters):
         yield batch.to_pandas()
@@ -7,6 +7,7 @@ from datetime import date
 
 import polars as pl
 
+from lamp_py.aws.day_manifest import day_path_from_fragment
 from lamp_py.aws.s3 import file_list_from_s3_with_details
 from lamp_py.aws.s3 import dt_from_obj_path
 from lamp_py.aws.s3 import get_last_modified_object
@@ -49,11 +50,22 @@ def vehicle_position_files_as_frame() -> pl.DataFrame:
         bucket_name=rt_vehicle_positions.bucket,
         file_prefix=rt_vehicle_positions.prefix,
     )
-    vp_df = pl.DataFrame(vp_objects).with_columns(
-        (pl.col("s3_obj_path").map_elements(lambda x: dt_from_obj_path(x).date(), return_dtype=pl.Date)).alias(
-            "service_date"
-        ),
-        pl.lit("gtfs_rt").alias("source"),
+    # daily files may be made up of a compacted day file and fragments listed
+    # in a day manifest. drop the manifests and collapse fragments into the
+    # path of their day file, which is expanded again when it is read.
+    vp_df = (
+        pl.DataFrame(vp_objects)
+        .filter(pl.col("s3_obj_path").str.ends_with(".parquet"))
+        .with_columns(
+            pl.col("s3_obj_path").map_elements(day_path_from_fragment, return_dtype=pl.String),
+        )
+        .unique(subset="s3_obj_path", keep="first", maintain_order=True)
+        .with_columns(
+            (pl.col("s3_obj_path").map_elements(lambda x: dt_from_obj_path(x).date(), return_dtype=pl.Date)).alias(
+                "service_date"
+            ),
+            pl.lit("gtfs_rt").alias("source"),
+        )
     )
 
     # the partition paths record the UTC time that the vehicle positions were
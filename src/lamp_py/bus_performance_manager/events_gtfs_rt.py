@@ -5,8 +5,9 @@ import polars as pl
 from pyarrow.fs import S3FileSystem
 import pyarrow.compute as pc
 
+from lamp_py.aws.day_manifest import expand_day_paths
 from lamp_py.bus_performance_manager.gtfs_utils import bus_routes_for_service_date
-from lamp_py.performance_manager.gtfs_utils import start_time_to_seconds
+from lamp_py.runtime_utils.gtfs_time import gtfs_time_to_seconds_expr, seconds_to_datetime_expr
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
 
@@ -152,6 +153,10 @@ def read_vehicle_positions(service_date: date, gtfs_rt_files: List[str]) -> pl.D
     logger.log_start()
     bus_routes = bus_routes_for_service_date(service_date)
 
+    # daily files with a day manifest are read as their compacted day file and
+    # appended fragments
+    gtfs_rt_files = expand_day_paths(gtfs_rt_files)
+
     try:
         vehicle_positions = _read_with_polars(service_date, gtfs_rt_files, bus_routes)
     except Exception as _:
@@ -219,12 +224,8 @@ def positions_to_events(vehicle_positions: pl.DataFrame) -> pl.DataFrame:
                 "IN_TRANSIT_TO": "gtfs_travel_to_dt",
             }
         )
-        .with_columns(pl.col("start_time").map_elements(start_time_to_seconds, return_dtype=pl.Int64))
-        .with_columns(
-            (pl.col("service_date").str.to_datetime("%Y%m%d") + pl.duration(seconds=pl.col("start_time"))).alias(
-                "start_dt"
-            )
-        )
+        .with_columns(gtfs_time_to_seconds_expr(pl.col("start_time")).alias("start_time"))
+        .with_columns(seconds_to_datetime_expr(pl.col("service_date"), pl.col("start_time")).alias("start_dt"))
         .select(
             [
                 "service_date",
@@ -3,7 +3,7 @@ from datetime import date
 import polars as pl
 
 from lamp_py.bus_performance_manager.gtfs_utils import gtfs_from_parquet
-from lamp_py.performance_manager.gtfs_utils import start_time_to_seconds
+from lamp_py.runtime_utils.gtfs_time import gtfs_time_to_seconds_expr
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
 
@@ -227,13 +227,9 @@ def stop_events_for_date(service_date: date) -> pl.DataFrame:
         #     how="left",
         # )
         .with_columns(
-            (pl.col("arrival_time").map_elements(start_time_to_seconds, return_dtype=pl.Int64)).alias(
-                "arrival_seconds"
-            ),
-            (pl.col("departure_time").map_elements(start_time_to_seconds, return_dtype=pl.Int64)).alias(
-                "departure_seconds"
-            ),
-            pl.col("plan_start_time").map_elements(start_time_to_seconds, return_dtype=pl.Int64),
+            gtfs_time_to_seconds_expr(pl.col("arrival_time")).alias("arrival_seconds"),
+            gtfs_time_to_seconds_expr(pl.col("departure_time")).alias("departure_seconds"),
+            gtfs_time_to_seconds_expr(pl.col("plan_start_time")).alias("plan_start_time"),
             pl.col("direction_id").cast(pl.Int8),
         )
         .with_columns(
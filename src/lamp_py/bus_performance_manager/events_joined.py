@@ -78,28 +78,42 @@ def match_plan_trips(gtfs: pl.DataFrame, schedule: pl.DataFrame) -> pl.DataFrame
     )
 
     # last match attempts to match trips that did not produce matches from exact or asof join
-    # find all scheduled trip within 1 hour of actual drop and most overlap some stop_id's
+    # find all scheduled trip within 1 hour of actual that share at least one stop_id
     # sort by most number of stop_id's in common and then duration difference between start_dt
-    last_matches = []
-    for row in asof_matches.filter(pl.col("plan_trip_id").is_null()).iter_rows(named=True):
-        plan_trip_id = None
-        try:
-            plan_trip_id = (
-                schedule_trips.filter(
-                    pl.col("route_id") == row["route_id"],
-                    pl.col("direction_id") == row["direction_id"],
-                    pl.Expr.abs(pl.col("plan_start_dt") - row["start_dt"]) < pl.duration(hours=1),
-                    pl.col("stop_id").list.set_difference(row["stop_id"]).list.len() < pl.col("stop_id").list.len(),
-                )
-                .sort(
-                    pl.col("stop_id").list.set_difference(row["stop_id"]).list.len(),
-                    pl.Expr.abs(pl.col("plan_start_dt") - row["start_dt"]),
-                )
-                .get_column("plan_trip_id")[0]
-            )
-        except Exception as _:
-            pass
-        last_matches.append({"trip_id": row["trip_id"], "plan_trip_id": plan_trip_id})
+    # candidates for every unmatched trip are built with a single join on route_id and
+    # direction_id, remaining ties are broken by plan_trip_id so matches are deterministic
+    unmatched_trips = asof_matches.filter(pl.col("plan_trip_id").is_null()).select(
+        "trip_id",
+        "route_id",
+        "direction_id",
+        "start_dt",
+        "stop_id",
+    )
+    last_matches = (
+        unmatched_trips.join(
+            schedule_trips.select(
+                "route_id",
+                "direction_id",
+                "plan_trip_id",
+                "plan_start_dt",
+                pl.col("stop_id").alias("plan_stop_id"),
+            ),
+            on=["route_id", "direction_id"],
+            how="inner",
+        )
+        .with_columns(
+            pl.col("plan_stop_id").list.set_difference(pl.col("stop_id")).list.len().alias("missing_stop_count"),
+            pl.Expr.abs(pl.col("plan_start_dt") - pl.col("start_dt")).alias("start_difference"),
+        )
+        .filter(
+            pl.col("start_difference") < pl.duration(hours=1),
+            pl.col("plan_stop_id").list.set_intersection(pl.col("stop_id")).list.len() > 0,
+        )
+        .sort("trip_id", "missing_stop_count", "start_difference", "plan_trip_id")
+        .unique("trip_id", keep="first", maintain_order=True)
+        .select("trip_id", "plan_trip_id")
+    )
+    last_matches = unmatched_trips.select("trip_id").join(last_matches, on="trip_id", how="left")
 
     # join all sets of matches into a single dataframe
     # print("exact", exact_matches.filter(pl.col("plan_trip_id").is_not_null()).select("trip_id", "plan_trip_id"))
@@ -109,7 +123,7 @@ def match_plan_trips(gtfs: pl.DataFrame, schedule: pl.DataFrame) -> pl.DataFrame
         [
             exact_matches.filter(pl.col("plan_trip_id").is_not_null()).select("trip_id", "plan_trip_id"),
             asof_matches.filter(pl.col("plan_trip_id").is_not_null()).select("trip_id", "plan_trip_id"),
-            pl.DataFrame(last_matches, schema={"trip_id": str, "plan_trip_id": str}),
+            last_matches,
         ],
         how="vertical",
         rechunk=True,
@@ -13,6 +13,7 @@ from lamp_py.runtime_utils.remote_files import (
     tm_operator_file,
 )
 from lamp_py.runtime_utils.process_logger import ProcessLogger
+from lamp_py.bus_performance_manager.tm_dimension_cache import tm_dimension_cache
 
 
 def _empty_stop_crossing() -> pl.DataFrame:
@@ -53,7 +54,7 @@ def generate_tm_events(tm_files: List[str]) -> pl.DataFrame:
     # the geo node id is the transit master key and the geo node abbr is the
     # gtfs stop id
     tm_geo_nodes = (
-        pl.scan_parquet(tm_geo_node_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_geo_node_file.s3_uri))
         .select(
             "GEO_NODE_ID",
             "GEO_NODE_ABBR",
@@ -66,7 +67,7 @@ def generate_tm_events(tm_files: List[str]) -> pl.DataFrame:
     # route id.
     # NOTE: some of these route ids have leading zeros
     tm_routes = (
-        pl.scan_parquet(tm_route_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_route_file.s3_uri))
         .select(
             "ROUTE_ID",
             "ROUTE_ABBR",
@@ -78,7 +79,7 @@ def generate_tm_events(tm_files: List[str]) -> pl.DataFrame:
     # the trip id is the transit master key and the trip serial number is the
     # gtfs trip id.
     tm_trips = (
-        pl.scan_parquet(tm_trip_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_trip_file.s3_uri))
         .select(
             "TRIP_ID",
             "TRIP_SERIAL_NUMBER",
@@ -90,7 +91,7 @@ def generate_tm_events(tm_files: List[str]) -> pl.DataFrame:
     # the vehicle id is the transit master key and the property tag is the
     # vehicle label
     tm_vehicles = (
-        pl.scan_parquet(tm_vehicle_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_vehicle_file.s3_uri))
         .select(
             "VEHICLE_ID",
             "PROPERTY_TAG",
@@ -219,7 +220,7 @@ def get_daily_work_pieces(daily_work_piece_files: List[str]) -> pl.DataFrame:
     # be scheduled for a single day of the week but we reuse Runs and Blocks
     # across different scheduled days.
     tm_work_pieces = (
-        pl.scan_parquet(tm_work_piece_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_work_piece_file.s3_uri))
         .select(
             "WORK_PIECE_ID",
             "BLOCK_ID",
@@ -236,7 +237,7 @@ def get_daily_work_pieces(daily_work_piece_files: List[str]) -> pl.DataFrame:
     # Time Table Version Id is similar to our Static Schedule Version keys in
     #   the Rail Performance Manager DB
     tm_blocks = (
-        pl.scan_parquet(tm_block_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_block_file.s3_uri))
         .select(
             "BLOCK_ID",
             "BLOCK_ABBR",
@@ -250,7 +251,7 @@ def get_daily_work_pieces(daily_work_piece_files: List[str]) -> pl.DataFrame:
     # Time Table Version Id is similar to our Static Schedule Version keys in
     #   the Rail Performance Manager DB
     tm_runs = (
-        pl.scan_parquet(tm_run_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_run_file.s3_uri))
         .select(
             "RUN_ID",
             "RUN_DESIGNATOR",
@@ -267,7 +268,7 @@ def get_daily_work_pieces(daily_work_piece_files: List[str]) -> pl.DataFrame:
     # Time Table Version Id is similar to our Static Schedule Version keys in
     #   the Rail Performance Manager DB
     tm_trips = (
-        pl.scan_parquet(tm_trip_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_trip_file.s3_uri))
         .select(
             "TRIP_ID",
             "BLOCK_ID",
@@ -337,7 +338,7 @@ def get_daily_work_pieces(daily_work_piece_files: List[str]) -> pl.DataFrame:
     # Operator Id is the TM Operator Table Key
     # Operator Logon Id is the Badge Number
     tm_operators = (
-        pl.scan_parquet(tm_operator_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_operator_file.s3_uri))
         .select(
             "OPERATOR_ID",
             "ONBOARD_LOGON_ID",
@@ -348,7 +349,7 @@ def get_daily_work_pieces(daily_work_piece_files: List[str]) -> pl.DataFrame:
     # Vehicle Id is the TM Vehicle Table Key
     # Property Tag is Vehicle Label used by the MBTA
     tm_vehicles = (
-        pl.scan_parquet(tm_vehicle_file.s3_uri)
+        pl.scan_parquet(tm_dimension_cache.local_path(tm_vehicle_file.s3_uri))
         .select(
             "VEHICLE_ID",
             "PROPERTY_TAG",
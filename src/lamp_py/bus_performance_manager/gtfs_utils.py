@@ -1,5 +1,5 @@
 from datetime import date
-from typing import List
+from typing import Dict, List, Optional
 
 import polars as pl
 
@@ -8,44 +8,112 @@ from lamp_py.runtime_utils.process_logger import ProcessLogger
 from lamp_py.runtime_utils.remote_files import compressed_gtfs
 
 
-def gtfs_from_parquet(file: str, service_date: date) -> pl.DataFrame:
+class GtfsDateCache:
+    """
+    gtfs tables already resolved for a service date. bus metrics are built one
+    service date at a time and several steps use the same tables, so only the
+    tables of the most recent service date are kept.
     """
-    Get GTFS data from specified file and service date
 
-    This will read from s3_uri of file
+    def __init__(self) -> None:
+        self.service_date: Optional[date] = None
+        self.tables: Dict[str, pl.DataFrame] = {}
 
-    :param file: gtfs file to acces (i.e. "feed_info")
-    :param service_date: service date of requested GTFS data
+    def tables_for(self, service_date: date) -> Dict[str, pl.DataFrame]:
+        """cached tables for service_date, dropping those of any other date"""
+        if service_date != self.service_date:
+            self.service_date = service_date
+            self.tables = {}
+        return self.tables
 
-    :return dataframe:
-        data columns of parquet file for service_date
+
+gtfs_date_cache = GtfsDateCache()
+
+
+def gtfs_parquet_path(file: str, service_date: date) -> str:
     """
-    logger = ProcessLogger("gtfs_from_parquet", file=file, service_date=service_date)
-    logger.log_start()
+    Path of the yearly compressed GTFS parquet file holding a service date,
+    falling back to the previous year for dates before the first feed of a
+    year
 
+    :param file: gtfs file to acces (i.e. "feed_info")
+    :param service_date: service date of requested GTFS data
+    """
     gtfs_year = service_date.year
-    service_date_int = int(service_date.strftime("%Y%m%d"))
-
     gtfs_file = compressed_gtfs.parquet_path(gtfs_year, file).s3_uri
 
     if not object_exists(gtfs_file):
         gtfs_file = compressed_gtfs.parquet_path(gtfs_year - 1, file).s3_uri
         if not object_exists(gtfs_file):
-            exception = FileNotFoundError(f"No GTFS archive files available for {service_date}")
-            logger.log_failure(exception)
-            raise exception
+            raise FileNotFoundError(f"No GTFS archive files available for {service_date}")
+
+    return gtfs_file
+
+
+def scan_gtfs_parquet(gtfs_file: str, service_date: date) -> pl.LazyFrame:
+    """
+    Lazily scan a compressed GTFS parquet file for a service date
+
+    The compressed GTFS archive is written a feed at a time, so row groups
+    cover a single gtfs_active_date / gtfs_end_date range. The active date
+    predicate is pushed into the scan, skipping the row groups of every other
+    feed in the yearly file.
+
+    :param gtfs_file: path of a compressed GTFS parquet file
+    :param service_date: service date of requested GTFS data
 
-    logger.add_metadata(gtfs_file=gtfs_file)
+    :return lazyframe:
+        data columns of parquet file for service_date
+    """
+    service_date_int = int(service_date.strftime("%Y%m%d"))
 
-    gtfs_df = (
-        pl.read_parquet(gtfs_file)
+    return (
+        pl.scan_parquet(gtfs_file)
         .filter(
             (pl.col("gtfs_active_date") <= service_date_int),
             (pl.col("gtfs_end_date") >= service_date_int),
         )
         .drop(["gtfs_active_date", "gtfs_end_date"])
     )
-    logger.add_metadata(gtfs_row_count=gtfs_df.shape[0])
+
+
+def gtfs_from_parquet(file: str, service_date: date) -> pl.DataFrame:
+    """
+    Get GTFS data from specified file and service date
+
+    This will read from s3_uri of file, unless the table was already read for
+    service_date
+
+    :param file: gtfs file to acces (i.e. "feed_info")
+    :param service_date: service date of requested GTFS data
+
+    :return dataframe:
+        data columns of parquet file for service_date
+    """
+    logger = ProcessLogger("gtfs_from_parquet", file=file, service_date=service_date)
+    logger.log_start()
+
+    cached_tables = gtfs_date_cache.tables_for(service_date)
+    if file in cached_tables:
+        logger.add_metadata(cache_hit=True, gtfs_row_count=cached_tables[file].shape[0])
+        logger.log_complete()
+        return cached_tables[file]
+
+    try:
+        gtfs_file = gtfs_parquet_path(file, service_date)
+    except FileNotFoundError as exception:
+        logger.log_failure(exception)
+        raise
+
+    logger.add_metadata(cache_hit=False, gtfs_file=gtfs_file)
+
+    gtfs_df = scan_gtfs_parquet(gtfs_file, service_date).collect()
+    cached_tables[file] = gtfs_df
+
+    logger.add_metadata(
+        gtfs_row_count=gtfs_df.shape[0],
+        gtfs_size_mb=f"{gtfs_df.estimated_size('mb'):.2f}",
+    )
     logger.log_complete()
     return gtfs_df
 
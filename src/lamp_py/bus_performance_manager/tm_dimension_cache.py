@@ -0,0 +1,154 @@
+import fcntl
+import json
+import os
+import uuid
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from lamp_py.aws.s3 import download_file, object_version
+from lamp_py.runtime_utils.process_logger import ProcessLogger
+
+# cache folder shared by every process of the bus performance manager
+TM_DIMENSION_CACHE_DIR = os.path.join("/tmp", "tm_dimensions")
+
+
+@dataclass
+class DimensionCacheStats:
+    """
+    lookups of a TmDimensionCache in this process
+
+    hits: served from disk, already validated during this run
+    revalidated: served from disk after its s3 version was found unchanged
+    misses: downloaded from s3
+    """
+
+    hits: int = 0
+    revalidated: int = 0
+    misses: int = 0
+
+    @property
+    def lookups(self) -> int:
+        """total number of lookups"""
+        return self.hits + self.revalidated + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        """share of lookups served from disk"""
+        if self.lookups == 0:
+            return 0.0
+        return (self.hits + self.revalidated) / self.lookups
+
+
+class TmDimensionCache:
+    """
+    On disk cache of the Transit Master dimension tables (stops, trips,
+    routes, vehicles, ...) that are joined to the stop crossings of every
+    service date. These tables change rarely.
+
+    Each cached file has a json sidecar with the s3 version (ETag and
+    LastModified) it was downloaded at, and the run it was last validated in.
+    A file is revalidated against s3 the first time it is used in a run, and
+    only downloaded if its version changed, so a bus run downloads each
+    dimension at most once. The folder is shared by the service date processes
+    of a run, a lock file per dimension keeps them from downloading it
+    concurrently.
+    """
+
+    def __init__(self, cache_dir: str = TM_DIMENSION_CACHE_DIR) -> None:
+        self.cache_dir = cache_dir
+        self.stats = DimensionCacheStats()
+
+        # used when no run was started, files are validated once per process
+        self.process_run_id = uuid.uuid4().hex
+
+    @property
+    def run_id_path(self) -> str:
+        """file holding the id of the current bus run"""
+        return os.path.join(self.cache_dir, "run_id")
+
+    def start_run(self) -> None:
+        """start a new bus run, every dimension is revalidated on its next use"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        with open(f"{self.run_id_path}.tmp", "w", encoding="utf8") as run_id_file:
+            run_id_file.write(uuid.uuid4().hex)
+        os.replace(f"{self.run_id_path}.tmp", self.run_id_path)
+
+    def run_id(self) -> str:
+        """id of the current bus run"""
+        try:
+            with open(self.run_id_path, "r", encoding="utf8") as run_id_file:
+                return run_id_file.read()
+        except FileNotFoundError:
+            return self.process_run_id
+
+    def local_path(self, s3_uri: str) -> str:
+        """
+        local path of an up to date copy of a dimension table. paths that are
+        not on s3 are returned unchanged.
+        """
+        if not s3_uri.startswith("s3://"):
+            return s3_uri
+
+        logger = ProcessLogger("tm_dimension_cache", s3_uri=s3_uri)
+        logger.log_start()
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        local_path = os.path.join(self.cache_dir, s3_uri.replace("s3://", "").replace("/", "__"))
+        run_id = self.run_id()
+
+        with open(f"{local_path}.lock", "w", encoding="utf8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+
+            cached = self.read_cache_info(local_path)
+            if cached is not None and cached["run_id"] == run_id:
+                self.stats.hits += 1
+                result = "hit"
+            else:
+                version = object_version(s3_uri)
+                if version is None:
+                    exception = FileNotFoundError(f"No Transit Master dimension file at {s3_uri}")
+                    logger.log_failure(exception)
+                    raise exception
+
+                if cached is not None and cached["version"] == version:
+                    self.stats.revalidated += 1
+                    result = "revalidated"
+                else:
+                    if not download_file(object_path=s3_uri, file_name=f"{local_path}.tmp"):
+                        exception = FileNotFoundError(f"Unable to download {s3_uri}")
+                        logger.log_failure(exception)
+                        raise exception
+                    os.replace(f"{local_path}.tmp", local_path)
+                    self.stats.misses += 1
+                    result = "miss"
+
+                self.write_cache_info(local_path, {"version": version, "run_id": run_id})
+
+        logger.add_metadata(
+            result=result,
+            lookups=self.stats.lookups,
+            hit_rate=f"{self.stats.hit_rate:.2f}",
+        )
+        logger.log_complete()
+        return local_path
+
+    @staticmethod
+    def read_cache_info(local_path: str) -> Optional[Dict[str, str]]:
+        """version and run of a cached file, None if it is not cached"""
+        if not os.path.exists(local_path):
+            return None
+        try:
+            with open(f"{local_path}.json", "r", encoding="utf8") as info_file:
+                return json.load(info_file)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    @staticmethod
+    def write_cache_info(local_path: str, cache_info: Dict[str, str]) -> None:
+        """record the version and run of a cached file"""
+        with open(f"{local_path}.json.tmp", "w", encoding="utf8") as info_file:
+            json.dump(cache_info, info_file)
+        os.replace(f"{local_path}.json.tmp", f"{local_path}.json")
+
+
+tm_dimension_cache = TmDimensionCache()
@@ -1,57 +1,202 @@
 import os
+import sys
 import tempfile
+from datetime import date
+from multiprocessing import get_context
+from multiprocessing.connection import wait
+from multiprocessing.process import BaseProcess
+from typing import Callable, Dict, List, Optional
+
+import psutil
 
 from lamp_py.bus_performance_manager.event_files import event_files_to_load
 from lamp_py.bus_performance_manager.events_metrics import bus_performance_metrics
+from lamp_py.bus_performance_manager.tm_dimension_cache import tm_dimension_cache
 from lamp_py.runtime_utils.remote_files import bus_events
 from lamp_py.runtime_utils.remote_files import VERSION_KEY
+from lamp_py.runtime_utils.cpu_count import available_cpu_count
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 from lamp_py.aws.s3 import upload_file
 
+# memory a service date process may use before it is stopped and its service
+# date is marked as failed
+SERVICE_DATE_MEMORY_MB = 6144
+
+# seconds between memory checks of running service date processes
+MEMORY_CHECK_SECONDS = 1.0
+
+WriteServiceDate = Callable[[date, List[str], List[str]], bool]
+
+
+def write_service_date(service_date: date, gtfs_files: List[str], tm_files: List[str]) -> bool:
+    """
+    Write the bus-performance parquet file for a single service date to S3
+
+    :return True if the file was written, False if the service date failed
+    """
+    day_logger = ProcessLogger(
+        "write_bus_metrics_day",
+        service_date=service_date,
+        gtfs_file_count=len(gtfs_files),
+        tm_file_count=len(tm_files),
+    )
+    day_logger.log_start()
+
+    # need gtfs_rt files to run process
+    if len(gtfs_files) == 0:
+        day_logger.log_failure(FileNotFoundError(f"No RT_VEHICLE_POSITION files found for {service_date}"))
+        return False
+
+    try:
+        events_df = bus_performance_metrics(service_date, gtfs_files, tm_files)
+        day_logger.add_metadata(bus_performance_rows=events_df.shape[0])
+
+        with tempfile.TemporaryDirectory() as tempdir:
+            write_file = f"{service_date.strftime('%Y%m%d')}.parquet"
+            events_df.write_parquet(os.path.join(tempdir, write_file), use_pyarrow=True)
+
+            if not upload_file(
+                file_name=os.path.join(tempdir, write_file),
+                object_path=os.path.join(bus_events.s3_uri, write_file),
+                extra_args={"Metadata": {VERSION_KEY: bus_events.version}},
+            ):
+                raise RuntimeError(f"Unable to upload bus performance file for {service_date}")
+
+        day_logger.log_complete()
+        return True
+    except Exception as exception:
+        day_logger.log_failure(exception)
+        return False
+
+
+def run_service_date_process(
+    write_date: WriteServiceDate,
+    service_date: date,
+    gtfs_files: List[str],
+    tm_files: List[str],
+) -> None:
+    """
+    service date process entry point, the exit code reports if the service
+    date was written
+    """
+    sys.exit(0 if write_date(service_date, gtfs_files, tm_files) else 1)
+
+
+def service_date_process_count(date_count: int, memory_limit_mb: int = SERVICE_DATE_MEMORY_MB) -> int:
+    """
+    number of service dates to process concurrently, limited by the number of
+    available cores and by available memory.
+    """
+    cpu_count = available_cpu_count()
+    memory_limit = int(psutil.virtual_memory().available / (1024 * 1024) / memory_limit_mb)
+
+    return max(1, min(cpu_count, memory_limit, date_count))
+
+
+def process_memory_mb(process: BaseProcess) -> float:
+    """resident memory of a running process, 0 if it has already exited"""
+    try:
+        return psutil.Process(process.pid).memory_info().rss / (1024 * 1024)
+    except psutil.NoSuchProcess:
+        return 0.0
+
+
+def write_service_dates(
+    event_files: Dict[date, Dict[str, List[str]]],
+    process_count: int,
+    memory_limit_mb: int = SERVICE_DATE_MEMORY_MB,
+    write_date: WriteServiceDate = write_service_date,
+) -> List[date]:
+    """
+    write every service date in its own spawned process, with up to
+    process_count running at once. a service date that fails, crashes its
+    process or uses more than memory_limit_mb is marked as failed without
+    impacting the others. no new service dates are started after SIGTERM.
+
+    :return service dates that failed
+    """
+    context = get_context("spawn")
+    pending = sorted(event_files.keys())
+    running: Dict[date, BaseProcess] = {}
+    failed: List[date] = []
+
+    while len(pending) > 0 or len(running) > 0:
+        if os.environ.get("GOT_SIGTERM") is not None:
+            pending.clear()
 
-def write_bus_metrics() -> None:
+        while len(pending) > 0 and len(running) < process_count:
+            service_date = pending.pop(0)
+            process = context.Process(
+                target=run_service_date_process,
+                args=(
+                    write_date,
+                    service_date,
+                    event_files[service_date]["gtfs_rt"],
+                    event_files[service_date]["transit_master"],
+                ),
+                name=f"write_bus_metrics_{service_date.strftime('%Y%m%d')}",
+            )
+            process.start()
+            running[service_date] = process
+
+        wait([process.sentinel for process in running.values()], timeout=MEMORY_CHECK_SECONDS)
+
+        for service_date, date_process in list(running.items()):
+            exception: Optional[Exception] = None
+            if date_process.is_alive():
+                memory_mb = process_memory_mb(date_process)
+                if memory_mb <= memory_limit_mb:
+                    continue
+                date_process.kill()
+                exception = MemoryError(f"Used {memory_mb:.0f}MB, more than the {memory_limit_mb}MB limit")
+            date_process.join()
+            del running[service_date]
+
+            if date_process.exitcode == 0:
+                continue
+            failed.append(service_date)
+
+            # failures inside of write_date are logged by the service date
+            # process, log the ones that stopped it
+            if exception is None and date_process.exitcode is not None and date_process.exitcode < 0:
+                exception = RuntimeError(f"Service date process exited with signal {-date_process.exitcode}")
+            if exception is not None:
+                day_logger = ProcessLogger("write_bus_metrics_day", service_date=service_date)
+                day_logger.log_start()
+                day_logger.log_failure(exception)
+
+    return sorted(failed)
+
+
+def write_bus_metrics(max_processes: Optional[int] = None) -> None:
     """
     Write bus-performance parquet files to S3 for service dates neeing to be processed
+
+    service dates are independent, so when more than one needs processing they
+    are written concurrently in separate processes, bounded by available cores
+    and memory, and by max_processes if it is set.
     """
     logger = ProcessLogger("write_bus_metrics")
     logger.log_start()
 
     event_files = event_files_to_load()
-    logger.add_metadata(service_date_count=len(event_files))
-
-    for service_date in event_files.keys():
-        gtfs_files = event_files[service_date]["gtfs_rt"]
-        tm_files = event_files[service_date]["transit_master"]
-
-        day_logger = ProcessLogger(
-            "write_bus_metrics_day",
-            service_date=service_date,
-            gtfs_file_count=len(gtfs_files),
-            tm_file_count=len(tm_files),
-        )
-        day_logger.log_start()
-
-        # need gtfs_rt files to run process
-        if len(gtfs_files) == 0:
-            day_logger.log_failure(FileNotFoundError(f"No RT_VEHICLE_POSITION files found for {service_date}"))
-            continue
-
-        try:
-            events_df = bus_performance_metrics(service_date, gtfs_files, tm_files)
-            day_logger.add_metadata(bus_performance_rows=events_df.shape[0])
-
-            with tempfile.TemporaryDirectory() as tempdir:
-                write_file = f"{service_date.strftime('%Y%m%d')}.parquet"
-                events_df.write_parquet(os.path.join(tempdir, write_file), use_pyarrow=True)
-
-                upload_file(
-                    file_name=os.path.join(tempdir, write_file),
-                    object_path=os.path.join(bus_events.s3_uri, write_file),
-                    extra_args={"Metadata": {VERSION_KEY: bus_events.version}},
-                )
-
-            day_logger.log_complete()
-        except Exception as exception:
-            day_logger.log_failure(exception)
+    process_count = service_date_process_count(len(event_files))
+    if max_processes is not None:
+        process_count = max(1, min(process_count, max_processes))
+    logger.add_metadata(service_date_count=len(event_files), process_count=process_count)
+
+    # transit master dimension tables are revalidated once per run, and shared
+    # by the processes of every service date
+    tm_dimension_cache.start_run()
+
+    if process_count == 1:
+        failed_dates = [
+            service_date
+            for service_date, files in event_files.items()
+            if not write_service_date(service_date, files["gtfs_rt"], files["transit_master"])
+        ]
+    else:
+        failed_dates = write_service_dates(event_files, process_count)
 
+    logger.add_metadata(failed_date_count=len(failed_dates))
     logger.log_complete()
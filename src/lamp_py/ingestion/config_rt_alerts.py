@@ -18,6 +18,12 @@ class RtAlertsDetail(GTFSRTDetail):
     def partition_column(self) -> str:
         return "alert.cause"
 
+    @property
+    def append_fragments(self) -> bool:
+        # alerts files are small, and their nested schema can be reset during
+        # a service day, which fragments of the same day can not represent.
+        return False
+
     @property
     def import_schema(self) -> pyarrow.schema:
         return pyarrow.schema(
@@ -0,0 +1,189 @@
+import os
+import json
+import math
+from dataclasses import dataclass
+from typing import (
+    Dict,
+    List,
+)
+
+import psutil
+
+from lamp_py.runtime_utils.process_logger import ProcessLogger
+from lamp_py.ingestion.converter import ConfigType
+
+
+@dataclass
+class ConversionPlan:
+    """
+    limits used by a gtfs-rt converter during a single conversion
+
+    max_table_rows: number of rows a day's table can grow to before it is
+        yielded and written to its day file
+    max_tables: number of tables a converter writes before it stops, leaving
+        any remaining files for the next conversion
+    """
+
+    max_table_rows: int = 2_000_000
+    max_tables: int = 15
+
+
+@dataclass
+class ConversionStats:
+    """
+    observed size of converted gtfs-rt files, as exponential moving averages
+
+    rows_per_file: rows produced from each gtfs-rt file
+    bytes_per_row: in memory arrow bytes of each row
+    """
+
+    rows_per_file: float = 1_000.0
+    bytes_per_row: float = 2_000.0
+
+
+class ConversionScheduler:
+    """
+    Choose batch sizes and converter parallelism for gtfs-rt conversions from
+    the observed rows per file of each config type, available memory, and the
+    number of files waiting to be converted.
+
+    Converters run in their own processes, so observations are shared between
+    conversions through a small json file per config type in stats_folder.
+    """
+
+    # weight of the newest observation in the moving averages
+    smoothing = 0.2
+
+    # fraction of available memory conversions are allowed to use
+    memory_fraction = 0.6
+    # peak memory of a converter relative to the size of its largest table,
+    # tables are concatenated, hashed, de-duplicated and written
+    table_memory_multiple = 4
+
+    min_table_rows = 100_000
+    max_table_rows = 2_000_000
+
+    min_tables = 15
+    max_tables = 120
+
+    def __init__(self, stats_folder: str = "/tmp/gtfs-rt-continuous/stats") -> None:
+        self.stats_folder = stats_folder
+        self.plans: Dict[ConfigType, ConversionPlan] = {}
+
+    def _stats_path(self, config_type: ConfigType) -> str:
+        return os.path.join(self.stats_folder, f"{config_type}.json")
+
+    def stats(self, config_type: ConfigType) -> ConversionStats:
+        """load the observed stats for a config type, or defaults if none"""
+        try:
+            with open(self._stats_path(config_type), "r", encoding="utf8") as stats_file:
+                return ConversionStats(**json.load(stats_file))
+        except (FileNotFoundError, TypeError, ValueError):
+            return ConversionStats()
+
+    def record(self, config_type: ConfigType, file_count: int, row_count: int, byte_count: int) -> None:
+        """
+        update the observed stats of a config type with a completed conversion
+
+        :param file_count: number of files converted
+        :param row_count: number of rows produced from the files
+        :param byte_count: in memory arrow bytes of the rows
+        """
+        if file_count == 0 or row_count == 0:
+            return
+
+        stats = self.stats(config_type)
+        stats.rows_per_file += self.smoothing * (row_count / file_count - stats.rows_per_file)
+        stats.bytes_per_row += self.smoothing * (byte_count / row_count - stats.bytes_per_row)
+
+        os.makedirs(self.stats_folder, exist_ok=True)
+        tmp_path = f"{self._stats_path(config_type)}.tmp"
+        with open(tmp_path, "w", encoding="utf8") as stats_file:
+            json.dump(stats.__dict__, stats_file)
+        os.replace(tmp_path, self._stats_path(config_type))
+
+    def memory_budget(self) -> int:
+        """bytes of memory available to all conversions"""
+        return int(psutil.virtual_memory().available * self.memory_fraction)
+
+    def plan(self, config_type: ConfigType, file_count: int, converter_count: int) -> ConversionPlan:
+        """
+        plan a conversion of file_count files for config_type, when running
+        alongside converter_count - 1 other converters.
+
+        the largest table is sized so that all converters fit in their share
+        of the memory budget. the number of tables is raised above the
+        default when a backlog of files needs more tables to be converted.
+        """
+        stats = self.stats(config_type)
+
+        converter_budget = self.memory_budget() / max(1, converter_count)
+        memory_rows = converter_budget / (stats.bytes_per_row * self.table_memory_multiple)
+        max_table_rows = int(min(self.max_table_rows, max(self.min_table_rows, memory_rows)))
+
+        files_per_table = max(1.0, max_table_rows / max(1.0, stats.rows_per_file))
+        tables_needed = math.ceil(file_count / files_per_table)
+        max_tables = min(self.max_tables, max(self.min_tables, tables_needed))
+
+        return ConversionPlan(max_table_rows=max_table_rows, max_tables=max_tables)
+
+    def parallelism(self, plans: Dict[ConfigType, ConversionPlan]) -> int:
+        """
+        number of converters that can run at the same time without their
+        largest tables exceeding the memory budget
+        """
+        if len(plans) == 0:
+            return 1
+
+        converter_memory = max(
+            plan.max_table_rows * self.stats(config_type).bytes_per_row * self.table_memory_multiple
+            for config_type, plan in plans.items()
+        )
+
+        return int(max(1, min(len(plans), self.memory_budget() // max(1, converter_memory))))
+
+    def schedule(self, file_counts: Dict[ConfigType, int]) -> List[List[ConfigType]]:
+        """
+        plan every conversion and group config types into waves of converters
+        that run concurrently. config types with the most files waiting are
+        run first.
+
+        :param file_counts: number of files waiting for each config type
+
+        :return waves of config types, plans for each are stored in self.plans
+        """
+        process_logger = ProcessLogger("conversion_schedule", config_count=len(file_counts))
+        process_logger.log_start()
+
+        self.plans = {
+            config_type: self.plan(config_type, file_count, len(file_counts))
+            for config_type, file_count in file_counts.items()
+        }
+        parallelism = self.parallelism(self.plans)
+
+        ordered = sorted(file_counts, key=lambda config_type: file_counts[config_type], reverse=True)
+        waves = [ordered[i : i + parallelism] for i in range(0, len(ordered), parallelism)]
+
+        process_logger.add_metadata(
+            memory_budget_mb=int(self.memory_budget() / (1024 * 1024)),
+            parallelism=parallelism,
+            wave_count=len(waves),
+            print_log=False,
+        )
+        for config_type, plan in self.plans.items():
+            stats = self.stats(config_type)
+            plan_logger = ProcessLogger(
+                "conversion_plan",
+                config_type=str(config_type),
+                queue_depth=file_counts[config_type],
+                rows_per_file=int(stats.rows_per_file),
+                bytes_per_row=int(stats.bytes_per_row),
+                max_table_rows=plan.max_table_rows,
+                max_tables=plan.max_tables,
+            )
+            plan_logger.log_start()
+            plan_logger.log_complete()
+
+        process_logger.log_complete()
+
+        return waves
@@ -1,9 +1,15 @@
+import fcntl
 import json
 import logging
 import os
 import shutil
 import tempfile
-from concurrent.futures import ThreadPoolExecutor
+import time
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+)
+from contextlib import contextmanager
 from dataclasses import (
     dataclass,
     field,
@@ -12,32 +18,57 @@ from datetime import (
     datetime,
     timezone,
 )
+from multiprocessing import get_context
 from queue import Queue
 from threading import current_thread
 from typing import (
     Dict,
     Iterable,
+    Iterator,
     List,
     Optional,
     Tuple,
 )
 
 import polars as pl
+import psutil
 import pyarrow
 from pyarrow import fs
 import pyarrow.compute as pc
+import pyarrow.ipc
+import pyarrow.json
 import pyarrow.parquet as pq
 import pyarrow.dataset as pd
-
+from pyarrow.util import guid
+
+from lamp_py.aws.day_manifest import (
+    DAY_MANIFEST,
+    FRAGMENT_FOLDER,
+    SUPERSEDED_GRACE_SECONDS,
+    DayFragment,
+    DayManifest,
+    SupersededFragment,
+    day_path_from_folder,
+    fragment_path,
+    manifest_path,
+    read_day_manifest,
+)
 from lamp_py.aws.s3 import (
+    delete_object,
     move_s3_objects,
+    move_s3_objects_async,
     file_list_from_s3,
     download_file,
     upload_file,
 )
+from lamp_py.runtime_utils.cpu_count import available_cpu_count
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
 from lamp_py.ingestion.config_rt_alerts import RtAlertsDetail
+from lamp_py.ingestion.conversion_scheduler import (
+    ConversionPlan,
+    ConversionScheduler,
+)
 from lamp_py.ingestion.config_busloc_trip import RtBusTripDetail
 from lamp_py.ingestion.config_busloc_vehicle import RtBusVehicleDetail
 from lamp_py.ingestion.config_rt_trip import RtTripDetail
@@ -58,6 +89,42 @@ from lamp_py.runtime_utils.remote_files import (
     S3_ARCHIVE,
 )
 
+GZIP_MAGIC = b"\x1f\x8b"
+
+# records are de-duplicated against other records from the previous 45 minutes
+UNIQUE_WINDOW_SECONDS = 60 * 45
+
+# memory reserved for each gz_to_pyarrow decode process
+DECODE_PROCESS_MEMORY_MB = 512
+
+# lock file in each local day folder, see day_lock
+DAY_LOCK = "day.lock"
+
+
+def decode_process_count(converter_count: int = 1) -> int:
+    """
+    number of gz_to_pyarrow decode processes each of converter_count
+    concurrently running converters can use, limited by the number of
+    available cores and by available memory.
+    """
+    cpu_count = available_cpu_count()
+    memory_limit = int(psutil.virtual_memory().available / (1024 * 1024) / DECODE_PROCESS_MEMORY_MB)
+
+    return max(1, min(cpu_count, memory_limit) // max(1, converter_count))
+
+
+@contextmanager
+def day_lock(day_folder: str) -> Iterator[None]:
+    """
+    exclusive lock of a local day folder. converters hold it while appending
+    a fragment, and the background compaction while it syncs and updates the
+    day manifest, so the two never write the manifest at the same time.
+    """
+    os.makedirs(day_folder, exist_ok=True)
+    with open(os.path.join(day_folder, DAY_LOCK), "w", encoding="utf8") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
 
 @dataclass
 class TableData:
@@ -72,6 +139,8 @@ class TableData:
     files: List[str] = field(default_factory=list)
 
 
+# pylint: disable=R0902
+# Too many instance attributes
 class GtfsRtConverter(Converter):
     """
     Converter that handles GTFS Real Time JSON data
@@ -113,13 +182,26 @@ class GtfsRtConverter(Converter):
         self.error_files: List[str] = []
         self.archive_files: List[str] = []
 
+        # when set above 1, files are decoded in a pool of this many processes
+        # instead of a pool of threads
+        self.decode_processes = 1
+
+        # table size and count limits, set by the ConversionScheduler
+        self.plan = ConversionPlan()
+
+        # files, rows and in memory bytes decoded during this conversion, fed
+        # back to the ConversionScheduler to plan future conversions
+        self.decoded_file_count = 0
+        self.decoded_row_count = 0
+        self.decoded_byte_count = 0
+
     def convert(self) -> None:
-        max_tables_to_convert = 15
         process_logger = ProcessLogger(
             "parquet_table_creator",
             table_type="gtfs-rt",
             config_type=str(self.config_type),
             file_count=len(self.files),
+            max_tables=self.plan.max_tables,
         )
         process_logger.log_start()
 
@@ -133,7 +215,7 @@ class GtfsRtConverter(Converter):
                 table_count += 1
                 process_logger.add_metadata(table_count=table_count)
                 # limit number of tables produced on each event loop
-                if table_count >= max_tables_to_convert:
+                if table_count >= self.plan.max_tables:
                     break
 
         except Exception as exception:
@@ -143,6 +225,19 @@ class GtfsRtConverter(Converter):
         finally:
             self.move_s3_files()
             self.clean_local_folders()
+            try:
+                ConversionScheduler().record(
+                    self.config_type,
+                    file_count=self.decoded_file_count,
+                    row_count=self.decoded_row_count,
+                    byte_count=self.decoded_byte_count,
+                )
+            except Exception as exception:
+                # stats only tune the next plan, failing to record them must
+                # not mask the outcome of the conversion
+                record_logger = ProcessLogger("conversion_scheduler_record", config_type=str(self.config_type))
+                record_logger.log_start()
+                record_logger.log_failure(exception)
 
     def thread_init(self) -> None:
         """
@@ -163,49 +258,53 @@ class GtfsRtConverter(Converter):
 
         only yield a new table when table size crosses over min_rows of yield_check
         """
-        max_workers = 4
-
         process_logger = ProcessLogger(
             "create_pyarrow_tables",
             config_type=str(self.config_type),
+            decode_processes=self.decode_processes,
+            max_table_rows=self.plan.max_table_rows,
         )
         process_logger.log_start()
 
-        with ThreadPoolExecutor(max_workers=max_workers, initializer=self.thread_init) as pool:
-            for result_dt, result_filename, rt_data in pool.map(self.gz_to_pyarrow, self.files):
-                # errors in gtfs_rt conversions are handled in the gz_to_pyarrow
-                # function. if one is encountered, the datetime will be none. log
-                # the error and move on to the next file.
-                if result_dt is None:
-                    self.error_files.append(result_filename)
-                    logging.error(
-                        "gz_to_pyarrow exception when loading: %s",
-                        result_filename,
-                    )
-                    continue
-
-                # create key for self.data_parts dictionary
-                dt_part = datetime(
-                    year=result_dt.year,
-                    month=result_dt.month,
-                    day=result_dt.day,
+        for result_dt, result_filename, rt_data in self.decode_files():
+            # errors in gtfs_rt conversions are handled in the gz_to_pyarrow
+            # function. if one is encountered, the datetime will be none. log
+            # the error and move on to the next file.
+            if result_dt is None:
+                self.error_files.append(result_filename)
+                logging.error(
+                    "gz_to_pyarrow exception when loading: %s",
+                    result_filename,
                 )
+                continue
 
-                # create new self.table_groups entry for key if it doesn't exist
-                if dt_part not in self.data_parts:
-                    self.data_parts[dt_part] = TableData()
-                    self.data_parts[dt_part].table = self.detail.transform_for_write(rt_data)
-                else:
-                    self.data_parts[dt_part].table = pyarrow.concat_tables(
-                        [
-                            self.data_parts[dt_part].table,
-                            self.detail.transform_for_write(rt_data),
-                        ]
-                    )
+            # create key for self.data_parts dictionary
+            dt_part = datetime(
+                year=result_dt.year,
+                month=result_dt.month,
+                day=result_dt.day,
+            )
 
-                self.data_parts[dt_part].files.append(result_filename)
+            rt_data = self.detail.transform_for_write(rt_data)
+            self.decoded_file_count += 1
+            self.decoded_row_count += rt_data.num_rows
+            self.decoded_byte_count += rt_data.nbytes
+
+            # create new self.table_groups entry for key if it doesn't exist
+            if dt_part not in self.data_parts:
+                self.data_parts[dt_part] = TableData()
+                self.data_parts[dt_part].table = rt_data
+            else:
+                self.data_parts[dt_part].table = pyarrow.concat_tables(
+                    [
+                        self.data_parts[dt_part].table,
+                        rt_data,
+                    ]
+                )
 
-                yield from self.yield_check(process_logger)
+            self.data_parts[dt_part].files.append(result_filename)
+
+            yield from self.yield_check(process_logger, min_rows=self.plan.max_table_rows)
 
         # yield any remaining tables
         yield from self.yield_check(process_logger, min_rows=-1)
@@ -213,6 +312,36 @@ class GtfsRtConverter(Converter):
         process_logger.add_metadata(file_count=0, number_of_rows=0)
         process_logger.log_complete()
 
+    def decode_files(self) -> Iterable[Tuple[Optional[datetime], str, Optional[pyarrow.table]]]:
+        """
+        run gz_to_pyarrow on all of the files to be converted, in order.
+
+        decoding is mostly python work that holds the GIL, so when
+        decode_processes is above 1, files are decoded in a pool of processes
+        that send tables back as arrow ipc streams. files are submitted in
+        batches so that a converter that stops early does not wait on, or hold
+        in memory, the decoded tables of every remaining file.
+        """
+        if self.decode_processes <= 1:
+            with ThreadPoolExecutor(max_workers=4, initializer=self.thread_init) as pool:
+                yield from pool.map(self.gz_to_pyarrow, self.files)
+            return
+
+        batch_size = self.decode_processes * 16
+        with ProcessPoolExecutor(
+            max_workers=self.decode_processes,
+            mp_context=get_context("spawn"),
+            initializer=_decode_process_init,
+            initargs=(self.config_type, self.files[:1]),
+        ) as pool:
+            for batch_start in range(0, len(self.files), batch_size):
+                batch = self.files[batch_start : batch_start + batch_size]
+                for result_dt, result_filename, ipc_stream in pool.map(_gz_to_ipc, batch, chunksize=4):
+                    rt_data = None
+                    if ipc_stream is not None:
+                        rt_data = pyarrow.ipc.open_stream(ipc_stream).read_all()
+                    yield (result_dt, result_filename, rt_data)
+
     def yield_check(self, process_logger: ProcessLogger, min_rows: int = 2_000_000) -> Iterable[pyarrow.table]:
         """
         yield all tables in the data_parts map that have been sufficiently
@@ -264,21 +393,17 @@ class GtfsRtConverter(Converter):
             # some of our older files are named incorrectly, with a simple
             # .json suffix rather than a .json.gz suffix. in those cases, the
             # s3 open_input_stream is unable to deduce the correct compression
-            # algo and fails with a UnicodeDecodeError. catch this failure and
-            # retry using a gzip compression algo. (EAFP Style)
-            try:
-                with file_system.open_input_stream(filename) as file:
-                    json_data = json.load(file)
-            except UnicodeDecodeError as _:
+            # algo and returns the raw gzip bytes. check for the gzip magic
+            # number and re-open using a gzip compression algo.
+            with file_system.open_input_stream(filename) as file:
+                feed_bytes = file.read()
+            if feed_bytes[:2] == GZIP_MAGIC:
                 with file_system.open_input_stream(filename, compression="gzip") as file:
-                    json_data = json.load(file)
+                    feed_bytes = file.read()
 
-            # parse timestamp info out of the header
-            feed_timestamp = json_data["header"]["timestamp"]
+            feed_timestamp, table = self.decode_feed(feed_bytes)
             timestamp = datetime.fromtimestamp(feed_timestamp, timezone.utc)
 
-            table = pyarrow.Table.from_pylist(json_data["entity"], schema=self.detail.import_schema)
-
             table = table.append_column(
                 "year",
                 pyarrow.array([timestamp.year] * table.num_rows, pyarrow.uint16()),
@@ -308,6 +433,62 @@ class GtfsRtConverter(Converter):
             table,
         )
 
+    def decode_feed(self, feed_bytes: bytes) -> Tuple[int, pyarrow.Table]:
+        """
+        Decode the bytes of a gtfs realtime json feed into its header timestamp
+        and a pyarrow table of its entities, using the detail import_schema.
+
+        The entire feed is parsed as a single json record by the pyarrow json
+        reader, so the entity array goes straight from bytes into arrow memory
+        without building intermediate python objects. The pyarrow reader is
+        stricter about type coercion than pyarrow.Table.from_pylist (e.g. it
+        will not convert 1.0 into an integer column), so if it rejects the
+        feed, fall back to decoding with the json module.
+
+        @feed_bytes uncompressed json feed
+
+        @return int - timestamp from the feed header
+        @return pyarrow.Table - feed entities with import_schema
+        """
+        feed_schema = pyarrow.schema(
+            [
+                ("header", pyarrow.struct([("timestamp", pyarrow.uint64())])),
+                ("entity", pyarrow.list_(pyarrow.struct(list(self.detail.import_schema)))),
+            ]
+        )
+
+        try:
+            feed = pyarrow.json.read_json(
+                pyarrow.py_buffer(feed_bytes),
+                read_options=pyarrow.json.ReadOptions(
+                    use_threads=False,
+                    # the whole feed must fit in a single block to be parsed
+                    # as a single record
+                    block_size=len(feed_bytes) + 1,
+                ),
+                parse_options=pyarrow.json.ParseOptions(
+                    explicit_schema=feed_schema,
+                    unexpected_field_behavior="ignore",
+                    newlines_in_values=True,
+                ),
+            )
+        except pyarrow.ArrowInvalid:
+            json_data = json.loads(feed_bytes)
+            return (
+                json_data["header"]["timestamp"],
+                pyarrow.Table.from_pylist(json_data["entity"], schema=self.detail.import_schema),
+            )
+
+        feed_timestamp = feed.column("header").combine_chunks().field("timestamp")[0].as_py()
+        entities = feed.column("entity").combine_chunks()
+        if feed.num_rows != 1 or feed_timestamp is None or entities.null_count > 0:
+            raise KeyError("gtfs realtime feed missing header timestamp or entity list")
+
+        return (
+            feed_timestamp,
+            pyarrow.Table.from_struct_array(entities.flatten()),
+        )
+
     def partition_dt(self, table: pyarrow.Table) -> datetime:
         """
         verify partition structure of pyarrow Table
@@ -406,7 +587,7 @@ class GtfsRtConverter(Converter):
 
         out_ds = self.make_hash_dataset(table, local_path)
 
-        unique_ts_min = pc.min(table.column("feed_timestamp")).as_py() - (60 * 45)
+        unique_ts_min = pc.min(table.column("feed_timestamp")).as_py() - UNIQUE_WINDOW_SECONDS
 
         no_hash_schema = out_ds.schema.remove(out_ds.schema.get_field_index(GTFS_RT_HASH_COL))
 
@@ -459,6 +640,303 @@ class GtfsRtConverter(Converter):
 
     # pylint: enable=R0914
 
+    def sync_day_with_s3(self, local_path: str) -> DayManifest:
+        """
+        Load the local manifest of a day. If it does not exist locally, sync
+        the day file, fragments and manifest from S3. Days written before day
+        manifests were introduced only have a day file.
+
+        :param local_path: local tmp path of the day file
+
+        :return DayManifest: manifest of local day files, all local files will
+            have a GTFS_RT_HASH_COL
+        """
+        manifest = read_day_manifest(local_path)
+        if manifest is not None:
+            return manifest
+
+        s3_path = local_path.replace(self.tmp_folder, S3_SPRINGBOARD)
+        manifest = read_day_manifest(s3_path)
+
+        if manifest is None:
+            manifest = DayManifest()
+            if self.sync_with_s3(local_path):
+                manifest.compacted = True
+        else:
+            os.makedirs(os.path.dirname(fragment_path(local_path, "")), exist_ok=True)
+            for s3_file, local_file in zip(manifest.file_paths(s3_path), manifest.file_paths(local_path)):
+                if not download_file(s3_file, local_file):
+                    raise FileNotFoundError(f"unable to download {s3_file} from day manifest")
+
+        for local_file in manifest.file_paths(local_path):
+            hash_gtfs_rt_parquet(local_file)
+
+        if manifest.compacted and manifest.compacted_max_feed_timestamp is None:
+            manifest.compacted_max_feed_timestamp = pc.max(
+                pq.read_table(local_path, columns=["feed_timestamp"]).column("feed_timestamp")
+            ).as_py()
+
+        self.write_manifest(manifest, local_path, upload=False)
+
+        return manifest
+
+    def write_manifest(self, manifest: DayManifest, local_path: str, upload: bool = True) -> None:
+        """
+        write day manifest to local tmp folder and, optionally, upload it to S3
+
+        :param manifest: day manifest to write
+        :param local_path: local tmp path of the day file
+        :param upload: upload the manifest to S3
+        """
+        local_manifest = manifest_path(local_path)
+        os.makedirs(os.path.dirname(local_manifest), exist_ok=True)
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            tmp_manifest = os.path.join(temp_dir, DAY_MANIFEST)
+            with open(tmp_manifest, "w", encoding="utf8") as manifest_file:
+                manifest_file.write(manifest.to_json())
+
+            if upload and not upload_file(tmp_manifest, local_manifest.replace(self.tmp_folder, S3_SPRINGBOARD)):
+                raise ConnectionError(f"unable to upload day manifest {local_manifest}")
+
+            os.replace(tmp_manifest, local_manifest)
+
+    def unique_window_paths(self, manifest: DayManifest, local_path: str, unique_ts_min: int) -> List[str]:
+        """
+        local paths of day file and fragments that may have records with a
+        feed_timestamp at or after unique_ts_min
+        """
+        paths = [
+            fragment_path(local_path, fragment.name)
+            for fragment in manifest.fragments
+            if fragment.max_feed_timestamp >= unique_ts_min
+        ]
+        if manifest.compacted and (manifest.compacted_max_feed_timestamp or 0) >= unique_ts_min:
+            paths.append(local_path)
+
+        return paths
+
+    def append_local_fragment(self, table: pyarrow.Table, local_path: str) -> None:
+        """
+        append new records of pyarrow Table to a day as a new fragment
+
+        records are de-duplicated against each other, and against records of
+        the day within UNIQUE_WINDOW_SECONDS of the table's oldest record, so
+        only fragments inside of that window are read. unlike write_local_pq,
+        records that were already written are never removed, when a late
+        record duplicates a newer one, the newer record is kept.
+
+        :param table: pyarrow Table
+        :param local_path: local tmp path of the day file
+        """
+        logger = ProcessLogger("append_local_fragment", local_path=local_path, table_rows=table.num_rows)
+        logger.log_start()
+
+        with day_lock(os.path.dirname(local_path)):
+            manifest = self.sync_day_with_s3(local_path)
+
+            # rows without a partition value are dropped by the partitioned day
+            # file write, drop them here as well to keep both layouts consistent
+            table = table.filter(pc.field(self.detail.partition_column).is_valid())
+            if table.num_rows == 0:
+                logger.log_complete()
+                return
+
+            table = hash_gtfs_rt_table(table)
+            unique_ts_min = pc.min(table.column("feed_timestamp")).as_py() - UNIQUE_WINDOW_SECONDS
+
+            existing_hashes = pl.DataFrame(schema={GTFS_RT_HASH_COL: pl.Binary})
+            window_paths = self.unique_window_paths(manifest, local_path, unique_ts_min)
+            if window_paths:
+                existing_hashes = pl.DataFrame(
+                    pd.dataset(window_paths).to_table(
+                        columns=[GTFS_RT_HASH_COL],
+                        filter=pc.field("feed_timestamp") >= unique_ts_min,
+                    )
+                )
+
+            sort_order = [(self.detail.partition_column, "ascending")] + (self.detail.table_sort_order or [])
+            fragment_table = (
+                pl.DataFrame(table)
+                .sort(by=["feed_timestamp"])
+                .unique(subset=GTFS_RT_HASH_COL, keep="first")
+                .join(existing_hashes, on=GTFS_RT_HASH_COL, how="anti")
+                .to_arrow()
+                .cast(table.schema)
+                .sort_by(sort_order)
+            )
+
+            logger.add_metadata(fragment_rows=fragment_table.num_rows, window_files=len(window_paths))
+            if fragment_table.num_rows == 0:
+                logger.log_complete()
+                return
+
+            fragment = DayFragment(
+                name=f"{guid()}.parquet",
+                num_rows=fragment_table.num_rows,
+                min_feed_timestamp=pc.min(fragment_table.column("feed_timestamp")).as_py(),
+                max_feed_timestamp=pc.max(fragment_table.column("feed_timestamp")).as_py(),
+            )
+            local_fragment = fragment_path(local_path, fragment.name)
+            os.makedirs(os.path.dirname(local_fragment), exist_ok=True)
+
+            with tempfile.TemporaryDirectory() as temp_dir:
+                upload_path = os.path.join(temp_dir, "upload.parquet")
+                # drop GTFS_RT_HASH_COL column for S3 upload
+                pq.write_table(fragment_table.drop_columns(GTFS_RT_HASH_COL), upload_path)
+                if not upload_file(upload_path, local_fragment.replace(self.tmp_folder, S3_SPRINGBOARD)):
+                    raise ConnectionError(f"unable to upload day fragment {local_fragment}")
+
+            pq.write_table(fragment_table, local_fragment)
+
+            manifest.fragments.append(fragment)
+            self.write_manifest(manifest, local_path)
+
+            logger.add_metadata(fragment_count=len(manifest.fragments))
+            logger.log_complete()
+
+    # pylint: disable=R0914
+    # pylint too many local variables (more than 15)
+    def compact_local_day(self, local_path: str) -> None:
+        """
+        compact fragments of a day, that are outside of the de-duplication
+        window, into the sorted day file.
+
+        compaction rewrites the whole day, so it only runs once enough cold
+        fragments have built up, or once every fragment of the day is cold
+        (i.e. for previous service days).
+
+        the day folder is only locked while the manifest is read and updated.
+        cold fragments are never changed, so the day is rewritten without the
+        lock, and converters can append fragments in the meantime.
+
+        :param local_path: local tmp path of the day file
+        """
+        compaction_fragment_count = 20
+
+        day_folder = os.path.dirname(local_path)
+        with day_lock(day_folder):
+            manifest = self.sync_day_with_s3(local_path)
+            self._delete_superseded_fragments(manifest, local_path)
+
+        cold_ts_max = int(time.time()) - UNIQUE_WINDOW_SECONDS
+
+        cold_fragments = [f for f in manifest.fragments if f.max_feed_timestamp < cold_ts_max]
+        if len(cold_fragments) == 0:
+            return
+        if len(cold_fragments) < compaction_fragment_count and len(cold_fragments) < len(manifest.fragments):
+            return
+
+        logger = ProcessLogger("compact_local_day", local_path=local_path, fragment_count=len(cold_fragments))
+        logger.log_start()
+
+        compact_paths = [fragment_path(local_path, f.name) for f in cold_fragments]
+        if manifest.compacted:
+            compact_paths.insert(0, local_path)
+
+        in_ds = pd.dataset(
+            compact_paths,
+            schema=pyarrow.unify_schemas([pq.read_schema(path) for path in compact_paths]),
+        )
+        no_hash_schema = in_ds.schema.remove(in_ds.schema.get_field_index(GTFS_RT_HASH_COL))
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            hash_pq_path = os.path.join(temp_dir, "hash.parquet")
+            upload_path = os.path.join(temp_dir, "upload.parquet")
+
+            with (
+                pq.ParquetWriter(hash_pq_path, schema=in_ds.schema) as hash_writer,
+                pq.ParquetWriter(upload_path, schema=no_hash_schema) as upload_writer,
+            ):
+                partitions = pc.unique(
+                    in_ds.to_table(columns=[self.detail.partition_column]).column(self.detail.partition_column)
+                )
+                for part in partitions:
+                    write_table = in_ds.to_table(filter=pc.field(self.detail.partition_column) == part)
+                    if self.detail.table_sort_order is not None:
+                        write_table = write_table.sort_by(self.detail.table_sort_order)
+
+                    hash_writer.write_table(write_table)
+                    # drop GTFS_RT_HASH_COL column for S3 upload
+                    upload_writer.write_table(write_table.drop_columns(GTFS_RT_HASH_COL))
+
+            if not upload_file(upload_path, local_path.replace(self.tmp_folder, S3_SPRINGBOARD)):
+                raise ConnectionError(f"unable to upload compacted day file {local_path}")
+
+            # re-read the manifest, fragments appended during the rewrite stay
+            # listed in it
+            with day_lock(day_folder):
+                manifest = self.sync_day_with_s3(local_path)
+                compacted_names = {f.name for f in cold_fragments}
+
+                manifest.compacted = True
+                manifest.compacted_max_feed_timestamp = max(
+                    [f.max_feed_timestamp for f in cold_fragments] + [manifest.compacted_max_feed_timestamp or 0]
+                )
+                manifest.fragments = [f for f in manifest.fragments if f.name not in compacted_names]
+                manifest.superseded += [
+                    SupersededFragment(name=f.name, superseded_timestamp=int(time.time())) for f in cold_fragments
+                ]
+
+                # until the manifest is written, the previous local day file and
+                # manifest are kept so that a failed compaction can be re-attempted
+                self.write_manifest(manifest, local_path)
+                os.replace(hash_pq_path, local_path)
+
+                # local fragments are only removed once the manifest no longer
+                # lists them. readers of s3 may still hold the previous
+                # manifest, so the s3 fragments are deleted by a later
+                # compaction, after a grace period.
+                for fragment in cold_fragments:
+                    os.remove(fragment_path(local_path, fragment.name))
+
+        logger.add_metadata(remaining_fragment_count=len(manifest.fragments))
+        logger.log_complete()
+
+    # pylint: enable=R0914
+
+    def _delete_superseded_fragments(self, manifest: DayManifest, local_path: str) -> None:
+        """
+        delete compacted fragments of a day from s3, once they have been out
+        of the day manifest for SUPERSEDED_GRACE_SECONDS
+
+        :param manifest: day manifest, updated and written if any fragments
+            are deleted
+        :param local_path: local tmp path of the day file
+        """
+        expired_ts_max = int(time.time()) - SUPERSEDED_GRACE_SECONDS
+        expired = [f for f in manifest.superseded if f.superseded_timestamp < expired_ts_max]
+        # fragments that fail to delete stay in the manifest and are
+        # re-attempted by the next compaction
+        deleted = [
+            f
+            for f in expired
+            if delete_object(fragment_path(local_path, f.name).replace(self.tmp_folder, S3_SPRINGBOARD))
+        ]
+        if len(deleted) > 0:
+            manifest.superseded = [f for f in manifest.superseded if f not in deleted]
+            self.write_manifest(manifest, local_path)
+
+    def _local_day_paths(self) -> List[str]:
+        """local tmp paths of the days of this config type with a day manifest"""
+        root_folder = os.path.join(self.tmp_folder, LAMP, str(self.config_type))
+        return sorted(day_path_from_folder(w_dir) for w_dir, _, files in os.walk(root_folder) if DAY_MANIFEST in files)
+
+    def compact_days(self) -> None:
+        """
+        compact the fragments of every local day of this config type, and
+        delete fragments that previous compactions superseded
+        """
+        for local_path in self._local_day_paths():
+            try:
+                self.compact_local_day(local_path)
+            except Exception as exception:
+                # fragments remain readable through the day manifest, the
+                # next compaction will re-attempt it.
+                logger = ProcessLogger("compact_local_day", local_path=local_path)
+                logger.log_start()
+                logger.log_failure(exception)
+
     def continuous_pq_update(self, table: pyarrow.Table) -> None:
         """
         Continuous updating of local parquet files that are synced with S3
@@ -482,7 +960,10 @@ class GtfsRtConverter(Converter):
 
             log.add_metadata(local_path=local_path)
 
-            self.write_local_pq(table, local_path)
+            if self.detail.append_fragments:
+                self.append_local_fragment(table, local_path)
+            else:
+                self.write_local_pq(table, local_path)
             self.send_metadata(local_path.replace(self.tmp_folder, S3_SPRINGBOARD))
 
             log.log_complete()
@@ -512,20 +993,24 @@ class GtfsRtConverter(Converter):
         )
         paths = {}
         for w_dir, _, files in os.walk(root_folder):
-            if len(files) == 0:
+            if len(files) == 0 or os.path.basename(w_dir) == FRAGMENT_FOLDER:
                 continue
             paths[datetime.strptime(w_dir, f"{root_folder}/year=%Y/month=%m/day=%d")] = w_dir
 
-        # remove all local day folders except two most recent
+        # remove all local day folders except two most recent, waiting for
+        # the background compaction to finish updating their manifests
         for key in sorted(paths.keys())[:-days_to_keep]:
-            shutil.rmtree(paths[key])
+            with day_lock(paths[key]):
+                shutil.rmtree(paths[key])
 
     def move_s3_files(self) -> None:
         """
-        move archive and error files to their respective s3 buckets.
+        move archive and error files to their respective s3 buckets. error
+        files are moved in the background while archive files are moved.
         """
+        error_move = None
         if len(self.error_files) > 0:
-            self.error_files = move_s3_objects(
+            error_move = move_s3_objects_async(
                 self.error_files,
                 os.path.join(S3_ERROR, LAMP),
             )
@@ -535,3 +1020,66 @@ class GtfsRtConverter(Converter):
                 self.archive_files,
                 os.path.join(S3_ARCHIVE, LAMP),
             )
+
+        if error_move is not None:
+            self.error_files = error_move.result()
+
+
+# pylint: enable=R0902
+
+
+def compact_gtfs_rt_days() -> None:
+    """
+    compact the day fragments of every gtfs-rt config type that appends
+    fragments. rewriting a day file takes time proportional to the size of the
+    day, so this runs in a background process, on its own cadence, instead of
+    at the end of every conversion.
+    """
+    logger = ProcessLogger("compact_gtfs_rt_days")
+    logger.log_start()
+
+    for config_type in ConfigType:
+        try:
+            converter = GtfsRtConverter(config_type, Queue())
+        except (IgnoreIngestion, NoImplException):
+            continue
+
+        if converter.detail.append_fragments:
+            converter.compact_days()
+
+    logger.log_complete()
+
+
+# converter used by _gz_to_ipc, set by _decode_process_init in each decode
+# process
+_decode_converter: Optional[GtfsRtConverter] = None
+
+
+def _decode_process_init(config_type: ConfigType, files: List[str]) -> None:
+    """
+    initialize a converter in each decode process, using the first file to
+    choose the file system
+    """
+    global _decode_converter  # pylint: disable=W0603
+
+    _decode_converter = GtfsRtConverter(config_type, Queue())
+    _decode_converter.add_files(files)
+    _decode_converter.thread_init()
+
+
+def _gz_to_ipc(filename: str) -> Tuple[Optional[datetime], str, Optional[bytes]]:
+    """
+    run gz_to_pyarrow in a decode process, returning the table as an arrow ipc
+    stream so it can be sent back to the parent process without pickling
+    python objects.
+    """
+    assert _decode_converter is not None, "decode process was not initialized"
+    timestamp, filename, table = _decode_converter.gz_to_pyarrow(filename)
+    if table is None:
+        return (timestamp, filename, None)
+
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+
+    return (timestamp, filename, sink.getvalue().to_pybytes())
@@ -29,6 +29,15 @@ class GTFSRTDetail(ABC):
     def import_schema(self) -> pyarrow.schema:
         """Get the import schema for the parquet table generated by this config"""
 
+    @property
+    def append_fragments(self) -> bool:
+        """
+        Append new records to each day as parquet fragments, listed in a day
+        manifest and periodically compacted into the sorted day file, instead
+        of rewriting the entire day file on every update.
+        """
+        return True
+
     @property
     def table_sort_order(self) -> Optional[List[Tuple[str, str]]]:
         """
@@ -1,5 +1,7 @@
 import os
+import time
 from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
 from queue import Queue
 from typing import (
     Dict,
@@ -13,8 +15,13 @@ from lamp_py.aws.s3 import (
 )
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
+from lamp_py.ingestion.conversion_scheduler import ConversionScheduler
 from lamp_py.ingestion.convert_gtfs import GtfsConverter
-from lamp_py.ingestion.convert_gtfs_rt import GtfsRtConverter
+from lamp_py.ingestion.convert_gtfs_rt import (
+    GtfsRtConverter,
+    compact_gtfs_rt_days,
+    decode_process_count,
+)
 from lamp_py.ingestion.converter import (
     ConfigType,
     Converter,
@@ -29,6 +36,14 @@ from lamp_py.ingestion.utils import group_sort_file_list
 from lamp_py.ingestion.compress_gtfs.gtfs_to_parquet import gtfs_to_parquet
 
 
+# seconds between the starts of background compactions of gtfs-rt day fragments
+COMPACTION_INTERVAL_SECONDS = 60 * 5
+
+# background compaction process, and the time.monotonic it was started at
+_compaction_process: Optional[BaseProcess] = None
+_compaction_started: Optional[float] = None
+
+
 class NoImplConverter(Converter):
     """
     Converter for incoming file formats that are unsupported. It passes all
@@ -63,6 +78,8 @@ def ingest_gtfs_archive(metadata_queue: Queue[Optional[str]]) -> None:
     logger.log_complete()
 
 
+# pylint: disable=R0914
+# pylint too many local variables (more than 15)
 def ingest_s3_files(metadata_queue: Queue[Optional[str]]) -> None:
     """
     get all of the filepaths currently in the incoming bucket, sort them into
@@ -74,6 +91,9 @@ def ingest_s3_files(metadata_queue: Queue[Optional[str]]) -> None:
     logger = ProcessLogger(process_name="ingest_s3_files")
     logger.log_start()
 
+    converters: Dict[ConfigType, Converter] = {}
+    converter_waves: List[List[Converter]] = []
+
     try:
         files = file_list_from_s3(
             bucket_name=S3_INCOMING,
@@ -84,7 +104,6 @@ def ingest_s3_files(metadata_queue: Queue[Optional[str]]) -> None:
 
         # initialize with an error / no impl converter, the rest will be added in as
         # the appear.
-        converters: Dict[ConfigType, Converter] = {}
         error_files: List[str] = []
 
         for file_group in grouped_files.values():
@@ -105,31 +124,91 @@ def ingest_s3_files(metadata_queue: Queue[Optional[str]]) -> None:
         converters[ConfigType.ERROR] = NoImplConverter(ConfigType.ERROR, metadata_queue)
         converters[ConfigType.ERROR].add_files(error_files)
 
+        # size each gtfs-rt conversion from the rows per file previously
+        # observed for its config type, the memory available and the number of
+        # files waiting, and group converters into waves that fit in memory
+        scheduler = ConversionScheduler()
+        rt_converters = {c.config_type: c for c in converters.values() if isinstance(c, GtfsRtConverter)}
+        waves = scheduler.schedule({config_type: len(c.files) for config_type, c in rt_converters.items()})
+        for config_type, plan in scheduler.plans.items():
+            rt_converters[config_type].plan = plan
+
+        # share available cores and memory between the gtfs-rt converters of
+        # each wave for decoding their files in process pools
+        decode_processes = decode_process_count(max((len(wave) for wave in waves), default=1))
+        for rt_converter in rt_converters.values():
+            rt_converter.decode_processes = decode_processes
+        logger.add_metadata(decode_processes=decode_processes, wave_count=len(waves))
+
+        # the error converter only moves files and runs with the first wave
+        converter_waves = [[rt_converters[config_type] for config_type in wave] for wave in waves]
+        if len(converter_waves) == 0:
+            converter_waves.append([])
+        converter_waves[0].append(converters[ConfigType.ERROR])
+
     except Exception as exception:
         logger.log_failure(exception)
+        converter_waves = [list(converters.values())]
 
-    # The remaining converters can be run in parallel
+    # The converters of each wave can be run in parallel
     #
     # Using signal.signal to detect ECS termination and multiprocessing.Manager
     # to manage the metadata queue along with multiprocessing.Pool.map causes
     # inadvertent SIGTERM signals to be sent and blocks the main event loop. To
-    # fix this, we use multiprocessing.Pool.map_async. We use pool.close()
-    # and pool.join() to ensure all work has completed in pools.
+    # avoid this, each converter is started in its own "spawn" process and
+    # joined to ensure all work has completed. Pool workers are daemonic, and
+    # daemonic processes can not start the decode process pools used by the
+    # gtfs-rt converters, so a Pool is not used here.
     #
     # Also worth noting, this application is run on Ubuntu when run on ECS,
     # who's default subprocess start method is "fork". On OSX, this default is
     # "spawn" some of the behavior described above only occurs when using
     # "fork". On OSX (and Windows?) to force this behavior, run
     # multiprocessing.set_start_method("fork") when starting the script.
-    if len(converters) > 0:
-        with get_context("spawn").Pool(processes=len(converters)) as pool:
-            pool.map_async(run_converter, converters.values())
-            pool.close()
-            pool.join()
+    for converter_wave in converter_waves:
+        converter_processes = [
+            get_context("spawn").Process(target=run_converter, args=(converter,)) for converter in converter_wave
+        ]
+        for converter_process in converter_processes:
+            converter_process.start()
+        for converter_process in converter_processes:
+            converter_process.join()
 
     logger.log_complete()
 
 
+# pylint: enable=R0914
+
+
+def start_background_compaction() -> None:
+    """
+    start compacting gtfs-rt day fragments in a background process, at most
+    once every COMPACTION_INTERVAL_SECONDS. the event loop doesn't wait for it,
+    and a new compaction is not started while the previous one is running.
+    """
+    global _compaction_process, _compaction_started  # pylint: disable=W0603
+
+    if _compaction_process is not None:
+        if _compaction_process.is_alive():
+            return
+        _compaction_process.join()
+        _compaction_process = None
+
+    now = time.monotonic()
+    if _compaction_started is not None and now - _compaction_started < COMPACTION_INTERVAL_SECONDS:
+        return
+
+    # daemonic, so a compaction doesn't delay shutting down. an interrupted
+    # compaction is re-attempted from the local day files by the next one.
+    _compaction_process = get_context("spawn").Process(
+        target=compact_gtfs_rt_days,
+        name="compact_gtfs_rt_days",
+        daemon=True,
+    )
+    _compaction_process.start()
+    _compaction_started = now
+
+
 def ingest_gtfs(metadata_queue: Queue[Optional[str]]) -> None:
     """
     ingest all gtfs file types
@@ -139,3 +218,4 @@ def ingest_gtfs(metadata_queue: Queue[Optional[str]]) -> None:
     gtfs_to_parquet()
     ingest_gtfs_archive(metadata_queue)
     ingest_s3_files(metadata_queue)
+    start_background_compaction()
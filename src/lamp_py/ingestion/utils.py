@@ -5,13 +5,12 @@ import shutil
 import pathlib
 import datetime
 import zoneinfo
-import pickle
-import hashlib
 import tempfile
-from typing import Dict, List, Any, Tuple
+from typing import Dict, List
 from urllib import request
 from io import BytesIO
 
+import numpy
 import pyarrow
 import pyarrow.dataset as pd
 import pyarrow.parquet as pq
@@ -206,68 +205,108 @@ def explode_table_column(table: pyarrow.table, column: str) -> pyarrow.table:
     )
 
 
-def hash_gtfs_rt_row(row: Any) -> Tuple[bytes]:
-    """hash row from polars dataframe"""
-    return (hashlib.md5(pickle.dumps(row), usedforsecurity=False).digest(),)
+def gtfs_rt_hash_version() -> bytes:
+    """
+    version of the GTFS_RT_HASH_COL hashing scheme, stored as field metadata
+    on GTFS_RT_HASH_COL.
+
+    polars does not guarantee that hash_rows results are stable across polars
+    releases, so the polars version is part of the scheme version. files
+    hashed with a different scheme, or with the original per-row pickle + md5
+    scheme that stored no version, are re-hashed when they are next loaded.
+    """
+    return f"2-polars-{pl.__version__}".encode()
 
 
-def hash_gtfs_rt_table(table: pyarrow.Table) -> pyarrow.Table:
+def gtfs_rt_hash_field() -> pyarrow.Field:
+    """GTFS_RT_HASH_COL field tagged with the current hash scheme version"""
+    return pyarrow.field(
+        GTFS_RT_HASH_COL,
+        pyarrow.large_binary(),
+        metadata={b"version": gtfs_rt_hash_version()},
+    )
+
+
+def has_current_gtfs_rt_hash(schema: pyarrow.Schema) -> bool:
     """
-    add GTFS_RT_HASH_COL column to pyarrow table, if not already present
+    check if schema has a GTFS_RT_HASH_COL generated by the current hash scheme
     """
-    hash_columns = table.column_names
-    if GTFS_RT_HASH_COL in hash_columns:
-        return table
+    if GTFS_RT_HASH_COL not in schema.names:
+        return False
+
+    metadata = schema.field(GTFS_RT_HASH_COL).metadata or {}
+    return metadata.get(b"version") == gtfs_rt_hash_version()
+
 
-    hash_columns.remove("feed_timestamp")
-    hash_columns = sorted(hash_columns)
+def hash_gtfs_rt_frame(frame: pl.DataFrame) -> pyarrow.Array:
+    """
+    hash every row of a polars dataframe, excluding feed_timestamp and
+    GTFS_RT_HASH_COL columns, in a single columnar pass.
+
+    polars can not hash nested dtypes, so list and struct columns are json
+    encoded before hashing. two 64 bit row hashes with different seeds are
+    combined into a 128 bit binary hash.
 
-    hash_schema = table.schema.append(pyarrow.field(GTFS_RT_HASH_COL, pyarrow.large_binary()))
+    :param frame: polars dataframe of gtfs-rt records
 
-    table = pl.from_arrow(table)
+    :return large_binary array of row hashes
+    """
+    hash_columns = sorted(c for c in frame.columns if c not in ("feed_timestamp", GTFS_RT_HASH_COL))
 
-    return (
-        table.with_columns(
-            table.select(hash_columns)
-            .map_rows(hash_gtfs_rt_row, return_dtype=pl.Binary)
-            .to_series(0)
-            .alias(GTFS_RT_HASH_COL)
+    hash_frame = frame.select(
+        (
+            pl.struct(pl.col(column)).struct.json_encode().alias(column)
+            if frame.schema[column].is_nested()
+            else pl.col(column)
         )
-        .to_arrow()
-        .cast(hash_schema)
+        for column in hash_columns
     )
 
+    row_hashes = numpy.column_stack(
+        [
+            hash_frame.hash_rows(seed=0, seed_1=1, seed_2=2, seed_3=3).to_numpy(),
+            hash_frame.hash_rows(seed=4, seed_1=5, seed_2=6, seed_3=7).to_numpy(),
+        ]
+    )
+
+    return pyarrow.Array.from_buffers(
+        pyarrow.binary(16),
+        frame.height,
+        [None, pyarrow.py_buffer(row_hashes.tobytes())],
+    ).cast(pyarrow.large_binary())
+
+
+def hash_gtfs_rt_table(table: pyarrow.Table) -> pyarrow.Table:
+    """
+    add GTFS_RT_HASH_COL column to pyarrow table, if not already present with
+    the current hash scheme version
+    """
+    if has_current_gtfs_rt_hash(table.schema):
+        return table
+
+    if GTFS_RT_HASH_COL in table.column_names:
+        table = table.drop_columns(GTFS_RT_HASH_COL)
+
+    return table.append_column(gtfs_rt_hash_field(), hash_gtfs_rt_frame(pl.DataFrame(table)))
+
 
 def hash_gtfs_rt_parquet(path: str) -> None:
     """
-    add GTFS_RT_HASH_COL to local parquet file, if not already present
+    add GTFS_RT_HASH_COL to local parquet file, if not already present with
+    the current hash scheme version
     """
     ds = pd.dataset(path)
-    hash_columns = ds.schema.names
-    if GTFS_RT_HASH_COL in hash_columns:
+    if has_current_gtfs_rt_hash(ds.schema):
         return
 
-    hash_columns.remove("feed_timestamp")
-    hash_columns = sorted(hash_columns)
-
-    hash_schema = ds.schema.append(pyarrow.field(GTFS_RT_HASH_COL, pyarrow.large_binary()))
+    columns = [column for column in ds.schema.names if column != GTFS_RT_HASH_COL]
+    hash_schema = pyarrow.schema([ds.schema.field(column) for column in columns]).append(gtfs_rt_hash_field())
 
     with tempfile.TemporaryDirectory() as temp_dir:
         tmp_pq = os.path.join(temp_dir, "temp.parquet")
         with pq.ParquetWriter(tmp_pq, schema=hash_schema) as writer:
-            for batch in ds.to_batches(batch_size=1024 * 1024):
-                batch = pl.from_arrow(batch)
-                batch = (
-                    batch.with_columns(
-                        batch.select(hash_columns)
-                        .map_rows(hash_gtfs_rt_row, return_dtype=pl.Binary)
-                        .to_series(0)
-                        .alias(GTFS_RT_HASH_COL)
-                    )
-                    .to_arrow()
-                    .cast(hash_schema)
-                )
-                writer.write_table(batch)
+            for batch in ds.to_batches(batch_size=1024 * 1024, columns=columns):
+                writer.write_table(hash_gtfs_rt_table(pyarrow.Table.from_batches([batch])))
 
         os.replace(tmp_pq, path)
 
@@ -0,0 +1,46 @@
+"""add flat file dates
+
+Revision ID: 7c4e1d9a2b63
+Revises: bfc0182db3ad
+Create Date: 2024-10-09 10:21:43.118204
+
+This change adds a flat_file_dates table used to track which service dates
+need to be written to the public flat file archive. Each record holds a dirty
+flag, the content hash of the last written file, and the details needed to
+build the archive index without listing the archive bucket.
+
+The table starts empty. The first flat file write seeds it from the files
+that are already in the public archive.
+
+Details
+* upgrade -> create flat_file_dates table
+
+* downgrade -> drop flat_file_dates table
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "7c4e1d9a2b63"
+down_revision = "bfc0182db3ad"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "flat_file_dates",
+        sa.Column("service_date", sa.Integer(), nullable=False),
+        sa.Column("dirty", sa.Boolean(), nullable=False),
+        sa.Column("dirty_since", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("content_hash", sa.String(length=32), nullable=True),
+        sa.Column("last_written", sa.DateTime(timezone=True), nullable=True),
+        sa.Column("size_bytes", sa.BigInteger(), nullable=True),
+        sa.PrimaryKeyConstraint("service_date"),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table("flat_file_dates")
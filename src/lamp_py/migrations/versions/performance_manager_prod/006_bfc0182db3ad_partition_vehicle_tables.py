@@ -0,0 +1,222 @@
+"""partition vehicle tables
+
+Revision ID: bfc0182db3ad
+Revises: 32ba735d080c
+Create Date: 2024-10-02 09:14:27.531806
+
+This change converts the vehicle_events and vehicle_trips tables to range
+partitioned tables on service_date, with one partition per calendar month.
+Partitions for new service dates are created by the performance manager
+before inserting records. VACUUM/ANALYZE can then be limited to recently
+modified partitions and old partitions can be detached for archive.
+
+Primary keys of partitioned tables must include the partition key, so
+primary keys become (pm_event_id, service_date) and (pm_trip_id, service_date).
+
+Details
+* upgrade -> drop opmi_all_rt_fields_joined view
+* upgrade -> rename vehicle tables to legacy tables and create partitioned vehicle tables
+* upgrade -> copy legacy records into monthly partitions
+* upgrade -> re-create indexes, constraints, triggers and view, drop legacy tables
+
+* downgrade -> copy records from partitioned tables into un-partitioned tables
+* downgrade -> re-create indexes, constraints, triggers and view, drop partitioned tables
+
+"""
+
+import logging
+from typing import List, Tuple
+
+from alembic import op
+import sqlalchemy as sa
+
+from lamp_py.migrations.versions.performance_manager_prod.sql_strings.strings_001 import (
+    view_opmi_all_rt_fields_joined,
+)
+
+# revision identifiers, used by Alembic.
+revision = "bfc0182db3ad"
+down_revision = "32ba735d080c"
+branch_labels = None
+depends_on = None
+
+vehicle_tables = ("vehicle_events", "vehicle_trips")
+
+
+def month_bounds(month: int) -> Tuple[int, int]:
+    """
+    YYYYMMDD service date range of a YYYYMM month partition, lower bound is
+    inclusive and upper bound is exclusive
+    """
+    year, month_of_year = divmod(month, 100)
+    if month_of_year == 12:
+        next_month = (year + 1) * 100 + 1
+    else:
+        next_month = month + 1
+
+    return (month * 100 + 1, next_month * 100 + 1)
+
+
+def months_between(start_date: int, end_date: int) -> List[int]:
+    """all YYYYMM months from the month of start_date to the month of end_date"""
+    months = []
+    month = start_date // 100
+    while month <= end_date // 100:
+        months.append(month)
+        month = month_bounds(month)[1] // 100
+
+    return months
+
+
+def create_partition_statement(table_name: str, month: int) -> str:
+    """sql statement to create a YYYYMM month partition of table_name"""
+    start_date, end_date = month_bounds(month)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {table_name}_{month} "
+        f"PARTITION OF {table_name} "
+        f"FOR VALUES FROM ({start_date}) TO ({end_date});"
+    )
+
+
+def drop_indexes_and_constraints() -> None:
+    """drop indexes and constraints of vehicle tables to free up their names"""
+    op.drop_index("ix_vehicle_events_composite_1", table_name="vehicle_events")
+    op.drop_index("ix_vehicle_events_composite_2", table_name="vehicle_events")
+    op.drop_index("ix_vehicle_events_vp_not_null", table_name="vehicle_events")
+    op.drop_constraint("vehicle_events_pkey", table_name="vehicle_events")
+
+    op.drop_index("ix_vehicle_trips_composite_1", table_name="vehicle_trips")
+    op.drop_constraint("vehicle_trips_unique_trip", table_name="vehicle_trips")
+    op.drop_constraint("vehicle_trips_static_version_key_fkey", table_name="vehicle_trips")
+    op.drop_constraint("vehicle_trips_pkey", table_name="vehicle_trips")
+
+
+def create_indexes_and_constraints(events_pkey: List[str], trips_pkey: List[str]) -> None:
+    """create indexes and constraints of vehicle tables"""
+    op.create_primary_key("vehicle_events_pkey", "vehicle_events", events_pkey)
+    op.create_index(
+        "ix_vehicle_events_composite_1",
+        "vehicle_events",
+        ["service_date", "pm_trip_id", "parent_station"],
+        unique=True,
+    )
+    op.create_index(
+        "ix_vehicle_events_composite_2",
+        "vehicle_events",
+        ["service_date", "pm_trip_id", "stop_sequence"],
+        unique=False,
+    )
+    op.create_index(
+        "ix_vehicle_events_vp_not_null",
+        "vehicle_events",
+        ["pm_event_id"],
+        unique=False,
+        postgresql_where=sa.text("vp_move_timestamp IS NOT NULL OR vp_stop_timestamp IS NOT NULL"),
+    )
+
+    op.create_primary_key("vehicle_trips_pkey", "vehicle_trips", trips_pkey)
+    op.create_unique_constraint(
+        "vehicle_trips_unique_trip",
+        "vehicle_trips",
+        ["service_date", "route_id", "trip_id"],
+    )
+    op.create_foreign_key(
+        "vehicle_trips_static_version_key_fkey",
+        "vehicle_trips",
+        "static_feed_info",
+        ["static_version_key"],
+        ["static_version_key"],
+    )
+    op.create_index(
+        "ix_vehicle_trips_composite_1",
+        "vehicle_trips",
+        ["route_id", "direction_id", "vehicle_id"],
+        unique=False,
+    )
+
+
+def create_triggers_and_view() -> None:
+    """
+    take ownership of id sequences and create triggers and views that depend
+    on vehicle tables
+    """
+    op.execute("ALTER SEQUENCE vehicle_events_pm_event_id_seq OWNED BY vehicle_events.pm_event_id;")
+    op.execute("ALTER SEQUENCE vehicle_trips_pm_trip_id_seq OWNED BY vehicle_trips.pm_trip_id;")
+
+    for table in vehicle_tables:
+        create_trigger = f"""
+            CREATE TRIGGER update_{table}_modified BEFORE UPDATE ON {table}
+            FOR EACH ROW EXECUTE PROCEDURE update_modified_columns();
+        """
+        op.execute(create_trigger)
+
+    create_trigger = """
+        CREATE TRIGGER rt_trips_update_branch_trunk BEFORE UPDATE ON vehicle_trips
+        FOR EACH ROW EXECUTE PROCEDURE update_rt_branch_trunk_id();
+    """
+    op.execute(create_trigger)
+
+    op.execute(view_opmi_all_rt_fields_joined)
+
+
+def upgrade() -> None:
+    conn = op.get_bind()
+    date_range_query = sa.text(
+        "SELECT min(service_date), max(service_date) FROM ("
+        "  SELECT min(service_date) AS service_date FROM vehicle_events"
+        "  UNION ALL SELECT max(service_date) FROM vehicle_events"
+        "  UNION ALL SELECT min(service_date) FROM vehicle_trips"
+        "  UNION ALL SELECT max(service_date) FROM vehicle_trips"
+        ") AS date_range;"
+    )
+    min_service_date, max_service_date = conn.execute(date_range_query).one()
+
+    op.execute("DROP VIEW IF EXISTS opmi_all_rt_fields_joined;")
+    drop_indexes_and_constraints()
+
+    for table in vehicle_tables:
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy;")
+        op.execute(f"CREATE TABLE {table} (LIKE {table}_legacy INCLUDING DEFAULTS) PARTITION BY RANGE (service_date);")
+
+    # records are copied before indexes are created, building indexes once is
+    # much faster than updating them for every inserted record
+    if min_service_date is not None:
+        for month in months_between(min_service_date, max_service_date):
+            start_date, end_date = month_bounds(month)
+            for table in vehicle_tables:
+                logging.info("partition_vehicle_tables, table=%s, month=%s", table, month)
+                op.execute(create_partition_statement(table, month))
+                op.execute(
+                    f"INSERT INTO {table} SELECT * FROM {table}_legacy "
+                    f"WHERE service_date >= {start_date} AND service_date < {end_date};"
+                )
+
+    create_indexes_and_constraints(
+        events_pkey=["pm_event_id", "service_date"],
+        trips_pkey=["pm_trip_id", "service_date"],
+    )
+    create_triggers_and_view()
+
+    for table in vehicle_tables:
+        op.execute(f"DROP TABLE {table}_legacy;")
+
+
+def downgrade() -> None:
+    op.execute("DROP VIEW IF EXISTS opmi_all_rt_fields_joined;")
+    drop_indexes_and_constraints()
+
+    # only records in attached partitions are copied, detached partitions are
+    # left in place as stand alone tables
+    for table in vehicle_tables:
+        op.execute(f"ALTER TABLE {table} RENAME TO {table}_partitioned;")
+        op.execute(f"CREATE TABLE {table} (LIKE {table}_partitioned INCLUDING DEFAULTS);")
+        op.execute(f"INSERT INTO {table} SELECT * FROM {table}_partitioned;")
+
+    create_indexes_and_constraints(
+        events_pkey=["pm_event_id"],
+        trips_pkey=["pm_trip_id"],
+    )
+    create_triggers_and_view()
+
+    for table in vehicle_tables:
+        op.execute(f"DROP TABLE {table}_partitioned;")
@@ -1,34 +1,55 @@
 import os
-from typing import List, Dict, Tuple, Optional
-from datetime import datetime, timezone
+import json
+import shutil
+from dataclasses import (
+    asdict,
+    dataclass,
+    field,
+)
+from typing import List, Dict, Set, Tuple, Optional
 
+import numpy
 import pandas
+import polars as pl
 import pyarrow
-import pyarrow.dataset as pd
 import pyarrow.parquet as pq
 import pyarrow.compute as pc
 import sqlalchemy as sa
-from dateutil.relativedelta import relativedelta
 
 from lamp_py.aws.s3 import (
     download_file,
     read_parquet,
+    read_parquet_table,
     upload_file,
     version_check,
 )
 
 from lamp_py.postgres.metadata_schema import MetadataLog
 from lamp_py.postgres.postgres_utils import DatabaseManager
+from lamp_py.runtime_utils.gtfs_time import timestamps_to_local_datetimes
 from lamp_py.runtime_utils.process_logger import ProcessLogger
-from lamp_py.runtime_utils.remote_files import public_alerts_file
+from lamp_py.runtime_utils.remote_files import (
+    public_alerts_dataset,
+    public_alerts_file,
+)
+
 
-from .gtfs_utils import BOSTON_TZ
+# file name of the manifest of the public alerts dataset
+ALERTS_MANIFEST = "manifest.json"
+# file name of the id / last modified timestamp index of the public alerts dataset
+ALERTS_ID_INDEX = "id_index.parquet"
+# partition of alerts without an active period start
+NULL_PARTITION = "no_active_period"
 
 
 class AlertsS3Info:
-    """S3 Constant info for Alerts Parquet File"""
+    """S3 Constant info for Alerts Parquet Dataset and File"""
 
+    # single file with all alerts, built from the dataset for tableau
     s3_path: str = public_alerts_file.s3_uri
+    dataset_path: str = public_alerts_dataset.s3_uri
+    manifest_path: str = os.path.join(public_alerts_dataset.s3_uri, ALERTS_MANIFEST)
+    id_index_path: str = os.path.join(public_alerts_dataset.s3_uri, ALERTS_ID_INDEX)
     version_key: str = "lamp_version"
     file_version: str = "1.1.0"
 
@@ -70,42 +91,263 @@ class AlertsS3Info:
     )
 
 
+@dataclass
+class AlertsPartition:
+    """
+    a month of alerts in the public alerts dataset
+
+    name: "YYYY-MM" month of the active period start of every alert in the
+        partition, or NULL_PARTITION for alerts without an active period start
+    num_rows: number of records in the partition
+    """
+
+    name: str
+    num_rows: int
+
+
+@dataclass
+class AlertsManifest:
+    """
+    manifest of all month partitions that make up the public alerts dataset
+
+    id_index_rows: number of pairs in the id index uploaded with the dataset,
+        used to detect an index that is out of sync with the partitions
+    """
+
+    partitions: List[AlertsPartition] = field(default_factory=list)
+    id_index_rows: int = 0
+
+    def to_json(self) -> str:
+        """serialize manifest to a json string"""
+        return json.dumps(asdict(self))
+
+    @classmethod
+    def from_json(cls, manifest_json: str) -> "AlertsManifest":
+        """deserialize manifest from a json string"""
+        manifest = json.loads(manifest_json)
+        return cls(
+            partitions=[AlertsPartition(**partition) for partition in manifest["partitions"]],
+            id_index_rows=manifest.get("id_index_rows", 0),
+        )
+
+    def partition_names(self) -> List[str]:
+        """
+        names of all partitions, in month order with alerts without an active
+        period start last
+        """
+        names = sorted(partition.name for partition in self.partitions if partition.name != NULL_PARTITION)
+        if any(partition.name == NULL_PARTITION for partition in self.partitions):
+            names.append(NULL_PARTITION)
+        return names
+
+    def set_partition(self, name: str, num_rows: int) -> None:
+        """add a partition to the manifest, or update its row count"""
+        for partition in self.partitions:
+            if partition.name == name:
+                partition.num_rows = num_rows
+                return
+        self.partitions.append(AlertsPartition(name=name, num_rows=num_rows))
+
+
+def partition_path(dataset_path: str, name: str) -> str:
+    """path of a month partition in an alerts dataset"""
+    return os.path.join(dataset_path, f"{name}.parquet")
+
+
+def read_alerts_manifest(local_folder: str) -> Optional[AlertsManifest]:
+    """
+    download and read the manifest of the public alerts dataset, if it exists
+    """
+    local_path = os.path.join(local_folder, ALERTS_MANIFEST)
+    if not download_file(object_path=AlertsS3Info.manifest_path, file_name=local_path):
+        return None
+
+    with open(local_path, "r", encoding="utf8") as manifest_file:
+        return AlertsManifest.from_json(manifest_file.read())
+
+
+def alert_partition_names(alerts_table: pyarrow.Table) -> pyarrow.Array:
+    """
+    month partition name of each alert, from its active period start
+    timestamp, or NULL_PARTITION if it has none
+    """
+    start_timestamps = alerts_table.column("active_period.start_timestamp").cast(pyarrow.timestamp("s", tz="UTC"))
+    return pc.fill_null(pc.strftime(start_timestamps, format="%Y-%m"), NULL_PARTITION)
+
+
+class AlertIdIndex:
+    """
+    sorted, unique alert id / last modified timestamp pairs of every record in
+    the public alerts dataset. it identifies alerts that have already been
+    processed without reading the dataset.
+
+    pairs are stored in a numpy structured array, which sorts and compares
+    them by id and then timestamp, so bulk lookups are a binary search.
+    missing last modified timestamps are stored as -1.
+    """
+
+    dtype = numpy.dtype([("id", numpy.int64), ("last_modified_timestamp", numpy.int64)])
+
+    def __init__(self, pairs: Optional[numpy.ndarray] = None) -> None:
+        if pairs is None:
+            pairs = numpy.empty(0, dtype=self.dtype)
+        self.pairs: numpy.ndarray = self.sorted_unique(pairs)
+
+    def __len__(self) -> int:
+        return len(self.pairs)
+
+    @staticmethod
+    def sorted_unique(pairs: numpy.ndarray) -> numpy.ndarray:
+        """
+        sort and deduplicate pairs. numpy.unique compares structured arrays
+        element by element, sorting the integer fields directly is much faster,
+        and pairs read from an index file are already sorted.
+        """
+        ids = pairs["id"]
+        timestamps = pairs["last_modified_timestamp"]
+
+        id_steps = ids[1:] - ids[:-1]
+        if ((id_steps > 0) | ((id_steps == 0) & (timestamps[1:] > timestamps[:-1]))).all():
+            return pairs
+
+        order = numpy.lexsort((timestamps, ids))
+        ids = ids[order]
+        timestamps = timestamps[order]
+
+        keep = numpy.ones(len(pairs), dtype=bool)
+        keep[1:] = (ids[1:] != ids[:-1]) | (timestamps[1:] != timestamps[:-1])
+
+        return pairs[order[keep]]
+
+    @classmethod
+    def to_pairs(cls, ids: pandas.Series, timestamps: pandas.Series) -> numpy.ndarray:
+        """build a structured array of pairs from id and timestamp columns"""
+        pairs = numpy.empty(len(ids), dtype=cls.dtype)
+        pairs["id"] = ids.to_numpy(dtype="int64")
+        pairs["last_modified_timestamp"] = timestamps.astype("Int64").to_numpy(dtype="int64", na_value=-1)
+        return pairs
+
+    @classmethod
+    def from_frame(cls, alerts: pandas.DataFrame) -> "AlertIdIndex":
+        """build an index from the id and last_modified_timestamp columns"""
+        return cls(cls.to_pairs(alerts["id"], alerts["last_modified_timestamp"]))
+
+    def contains(self, pairs: numpy.ndarray) -> numpy.ndarray:
+        """boolean mask of the pairs that are in the index"""
+        positions = numpy.searchsorted(self.pairs, pairs)
+        indexed = positions < len(self.pairs)
+        indexed[indexed] = self.pairs[positions[indexed]] == pairs[indexed]
+        return indexed
+
+    def is_new(self, alerts: pandas.DataFrame) -> numpy.ndarray:
+        """boolean mask of the alerts whose id / timestamp pair is not indexed"""
+        return ~self.contains(self.to_pairs(alerts["id"], alerts["last_modified_timestamp"]))
+
+    def add(self, alerts: pandas.DataFrame) -> None:
+        """add the id / timestamp pairs of alerts to the index"""
+        pairs = self.sorted_unique(self.to_pairs(alerts["id"], alerts["last_modified_timestamp"]))
+        pairs = pairs[~self.contains(pairs)]
+
+        # inserting at the search positions keeps the index sorted
+        self.pairs = numpy.insert(self.pairs, numpy.searchsorted(self.pairs, pairs), pairs)
+
+    def write(self, local_path: str) -> None:
+        """write the index to a parquet file"""
+        table = pyarrow.table(
+            {
+                "id": self.pairs["id"],
+                "last_modified_timestamp": self.pairs["last_modified_timestamp"],
+            }
+        )
+        pq.write_table(table, local_path)
+
+    @classmethod
+    def read(cls, local_path: str) -> "AlertIdIndex":
+        """read an index from a parquet file"""
+        table = pq.read_table(local_path)
+        pairs = numpy.empty(table.num_rows, dtype=cls.dtype)
+        pairs["id"] = table.column("id").to_numpy()
+        pairs["last_modified_timestamp"] = table.column("last_modified_timestamp").to_numpy()
+        return cls(pairs)
+
+
 class AlertParquetHandler:
     """
-    This class handles all of the interactions with alert data thats stored as a parquet file on s3.
+    This class handles all of the interactions with the public alerts dataset,
+    a parquet file for each month of alert active periods on s3, listed in a
+    manifest.
+
+    New records are appended to local copies of the months they belong to,
+    only those months are uploaded, followed by the updated manifest.
     """
 
     def __init__(self, update_alerts: bool) -> None:
-        self.s3_path: str = AlertsS3Info.s3_path
+        self.dataset_path: str = AlertsS3Info.dataset_path
 
-        self.local_path: str = os.path.join("/tmp", "alerts.parquet")
+        self.local_folder: str = os.path.join("/tmp", "alerts")
         self.parquet_schema: pyarrow.Schema = AlertsS3Info.parquet_schema
 
-        # flag used to upload if new data is appended to the parquet file.
-        self.new_data: bool = False
+        # stage workers process alerts repeatedly, start from a clean folder
+        shutil.rmtree(self.local_folder, ignore_errors=True)
+        os.makedirs(self.local_folder)
 
-        # only download the remote file if its being updated.
+        # only read the remote manifest if the dataset is being updated,
+        # otherwise every partition is rebuilt.
+        self.manifest = AlertsManifest()
         if update_alerts:
-            download_file(object_path=self.s3_path, file_name=self.local_path)
+            self.manifest = read_alerts_manifest(self.local_folder) or AlertsManifest()
+
+        # partitions with new records, that are uploaded
+        self.touched_partitions: Set[str] = set()
+
+        # id / last modified timestamp pairs of every record in the dataset,
+        # updated as records are appended
+        self.id_index = self.load_id_index()
+
+    @property
+    def new_data(self) -> bool:
+        """flag used to upload if new data is appended to the dataset"""
+        return len(self.touched_partitions) > 0
 
-    def existing_id_timestamp_pairs(self) -> pandas.DataFrame:
+    def remote_partition_paths(self) -> List[str]:
+        """s3 paths of all partitions in the manifest"""
+        return [partition_path(self.dataset_path, name) for name in self.manifest.partition_names()]
+
+    def local_partition_path(self, name: str) -> str:
+        """local path of a partition"""
+        return partition_path(self.local_folder, name)
+
+    def load_id_index(self) -> AlertIdIndex:
         """
-        get all unique alert id / last modified timestamp pairs in the local
-        parquet file, a key that can be used to identify alerts that have
-        already been processed.
+        download the id index of the dataset. if it is missing or out of sync
+        with the manifest, rebuild it from the id and last modified timestamp
+        columns of every partition.
         """
-        columns = ["id", "last_modified_timestamp"]
+        if len(self.manifest.partitions) == 0:
+            return AlertIdIndex()
 
-        if os.path.exists(self.local_path):
-            existing_alerts = pq.read_table(self.local_path, columns=columns).to_pandas()
-            existing_alerts = existing_alerts.drop_duplicates()
-            return existing_alerts
+        process_logger = ProcessLogger("load_alerts_id_index")
+        process_logger.log_start()
 
-        return pandas.DataFrame(columns=columns)
+        local_path = os.path.join(self.local_folder, ALERTS_ID_INDEX)
+        if download_file(object_path=AlertsS3Info.id_index_path, file_name=local_path):
+            id_index = AlertIdIndex.read(local_path)
+            if len(id_index) == self.manifest.id_index_rows:
+                process_logger.add_metadata(rebuilt=False, id_index_rows=len(id_index))
+                process_logger.log_complete()
+                return id_index
+
+        existing_alerts = read_parquet(self.remote_partition_paths(), columns=["id", "last_modified_timestamp"])
+        id_index = AlertIdIndex.from_frame(existing_alerts)
+
+        process_logger.add_metadata(rebuilt=True, id_index_rows=len(id_index))
+        process_logger.log_complete()
+        return id_index
 
     def append_new_records(self, alerts: pandas.DataFrame) -> None:
         """
-        append alerts to the end of the local parquet file using batches to keep memory usage lower
+        append alerts to the local copies of the month partitions they belong
+        to. partitions that are not local yet are downloaded first.
         """
         process_logger = ProcessLogger(
             process_name="append_new_alerts_records",
@@ -119,77 +361,118 @@ class AlertParquetHandler:
             process_logger.log_complete()
             return
 
-        if os.path.exists(self.local_path):
-            joined_ds = pd.dataset(
-                [pd.dataset(self.local_path), pd.dataset(alerts_table)],
-                schema=self.parquet_schema,
-            )
-        else:
-            joined_ds = pd.dataset(alerts_table, schema=self.parquet_schema)
+        partition_names = alert_partition_names(alerts_table)
 
-        process_logger.add_metadata(
-            new_records=alerts_table.num_rows,
-            total_records=joined_ds.count_rows(),
-        )
+        for name in pc.unique(partition_names).to_pylist():
+            local_path = self.local_partition_path(name)
+            new_records = alerts_table.filter(pc.equal(partition_names, name))
+
+            # download existing records the first time a partition is touched
+            if name not in self.touched_partitions and name in self.manifest.partition_names():
+                if not download_file(
+                    object_path=partition_path(self.dataset_path, name),
+                    file_name=local_path,
+                ):
+                    raise FileNotFoundError(f"Unable to download alerts partition {name}")
+
+            if os.path.exists(local_path):
+                new_records = pyarrow.concat_tables(
+                    [pq.read_table(local_path, schema=self.parquet_schema), new_records]
+                )
+
+            tmp_path = f"{local_path}.tmp"
+            pq.write_table(new_records, tmp_path)
+            os.replace(tmp_path, local_path)
 
-        # write new alerts to a new file and then join them with the local file in batches
-        new_path = os.path.join("/tmp", "new_alerts.parquet")
-        row_group_count = 0
+            self.manifest.set_partition(name, new_records.num_rows)
+            self.touched_partitions.add(name)
 
-        partition_key = "active_period.start_timestamp"
-        partition_key_arr = joined_ds.to_table(columns=[partition_key]).column(partition_key)
+        self.id_index.add(alerts)
 
-        # the start is the start of the month containing the minimum timestamp
-        start = pc.min(partition_key_arr).as_py()
-        start_dt = datetime.fromtimestamp(start)
-        start = datetime(start_dt.year, start_dt.month, 1)
+        process_logger.add_metadata(
+            new_records=alerts_table.num_rows,
+            touched_partitions=len(self.touched_partitions),
+            total_records=sum(partition.num_rows for partition in self.manifest.partitions),
+        )
+        process_logger.log_complete()
 
-        # "now" is the maximum timestamp in the dataset
-        now = pc.max(partition_key_arr).as_py()
-        now = datetime.fromtimestamp(now)
+    def upload_data(self) -> None:
+        """
+        upload partitions with new records to s3, followed by the id index and
+        the manifest
+        """
+        if not self.new_data:
+            return
 
-        with pq.ParquetWriter(new_path, schema=self.parquet_schema) as writer:
-            while start < now:
-                end = start + relativedelta(months=1)
-                if end < now:
-                    table = joined_ds.filter(
-                        (pc.field(partition_key) >= int(start.timestamp()))
-                        & (pc.field(partition_key) < int(end.timestamp()))
-                    ).to_table()
-                else:
-                    table = joined_ds.filter((pc.field(partition_key) >= int(start.timestamp()))).to_table()
+        extra_args = {"Metadata": {AlertsS3Info.version_key: AlertsS3Info.file_version}}
+
+        for name in sorted(self.touched_partitions):
+            if not upload_file(
+                file_name=self.local_partition_path(name),
+                object_path=partition_path(self.dataset_path, name),
+                extra_args=extra_args,
+            ):
+                raise RuntimeError(f"Unable to upload alerts partition {name}")
+
+        id_index_path = os.path.join(self.local_folder, ALERTS_ID_INDEX)
+        self.id_index.write(id_index_path)
+        if not upload_file(
+            file_name=id_index_path,
+            object_path=AlertsS3Info.id_index_path,
+            extra_args=extra_args,
+        ):
+            raise RuntimeError("Unable to upload alerts id index")
+        self.manifest.id_index_rows = len(self.id_index)
+
+        # the manifest is uploaded last, so it only lists uploaded partitions
+        manifest_path = os.path.join(self.local_folder, ALERTS_MANIFEST)
+        with open(manifest_path, "w", encoding="utf8") as manifest_file:
+            manifest_file.write(self.manifest.to_json())
+
+        if not upload_file(
+            file_name=manifest_path,
+            object_path=AlertsS3Info.manifest_path,
+            extra_args=extra_args,
+        ):
+            raise RuntimeError("Unable to upload alerts manifest")
+
+
+def write_alerts_single_file(local_path: str) -> int:
+    """
+    combine every partition of the public alerts dataset into a single parquet
+    file, with a row group for each month, in month order and alerts without an
+    active period start last.
 
-                if table.num_rows > 0:
-                    row_group_count += 1
-                    writer.write_table(table)
+    :return number of records written
+    """
+    process_logger = ProcessLogger("write_alerts_single_file")
+    process_logger.log_start()
 
-                start = end
+    local_folder = os.path.dirname(local_path)
+    manifest = read_alerts_manifest(local_folder) or AlertsManifest()
+    parquet_schema = AlertsS3Info.parquet_schema
 
-            table = joined_ds.filter((pc.field(partition_key).is_null())).to_table()
+    row_count = 0
+    with pq.ParquetWriter(local_path, schema=parquet_schema) as writer:
+        for name in manifest.partition_names():
+            partition = read_parquet_table(partition_path(AlertsS3Info.dataset_path, name))
+            writer.write_table(partition.select(parquet_schema.names).cast(parquet_schema))
+            row_count += partition.num_rows
 
-            if table.num_rows > 0:
-                row_group_count += 1
-                writer.write_table(table)
+    process_logger.add_metadata(partition_count=len(manifest.partitions), row_count=row_count)
+    process_logger.log_complete()
 
-        os.replace(new_path, self.local_path)
-        self.new_data = True
+    return row_count
 
-        process_logger.add_metadata(row_group_count=row_group_count)
-        process_logger.log_complete()
 
-    def upload_data(self) -> None:
-        """
-        upload the local parquet file to s3 if new data was added
-        """
-        if self.new_data:
-            upload_file(
-                file_name=self.local_path,
-                object_path=self.s3_path,
-                extra_args={"Metadata": {AlertsS3Info.version_key: AlertsS3Info.file_version}},
-            )
+def nested_dtype(arrow_type: pyarrow.DataType) -> Optional[pandas.ArrowDtype]:
+    """pandas types mapper that keeps nested arrow columns as arrow"""
+    if pyarrow.types.is_nested(arrow_type):
+        return pandas.ArrowDtype(arrow_type)
+    return None
 
 
-def extract_alerts(alert_files: List[str], existing_id_timestamp_pairs: pandas.DataFrame) -> pandas.DataFrame:
+def extract_alerts(alert_files: List[str], id_index: AlertIdIndex) -> pandas.DataFrame:
     """Read alerts data from unprocessed files, remove duplicates, and set types"""
     columns = [
         "id",
@@ -236,8 +519,11 @@ def extract_alerts(alert_files: List[str], existing_id_timestamp_pairs: pandas.D
         "alert.informed_entity": "informed_entity",
     }
 
+    # keep nested translation, active period and informed entity columns in
+    # arrow memory, they are transformed with arrow and polars.
     alerts = (
-        read_parquet(filename=alert_files, columns=columns)
+        read_parquet_table(filename=alert_files, columns=columns)
+        .to_pandas(types_mapper=nested_dtype)
         .rename(columns=rename_map)
         .drop_duplicates(subset=["id", "last_modified_timestamp"])
     )
@@ -256,33 +542,58 @@ def extract_alerts(alert_files: List[str], existing_id_timestamp_pairs: pandas.D
     alerts["last_push_notification_timestamp"] = alerts["last_push_notification_timestamp"].astype("Int64")
     alerts["closed_timestamp"] = alerts["closed_timestamp"].astype("Int64")
 
-    # perform an anti-join against existing alerts. merge with existing pairs
-    # and keep only the records that are new.
-    alerts = pandas.merge(
-        alerts,
-        existing_id_timestamp_pairs,
-        on=["id", "last_modified_timestamp"],
-        how="left",
-        indicator=True,
-    )
-    alerts = alerts[alerts["_merge"] == "left_only"]
-    alerts = alerts.drop(columns=["_merge"])
+    # keep only the records that are not in the dataset yet
+    alerts = alerts[id_index.is_new(alerts)].reset_index(drop=True)
 
     return alerts
 
 
-def transform_translations(alerts: pandas.DataFrame) -> pandas.DataFrame:
-    """For each string field with translations, pull out the English string"""
+def nested_column(alerts: pandas.DataFrame, column: str) -> pl.Series:
+    """
+    convert a pandas column of nested lists and dicts into a polars series
+    of lists and structs
+    """
+    return pl.Series(values=pyarrow.array(alerts[column], from_pandas=True))
+
+
+def struct_field(structs: pl.Series, key: str) -> pl.Series:
+    """
+    get a field from a polars series of structs. the field is all nulls if
+    no struct has it.
+    """
+    if isinstance(structs.dtype, pl.Struct) and key in [field.name for field in structs.dtype.fields]:
+        return structs.struct.field(key)
+    return pl.Series(values=[None] * len(structs))
+
+
+def explode_nested(alerts: pandas.DataFrame, column: str) -> Tuple[pandas.DataFrame, pl.Series]:
+    """
+    explode alerts along a list column the same way as pandas explode, empty
+    and null lists are kept as a single null record.
+
+    :return alerts without the list column, and the exploded list values
+    """
+    exploded = pl.DataFrame(
+        {
+            "row": pl.int_range(len(alerts), eager=True),
+            column: nested_column(alerts, column),
+        }
+    ).explode(column)
+
+    alerts = alerts.drop(columns=[column]).iloc[exploded.get_column("row").to_numpy()]
+
+    return alerts, exploded.get_column(column)
+
+
+def local_datetimes(timestamps: pandas.Series) -> pandas.Series:
+    """
+    convert unix timestamps into naive eastern time datetimes
+    """
+    return timestamps_to_local_datetimes(timestamps.astype("Int64")).astype("datetime64[ns]")
 
-    def process_translation(translations: Optional[List[Dict[str, str]]]) -> Optional[str]:
-        """small lambda for processing the translation"""
-        if translations is None:
-            return None
-        for translation in translations:
-            if translation["language"] == "en":
-                return translation["text"]
-        return None
 
+def transform_translations(alerts: pandas.DataFrame) -> pandas.DataFrame:
+    """For each string field with translations, pull out the English string"""
     translation_columns = [
         "header_text",
         "description_text",
@@ -294,7 +605,16 @@ def transform_translations(alerts: pandas.DataFrame) -> pandas.DataFrame:
     drop_columns = []
     for key in translation_columns:
         translation_key = f"{key}.translation"
-        alerts[f"{translation_key}.text"] = alerts[translation_key].apply(process_translation)
+        translations = nested_column(alerts, translation_key)
+
+        english_text = pl.Series(values=[None] * len(alerts), dtype=pl.String)
+        if isinstance(translations.dtype, pl.List) and isinstance(translations.dtype.inner, pl.Struct):
+            english_text = struct_field(
+                translations.list.eval(pl.element().filter(pl.element().struct.field("language") == "en")).list.first(),
+                "text",
+            )
+
+        alerts[f"{translation_key}.text"] = english_text.to_numpy()
         drop_columns.append(translation_key)
 
     alerts = alerts.drop(columns=drop_columns)
@@ -302,27 +622,6 @@ def transform_translations(alerts: pandas.DataFrame) -> pandas.DataFrame:
     return alerts
 
 
-def unix_to_est(unix_time: Optional[int]) -> Optional[datetime]:
-    """
-    Utility for converting a unix timestamp into a datetime object.
-    Indexing errors occur when using pandas built in datetime manipulation
-    functions with NaN's, so filter them out with this function instead.
-    """
-    if unix_time is None or pandas.isna(unix_time):
-        return None
-
-    # Create a datetime object from the Unix timestamp
-    dt_utc = datetime.fromtimestamp(unix_time, tz=timezone.utc)
-
-    # Convert to Eastern Time (ET) with DST consideration
-    dt_est = dt_utc.astimezone(BOSTON_TZ)
-
-    # Remove the timezone information
-    dt_est_naive = dt_est.replace(tzinfo=None)
-
-    return dt_est_naive
-
-
 def transform_timestamps(alerts: pandas.DataFrame) -> pandas.DataFrame:
     """
     Transform all timestamps to easter standard time.
@@ -338,7 +637,7 @@ def transform_timestamps(alerts: pandas.DataFrame) -> pandas.DataFrame:
     for key in timestamp_columns:
         timestamp_key = f"{key}_timestamp"
         datetime_key = f"{key}_datetime"
-        alerts[datetime_key] = alerts[timestamp_key].apply(unix_to_est)
+        alerts[datetime_key] = local_datetimes(alerts[timestamp_key])
 
     return alerts
 
@@ -353,44 +652,20 @@ def explode_active_periods(alerts: pandas.DataFrame) -> pandas.DataFrame:
     * Explode the active period column
     * Extract the start and end timestamps
     * Convert the timestamps to datetimes
-    * Remove active period columns
     """
-    # pull out the active period timestamps from the dict in that column
-    alerts = alerts.explode("active_period")
-
-    def extract_start_end(period: Dict[str, int] | float | None) -> Tuple[int | None, int | None]:
-        """
-        small lambda for extracting start and end timestamps
-
-        Note that the period could be None or NaN based on source data and the
-        result of the explode function, resulting in the weird looking type
-        hint above.
-        """
-        if isinstance(period, dict):
-            return period.get("start"), period.get("end")
-        return None, None
-
-    alerts[
-        [
-            "active_period.start_timestamp",
-            "active_period.end_timestamp",
-        ]
-    ] = (
-        alerts["active_period"].apply(extract_start_end).apply(pandas.Series)
-    )
+    alerts, active_periods = explode_nested(alerts, "active_period")
 
-    # convert these timestamps to Int64 to avoid floating point errors
-    alerts["active_period.start_timestamp"] = alerts["active_period.start_timestamp"].astype("Int64")
-    alerts["active_period.end_timestamp"] = alerts["active_period.end_timestamp"].astype("Int64")
-
-    # drop the active period list column
-    alerts = alerts.drop(columns=["active_period"])
+    # pull out the active period timestamps from the exploded structs, as
+    # Int64 to avoid floating point errors
+    for base in ["start", "end"]:
+        timestamps = struct_field(active_periods, base).cast(pl.Int64)
+        alerts[f"active_period.{base}_timestamp"] = pandas.array(timestamps.to_list(), dtype="Int64")
 
     # convert all of the timestamp columns to eastern standard time
     for base in ["start", "end"]:
         timestamp_key = f"active_period.{base}_timestamp"
         datetime_key = f"active_period.{base}_datetime"
-        alerts[datetime_key] = alerts[timestamp_key].apply(unix_to_est)
+        alerts[datetime_key] = local_datetimes(alerts[timestamp_key])
 
     return alerts
 
@@ -402,7 +677,7 @@ def explode_informed_entity(alerts: pandas.DataFrame) -> pandas.DataFrame:
     record along this list and extract the required information into new
     columns
     """
-    alerts = alerts.explode("informed_entity")
+    alerts, informed_entities = explode_nested(alerts, "informed_entity")
 
     informed_entity_keys = [
         "route_id",
@@ -410,20 +685,17 @@ def explode_informed_entity(alerts: pandas.DataFrame) -> pandas.DataFrame:
         "direction_id",
         "stop_id",
         "facility_id",
-        "activities",
     ]
 
     # extract information from the informed entity
     for key in informed_entity_keys:
-        full_key = f"informed_entity.{key}"
-        alerts[full_key] = alerts["informed_entity"].apply(lambda x, k=key: None if x is None else x.get(k))
-
-    alerts = alerts.drop(columns=["informed_entity"])
+        alerts[f"informed_entity.{key}"] = struct_field(informed_entities, key).to_arrow().to_pandas().to_numpy()
 
     # transform the activities field from a list to a pipe delimitated string
-    alerts["informed_entity.activities"] = alerts["informed_entity.activities"].apply(
-        lambda x: (None if x is None else "|".join(str(item) for item in x if item is not None))
-    )
+    activities = struct_field(informed_entities, "activities")
+    if isinstance(activities.dtype, pl.List):
+        activities = activities.cast(pl.List(pl.String)).list.join("|", ignore_nulls=True)
+    alerts["informed_entity.activities"] = activities.to_numpy()
 
     # the commuter rail informed entity contains extra details that aren't
     # extracted in this transformation. those instances will appear as
@@ -460,7 +732,7 @@ def process_alerts(md_db_manager: DatabaseManager) -> None:
     process_logger = ProcessLogger("process_alerts")
     process_logger.log_start()
 
-    version_match = version_check(obj=AlertsS3Info.s3_path, version=AlertsS3Info.file_version)
+    version_match = version_check(obj=AlertsS3Info.manifest_path, version=AlertsS3Info.file_version)
 
     metadata_records = get_alert_files(
         md_db_manager=md_db_manager,
@@ -479,7 +751,9 @@ def process_alerts(md_db_manager: DatabaseManager) -> None:
 
     # create a handler object that will download, append, and upload data
     parquet_handler = AlertParquetHandler(update_alerts=version_match)
-    existing_id_timestamp_pairs = parquet_handler.existing_id_timestamp_pairs()
+
+    # files whose alerts were appended, marked as processed once uploaded
+    processed_pk_ids: List[str] = []
 
     # process up to 24 hours at a time
     chunk_size = 24
@@ -495,7 +769,7 @@ def process_alerts(md_db_manager: DatabaseManager) -> None:
 
         try:
             # extract the data and transform it for publication
-            alerts = extract_alerts(alert_files, existing_id_timestamp_pairs)
+            alerts = extract_alerts(alert_files, parquet_handler.id_index)
 
             if alerts.empty:
                 subprocess_logger.log_complete()
@@ -508,17 +782,11 @@ def process_alerts(md_db_manager: DatabaseManager) -> None:
 
             subprocess_logger.add_metadata(explode_alerts=len(alerts))
 
-            # add the new alerts to the local temp file that will be published
+            # add the new alerts to the local temp file that will be published,
+            # and their id timestamp pairs to the index for the next pass
             parquet_handler.append_new_records(alerts)
 
-            # add new id timestamp pairs to existing for next pass
-            new_id_timestamp_pairs = alerts[["id", "last_modified_timestamp"]]
-            existing_id_timestamp_pairs = pandas.concat([existing_id_timestamp_pairs, new_id_timestamp_pairs])
-
-            # update metadata for the files that were processed
-            md_db_manager.execute(
-                sa.update(MetadataLog.__table__).where(MetadataLog.pk_id.in_(pk_ids)).values(rail_pm_processed=True)
-            )
+            processed_pk_ids += pk_ids
 
             subprocess_logger.log_complete()
 
@@ -532,6 +800,21 @@ def process_alerts(md_db_manager: DatabaseManager) -> None:
 
             subprocess_logger.log_failure(error)
 
-    # upload the file with new data and exit
-    parquet_handler.upload_data()
+    # upload the file with new data. if the upload fails, the files stay
+    # unprocessed and are retried on the next run.
+    try:
+        parquet_handler.upload_data()
+    except Exception as error:
+        process_logger.log_failure(error)
+        return
+
+    # update metadata for the files that were processed
+    if len(processed_pk_ids) > 0:
+        md_db_manager.execute(
+            sa.update(MetadataLog.__table__)
+            .where(MetadataLog.pk_id.in_(processed_pk_ids))
+            .values(rail_pm_processed=True)
+        )
+
+    process_logger.add_metadata(processed_file_count=len(processed_pk_ids))
     process_logger.log_complete()
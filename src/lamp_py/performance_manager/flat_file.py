@@ -1,10 +1,16 @@
+import hashlib
 import os
 import re
-from typing import Set, List
-from datetime import datetime
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Set
+from datetime import datetime, timedelta, timezone
 
 from botocore.exceptions import ClientError
 import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.functions import count, now
 import pandas
 import pyarrow
 
@@ -16,9 +22,11 @@ from lamp_py.aws.s3 import (
     upload_file,
 )
 from lamp_py.performance_manager.gtfs_utils import (
+    service_date_from_timestamp,
     static_version_key_from_service_date,
 )
 from lamp_py.postgres.rail_performance_manager_schema import (
+    FlatFileDates,
     VehicleEvents,
     VehicleTrips,
     StaticStopTimes,
@@ -46,65 +54,137 @@ class S3Archive:
     RPM_VERSION = "1.1.0"
 
 
-def dates_to_update(db_manager: DatabaseManager) -> Set[datetime]:
+# number of service dates written to the public archive concurrently
+FLAT_FILE_WRITE_WORKERS = 4
+
+# new events are processed for the live service date on every event loop, only
+# rewrite its flat file after this much time has passed since the last write
+LIVE_DATE_DEBOUNCE = timedelta(minutes=10)
+
+
+def service_date_to_datetime(service_date: int) -> datetime:
+    """convert a YYYYMMDD service date into a datetime"""
+    return datetime.strptime(str(service_date), "%Y%m%d")
+
+
+def flat_file_name(service_date: datetime) -> str:
+    """public archive filename of a service date"""
+    return f"{service_date.strftime('%Y-%m-%d')}-subway-on-time-performance-v1.parquet"
+
+
+def mark_dates_dirty(db_manager: DatabaseManager, service_dates: sa.sql.selectable.Select) -> None:
     """
-    Generate a list of service dates that we need to create / recreate flat
-    files for. The list will include service dates that have data in the
-    vehicle events table that are missing in the public archive bucket and
-    service dates that we have generated new data for.
+    mark service dates as needing a flat file write in the flat_file_dates
+    table, adding records for service dates that are not tracked yet.
+
+    dirty_since is set to the time of the latest mark, so a flat file write
+    can tell if its service date was marked again while it was running.
+
+    :param service_dates: select query with a single service_date column
+    """
+    service_dates_sub = service_dates.subquery("dirty_service_dates")
+    insert_query = postgresql.insert(FlatFileDates.__table__).from_select(
+        ["service_date", "dirty", "dirty_since"],
+        sa.select(service_dates_sub.c.service_date, sa.true(), now()),
+    )
+    db_manager.execute(
+        insert_query.on_conflict_do_update(
+            index_elements=[FlatFileDates.service_date],
+            set_={
+                "dirty": sa.true(),
+                "dirty_since": insert_query.excluded.dirty_since,
+            },
+        )
+    )
+
+
+def mark_temp_event_dates_dirty(db_manager: DatabaseManager) -> None:
+    """
+    mark service dates with new events in temp_event_compare as needing a
+    flat file write
+    """
+    mark_dates_dirty(db_manager, sa.select(TempEventCompare.service_date).distinct())
+
+
+def mark_untracked_dates_dirty(db_manager: DatabaseManager) -> None:
+    """
+    mark service dates in the vehicle_trips table that are not tracked in the
+    flat_file_dates table as needing a flat file write
+    """
+    untracked_dates = (
+        sa.select(VehicleTrips.service_date)
+        .distinct()
+        .where(~sa.exists().where(FlatFileDates.service_date == VehicleTrips.service_date))
+    )
+    mark_dates_dirty(db_manager, untracked_dates)
+
+
+def seed_flat_file_dates(db_manager: DatabaseManager) -> None:
+    """
+    if the flat_file_dates table is empty, fill it with the service dates of
+    files that are already in the public archive. this is the only time the
+    archive bucket is listed, after that the table is the source of truth for
+    what has been written.
     """
+    tracked_count = db_manager.select_as_list(sa.select(count(FlatFileDates.service_date).label("count")))
+    if tracked_count[0]["count"] > 0:
+        return
 
-    def db_service_dates_to_datetimes(df: pandas.DataFrame) -> Set[datetime]:
-        """
-        utility to convert a dataframe with a service_date column into a set of
-        datetimes.
-        """
-        if df.size == 0:
-            return set()
-
-        return set(datetime.strptime(str(service_date), "%Y%m%d") for service_date in df["service_date"])
-
-    def filepaths_to_datetimes(filepaths: List[str]) -> Set[datetime]:
-        """
-        utility to convert filepaths to a set of datetimes
-
-        archive filepaths are formatted like
-        "s3://<bucket>/<prefix>/YYYY-MM-DD-subway-on-time-performance-v1.parquet"
-        """
-        # filename is everything after the last "/"
-        # first 10 chars are YYYY-MM-DD
-        # use strptime to convert to a datetime
-        datetimes = set()
-        for filepath in filepaths:
-            match = re.search(r"(?P<date>\d{4}-\d{1,2}-\d{1,2})", filepath)
-            if match is not None:
-                datetimes.add(datetime.strptime(match.group("date"), "%Y-%m-%d"))
-
-        return datetimes
-
-    # get the archived service dates as a set
-    archive_filepaths = file_list_from_s3(
+    archive_files = file_list_from_s3_with_details(
         bucket_name=S3Archive.BUCKET_NAME,
         file_prefix=S3Archive.RAIL_PERFORMANCE_PREFIX,
     )
-    archived_datetimes = filepaths_to_datetimes(archive_filepaths)
 
-    # get the processed service dates as a set
-    vehicle_events_service_dates = db_manager.select_as_dataframe(sa.select(VehicleTrips.service_date).distinct())
-    processed_datetimes = db_service_dates_to_datetimes(vehicle_events_service_dates)
+    archived_dates = []
+    for archive_file in archive_files:
+        match = re.search(r"(?P<date>\d{4}-\d{1,2}-\d{1,2})", archive_file["s3_obj_path"])
+        if match is None:
+            continue
+        archived_dates.append(
+            {
+                "service_date": int(datetime.strptime(match.group("date"), "%Y-%m-%d").strftime("%Y%m%d")),
+                "dirty": False,
+                "last_written": archive_file["last_modified"],
+                "size_bytes": archive_file["size_bytes"],
+            }
+        )
 
-    # get service dates with new data from the last event loop
-    new_data_service_dates = db_manager.select_as_dataframe(sa.select(TempEventCompare.service_date).distinct())
-    new_data_datetimes = db_service_dates_to_datetimes(new_data_service_dates)
+    if archived_dates:
+        db_manager.execute_with_data(
+            postgresql.insert(FlatFileDates.__table__).on_conflict_do_nothing(),
+            pandas.DataFrame(archived_dates),
+        )
 
-    # return the processed dates that have yet to be archived plus dates with new data
-    return (processed_datetimes - archived_datetimes).union(new_data_datetimes)
+
+def dates_to_update(db_manager: DatabaseManager) -> Set[datetime]:
+    """
+    Generate a list of service dates that we need to create / recreate flat
+    files for from the dirty service dates of the flat_file_dates table.
+
+    The live service date is left dirty until LIVE_DATE_DEBOUNCE has passed
+    since its last write, so it isn't rewritten on every event loop.
+    """
+    live_service_date = service_date_from_timestamp(int(time.time()))
+    debounce_cutoff = datetime.now(timezone.utc) - LIVE_DATE_DEBOUNCE
+
+    dirty_dates_query = sa.select(FlatFileDates.service_date).where(
+        FlatFileDates.dirty == sa.true(),
+        sa.or_(
+            FlatFileDates.service_date != live_service_date,
+            FlatFileDates.last_written.is_(None),
+            FlatFileDates.last_written < debounce_cutoff,
+        ),
+    )
+
+    return set(
+        service_date_to_datetime(record["service_date"]) for record in db_manager.select_as_list(dirty_dates_query)
+    )
 
 
 def write_flat_files(db_manager: DatabaseManager) -> None:
     """
     * find service dates that have not been fully archived
-    * write flat files for those dates
+    * write flat files for those dates, several dates at a time
     * update the archive log csv file
     """
     # if we don't have a public archive bucket, exit
@@ -117,9 +197,11 @@ def write_flat_files(db_manager: DatabaseManager) -> None:
     try:
 
         # check the file version, deleting records if they need to be replaced
-        check_version()
+        check_version(db_manager)
 
         # get the service dates that need to be archived
+        seed_flat_file_dates(db_manager)
+        mark_untracked_dates_dirty(db_manager)
         service_dates = dates_to_update(db_manager)
 
         process_logger.add_metadata(date_count=len(service_dates))
@@ -129,32 +211,96 @@ def write_flat_files(db_manager: DatabaseManager) -> None:
             process_logger.log_complete()
             return
 
-        for service_date in service_dates:
-            sub_process_logger = ProcessLogger(
-                "flat_file_write",
-                service_date=service_date.strftime("%Y-%m-%d"),
-            )
-            sub_process_logger.log_start()
+        with ThreadPoolExecutor(max_workers=min(FLAT_FILE_WRITE_WORKERS, len(service_dates))) as pool:
+            written = list(pool.map(partial(write_service_date, db_manager), sorted(service_dates)))
+
+        process_logger.add_metadata(written_count=sum(written))
+
+        if any(written):
+            write_csv_index(db_manager)
+
+        process_logger.log_complete()
+
+    except Exception as e:
+        process_logger.log_failure(e)
+
+
+def write_service_date(db_manager: DatabaseManager, service_date: datetime) -> bool:
+    """
+    write the flat file for a service date if its content has changed since
+    the last write and clear its dirty flag.
 
-            try:
-                write_daily_table(db_manager=db_manager, service_date=service_date)
-            except Exception as e:
-                sub_process_logger.log_failure(e)
-            else:
-                sub_process_logger.log_complete()
+    the dirty flag is only cleared if the service date was not marked dirty
+    again while the flat file was being written, so new events processed in
+    the meantime are picked up by the next event loop.
 
-        write_csv_index()
+    failures are logged and leave the service date dirty, so it will be
+    retried on the next event loop.
 
+    :return True if a new flat file was uploaded
+    """
+    service_date_int = int(service_date.strftime("%Y%m%d"))
+    process_logger = ProcessLogger(
+        "flat_file_write",
+        service_date=service_date.strftime("%Y-%m-%d"),
+    )
+    process_logger.log_start()
+
+    try:
+        tracked = db_manager.select_as_list(
+            sa.select(
+                FlatFileDates.content_hash,
+                FlatFileDates.last_written,
+                FlatFileDates.dirty_since,
+            ).where(FlatFileDates.service_date == service_date_int)
+        )
+
+        new_hash = content_fingerprint(db_manager=db_manager, service_date=service_date_int)
+
+        unchanged = (
+            len(tracked) > 0 and tracked[0]["content_hash"] == new_hash and tracked[0]["last_written"] is not None
+        )
+
+        if not unchanged:
+            size_bytes = write_daily_table(
+                db_manager=db_manager,
+                service_date=service_date,
+                select_query=daily_table_query(db_manager=db_manager, service_date=service_date_int),
+            )
+            db_manager.execute(
+                sa.update(FlatFileDates.__table__)
+                .where(FlatFileDates.service_date == service_date_int)
+                .values(
+                    size_bytes=size_bytes,
+                    content_hash=new_hash,
+                    last_written=datetime.now(timezone.utc),
+                )
+            )
+
+        dirty_since = tracked[0]["dirty_since"] if len(tracked) > 0 else None
+        db_manager.execute(
+            sa.update(FlatFileDates.__table__)
+            .where(
+                FlatFileDates.service_date == service_date_int,
+                FlatFileDates.dirty_since.is_not_distinct_from(dirty_since),
+            )
+            .values(dirty=False, dirty_since=None)
+        )
+
+        process_logger.add_metadata(unchanged=unchanged)
         process_logger.log_complete()
+        return not unchanged
 
     except Exception as e:
         process_logger.log_failure(e)
+        return False
 
 
-def check_version() -> None:
+def check_version(db_manager: DatabaseManager) -> None:
     """
     check the version of of the index csv file. if it is behind the current
-    version, delete all of the files with the rail performance manager prefix.
+    version, delete all of the files with the rail performance manager prefix
+    and all flat_file_dates records, so every service date is rewritten.
     """
     index_object = os.path.join(
         S3Archive.BUCKET_NAME,
@@ -185,27 +331,48 @@ def check_version() -> None:
             if not success:
                 raise RuntimeError(f"Failed to delete {file} when updating flat files")
 
+        db_manager.execute(sa.delete(FlatFileDates.__table__))
+
 
-def write_csv_index() -> None:
+def write_csv_index(db_manager: DatabaseManager) -> None:
     """
     write a csv file to the rail performance manager public archive describing
     all of the files in the archive including size, last modified, and service
     date.
+
+    file details are read from the flat_file_dates table, which is updated as
+    files are written, instead of listing the archive bucket.
     """
-    file_details = file_list_from_s3_with_details(
-        bucket_name=S3Archive.BUCKET_NAME,
-        file_prefix=S3Archive.RAIL_PERFORMANCE_PREFIX,
+    written_dates = db_manager.select_as_list(
+        sa.select(
+            FlatFileDates.service_date,
+            FlatFileDates.size_bytes,
+            FlatFileDates.last_written,
+        )
+        .where(FlatFileDates.last_written.is_not(None))
+        .order_by(FlatFileDates.service_date)
     )
 
-    df = pandas.DataFrame(file_details)
-
-    # drop details for the index cvs and add in service date column
-    df = df[~df["s3_obj_path"].str.endswith(S3Archive.INDEX_FILENAME)]
-    df["service_date"] = df["s3_obj_path"].apply(lambda x: x.split("/")[-1][:10])
+    file_details = []
+    for record in written_dates:
+        service_date = service_date_to_datetime(record["service_date"])
+        file_details.append(
+            {
+                "size_bytes": record["size_bytes"],
+                "last_modified": record["last_written"],
+                "service_date": service_date.strftime("%Y-%m-%d"),
+                "file_url": os.path.join(
+                    "https://performancedata.mbta.com",
+                    S3Archive.RAIL_PERFORMANCE_PREFIX,
+                    flat_file_name(service_date),
+                ),
+            }
+        )
 
-    # replace "s3://[S3Archive.BUCKET_NAME]" with "https://performancedata.mbta.com"
-    df["file_url"] = df["s3_obj_path"].str.replace(f"s3://{S3Archive.BUCKET_NAME}", "https://performancedata.mbta.com")
-    df = df.drop(columns=["s3_obj_path"])
+    df = pandas.DataFrame(
+        file_details,
+        columns=["size_bytes", "last_modified", "service_date", "file_url"],
+    )
 
     # write to local csv and upload file to s3
     csv_path = "/tmp/rpm_archive_index.csv"
@@ -224,13 +391,11 @@ def write_csv_index() -> None:
     os.remove(csv_path)
 
 
-def write_daily_table(db_manager: DatabaseManager, service_date: datetime) -> pyarrow.Table:
+def daily_table_query(db_manager: DatabaseManager, service_date: int) -> sa.sql.selectable.Select:
     """
-    Generate a dataframe of all events and metrics for a single service date
+    Generate a select query of all events and metrics for a single service date
     """
-    service_date_int = int(service_date.strftime("%Y%m%d"))
-    service_date_str = service_date.strftime("%Y-%m-%d")
-    static_version_key = static_version_key_from_service_date(service_date=service_date_int, db_manager=db_manager)
+    static_version_key = static_version_key_from_service_date(service_date=service_date, db_manager=db_manager)
 
     static_subquery = (
         sa.select(
@@ -311,7 +476,7 @@ def write_daily_table(db_manager: DatabaseManager, service_date: datetime) -> py
             ),
         )
         .where(
-            VehicleEvents.service_date == service_date_int,
+            VehicleEvents.service_date == service_date,
             VehicleTrips.static_version_key == static_version_key,
             StaticRoutes.route_type < 2,
             VehicleTrips.revenue == sa.true(),
@@ -329,6 +494,67 @@ def write_daily_table(db_manager: DatabaseManager, service_date: datetime) -> py
         )
     )
 
+    return select_query
+
+
+def content_fingerprint(db_manager: DatabaseManager, service_date: int) -> str:
+    """
+    md5 hash of the inputs to the flat file of a service date: its static
+    version key, and the record count and latest updated_on of its
+    vehicle_events and vehicle_trips records.
+
+    updated_on is set on every insert and, by trigger, on every update, and
+    the counts change when records are deleted, so the fingerprint changes
+    whenever the daily table query could return different records. this
+    only reads the service date partitions of the two tables, instead of
+    running the daily table query.
+    """
+    static_version_key = static_version_key_from_service_date(service_date=service_date, db_manager=db_manager)
+
+    events = (
+        sa.select(
+            count().label("event_count"),
+            sa.func.max(VehicleEvents.updated_on).label("events_updated_on"),
+        )
+        .where(VehicleEvents.service_date == service_date)
+        .subquery("events")
+    )
+    trips = (
+        sa.select(
+            count().label("trip_count"),
+            sa.func.max(VehicleTrips.updated_on).label("trips_updated_on"),
+        )
+        .where(VehicleTrips.service_date == service_date)
+        .subquery("trips")
+    )
+
+    fingerprint = db_manager.select_as_list(sa.select(events, trips))[0]
+    fingerprint_string = "|".join(
+        str(value)
+        for value in [
+            S3Archive.RPM_VERSION,
+            static_version_key,
+            fingerprint["event_count"],
+            fingerprint["events_updated_on"],
+            fingerprint["trip_count"],
+            fingerprint["trips_updated_on"],
+        ]
+    )
+
+    return hashlib.md5(fingerprint_string.encode()).hexdigest()
+
+
+def write_daily_table(
+    db_manager: DatabaseManager,
+    service_date: datetime,
+    select_query: sa.sql.selectable.Select,
+) -> int:
+    """
+    Write a parquet file of all events and metrics for a single service date
+    to the public archive
+
+    :return size of the written file in bytes
+    """
     flat_schema = pyarrow.schema(
         [
             ("stop_sequence", pyarrow.int16()),
@@ -362,7 +588,7 @@ def write_daily_table(db_manager: DatabaseManager, service_date: datetime) -> py
     )
 
     # generate temp local and s3 paths from the service date
-    filename = f"{service_date_str}-subway-on-time-performance-v1.parquet"
+    filename = flat_file_name(service_date)
     temp_local_path = f"/tmp/{filename}"
     s3_path = os.path.join(S3Archive.BUCKET_NAME, S3Archive.RAIL_PERFORMANCE_PREFIX, filename)
 
@@ -371,17 +597,22 @@ def write_daily_table(db_manager: DatabaseManager, service_date: datetime) -> py
         os.remove(temp_local_path)
 
     # write the local file and upload it to s3
-    db_manager.write_to_parquet(
+    db_manager.copy_to_parquet(
         select_query=select_query,
         write_path=temp_local_path,
         schema=flat_schema,
     )
 
-    upload_file(
+    uploaded = upload_file(
         file_name=temp_local_path,
         object_path=s3_path,
         extra_args={"Metadata": {S3Archive.VERSION_KEY: S3Archive.RPM_VERSION}},
     )
+    if not uploaded:
+        raise RuntimeError(f"Failed to upload {s3_path}")
 
     # delete the local file
+    size_bytes = os.path.getsize(temp_local_path)
     os.remove(temp_local_path)
+
+    return size_bytes
@@ -1,59 +1,56 @@
 import datetime
-from typing import Optional, List, Union
-from functools import lru_cache
+from typing import List, Union
 
 import numpy
 import pandas
+import polars as pl
 import pytz
-import sqlalchemy as sa
 
 from lamp_py.postgres.postgres_utils import DatabaseManager
-from lamp_py.postgres.rail_performance_manager_schema import (
-    StaticFeedInfo,
-    StaticRoutes,
-    StaticStops,
-)
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 from lamp_py.aws.s3 import dt_from_obj_path
+from lamp_py.runtime_utils.gtfs_time import BOSTON_TZ_NAME, service_dates_from_timestamps
+
+from .schedule_cache import static_schedule_cache
 
 
 # boston tzinfo to be used with datetimes that require DST considerations.
 #
 # NOTE: do not use this as an argument for datetime.deatime constructors.
 # instead use BOSTON_TZ with a naive datetime. (https://pypi.org/project/pytz/)
-BOSTON_TZ = pytz.timezone("EST5EDT")
-
-
-@lru_cache
-def start_time_to_seconds(
-    time: Optional[str],
-) -> Optional[int]:
-    """
-    transform time string in HH:MM:SS format to seconds
-    """
-    if time is None:
-        return time
-
-    try:
-        (hour, minute, second) = time.split(":")
-        return int(hour) * 3600 + int(minute) * 60 + int(second)
-    except ValueError:
-        # some older files have the start time already formatted as seconds
-        # after midnight. in those cases, convert to an int and pass through.
-        return int(time)
-
-
-def start_timestamp_to_seconds(start_timestamp: int) -> int:
-    """
-    convert a start timestamp into seconds after midnight of its service date.
-    """
-    service_date_string = str(service_date_from_timestamp(start_timestamp))
-    year = int(service_date_string[:4])
-    month = int(service_date_string[4:6])
-    day = int(service_date_string[6:8])
-    start_of_service_day = int(BOSTON_TZ.localize(datetime.datetime(year=year, month=month, day=day)).timestamp())
-
-    return start_timestamp - start_of_service_day
+BOSTON_TZ = pytz.timezone(BOSTON_TZ_NAME)
+
+# Red line stop_id's used to assign "Red-A" (Ashmont) and "Red-B" (Braintree)
+# branch_route_id values to Red line trips
+RED_ASHMONT_STOP_IDS = frozenset(
+    (
+        "70085",
+        "70086",
+        "70087",
+        "70088",
+        "70089",
+        "70090",
+        "70091",
+        "70092",
+        "70093",
+        "70094",
+    )
+)
+RED_BRAINTREE_STOP_IDS = frozenset(
+    (
+        "70095",
+        "70096",
+        "70097",
+        "70098",
+        "70099",
+        "70100",
+        "70101",
+        "70102",
+        "70103",
+        "70104",
+        "70105",
+    )
+)
 
 
 def service_date_from_timestamp(timestamp: int) -> int:
@@ -79,7 +76,7 @@ def add_missing_service_dates(events_dataframe: pandas.DataFrame, timestamp_key:
     """
     events_dataframe["service_date"] = events_dataframe["service_date"].where(
         events_dataframe["service_date"].notna(),
-        events_dataframe[timestamp_key].apply(service_date_from_timestamp),
+        service_dates_from_timestamps(events_dataframe[timestamp_key]),
     )
 
     return events_dataframe
@@ -100,57 +97,11 @@ def unique_trip_stop_columns() -> List[str]:
 def static_version_key_from_service_date(service_date: int, db_manager: DatabaseManager) -> int:
     """
     for a given service date, determine the correct static schedule to use
-    """
-    # the service date must:
-    # * be between "feed_start_date" and "feed_end_date" in StaticFeedInfo
-    # * be less than or equal to "feed_active_date" in StaticFeedInfo
-    #
-    # order all static version keys by feed_active_date descending and
-    # created_on date descending, then choose the first tone. this handles
-    # multiple static schedules being issued for the same service day
-    live_match_query = (
-        sa.select(StaticFeedInfo.static_version_key)
-        .where(
-            StaticFeedInfo.feed_start_date <= service_date,
-            StaticFeedInfo.feed_end_date >= service_date,
-            StaticFeedInfo.feed_active_date <= service_date,
-        )
-        .order_by(
-            StaticFeedInfo.feed_active_date.desc(),
-            StaticFeedInfo.created_on.desc(),
-        )
-        .limit(1)
-    )
 
-    # "feed_start_date" and "feed_end_date" are modified for archived GTFS
-    # Schedule files. If processing archived static schedules, these alternate
-    # rules must be used for matching GTFS static to GTFS-RT data
-    archive_match_query = (
-        sa.select(StaticFeedInfo.static_version_key)
-        .where(
-            StaticFeedInfo.feed_start_date <= service_date,
-            StaticFeedInfo.feed_end_date >= service_date,
-        )
-        .order_by(
-            StaticFeedInfo.feed_start_date.desc(),
-            StaticFeedInfo.created_on.desc(),
-        )
-        .limit(1)
-    )
-
-    result = db_manager.select_as_list(live_match_query)
-
-    # if live_match_query fails, attempt to look for a match using the archive method
-    if len(result) == 0:
-        result = db_manager.select_as_list(archive_match_query)
-
-    # if this query does not produce a result, no static schedule info
-    # exists for this trip update data, so the data
-    # should not be processed until valid static schedule data exists
-    if len(result) == 0:
-        raise IndexError(f"StaticFeedInfo table has no matching schedule for service_date={service_date}")
-
-    return int(result[0]["static_version_key"])
+    lookups are served from the process local static schedule cache, see
+    StaticScheduleCache.static_version_key for matching rules
+    """
+    return static_schedule_cache.static_version_key(service_date, db_manager)
 
 
 def add_static_version_key_column(
@@ -221,12 +172,7 @@ def add_parent_station_column(
     lookup_v_keys = [int(s_v_key) for s_v_key in events_dataframe["static_version_key"].unique()]
 
     # pull parent station data for joining to events dataframe
-    parent_station_query = sa.select(
-        StaticStops.static_version_key,
-        StaticStops.stop_id,
-        StaticStops.parent_station,
-    ).where(StaticStops.static_version_key.in_(lookup_v_keys))
-    parent_stations = db_manager.select_as_dataframe(parent_station_query)
+    parent_stations = static_schedule_cache.stop_parent_stations(lookup_v_keys, db_manager).to_pandas()
 
     # join parent stations to events on "stop_id" and "static_version_key" foreign key
     events_dataframe = events_dataframe.merge(parent_stations, how="left", on=["static_version_key", "stop_id"])
@@ -243,6 +189,44 @@ def add_parent_station_column(
     return events_dataframe
 
 
+def add_static_frame_columns(events: pl.DataFrame, db_manager: DatabaseManager) -> pl.DataFrame:
+    """
+    polars version of add_static_version_key_column and
+    add_parent_station_column, adds "static_version_key" and
+    "parent_station" columns to an events frame with "service_date" and
+    "stop_id" columns.
+
+    if a stop has no parent station, its stop_id is used as the
+    parent_station.
+    """
+    service_dates = events.get_column("service_date").unique().to_list()
+    static_version_keys = pl.DataFrame(
+        {
+            "service_date": service_dates,
+            "static_version_key": [
+                static_version_key_from_service_date(service_date=int(service_date), db_manager=db_manager)
+                for service_date in service_dates
+            ],
+        },
+        schema={"service_date": pl.Int64, "static_version_key": pl.Int64},
+    )
+    events = events.join(static_version_keys, on="service_date", how="left")
+
+    parent_stations = pl.from_arrow(
+        static_schedule_cache.stop_parent_stations(
+            static_version_keys.get_column("static_version_key").unique().to_list(), db_manager
+        )
+    )
+    assert isinstance(parent_stations, pl.DataFrame)
+
+    return events.join(
+        parent_stations,
+        on=["static_version_key", "stop_id"],
+        how="left",
+        coalesce=True,
+    ).with_columns(pl.coalesce("parent_station", "stop_id").alias("parent_station"))
+
+
 def rail_routes_from_filepath(filepath: Union[List[str], str], db_manager: DatabaseManager) -> List[str]:
     """
     get a list of rail route_ids that were in effect on a given service date
@@ -258,11 +242,4 @@ def rail_routes_from_filepath(filepath: Union[List[str], str], db_manager: Datab
 
     static_version_key = static_version_key_from_service_date(service_date=service_date, db_manager=db_manager)
 
-    result = db_manager.execute(
-        sa.select(StaticRoutes.route_id).where(
-            StaticRoutes.route_type.in_([0, 1, 2]),
-            StaticRoutes.static_version_key == static_version_key,
-        )
-    )
-
-    return [row[0] for row in result]
+    return static_schedule_cache.rail_routes(static_version_key, db_manager)
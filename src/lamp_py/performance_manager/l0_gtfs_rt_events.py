@@ -1,6 +1,5 @@
 from typing import Dict, List, Tuple
 
-import numpy
 import pandas
 import sqlalchemy as sa
 from sqlalchemy.dialects import postgresql
@@ -19,11 +18,18 @@ from lamp_py.postgres.postgres_utils import (
 )
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
+from .flat_file import mark_temp_event_dates_dirty
 from .gtfs_utils import unique_trip_stop_columns
+from .schedule_cache import static_schedule_cache
 from .l0_rt_trip_updates import process_tu_files
 from .l0_rt_vehicle_positions import process_vp_files
 from .l1_rt_trips import process_trips, load_new_trip_data
 from .l1_rt_metrics import update_metrics_from_temp_events
+from .partitions import (
+    create_service_date_partitions,
+    temp_event_service_dates,
+    vacuum_analyze_partitions,
+)
 
 
 def get_gtfs_rt_paths(md_db_manager: DatabaseManager, path_count: int = 12) -> Dict[str, List]:
@@ -278,14 +284,14 @@ def build_temp_events(events: pandas.DataFrame, db_manager: DatabaseManager) ->
     events["vp_move_timestamp"] = events["vp_move_timestamp"].astype("Int64")
     events["vp_stop_timestamp"] = events["vp_stop_timestamp"].astype("Int64")
     events["tu_stop_timestamp"] = events["tu_stop_timestamp"].astype("Int64")
-    events = events.fillna(numpy.nan).replace([numpy.nan], [None])
 
-    # truncate temp_event_compare table and insert all event records
+    # truncate temp_event_compare table and bulk load all event records
     db_manager.truncate_table(TempEventCompare)
-    db_manager.execute_with_data(
-        sa.insert(TempEventCompare.__table__),
-        events,
-    )
+    db_manager.insert_dataframe(events, TempEventCompare)
+
+    # make sure vehicle_trips and vehicle_events have partitions for all
+    # service dates in temp_event_compare
+    create_service_date_partitions(db_manager, temp_event_service_dates(db_manager))
 
     # make sure vehicle_trips has trips for all events in temp_event_compare
     load_new_trip_data(db_manager=db_manager)
@@ -505,11 +511,13 @@ def process_gtfs_rt_files(
                 process_trips(rpm_db_manager)
                 # update event metrics columns
                 update_metrics_from_temp_events(rpm_db_manager)
+                # flag service dates with new events for flat file writes
+                mark_temp_event_dates_dirty(rpm_db_manager)
 
         md_db_manager.execute(
             sa.update(MetadataLog.__table__).where(MetadataLog.pk_id.in_(files["ids"])).values(rail_pm_processed=True)
         )
-        process_logger.add_metadata(event_count=events.shape[0])
+        process_logger.add_metadata(event_count=events.shape[0], **static_schedule_cache.stats())
         process_logger.log_complete()
     except Exception as error:
         md_db_manager.execute(
@@ -519,5 +527,5 @@ def process_gtfs_rt_files(
         )
         process_logger.log_failure(error)
 
-    rpm_db_manager.vacuum_analyze(VehicleEvents)
-    rpm_db_manager.vacuum_analyze(VehicleTrips)
+    # only vacuum partitions holding service dates that were just modified
+    vacuum_analyze_partitions(rpm_db_manager, temp_event_service_dates(rpm_db_manager))
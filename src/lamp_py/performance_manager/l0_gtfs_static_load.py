@@ -24,11 +24,12 @@ from lamp_py.postgres.postgres_utils import (
     DatabaseManager,
     get_unprocessed_files,
 )
+from lamp_py.runtime_utils.gtfs_time import gtfs_times_to_seconds
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 from lamp_py.runtime_utils.infinite_wait import infinite_wait
 from lamp_py.runtime_utils.remote_files import S3_SPRINGBOARD
 
-from .gtfs_utils import start_time_to_seconds
+from .schedule_cache import static_schedule_cache
 
 from .l0_gtfs_static_mod import modify_static_tables
 
@@ -330,7 +331,7 @@ def transform_data_tables(static_tables: Dict[str, StaticTableDetails]) -> None:
 
         if table.column_info.time_to_seconds_cols is not None:
             for col in table.column_info.time_to_seconds_cols:
-                table.data_table[col] = table.data_table[col].apply(start_time_to_seconds).astype("Int64")
+                table.data_table[col] = gtfs_times_to_seconds(table.data_table[col])
 
         table.data_table = table.data_table.fillna(numpy.nan).replace([numpy.nan], [None])
         table.data_table = table.data_table.replace([""], [None])
@@ -452,6 +453,9 @@ def process_static_tables(
             insert_data_tables(static_tables, static_version_key, rpm_db_manager)
             modify_static_tables(static_version_key, rpm_db_manager)
 
+            # cached schedule lookups may change with the new schedule version
+            static_schedule_cache.invalidate()
+
             update_md_log = (
                 sa.update(MetadataLog.__table__).where(MetadataLog.pk_id.in_(ids)).values(rail_pm_processed=True)
             )
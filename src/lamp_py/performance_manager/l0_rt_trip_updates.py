@@ -1,41 +1,64 @@
-from typing import Iterator, List, Union
+from typing import Iterator, List, Optional, Union
 import time
 
 import numpy
 import pandas
+import polars as pl
+import pyarrow
 import pyarrow.compute as pc
-from lamp_py.aws.s3 import read_parquet_chunks
+from lamp_py.aws.s3 import read_parquet_batches, read_parquet_chunks
 from lamp_py.postgres.postgres_utils import DatabaseManager
+from lamp_py.runtime_utils.gtfs_time import (
+    gtfs_time_to_seconds_expr,
+    gtfs_times_to_seconds,
+    service_date_from_timestamp_expr,
+)
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
 from .gtfs_utils import (
-    add_missing_service_dates,
-    add_parent_station_column,
-    add_static_version_key_column,
+    add_static_frame_columns,
     rail_routes_from_filepath,
-    start_time_to_seconds,
     unique_trip_stop_columns,
 )
 
 
-def get_tu_dataframe_chunks(to_load: Union[str, List[str]], route_ids: List[str]) -> Iterator[pandas.DataFrame]:
+TRIP_UPDATE_COLUMNS = [
+    "feed_timestamp",
+    "trip_update.timestamp",
+    "trip_update.stop_time_update.stop_id",
+    "trip_update.stop_time_update.arrival.time",
+    "trip_update.trip.direction_id",
+    "trip_update.trip.route_id",
+    "trip_update.trip.start_date",
+    "trip_update.trip.start_time",
+    "trip_update.vehicle.id",
+    "trip_update.trip.trip_id",
+]
+
+TU_COLUMN_RENAMES = {
+    "trip_update.timestamp": "timestamp",
+    "trip_update.stop_time_update.stop_id": "stop_id",
+    "trip_update.stop_time_update.arrival.time": "tu_stop_timestamp",
+    "trip_update.trip.direction_id": "direction_id",
+    "trip_update.trip.route_id": "route_id",
+    "trip_update.trip.start_date": "start_date",
+    "trip_update.trip.start_time": "start_time",
+    "trip_update.vehicle.id": "vehicle_id",
+    "trip_update.trip.trip_id": "trip_id",
+}
+
+# rows per record batch when reducing trip updates as they are read. the
+# parquet reader buffers several batches ahead, so peak memory scales with
+# this value, not with the size of the day being processed.
+TU_BATCH_ROWS = 100_000
+
+
+def tu_filters(route_ids: List[str]) -> pc.Expression:
     """
-    return interator of dataframe chunks from a trip updates parquet file
-    (or list of files)
+    parquet filters that drop trip updates without the data needed to build
+    events, or that are not on one of route_ids
     """
-    trip_update_columns = [
-        "feed_timestamp",
-        "trip_update.timestamp",
-        "trip_update.stop_time_update.stop_id",
-        "trip_update.stop_time_update.arrival.time",
-        "trip_update.trip.direction_id",
-        "trip_update.trip.route_id",
-        "trip_update.trip.start_date",
-        "trip_update.trip.start_time",
-        "trip_update.vehicle.id",
-        "trip_update.trip.trip_id",
-    ]
-    trip_update_filters = (
+    return (
         (pc.field("trip_update.trip.direction_id").isin((0, 1)))
         & (pc.field("trip_update.trip.trip_id").is_valid())
         & (pc.field("trip_update.vehicle.id").is_valid())
@@ -43,13 +66,19 @@ def get_tu_dataframe_chunks(to_load: Union[str, List[str]], route_ids: List[str]
         & (pc.field("trip_update.stop_time_update.arrival.time") > 0)
     )
 
+
+def get_tu_dataframe_chunks(to_load: Union[str, List[str]], route_ids: List[str]) -> Iterator[pandas.DataFrame]:
+    """
+    return interator of dataframe chunks from a trip updates parquet file
+    (or list of files)
+    """
     # 100_000 batch size should result in ~5-6 GB of memory use per batch
     # of trip update records
     return read_parquet_chunks(
         to_load,
         max_rows=1_000_000,
-        columns=trip_update_columns,
-        filters=trip_update_filters,
+        columns=TRIP_UPDATE_COLUMNS,
+        filters=tu_filters(route_ids),
     )
 
 
@@ -63,25 +92,14 @@ def get_and_unwrap_tu_dataframe(paths: Union[str, List[str]], route_ids: List[st
 
     trip_updates = pandas.DataFrame()
 
-    rename_mapper = {
-        "trip_update.timestamp": "timestamp",
-        "trip_update.stop_time_update.stop_id": "stop_id",
-        "trip_update.stop_time_update.arrival.time": "tu_stop_timestamp",
-        "trip_update.trip.direction_id": "direction_id",
-        "trip_update.trip.route_id": "route_id",
-        "trip_update.trip.start_date": "start_date",
-        "trip_update.trip.start_time": "start_time",
-        "trip_update.vehicle.id": "vehicle_id",
-        "trip_update.trip.trip_id": "trip_id",
-    }
-
     retry_attempts = 2
     for retry_attempt in range(retry_attempts + 1):
         try:
             process_logger.add_metadata(retry_attempts=retry_attempt)
+            batches = []
             for batch_events in get_tu_dataframe_chunks(paths, route_ids):
                 # rename columns from trip update parquet schema
-                batch_events = batch_events.rename(columns=rename_mapper)
+                batch_events = batch_events.rename(columns=TU_COLUMN_RENAMES)
                 # use feed_timestamp if timestamp value is null
                 batch_events["timestamp"] = batch_events["timestamp"].where(
                     batch_events["timestamp"].notna(),
@@ -97,7 +115,7 @@ def get_and_unwrap_tu_dataframe(paths: Union[str, List[str]], route_ids: List[st
                 batch_events["direction_id"] = pandas.to_numeric(batch_events["direction_id"]).astype(numpy.bool_)
 
                 # store start_time as seconds from start of day int64
-                batch_events["start_time"] = batch_events["start_time"].apply(start_time_to_seconds).astype("Int64")
+                batch_events["start_time"] = gtfs_times_to_seconds(batch_events["start_time"])
 
                 batch_events["tu_stop_timestamp"] = pandas.to_numeric(batch_events["tu_stop_timestamp"]).astype("Int64")
 
@@ -109,7 +127,12 @@ def get_and_unwrap_tu_dataframe(paths: Union[str, List[str]], route_ids: List[st
                     & (batch_events["tu_stop_timestamp"] - batch_events["timestamp"] < 120)
                 ]
 
-                trip_updates = pandas.concat([trip_updates, batch_events])
+                batches.append(batch_events)
+
+            # concatenate once, concatenating on every chunk copies all
+            # previous chunks each time
+            if batches:
+                trip_updates = pandas.concat(batches)
             break
         except Exception as exception:
             if retry_attempt == retry_attempts:
@@ -123,21 +146,139 @@ def get_and_unwrap_tu_dataframe(paths: Union[str, List[str]], route_ids: List[st
     return trip_updates
 
 
-def reduce_trip_updates(trip_updates: pandas.DataFrame) -> pandas.DataFrame:
+def unwrap_tu_batch(batch: pyarrow.RecordBatch) -> pl.DataFrame:
     """
-    reduce the data frame to a single record per trip / stop.
+    polars version of the per chunk transform in get_and_unwrap_tu_dataframe,
+    missing service dates are filled in from the record timestamp.
     """
-    process_logger = ProcessLogger("tu.reduce", start_row_count=trip_updates.shape[0])
+    trip_updates = pl.from_arrow(batch)
+    assert isinstance(trip_updates, pl.DataFrame)
+
+    return (
+        trip_updates.rename(TU_COLUMN_RENAMES).select(
+            # use feed_timestamp if timestamp value is null
+            pl.coalesce("timestamp", "feed_timestamp").cast(pl.Int64).alias("timestamp"),
+            pl.col("start_date").cast(pl.Int64).alias("service_date"),
+            "route_id",
+            "trip_id",
+            "stop_id",
+            pl.col("tu_stop_timestamp").cast(pl.Int64),
+            pl.col("direction_id").cast(pl.Boolean),
+            "start_time",
+            "vehicle_id",
+        )
+        # filter out stop event predictions that are too far into the future
+        # and are unlikely to be used as a final stop event prediction
+        # (2 minutes) or predictions that go into the past (negative values)
+        .filter(
+            (pl.col("tu_stop_timestamp") - pl.col("timestamp") >= 0)
+            & (pl.col("tu_stop_timestamp") - pl.col("timestamp") < 120)
+        )
+        # string and timezone conversions run after the filter, on the
+        # fraction of records that are kept
+        .with_columns(
+            pl.coalesce(
+                "service_date",
+                service_date_from_timestamp_expr(pl.col("timestamp")),
+            ).alias("service_date"),
+            gtfs_time_to_seconds_expr(pl.col("start_time")).alias("start_time"),
+        )
+    )
+
+
+def latest_trip_updates(trip_updates: pl.DataFrame) -> pl.DataFrame:
+    """
+    hash aggregate trip updates down to the record with the latest
+    "timestamp" for each trip / stop. if several records share the latest
+    timestamp, the first one read is kept, the same as reduce_trip_updates.
+    """
+    return (
+        trip_updates.sort("timestamp", descending=True, maintain_order=True)
+        .group_by(unique_trip_stop_columns())
+        .agg(pl.all().first())
+    )
+
+
+def merge_latest_trip_updates(latest: Optional[pl.DataFrame], trip_updates: pl.DataFrame) -> pl.DataFrame:
+    """
+    merge reduced trip updates from a chunk into the running state of latest
+    trip updates. the running state goes first, so ties are won by records
+    from earlier chunks.
+    """
+    if latest is None:
+        return trip_updates
+
+    return latest_trip_updates(pl.concat([latest, trip_updates.select(latest.columns)]))
+
+
+def get_reduced_tu_dataframe(
+    paths: Union[str, List[str]],
+    route_ids: List[str],
+    db_manager: DatabaseManager,
+) -> pandas.DataFrame:
+    """
+    read trip update records from parquet files in chunks, reducing each
+    chunk to a single record per trip / stop as it is read.
+
+    a running state of the latest prediction for each trip / stop is kept
+    across chunks, so memory use is bounded by the size of a chunk and the
+    number of distinct trip / stops, not by the number of trip updates.
+    """
+    process_logger = ProcessLogger("tu.get_reduced_dataframe")
     process_logger.log_start()
 
-    trip_stop_columns = unique_trip_stop_columns()
+    latest: Optional[pl.DataFrame] = None
+    chunk_count = 0
+    row_count = 0
 
-    # sort all trip updates by reverse timestamp, then drop all of the updates
-    # for the same trip and same station but the first one. the first update will
-    # be the most recent arrival time prediction
-    trip_updates = trip_updates.sort_values(by=["timestamp"], ascending=False)
-    trip_updates = trip_updates.drop_duplicates(subset=trip_stop_columns, keep="first")
+    retry_attempts = 2
+    for retry_attempt in range(retry_attempts + 1):
+        try:
+            process_logger.add_metadata(retry_attempts=retry_attempt)
+            latest = None
+            chunk_count = 0
+            row_count = 0
+            for batch in read_parquet_batches(
+                paths,
+                max_rows=TU_BATCH_ROWS,
+                columns=TRIP_UPDATE_COLUMNS,
+                filters=tu_filters(route_ids),
+            ):
+                chunk_count += 1
+                trip_updates = unwrap_tu_batch(batch)
+                if trip_updates.height == 0:
+                    continue
+                row_count += trip_updates.height
+
+                latest = merge_latest_trip_updates(
+                    latest, latest_trip_updates(add_static_frame_columns(trip_updates, db_manager))
+                )
+            break
+        except Exception as exception:
+            if retry_attempt == retry_attempts:
+                process_logger.log_failure(exception)
+                raise exception
+            time.sleep(1)
+
+    if latest is None:
+        reduced = pandas.DataFrame()
+    else:
+        reduced = (
+            latest.sort(unique_trip_stop_columns())
+            .to_pandas()
+            .astype({"service_date": "Int64", "start_time": "Int64", "tu_stop_timestamp": "Int64"})
+        )
+
+    process_logger.add_metadata(chunk_count=chunk_count, row_count=row_count, trip_stop_count=reduced.shape[0])
+    process_logger.log_complete()
 
+    return reduced
+
+
+def add_event_columns(trip_updates: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    drop "timestamp" and add vehicle position columns to reduced trip updates
+    """
     # after group and sort, "timestamp" longer needed
     trip_updates = trip_updates.drop(columns=["timestamp"])
 
@@ -151,6 +292,27 @@ def reduce_trip_updates(trip_updates: pandas.DataFrame) -> pandas.DataFrame:
     trip_updates["vehicle_consist"] = None
     trip_updates["revenue"] = True
 
+    return trip_updates
+
+
+def reduce_trip_updates(trip_updates: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    reduce the data frame to a single record per trip / stop.
+    """
+    process_logger = ProcessLogger("tu.reduce", start_row_count=trip_updates.shape[0])
+    process_logger.log_start()
+
+    trip_stop_columns = unique_trip_stop_columns()
+
+    # sort all trip updates by reverse timestamp, then drop all of the updates
+    # for the same trip and same station but the first one. the first update will
+    # be the most recent arrival time prediction. the sort is stable, so ties
+    # on timestamp are won by the first record read, as in latest_trip_updates
+    trip_updates = trip_updates.sort_values(by=["timestamp"], ascending=False, kind="stable")
+    trip_updates = trip_updates.drop_duplicates(subset=trip_stop_columns, keep="first")
+
+    trip_updates = add_event_columns(trip_updates)
+
     process_logger.add_metadata(after_row_count=trip_updates.shape[0])
     process_logger.log_complete()
 
@@ -163,17 +325,17 @@ def process_tu_files(
 ) -> pandas.DataFrame:
     """
     Generate a dataframe of Vehicle Events from gtfs_rt trip updates parquet files.
+
+    trip updates are reduced to the latest prediction per trip / stop as they
+    are read, see get_reduced_tu_dataframe.
     """
     process_logger = ProcessLogger("process_trip_updates", file_count=len(paths), paths=paths)
     process_logger.log_start()
 
     route_ids = rail_routes_from_filepath(paths, db_manager)
-    trip_updates = get_and_unwrap_tu_dataframe(paths, route_ids)
+    trip_updates = get_reduced_tu_dataframe(paths, route_ids, db_manager)
     if trip_updates.shape[0] > 0:
-        trip_updates = add_missing_service_dates(events_dataframe=trip_updates, timestamp_key="timestamp")
-        trip_updates = add_static_version_key_column(trip_updates, db_manager)
-        trip_updates = add_parent_station_column(trip_updates, db_manager)
-        trip_updates = reduce_trip_updates(trip_updates)
+        trip_updates = add_event_columns(trip_updates)
 
     process_logger.add_metadata(vehicle_events_count=trip_updates.shape[0])
     process_logger.log_complete()
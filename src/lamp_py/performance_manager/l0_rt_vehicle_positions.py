@@ -2,47 +2,48 @@ from typing import List, Union, Dict, Tuple
 
 import numpy
 import pandas
+import polars as pl
 import pyarrow.compute as pc
-from lamp_py.aws.s3 import read_parquet
+from lamp_py.aws.s3 import read_parquet, read_parquet_table
 from lamp_py.postgres.postgres_utils import DatabaseManager
+from lamp_py.runtime_utils.gtfs_time import (
+    gtfs_time_to_seconds_expr,
+    gtfs_times_to_seconds,
+    service_date_from_timestamp_expr,
+)
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
 from .gtfs_utils import (
-    add_parent_station_column,
-    add_missing_service_dates,
-    add_static_version_key_column,
+    add_static_frame_columns,
     rail_routes_from_filepath,
-    start_time_to_seconds,
     unique_trip_stop_columns,
 )
 
 
-def get_vp_dataframe(to_load: Union[str, List[str]], route_ids: List[str]) -> pandas.DataFrame:
+VP_COLUMN_RENAMES = {
+    "vehicle.current_status": "current_status",
+    "vehicle.current_stop_sequence": "current_stop_sequence",
+    "vehicle.stop_id": "stop_id",
+    "vehicle.timestamp": "vehicle_timestamp",
+    "vehicle.trip.direction_id": "direction_id",
+    "vehicle.trip.route_id": "route_id",
+    "vehicle.trip.start_date": "start_date",
+    "vehicle.trip.start_time": "start_time",
+    "vehicle.trip.revenue": "revenue",
+    "vehicle.vehicle.id": "vehicle_id",
+    "vehicle.trip.trip_id": "trip_id",
+    "vehicle.vehicle.label": "vehicle_label",
+    "vehicle.vehicle.consist": "vehicle_consist",
+    "vehicle.multi_carriage_details": "multi_carriage_details",
+}
+
+
+def vp_filters(route_ids: List[str]) -> pc.Expression:
     """
-    return a dataframe from a vehicle position parquet file (or list of files)
-    with expected columns without null data.
+    parquet filters that drop vehicle positions without the data needed to
+    build events, or that are not on one of route_ids
     """
-    process_logger = ProcessLogger("vp.get_dataframe")
-    process_logger.log_start()
-
-    vehicle_position_cols = [
-        "vehicle.current_status",
-        "vehicle.current_stop_sequence",
-        "vehicle.stop_id",
-        "vehicle.timestamp",
-        "vehicle.trip.direction_id",
-        "vehicle.trip.route_id",
-        "vehicle.trip.start_date",
-        "vehicle.trip.start_time",
-        "vehicle.trip.revenue",
-        "vehicle.vehicle.id",
-        "vehicle.trip.trip_id",
-        "vehicle.vehicle.label",
-        "vehicle.vehicle.consist",
-        "vehicle.multi_carriage_details",
-    ]
-
-    vehicle_position_filters = (
+    return (
         (pc.field("vehicle.current_status").is_valid())
         & (pc.field("vehicle.current_stop_sequence") >= 0)
         & (pc.field("vehicle.stop_id").is_valid())
@@ -54,30 +55,22 @@ def get_vp_dataframe(to_load: Union[str, List[str]], route_ids: List[str]) -> pa
         & (pc.field("vehicle.trip.trip_id").is_valid())
     )
 
-    rename_mapper = {
-        "vehicle.current_status": "current_status",
-        "vehicle.current_stop_sequence": "current_stop_sequence",
-        "vehicle.stop_id": "stop_id",
-        "vehicle.timestamp": "vehicle_timestamp",
-        "vehicle.trip.direction_id": "direction_id",
-        "vehicle.trip.route_id": "route_id",
-        "vehicle.trip.start_date": "start_date",
-        "vehicle.trip.start_time": "start_time",
-        "vehicle.trip.revenue": "revenue",
-        "vehicle.vehicle.id": "vehicle_id",
-        "vehicle.trip.trip_id": "trip_id",
-        "vehicle.vehicle.label": "vehicle_label",
-        "vehicle.vehicle.consist": "vehicle_consist",
-        "vehicle.multi_carriage_details": "multi_carriage_details",
-    }
+
+def get_vp_dataframe(to_load: Union[str, List[str]], route_ids: List[str]) -> pandas.DataFrame:
+    """
+    return a dataframe from a vehicle position parquet file (or list of files)
+    with expected columns without null data.
+    """
+    process_logger = ProcessLogger("vp.get_dataframe")
+    process_logger.log_start()
 
     result = read_parquet(
         to_load,
-        columns=vehicle_position_cols,
-        filters=vehicle_position_filters,
+        columns=list(VP_COLUMN_RENAMES),
+        filters=vp_filters(route_ids),
     )
 
-    result = result.rename(columns=rename_mapper)
+    result = result.rename(columns=VP_COLUMN_RENAMES)
 
     process_logger.add_metadata(row_count=result.shape[0])
     process_logger.log_complete()
@@ -117,7 +110,7 @@ def transform_vp_datatypes(
     vehicle_positions["revenue"] = numpy.where(vehicle_positions["revenue"].eq(False), False, True).astype(numpy.bool_)
 
     # store start_time as seconds from start of day as int64
-    vehicle_positions["start_time"] = vehicle_positions["start_time"].apply(start_time_to_seconds).astype("Int64")
+    vehicle_positions["start_time"] = gtfs_times_to_seconds(vehicle_positions["start_time"])
 
     process_logger.log_complete()
     return vehicle_positions
@@ -207,25 +200,140 @@ def transform_vp_timestamps(
     return vehicle_positions
 
 
+def get_vp_frame(to_load: Union[str, List[str]], route_ids: List[str]) -> pl.DataFrame:
+    """
+    polars version of get_vp_dataframe, the arrow table read from the parquet
+    files is handed to polars without a copy through pandas.
+    """
+    process_logger = ProcessLogger("vp.get_frame")
+    process_logger.log_start()
+
+    table = read_parquet_table(
+        to_load,
+        columns=list(VP_COLUMN_RENAMES),
+        filters=vp_filters(route_ids),
+    )
+    result = pl.from_arrow(table.rename_columns([VP_COLUMN_RENAMES[name] for name in table.column_names]))
+    assert isinstance(result, pl.DataFrame)
+
+    process_logger.add_metadata(row_count=result.height)
+    process_logger.log_complete()
+
+    return result
+
+
+def _carriage_labels_expr(vehicle_positions: pl.DataFrame, column: str) -> pl.Expr:
+    """
+    pipe delimited string of the carriage labels in a list of structs column,
+    columns without a list type only hold nulls and are cast to strings.
+    """
+    if not isinstance(vehicle_positions.schema[column], pl.List):
+        return pl.col(column).cast(pl.String)
+
+    # labels are joined with python's str() in the pandas implementation, a
+    # null label is written as "None"
+    return pl.col(column).list.eval(pl.element().struct.field("label").cast(pl.String).fill_null("None")).list.join("|")
+
+
+def transform_vp_frame_datatypes(vehicle_positions: pl.DataFrame) -> pl.DataFrame:
+    """
+    polars version of transform_vp_datatypes and add_missing_service_dates
+    """
+    process_logger = ProcessLogger("vp.transform_frame_datatypes", row_count=vehicle_positions.height)
+    process_logger.log_start()
+
+    vehicle_positions = vehicle_positions.with_columns(
+        # current_status: 1 = MOVING, 0 = STOPPED_AT
+        (pl.col("current_status") != "STOPPED_AT").alias("is_moving"),
+        pl.col("current_stop_sequence").cast(pl.Int64).alias("stop_sequence"),
+        pl.col("vehicle_timestamp").cast(pl.Int64),
+        # generate the service date from the vehicle timestamp if null
+        pl.coalesce(
+            pl.col("start_date").cast(pl.Int64),
+            service_date_from_timestamp_expr(pl.col("vehicle_timestamp")),
+        ).alias("service_date"),
+        pl.col("direction_id").cast(pl.Boolean),
+        # fix revenue field, NULL is True
+        pl.col("revenue").cast(pl.Boolean).fill_null(True),
+        gtfs_time_to_seconds_expr(pl.col("start_time")).alias("start_time"),
+        _carriage_labels_expr(vehicle_positions, "vehicle_consist").alias("vehicle_consist"),
+        _carriage_labels_expr(vehicle_positions, "multi_carriage_details").alias("multi_carriage_details"),
+    ).drop("current_status", "current_stop_sequence", "start_date")
+
+    process_logger.log_complete()
+    return vehicle_positions
+
+
+def transform_vp_frame_timestamps(vehicle_positions: pl.DataFrame) -> pl.DataFrame:
+    """
+    polars version of transform_vp_timestamps. a single group by on the
+    unique trip-stop columns finds the earliest moving and stopped timestamps
+    and keeps the details of the first vehicle position for each trip-stop.
+    """
+    process_logger = ProcessLogger("vp.transform_frame_timestamps", start_row_count=vehicle_positions.height)
+    process_logger.log_start()
+
+    trip_stop_columns = unique_trip_stop_columns()
+    detail_columns = [
+        column
+        for column in vehicle_positions.columns
+        if column not in trip_stop_columns and column not in ("is_moving", "vehicle_timestamp")
+    ]
+
+    vehicle_positions = (
+        vehicle_positions.group_by(trip_stop_columns, maintain_order=True)
+        .agg(
+            pl.col("vehicle_timestamp").filter(~pl.col("is_moving")).min().alias("vp_stop_timestamp"),
+            pl.col("vehicle_timestamp").filter(pl.col("is_moving")).min().alias("vp_move_timestamp"),
+            pl.col(detail_columns).first(),
+        )
+        .sort(trip_stop_columns)
+        .with_columns(
+            # coalesce vehicle_consist with multi_carriage_details.
+            # vehicle_consist dropped from RT_VEHICLE_POSITIONS feed on 2024-03-05
+            pl.coalesce("vehicle_consist", "multi_carriage_details").alias("vehicle_consist"),
+        )
+        .drop("multi_carriage_details")
+    )
+
+    process_logger.add_metadata(after_row_count=vehicle_positions.height)
+    process_logger.log_complete()
+    return vehicle_positions
+
+
+def vp_frame_to_dataframe(vehicle_positions: pl.DataFrame) -> pandas.DataFrame:
+    """
+    convert vehicle events built with polars into the pandas dataframe
+    expected by the rest of the rail performance manager
+    """
+    nullable_int_columns = ["service_date", "vp_stop_timestamp", "vp_move_timestamp", "start_time"]
+    return vehicle_positions.to_pandas().astype(
+        {column: "Int64" for column in nullable_int_columns if column in vehicle_positions.columns}
+    )
+
+
 def process_vp_files(
     paths: Union[str, List[str]],
     db_manager: DatabaseManager,
 ) -> pandas.DataFrame:
     """
     Generate a dataframe of Vehicle Events from gtfs_rt vehicle position parquet files.
+
+    vehicle positions are transformed with polars, the pandas transform
+    functions in this module produce the same events.
     """
     process_logger = ProcessLogger("process_vehicle_positions", file_count=len(paths), paths=paths)
     process_logger.log_start()
 
     route_ids = rail_routes_from_filepath(paths, db_manager)
-    vehicle_positions = get_vp_dataframe(paths, route_ids)
-    if vehicle_positions.shape[0] > 0:
-        vehicle_positions = transform_vp_datatypes(vehicle_positions)
-        vehicle_positions = add_missing_service_dates(vehicle_positions, timestamp_key="vehicle_timestamp")
-        vehicle_positions = add_static_version_key_column(vehicle_positions, db_manager)
-        vehicle_positions = add_parent_station_column(vehicle_positions, db_manager)
-        vehicle_positions = transform_vp_timestamps(vehicle_positions)
-
-    process_logger.add_metadata(vehicle_events_count=vehicle_positions.shape[0])
+    vehicle_positions = get_vp_frame(paths, route_ids)
+    if vehicle_positions.height > 0:
+        vehicle_positions = transform_vp_frame_datatypes(vehicle_positions)
+        vehicle_positions = add_static_frame_columns(vehicle_positions, db_manager)
+        vehicle_positions = transform_vp_frame_timestamps(vehicle_positions)
+
+    vehicle_events = vp_frame_to_dataframe(vehicle_positions)
+
+    process_logger.add_metadata(vehicle_events_count=vehicle_events.shape[0])
     process_logger.log_complete()
-    return vehicle_positions
+    return vehicle_events
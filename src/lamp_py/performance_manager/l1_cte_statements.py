@@ -1,7 +1,10 @@
+from typing import Optional
+
 import sqlalchemy as sa
-from sqlalchemy.sql.functions import rank
+from sqlalchemy.sql.functions import count, rank
 from lamp_py.postgres.rail_performance_manager_schema import (
     ServiceIdDates,
+    StaticRoutePatterns,
     StaticStops,
     StaticStopTimes,
     StaticTrips,
@@ -109,17 +112,271 @@ def static_trips_subquery(static_version_key: int, service_date: int) -> sa.sql.
     )
 
 
-def rt_trips_subquery(service_date: int) -> sa.sql.selectable.Subquery:
+def static_trips_summary_subquery(static_version_key: int, service_date: int) -> sa.sql.selectable.Subquery:
+    """
+    return Selectable with one summary record for each static trip on given
+    service_date and static_version_key value combo
+
+    created fields to be returned:
+        - route_id (branch_route_id, or trunk_route_id if branch is null)
+        - static_start_time (arrival time at first stop of trip)
+        - static_stop_count (number of stops on trip)
+    """
+    static_trips_sub = static_trips_subquery(static_version_key, service_date)
+
+    # to build a 'summary' trips table only the first and last records for each
+    # static trip are needed.
+    first_stop_static_sub = (
+        sa.select(
+            static_trips_sub.c.static_trip_id,
+            static_trips_sub.c.static_stop_timestamp.label("static_start_time"),
+        )
+        .select_from(static_trips_sub)
+        .where(static_trips_sub.c.static_trip_first_stop == sa.true())
+        .subquery(name="first_stop_static_sub")
+    )
+
+    # join first_stop_static_sub with last stop records to create trip summary records
+    return (
+        sa.select(
+            static_trips_sub.c.static_trip_id,
+            sa.func.coalesce(
+                static_trips_sub.c.branch_route_id,
+                static_trips_sub.c.trunk_route_id,
+            ).label("route_id"),
+            static_trips_sub.c.direction_id,
+            first_stop_static_sub.c.static_start_time,
+            static_trips_sub.c.static_trip_stop_rank.label("static_stop_count"),
+        )
+        .select_from(static_trips_sub)
+        .join(
+            first_stop_static_sub,
+            static_trips_sub.c.static_trip_id == first_stop_static_sub.c.static_trip_id,
+        )
+        .where(static_trips_sub.c.static_trip_last_stop == sa.true())
+        .subquery(name="static_trips_summary_sub")
+    )
+
+
+def static_canon_subquery(static_version_key: int) -> sa.sql.selectable.Subquery:
+    """
+    return Selectable named "static_canon" with a canonical stop_sequence for
+    each parent_station on each route in each direction of a static_version_key
+
+    canonical trips are the representative_trip_id of route patterns with
+    route_pattern_typicality = 5, falling back to route_pattern_typicality = 1
+    """
+    # select canonical trip_id for each trip_pattern and direction combination
+    # this will first select any representative_trip_id where the route_pattern_typicality = 5
+    # and then fall back to where the route_pattern_typicality = 1
+    canon_trips = (
+        sa.select(
+            StaticRoutePatterns.direction_id,
+            StaticRoutePatterns.representative_trip_id,
+            StaticTrips.trunk_route_id,
+            sa.func.coalesce(StaticTrips.branch_route_id, StaticTrips.trunk_route_id).label("route_id"),
+            StaticRoutePatterns.static_version_key,
+        )
+        .distinct(
+            sa.func.coalesce(StaticTrips.branch_route_id, StaticTrips.trunk_route_id),
+            StaticRoutePatterns.direction_id,
+            StaticRoutePatterns.static_version_key,
+        )
+        .select_from(StaticRoutePatterns)
+        .join(
+            StaticTrips,
+            sa.and_(
+                StaticRoutePatterns.representative_trip_id == StaticTrips.trip_id,
+                StaticRoutePatterns.static_version_key == StaticTrips.static_version_key,
+            ),
+        )
+        .where(
+            StaticRoutePatterns.static_version_key == static_version_key,
+            sa.or_(
+                StaticRoutePatterns.route_pattern_typicality == 1,
+                StaticRoutePatterns.route_pattern_typicality == 5,
+            ),
+        )
+        .order_by(
+            sa.func.coalesce(StaticTrips.branch_route_id, StaticTrips.trunk_route_id),
+            StaticRoutePatterns.direction_id,
+            StaticRoutePatterns.static_version_key,
+            StaticRoutePatterns.route_pattern_typicality.desc(),
+        )
+        .subquery("canon_trips")
+    )
+    # using the representative_trip_id's from the canon_trips query, create
+    # stop_sequence values for each parent_station on each route in each direction.
+    # stop_sequence's are created using the row_number function so that they
+    # always start at 1 and increment according to the
+    # StaticStopTimes.stop_sequence order
+    return (
+        sa.select(
+            canon_trips.c.direction_id,
+            canon_trips.c.trunk_route_id,
+            canon_trips.c.route_id,
+            StaticStops.parent_station,
+            sa.over(
+                sa.func.row_number(),
+                partition_by=(
+                    canon_trips.c.static_version_key,
+                    canon_trips.c.direction_id,
+                    canon_trips.c.route_id,
+                ),
+                order_by=StaticStopTimes.stop_sequence,
+            ).label("stop_sequence"),
+            canon_trips.c.static_version_key,
+        )
+        .select_from(canon_trips)
+        .join(
+            StaticStopTimes,
+            sa.and_(
+                canon_trips.c.representative_trip_id == StaticStopTimes.trip_id,
+                canon_trips.c.static_version_key == StaticStopTimes.static_version_key,
+            ),
+        )
+        .join(
+            StaticStops,
+            sa.and_(
+                StaticStopTimes.stop_id == StaticStops.stop_id,
+                StaticStopTimes.static_version_key == StaticStops.static_version_key,
+            ),
+        )
+        .subquery("static_canon")
+    )
+
+
+def sync_values_subquery(static_canon: sa.sql.selectable.Subquery) -> sa.sql.selectable.Subquery:
+    """
+    return Selectable named "sync_values" with a sync_stop_sequence for each
+    trunk_route_id, direction_id, parent_station, static_version_key pair of
+    a static_canon subquery
+
+    sync_stop_sequence values are normalized across all branches of a trunk
+    """
+    # select "zero_point" parent_stations
+    # this query will produce one parent_station for each trunk_route_id that
+    # is the most likey to have all branch_routes passing through them
+    zero_point_stop = (
+        sa.select(
+            static_canon.c.trunk_route_id,
+            static_canon.c.parent_station,
+            sa.literal(0).label("sync_start"),
+        )
+        .distinct(
+            static_canon.c.trunk_route_id,
+        )
+        .group_by(
+            static_canon.c.trunk_route_id,
+            static_canon.c.parent_station,
+        )
+        .order_by(
+            static_canon.c.trunk_route_id,
+            count(
+                static_canon.c.stop_sequence,
+            ).desc(),
+            (sa.func.max(static_canon.c.stop_sequence) - sa.func.min(static_canon.c.stop_sequence)).desc(),
+        )
+        .subquery("zero_points")
+    )
+
+    # select stop_sequence number for the zero_point parent_station of each route-branch,
+    # consider this value the stop_sequence "adjustment" value
+    zero_seq_vals = (
+        sa.select(
+            static_canon.c.direction_id,
+            static_canon.c.route_id,
+            static_canon.c.stop_sequence.label("seq_adjust"),
+        )
+        .select_from(static_canon)
+        .join(
+            zero_point_stop,
+            sa.and_(
+                zero_point_stop.c.trunk_route_id == static_canon.c.trunk_route_id,
+                zero_point_stop.c.parent_station == static_canon.c.parent_station,
+            ),
+        )
+        .subquery("zero_seq_vals")
+    )
+
+    # select the minimum stop_sequence value and minimum difference
+    # between a stop_sequence and stop_sequence "adjustment" for each branch-route
+    # these values will be used to normalize canonical stop_sequence values across a trunk
+    sync_adjust_vals = (
+        sa.select(
+            static_canon.c.direction_id,
+            static_canon.c.trunk_route_id,
+            sa.func.min(static_canon.c.stop_sequence).label("min_seq"),
+            sa.func.min(static_canon.c.stop_sequence - zero_seq_vals.c.seq_adjust).label("min_sync"),
+        )
+        .select_from(static_canon)
+        .join(
+            zero_seq_vals,
+            sa.and_(
+                zero_seq_vals.c.direction_id == static_canon.c.direction_id,
+                zero_seq_vals.c.route_id == static_canon.c.route_id,
+            ),
+        )
+        .group_by(
+            static_canon.c.direction_id,
+            static_canon.c.trunk_route_id,
+        )
+        .subquery("sync_adjust_vals")
+    )
+
+    # create sync_stop_sequence
+    # sync_stop_sequence = canonical_stop_sequence - zero_parent_stop_sequence - minimum_sync_sequence_adjustment(for trunk) + minimum_canonical_stop_sequence(for trunk)
+    # one sync_stop_sequence value is created for each trunk_route_id, direction_id, parent_station, static_version_key pair
+    return (
+        sa.select(
+            static_canon.c.direction_id,
+            static_canon.c.trunk_route_id,
+            static_canon.c.parent_station,
+            static_canon.c.static_version_key,
+            (
+                static_canon.c.stop_sequence
+                - zero_seq_vals.c.seq_adjust
+                - sync_adjust_vals.c.min_sync
+                + sync_adjust_vals.c.min_seq
+            ).label("sync_stop_sequence"),
+        )
+        .distinct()
+        .select_from(static_canon)
+        .join(
+            zero_seq_vals,
+            sa.and_(
+                zero_seq_vals.c.direction_id == static_canon.c.direction_id,
+                zero_seq_vals.c.route_id == static_canon.c.route_id,
+            ),
+        )
+        .join(
+            sync_adjust_vals,
+            sa.and_(
+                sync_adjust_vals.c.direction_id == static_canon.c.direction_id,
+                sync_adjust_vals.c.trunk_route_id == static_canon.c.trunk_route_id,
+            ),
+        )
+        .subquery(("sync_values"))
+    )
+
+
+def rt_trips_subquery(
+    service_date: int,
+    pm_trip_ids: Optional[sa.sql.selectable.Select] = None,
+) -> sa.sql.selectable.Subquery:
     """
     return Selectable representing all RT trips on a given service date
 
+    if pm_trip_ids is set, only trips returned by the pm_trip_ids select are
+    included
+
     created fields to be returned:
         - rt_trip_first_stop_flag (bool indicating first stop of trip by trip_hash)
         - rt_trip_last_stop_flag (bool indicating last stop of trip by trip_hash)
         - static_stop_rank (rank field counting from 1 to N number of stops on trip by trip_hash)
     """
 
-    return (
+    rt_trips_select = (
         sa.select(
             VehicleTrips.static_version_key,
             VehicleTrips.direction_id,
@@ -174,14 +431,24 @@ def rt_trips_subquery(service_date: int) -> sa.sql.selectable.Subquery:
                 VehicleEvents.vp_stop_timestamp.is_not(None),
             ),
         )
-    ).subquery(name="rt_trips_sub")
+    )
+
+    if pm_trip_ids is not None:
+        rt_trips_select = rt_trips_select.where(VehicleEvents.pm_trip_id.in_(pm_trip_ids))
 
+    return rt_trips_select.subquery(name="rt_trips_sub")
 
-def trips_for_metrics_subquery(static_version_key: int, service_date: int) -> sa.sql.selectable.Subquery:
+
+def trips_for_metrics_subquery(
+    static_version_key: int,
+    service_date: int,
+    pm_trip_ids: Optional[sa.sql.selectable.Select] = None,
+) -> sa.sql.selectable.Subquery:
     """
     return Selectable named "trips_for_metrics" with fields needed to develop metrics tables
 
-    will return one record for every unique trip-stop on 'service_date'
+    will return one record for every unique trip-stop on 'service_date', or
+    only for trips returned by the pm_trip_ids select if it is set
 
     joins rt_trips_sub to static_trips_sub on static_trip_id_guess, static_version_key, parent_station and static_stop_rank,
 
@@ -191,7 +458,7 @@ def trips_for_metrics_subquery(static_version_key: int, service_date: int) -> sa
     """
 
     static_trips_sub = static_trips_subquery(static_version_key, service_date)
-    rt_trips_sub = rt_trips_subquery(service_date)
+    rt_trips_sub = rt_trips_subquery(service_date, pm_trip_ids)
 
     return (
         sa.select(
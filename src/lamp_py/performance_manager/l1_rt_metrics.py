@@ -1,3 +1,5 @@
+from typing import List, Optional
+
 import sqlalchemy as sa
 
 from lamp_py.postgres.postgres_utils import DatabaseManager
@@ -12,22 +14,122 @@ from .l1_cte_statements import (
 )
 
 
+def headways_update_statement(
+    trips_for_headways: sa.sql.selectable.Subquery,
+    route_column: str,
+    headway_column: str,
+    touched_trips: Optional[sa.sql.selectable.Select] = None,
+) -> sa.sql.dml.Update:
+    """
+    build update statement for a headway column of vehicle_events, headways
+    are partitioned on parent_station, direction_id and route_column
+
+    if touched_trips is set, headways are only computed and written at
+    parent stations visited by touched trips. every headway partition at
+    those stations is recomputed in full, so trips whose previous trip
+    changed are updated even if that trip left the partition, by changing
+    route, branch or trunk, or dropping out of trips_for_headways.
+    """
+    headway_partition = (
+        trips_for_headways.c.parent_station,
+        trips_for_headways.c[route_column],
+        trips_for_headways.c.direction_id,
+    )
+    headway_columns: List[sa.sql.expression.ColumnElement] = [
+        trips_for_headways.c.pm_trip_id,
+        trips_for_headways.c.service_date,
+        trips_for_headways.c.parent_station,
+        trips_for_headways.c.next_station_move,
+        (
+            trips_for_headways.c.next_station_move
+            - sa.func.lag(
+                trips_for_headways.c.next_station_move,
+            ).over(
+                partition_by=headway_partition,
+                order_by=trips_for_headways.c.next_station_move,
+            )
+        ).label(headway_column),
+    ]
+    headway_conditions = [trips_for_headways.c[route_column].is_not(None)]
+
+    if touched_trips is not None:
+        # filtering whole headway partitions does not change headway values.
+        # stations are selected from vehicle_events, so they include events
+        # of touched trips that are no longer in trips_for_headways
+        touched_stations = sa.select(VehicleEvents.parent_station).where(
+            VehicleEvents.service_date == trips_for_headways.c.service_date,
+            VehicleEvents.pm_trip_id.in_(touched_trips),
+        )
+        headway_conditions.append(trips_for_headways.c.parent_station.in_(touched_stations))
+
+    t_headways_sub = (
+        sa.select(*headway_columns).where(*headway_conditions).subquery(name=f"t_headways_{route_column.split('_')[0]}")
+    )
+    headway_seconds = t_headways_sub.c[headway_column]
+
+    # limit headways calculations to NON-NULL positive integers
+    # would be nice if this could be done in the first query, but I can't
+    # get it to work with sqlalchemy
+    update_headways = (
+        sa.update(VehicleEvents.__table__)
+        .values({headway_column: headway_seconds})
+        .where(
+            VehicleEvents.pm_trip_id == t_headways_sub.c.pm_trip_id,
+            VehicleEvents.service_date == t_headways_sub.c.service_date,
+            VehicleEvents.parent_station == t_headways_sub.c.parent_station,
+            headway_seconds.is_not(None),
+            headway_seconds > 0,
+        )
+    )
+
+    if touched_trips is not None:
+        update_headways = update_headways.where(
+            VehicleEvents.__table__.c[headway_column].is_distinct_from(headway_seconds),
+        )
+
+    return update_headways
+
+
 # pylint: disable=R0914
 # pylint too many local variables (more than 15)
 def update_metrics_columns(
     db_manager: DatabaseManager,
     seed_service_date: int,
     static_version_key: int,
+    incremental: bool = False,
 ) -> None:
     """
     update metrics columns in vehicle_events table for seed_service_date, static_version_key combination
 
+    by default all trips of the service date are recomputed and written. if
+    incremental is True, only the affected set of the trips in
+    temp_event_compare is recomputed, and only values that changed are
+    written:
+        - travel and dwell times only depend on the events of their own trip,
+          so they are limited to trips in temp_event_compare
+        - headways also depend on the previous trip at the same
+          parent_station, route and direction. they are recomputed for every
+          trip at the parent stations visited by trips in temp_event_compare
+
+    the full recompute is the fallback for changes made outside of the event
+    loop, and a correctness check for the incremental mode.
     """
 
-    process_logger = ProcessLogger("l1_rt_metrics_table_loader")
+    process_logger = ProcessLogger(
+        "l1_rt_metrics_table_loader",
+        service_date=seed_service_date,
+        static_version_key=static_version_key,
+        incremental=incremental,
+    )
     process_logger.log_start()
 
-    trips_for_metrics = trips_for_metrics_subquery(static_version_key, seed_service_date)
+    touched_trips: Optional[sa.sql.selectable.Select] = None
+    if incremental:
+        touched_trips = (
+            sa.select(TempEventCompare.pm_trip_id).where(TempEventCompare.service_date == seed_service_date).distinct()
+        )
+
+    trips_for_metrics = trips_for_metrics_subquery(static_version_key, seed_service_date, touched_trips)
     trips_for_headways = trips_for_headways_subquery(
         service_date=seed_service_date,
     )
@@ -36,9 +138,10 @@ def update_metrics_columns(
     # limited to records where stop_timestamp > move_timestamp to avoid negative travel times
     # limited to non NULL stop and move timestamps to avoid NULL results
     # negative travel times are error records, should flag???
+    travel_time_seconds = trips_for_metrics.c.stop_timestamp - trips_for_metrics.c.move_timestamp
     update_travel_times = (
         sa.update(VehicleEvents.__table__)
-        .values(travel_time_seconds=trips_for_metrics.c.stop_timestamp - trips_for_metrics.c.move_timestamp)
+        .values(travel_time_seconds=travel_time_seconds)
         .where(
             VehicleEvents.pm_trip_id == trips_for_metrics.c.pm_trip_id,
             VehicleEvents.service_date == trips_for_metrics.c.service_date,
@@ -48,8 +151,12 @@ def update_metrics_columns(
             trips_for_metrics.c.stop_timestamp > trips_for_metrics.c.move_timestamp,
         )
     )
+    if incremental:
+        update_travel_times = update_travel_times.where(
+            VehicleEvents.travel_time_seconds.is_distinct_from(travel_time_seconds)
+        )
 
-    db_manager.execute(update_travel_times)
+    travel_time_count = db_manager.execute(update_travel_times).rowcount
 
     # dwell_times calculations are different for the first stop of a trip
     # the first stop of a trip includes the dwell time since the stop_timestamp of
@@ -101,7 +208,12 @@ def update_metrics_columns(
             t_dwell_times_sub.c.dwell_time_seconds > 0,
         )
     )
-    db_manager.execute(update_dwell_times)
+    if incremental:
+        update_dwell_times = update_dwell_times.where(
+            VehicleEvents.dwell_time_seconds.is_distinct_from(t_dwell_times_sub.c.dwell_time_seconds)
+        )
+
+    dwell_time_count = db_manager.execute(update_dwell_times).rowcount
 
     # this headways calculation is incomplete
     #
@@ -110,98 +222,43 @@ def update_metrics_columns(
     #
     # headways are calculated with stop_timestamp to stop_timestamp for the
     # next station in a trip
-    t_headways_branch_sub = (
-        sa.select(
-            trips_for_headways.c.pm_trip_id,
-            trips_for_headways.c.service_date,
-            trips_for_headways.c.parent_station,
-            (
-                trips_for_headways.c.next_station_move
-                - sa.func.lag(
-                    trips_for_headways.c.next_station_move,
-                ).over(
-                    partition_by=(
-                        trips_for_headways.c.parent_station,
-                        trips_for_headways.c.branch_route_id,
-                        trips_for_headways.c.direction_id,
-                    ),
-                    order_by=trips_for_headways.c.next_station_move,
-                )
-            ).label("headway_branch_seconds"),
-        )
-        .where(
-            trips_for_headways.c.branch_route_id.is_not(None),
-        )
-        .subquery(name="t_headways_branch")
-    )
-
-    # limit headways branch calculations to NON-NULL positive integers
-    # would be nice if this could be done in the first query, but I can't
-    # get it to work with sqlalchemy
-    update_branch_headways = (
-        sa.update(VehicleEvents.__table__)
-        .values(headway_branch_seconds=t_headways_branch_sub.c.headway_branch_seconds)
-        .where(
-            VehicleEvents.pm_trip_id == t_headways_branch_sub.c.pm_trip_id,
-            VehicleEvents.service_date == t_headways_branch_sub.c.service_date,
-            VehicleEvents.parent_station == t_headways_branch_sub.c.parent_station,
-            t_headways_branch_sub.c.headway_branch_seconds.is_not(None),
-            t_headways_branch_sub.c.headway_branch_seconds > 0,
-        )
-    )
-    db_manager.execute(update_branch_headways)
-
-    t_headways_trunk_sub = (
-        sa.select(
-            trips_for_headways.c.pm_trip_id,
-            trips_for_headways.c.service_date,
-            trips_for_headways.c.parent_station,
-            (
-                trips_for_headways.c.next_station_move
-                - sa.func.lag(
-                    trips_for_headways.c.next_station_move,
-                ).over(
-                    partition_by=(
-                        trips_for_headways.c.parent_station,
-                        trips_for_headways.c.trunk_route_id,
-                        trips_for_headways.c.direction_id,
-                    ),
-                    order_by=trips_for_headways.c.next_station_move,
-                )
-            ).label("headway_trunk_seconds"),
+    branch_headway_count = db_manager.execute(
+        headways_update_statement(
+            trips_for_headways,
+            route_column="branch_route_id",
+            headway_column="headway_branch_seconds",
+            touched_trips=touched_trips,
         )
-        .where(
-            trips_for_headways.c.trunk_route_id.is_not(None),
+    ).rowcount
+    trunk_headway_count = db_manager.execute(
+        headways_update_statement(
+            trips_for_headways,
+            route_column="trunk_route_id",
+            headway_column="headway_trunk_seconds",
+            touched_trips=touched_trips,
         )
-        .subquery(name="t_headways_trunk")
-    )
+    ).rowcount
 
-    # limit headways trunk calculations to NON-NULL positive integers
-    # would be nice if this could be done in the first CTE, but I can't
-    # get it to work with sqlalchemy
-    update_trunk_headways = (
-        sa.update(VehicleEvents.__table__)
-        .values(headway_trunk_seconds=t_headways_trunk_sub.c.headway_trunk_seconds)
-        .where(
-            VehicleEvents.pm_trip_id == t_headways_trunk_sub.c.pm_trip_id,
-            VehicleEvents.service_date == t_headways_trunk_sub.c.service_date,
-            VehicleEvents.parent_station == t_headways_trunk_sub.c.parent_station,
-            t_headways_trunk_sub.c.headway_trunk_seconds.is_not(None),
-            t_headways_trunk_sub.c.headway_trunk_seconds > 0,
-        )
+    process_logger.add_metadata(
+        travel_time_count=travel_time_count,
+        dwell_time_count=dwell_time_count,
+        branch_headway_count=branch_headway_count,
+        trunk_headway_count=trunk_headway_count,
     )
-    db_manager.execute(update_trunk_headways)
-
     process_logger.log_complete()
 
 
 # pylint: enable=R0914
 
 
-def update_metrics_from_temp_events(db_manager: DatabaseManager) -> None:
+def update_metrics_from_temp_events(db_manager: DatabaseManager, incremental: bool = True) -> None:
     """
     update daily metrics values for service_date, static_version_key combos in
     temp_event_compare table
+
+    by default only metrics affected by trips in temp_event_compare are
+    updated, if incremental is False all metrics of each service date are
+    recomputed
     """
     service_date_query = sa.select(
         TempEventCompare.service_date,
@@ -215,4 +272,5 @@ def update_metrics_from_temp_events(db_manager: DatabaseManager) -> None:
             db_manager=db_manager,
             seed_service_date=service_date,
             static_version_key=static_version_key,
+            incremental=incremental,
         )
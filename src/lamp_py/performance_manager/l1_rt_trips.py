@@ -1,3 +1,4 @@
+import os
 from typing import Optional
 
 import pandas
@@ -15,14 +16,19 @@ from lamp_py.postgres.rail_performance_manager_schema import (
     TempEventCompare,
     StaticDirections,
     StaticStopTimes,
-    StaticRoutePatterns,
-    StaticStops,
 )
+from lamp_py.runtime_utils.gtfs_time import start_timestamps_to_seconds
 from lamp_py.runtime_utils.process_logger import ProcessLogger
-from .gtfs_utils import start_timestamp_to_seconds
 from .l1_cte_statements import (
-    static_trips_subquery,
+    static_canon_subquery,
+    static_trips_summary_subquery,
+    sync_values_subquery,
 )
+from .gtfs_utils import (
+    RED_ASHMONT_STOP_IDS,
+    RED_BRAINTREE_STOP_IDS,
+)
+from .l1_rt_trips_fused import process_trips_fused
 
 
 def update_prev_next_trip_stop(db_manager: DatabaseManager) -> None:
@@ -309,9 +315,9 @@ def update_start_times(db_manager: DatabaseManager) -> None:
     )
 
     if unscheduled_start_times.shape[0] > 0:
-        unscheduled_start_times["b_start_time"] = (
-            unscheduled_start_times["b_start_time"].apply(start_timestamp_to_seconds).astype("int64")
-        )
+        unscheduled_start_times["b_start_time"] = start_timestamps_to_seconds(
+            unscheduled_start_times["b_start_time"]
+        ).astype("int64")
 
         start_times_update_query = (
             sa.update(VehicleTrips.__table__)
@@ -380,35 +386,10 @@ def update_branch_trunk_route_id(db_manager: DatabaseManager) -> None:
     red_events_df = db_manager.select_as_dataframe(red_events)
 
     def get_red_branch(pm_trip_id: int) -> Optional[str]:
-        ashmont_stop_ids = {
-            "70087",
-            "70088",
-            "70089",
-            "70090",
-            "70091",
-            "70092",
-            "70093",
-            "70094",
-            "70085",
-            "70086",
-        }
-        braintree_stop_ids = {
-            "70097",
-            "70098",
-            "70099",
-            "70100",
-            "70101",
-            "70102",
-            "70103",
-            "70104",
-            "70105",
-            "70095",
-            "70096",
-        }
         trip_stop_ids = set(red_events_df[red_events_df["pm_trip_id"] == pm_trip_id]["stop_id"])
-        if trip_stop_ids & ashmont_stop_ids:
+        if trip_stop_ids & RED_ASHMONT_STOP_IDS:
             return "Red-A"
-        if trip_stop_ids & braintree_stop_ids:
+        if trip_stop_ids & RED_BRAINTREE_STOP_IDS:
             return "Red-B"
         return None
 
@@ -644,81 +625,7 @@ def update_stop_sequence(db_manager: DatabaseManager) -> None:
         )
     )
     for record in db_manager.select_as_list(distinct_query):
-        canon_trips = (
-            sa.select(
-                StaticRoutePatterns.direction_id,
-                StaticRoutePatterns.representative_trip_id,
-                StaticTrips.trunk_route_id,
-                sa.func.coalesce(StaticTrips.branch_route_id, StaticTrips.trunk_route_id).label("route_id"),
-                StaticRoutePatterns.static_version_key,
-            )
-            .distinct(
-                sa.func.coalesce(StaticTrips.branch_route_id, StaticTrips.trunk_route_id),
-                StaticRoutePatterns.direction_id,
-                StaticRoutePatterns.static_version_key,
-            )
-            .select_from(StaticRoutePatterns)
-            .join(
-                StaticTrips,
-                sa.and_(
-                    StaticRoutePatterns.representative_trip_id == StaticTrips.trip_id,
-                    StaticRoutePatterns.static_version_key == StaticTrips.static_version_key,
-                ),
-            )
-            .where(
-                StaticRoutePatterns.static_version_key == record["static_version_key"],
-                sa.or_(
-                    StaticRoutePatterns.route_pattern_typicality == 1,
-                    StaticRoutePatterns.route_pattern_typicality == 5,
-                ),
-            )
-            .order_by(
-                sa.func.coalesce(StaticTrips.branch_route_id, StaticTrips.trunk_route_id),
-                StaticRoutePatterns.direction_id,
-                StaticRoutePatterns.static_version_key,
-                StaticRoutePatterns.route_pattern_typicality.desc(),
-            )
-            .subquery("canon_trips")
-        )
-        # using the representative_trip_id's from the canon_trips query, create
-        # stop_sequence values for each parent_station on each route in each direction.
-        # stop_sequence's are created using the row_number function so that they
-        # always start at 1 and increment according to the
-        # StaticStopTimes.stop_sequence order
-        static_canon = (
-            sa.select(
-                canon_trips.c.direction_id,
-                canon_trips.c.trunk_route_id,
-                canon_trips.c.route_id,
-                StaticStops.parent_station,
-                sa.over(
-                    sa.func.row_number(),
-                    partition_by=(
-                        canon_trips.c.static_version_key,
-                        canon_trips.c.direction_id,
-                        canon_trips.c.route_id,
-                    ),
-                    order_by=StaticStopTimes.stop_sequence,
-                ).label("stop_sequence"),
-                canon_trips.c.static_version_key,
-            )
-            .select_from(canon_trips)
-            .join(
-                StaticStopTimes,
-                sa.and_(
-                    canon_trips.c.representative_trip_id == StaticStopTimes.trip_id,
-                    canon_trips.c.static_version_key == StaticStopTimes.static_version_key,
-                ),
-            )
-            .join(
-                StaticStops,
-                sa.and_(
-                    StaticStopTimes.stop_id == StaticStops.stop_id,
-                    StaticStopTimes.static_version_key == StaticStops.static_version_key,
-                ),
-            )
-            .subquery("static_canon")
-        )
+        static_canon = static_canon_subquery(record["static_version_key"])
 
         # subquery to join static_canon results to vehicle_events records
         rt_canon = (
@@ -769,110 +676,7 @@ def update_stop_sequence(db_manager: DatabaseManager) -> None:
         db_manager.execute(update_rt_canon)
         process_logger.log_complete()
 
-        # select "zero_point" parent_stations
-        # this query will produce one parent_station for each trunk_route_id that
-        # is the most likey to have all branch_routes passing through them
-        zero_point_stop = (
-            sa.select(
-                static_canon.c.trunk_route_id,
-                static_canon.c.parent_station,
-                sa.literal(0).label("sync_start"),
-            )
-            .distinct(
-                static_canon.c.trunk_route_id,
-            )
-            .group_by(
-                static_canon.c.trunk_route_id,
-                static_canon.c.parent_station,
-            )
-            .order_by(
-                static_canon.c.trunk_route_id,
-                count(
-                    static_canon.c.stop_sequence,
-                ).desc(),
-                (sa.func.max(static_canon.c.stop_sequence) - sa.func.min(static_canon.c.stop_sequence)).desc(),
-            )
-            .subquery("zero_points")
-        )
-
-        # select stop_sequence number for the zero_point parent_station of each route-branch,
-        # consider this value the stop_sequence "adjustment" value
-        zero_seq_vals = (
-            sa.select(
-                static_canon.c.direction_id,
-                static_canon.c.route_id,
-                static_canon.c.stop_sequence.label("seq_adjust"),
-            )
-            .select_from(static_canon)
-            .join(
-                zero_point_stop,
-                sa.and_(
-                    zero_point_stop.c.trunk_route_id == static_canon.c.trunk_route_id,
-                    zero_point_stop.c.parent_station == static_canon.c.parent_station,
-                ),
-            )
-            .subquery("zero_seq_vals")
-        )
-
-        # select the minimum stop_sequence value and minimum difference
-        # between a stop_sequence and stop_sequence "adjustment" for each branch-route
-        # these values will be used to normalize canonical stop_sequence values across a trunk
-        sync_adjust_vals = (
-            sa.select(
-                static_canon.c.direction_id,
-                static_canon.c.trunk_route_id,
-                sa.func.min(static_canon.c.stop_sequence).label("min_seq"),
-                sa.func.min(static_canon.c.stop_sequence - zero_seq_vals.c.seq_adjust).label("min_sync"),
-            )
-            .select_from(static_canon)
-            .join(
-                zero_seq_vals,
-                sa.and_(
-                    zero_seq_vals.c.direction_id == static_canon.c.direction_id,
-                    zero_seq_vals.c.route_id == static_canon.c.route_id,
-                ),
-            )
-            .group_by(
-                static_canon.c.direction_id,
-                static_canon.c.trunk_route_id,
-            )
-            .subquery("sync_adjust_vals")
-        )
-
-        # create sync_stop_sequence
-        # sync_stop_sequence = canonical_stop_sequence - zero_parent_stop_sequence - minimum_sync_sequence_adjustment(for trunk) + minimum_canonical_stop_sequence(for trunk)
-        # one sync_stop_sequence value is created for each trunk_route_id, direction_id, parent_station, static_version_key pair
-        sync_values = (
-            sa.select(
-                static_canon.c.direction_id,
-                static_canon.c.trunk_route_id,
-                static_canon.c.parent_station,
-                static_canon.c.static_version_key,
-                (
-                    static_canon.c.stop_sequence
-                    - zero_seq_vals.c.seq_adjust
-                    - sync_adjust_vals.c.min_sync
-                    + sync_adjust_vals.c.min_seq
-                ).label("sync_stop_sequence"),
-            )
-            .distinct()
-            .select_from(static_canon)
-            .join(
-                zero_seq_vals,
-                sa.and_(
-                    zero_seq_vals.c.direction_id == static_canon.c.direction_id,
-                    zero_seq_vals.c.route_id == static_canon.c.route_id,
-                ),
-            )
-            .join(
-                sync_adjust_vals,
-                sa.and_(
-                    sync_adjust_vals.c.direction_id == static_canon.c.direction_id,
-                    sync_adjust_vals.c.trunk_route_id == static_canon.c.trunk_route_id,
-                ),
-            )
-            .subquery(("sync_values"))
-        )
+        sync_values = sync_values_subquery(static_canon)
 
         rt_sync = (
             sa.select(
@@ -932,40 +736,7 @@ def backup_rt_static_trip_match(
     this matches an RT trip to a static trip with the same branch_route_id or trunk_route_id if branch is null
     and direction with the closest start_time
     """
-    static_trips_sub = static_trips_subquery(static_version_key, seed_service_date)
-
-    # to build a 'summary' trips table only the first and last records for each
-    # static trip are needed.
-    first_stop_static_sub = (
-        sa.select(
-            static_trips_sub.c.static_trip_id,
-            static_trips_sub.c.static_stop_timestamp.label("static_start_time"),
-        )
-        .select_from(static_trips_sub)
-        .where(static_trips_sub.c.static_trip_first_stop == sa.true())
-        .subquery(name="first_stop_static_sub")
-    )
-
-    # join first_stop_static_sub with last stop records to create trip summary records
-    static_trips_summary_sub = (
-        sa.select(
-            static_trips_sub.c.static_trip_id,
-            sa.func.coalesce(
-                static_trips_sub.c.branch_route_id,
-                static_trips_sub.c.trunk_route_id,
-            ).label("route_id"),
-            static_trips_sub.c.direction_id,
-            first_stop_static_sub.c.static_start_time,
-            static_trips_sub.c.static_trip_stop_rank.label("static_stop_count"),
-        )
-        .select_from(static_trips_sub)
-        .join(
-            first_stop_static_sub,
-            static_trips_sub.c.static_trip_id == first_stop_static_sub.c.static_trip_id,
-        )
-        .where(static_trips_sub.c.static_trip_last_stop == sa.true())
-        .subquery(name="static_trips_summary_sub")
-    )
+    static_trips_summary_sub = static_trips_summary_subquery(static_version_key, seed_service_date)
 
     # pull RT trips records that are candidates for backup matching to static trips
     temp_trips = (
@@ -1064,17 +835,41 @@ def update_backup_static_trip_id(db_manager: DatabaseManager) -> None:
     process_logger.log_complete()
 
 
-def process_trips(db_manager: DatabaseManager) -> None:
+def fused_trips_enabled() -> bool:
+    """
+    the fused trip path is switched on by setting the RPM_FUSED_TRIPS
+    environment variable to "true"
+    """
+    return os.environ.get("RPM_FUSED_TRIPS", "false").lower() == "true"
+
+
+def process_trips(db_manager: DatabaseManager, fused: Optional[bool] = None) -> None:
     """
     update vehicle_trips table based on new events in temp_event_compare
 
+    :param fused if True, derive all trip columns in one pass with
+    process_trips_fused, otherwise run each update function in sequence. if
+    None, the RPM_FUSED_TRIPS environment variable picks the path. the fused
+    path is opt in until it has matched the update functions on production
+    data.
     """
-    update_static_version_key(db_manager)
-    update_branch_trunk_route_id(db_manager)
-    update_trip_stop_counts(db_manager)
-    update_prev_next_trip_stop(db_manager)
-    update_static_trip_id_guess_exact(db_manager)
-    update_start_times(db_manager)
-    update_directions(db_manager)
-    update_stop_sequence(db_manager)
-    update_backup_static_trip_id(db_manager)
+    if fused is None:
+        fused = fused_trips_enabled()
+
+    process_logger = ProcessLogger("l1_trips.process_trips", path="fused" if fused else "sequential")
+    process_logger.log_start()
+
+    if fused:
+        process_trips_fused(db_manager)
+    else:
+        update_static_version_key(db_manager)
+        update_branch_trunk_route_id(db_manager)
+        update_trip_stop_counts(db_manager)
+        update_prev_next_trip_stop(db_manager)
+        update_static_trip_id_guess_exact(db_manager)
+        update_start_times(db_manager)
+        update_directions(db_manager)
+        update_stop_sequence(db_manager)
+        update_backup_static_trip_id(db_manager)
+
+    process_logger.log_complete()
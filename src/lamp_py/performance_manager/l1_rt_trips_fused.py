@@ -0,0 +1,700 @@
+from typing import Any, List, Tuple
+
+import pandas
+import sqlalchemy as sa
+from sqlalchemy.sql.functions import count
+
+from lamp_py.postgres.postgres_utils import DatabaseManager
+from lamp_py.postgres.rail_performance_manager_schema import (
+    StaticDirections,
+    StaticStopTimes,
+    StaticTrips,
+    TempEventCompare,
+    VehicleEvents,
+    VehicleTrips,
+)
+from lamp_py.runtime_utils.gtfs_time import start_timestamps_to_seconds
+from lamp_py.runtime_utils.process_logger import ProcessLogger
+from .gtfs_utils import (
+    RED_ASHMONT_STOP_IDS,
+    RED_BRAINTREE_STOP_IDS,
+)
+from .l1_cte_statements import (
+    static_canon_subquery,
+    static_trips_summary_subquery,
+    sync_values_subquery,
+)
+
+# vehicle_trips columns derived by process_trips_fused, written back to the
+# database with a single UPDATE statement
+DERIVED_TRIP_COLUMNS = (
+    VehicleTrips.static_version_key,
+    VehicleTrips.branch_route_id,
+    VehicleTrips.trunk_route_id,
+    VehicleTrips.stop_count,
+    VehicleTrips.start_time,
+    VehicleTrips.static_trip_id_guess,
+    VehicleTrips.static_start_time,
+    VehicleTrips.static_stop_count,
+    VehicleTrips.first_last_station_match,
+    VehicleTrips.direction,
+    VehicleTrips.direction_destination,
+)
+
+# derived columns holding integer values, kept as nullable integers while
+# being processed in pandas
+INTEGER_TRIP_COLUMNS = (
+    "static_version_key",
+    "stop_count",
+    "start_time",
+    "static_start_time",
+    "static_stop_count",
+)
+
+# working set lookup columns holding integer values
+INTEGER_LOOKUP_COLUMNS = (
+    "temp_start_time",
+    "event_stop_count",
+    "first_event_timestamp",
+    "static_stop_count_schedule",
+    "schedule_start_time",
+)
+
+
+def working_set_trips_query() -> sa.sql.selectable.Select:
+    """
+    select the working set of vehicle_trips records for process_trips_fused
+
+    the working set is every trip with new events in temp_event_compare, plus
+    any trip on a service date of temp_event_compare that is not using the
+    latest static_version_key of that service date. only trips with new events
+    are flagged as "touched".
+    """
+    touched_trips = (
+        sa.select(
+            TempEventCompare.service_date,
+            TempEventCompare.pm_trip_id,
+            sa.func.max(TempEventCompare.start_time).label("temp_start_time"),
+            sa.func.bool_or(TempEventCompare.start_time.is_(None)).label("temp_missing_start_time"),
+        )
+        .group_by(
+            TempEventCompare.service_date,
+            TempEventCompare.pm_trip_id,
+        )
+        .subquery("touched_trips")
+    )
+
+    version_key_sub = (
+        sa.select(
+            TempEventCompare.service_date,
+            sa.func.max(TempEventCompare.static_version_key).label("max_version_key"),
+        )
+        .group_by(
+            TempEventCompare.service_date,
+        )
+        .subquery("update_version_key")
+    )
+
+    return (
+        sa.select(
+            VehicleTrips.pm_trip_id,
+            VehicleTrips.service_date,
+            VehicleTrips.route_id,
+            VehicleTrips.direction_id,
+            VehicleTrips.trip_id,
+            *DERIVED_TRIP_COLUMNS,
+            version_key_sub.c.max_version_key,
+            touched_trips.c.pm_trip_id.is_not(None).label("touched"),
+            touched_trips.c.temp_start_time,
+            touched_trips.c.temp_missing_start_time,
+        )
+        .select_from(VehicleTrips)
+        .join(
+            version_key_sub,
+            VehicleTrips.service_date == version_key_sub.c.service_date,
+        )
+        .outerjoin(
+            touched_trips,
+            sa.and_(
+                VehicleTrips.service_date == touched_trips.c.service_date,
+                VehicleTrips.pm_trip_id == touched_trips.c.pm_trip_id,
+            ),
+        )
+        .where(
+            sa.or_(
+                touched_trips.c.pm_trip_id.is_not(None),
+                VehicleTrips.static_version_key != version_key_sub.c.max_version_key,
+            )
+        )
+    )
+
+
+def trip_events_query() -> sa.sql.selectable.Select:
+    """
+    select per trip aggregates of vehicle_events for trips with new events
+
+    created fields to be returned:
+        - event_stop_count (events with vehicle position timestamps)
+        - first_event_timestamp (earliest move, stop or trip update timestamp)
+        - ashmont_stop / braintree_stop (trip has events at Red line branch stops)
+    """
+    distinct_trips = (
+        sa.select(TempEventCompare.service_date, TempEventCompare.pm_trip_id).distinct().subquery("distinct_trips")
+    )
+
+    return (
+        sa.select(
+            VehicleEvents.pm_trip_id,
+            count(VehicleEvents.pm_trip_id)
+            .filter(
+                sa.or_(
+                    VehicleEvents.vp_move_timestamp.is_not(None),
+                    VehicleEvents.vp_stop_timestamp.is_not(None),
+                ),
+            )
+            .label("event_stop_count"),
+            # added trip start times are defined as the time the train departs
+            # the first station. on occasion, a trip will not have a move time.
+            # in those cases, use the earliest stop time.
+            sa.func.coalesce(
+                sa.func.min(VehicleEvents.vp_move_timestamp),
+                sa.func.min(VehicleEvents.vp_stop_timestamp),
+                sa.func.min(VehicleEvents.tu_stop_timestamp),
+            ).label("first_event_timestamp"),
+            sa.func.bool_or(VehicleEvents.stop_id.in_(sorted(RED_ASHMONT_STOP_IDS))).label("ashmont_stop"),
+            sa.func.bool_or(VehicleEvents.stop_id.in_(sorted(RED_BRAINTREE_STOP_IDS))).label("braintree_stop"),
+        )
+        .select_from(VehicleEvents)
+        .join(
+            distinct_trips,
+            sa.and_(
+                distinct_trips.c.service_date == VehicleEvents.service_date,
+                distinct_trips.c.pm_trip_id == VehicleEvents.pm_trip_id,
+            ),
+        )
+        .group_by(
+            VehicleEvents.pm_trip_id,
+        )
+    )
+
+
+def static_trip_times_query() -> sa.sql.selectable.Select:
+    """
+    select static schedule stop counts and start times of static trips with
+    the same trip_id as trips with new events, using the latest
+    static_version_key of each service date
+
+    created fields to be returned:
+        - static_stop_count (number of static stop times of the trip)
+        - schedule_start_time (earliest static departure_time of the trip)
+        - static_trip_exists (trip_id exists in static_trips)
+    """
+    static_trip_ids = (
+        sa.select(
+            sa.func.max(TempEventCompare.static_version_key)
+            .over(partition_by=TempEventCompare.service_date)
+            .label("static_version_key"),
+            TempEventCompare.trip_id,
+        )
+        .distinct()
+        .subquery("static_trip_ids")
+    )
+
+    return (
+        sa.select(
+            StaticStopTimes.static_version_key,
+            StaticStopTimes.trip_id,
+            count(StaticStopTimes.stop_sequence).label("static_stop_count"),
+            sa.func.min(StaticStopTimes.departure_time).label("schedule_start_time"),
+            sa.func.bool_or(StaticTrips.trip_id.is_not(None)).label("static_trip_exists"),
+        )
+        .select_from(StaticStopTimes)
+        .join(
+            static_trip_ids,
+            sa.and_(
+                StaticStopTimes.static_version_key == static_trip_ids.c.static_version_key,
+                StaticStopTimes.trip_id == static_trip_ids.c.trip_id,
+            ),
+        )
+        .outerjoin(
+            StaticTrips,
+            sa.and_(
+                StaticStopTimes.static_version_key == StaticTrips.static_version_key,
+                StaticStopTimes.trip_id == StaticTrips.trip_id,
+            ),
+        )
+        .group_by(
+            StaticStopTimes.static_version_key,
+            StaticStopTimes.trip_id,
+        )
+    )
+
+
+def static_directions_query(static_version_keys: List[int]) -> sa.sql.selectable.Select:
+    """
+    select direction and direction_destination values of static_version_keys
+    """
+    return (
+        sa.select(
+            StaticDirections.static_version_key,
+            StaticDirections.route_id,
+            StaticDirections.direction_id,
+            StaticDirections.direction.label("static_direction"),
+            StaticDirections.direction_destination.label("static_direction_destination"),
+        )
+        .distinct(
+            StaticDirections.static_version_key,
+            StaticDirections.route_id,
+            StaticDirections.direction_id,
+        )
+        .where(StaticDirections.static_version_key.in_(static_version_keys))
+        .order_by(
+            StaticDirections.static_version_key,
+            StaticDirections.route_id,
+            StaticDirections.direction_id,
+        )
+    )
+
+
+def static_trips_summary_query(date_keys: List[Tuple[int, int]]) -> sa.sql.selectable.Select:
+    """
+    select static trip summary records for each service_date and
+    static_version_key pair of date_keys
+    """
+    summary_selects = []
+    for service_date, static_version_key in date_keys:
+        summary_sub = static_trips_summary_subquery(static_version_key, service_date)
+        summary_selects.append(
+            sa.select(
+                sa.literal(int(service_date)).label("service_date"),
+                summary_sub.c.static_trip_id,
+                summary_sub.c.route_id,
+                summary_sub.c.direction_id,
+                summary_sub.c.static_start_time,
+                summary_sub.c.static_stop_count,
+            )
+        )
+
+    return sa.select(sa.union_all(*summary_selects).subquery("static_trips_summary_all"))
+
+
+def select_dataframe(db_manager: DatabaseManager, select_query: sa.sql.selectable.Select) -> pandas.DataFrame:
+    """
+    select_as_dataframe that keeps the selected columns if no records are found
+    """
+    dataframe = db_manager.select_as_dataframe(select_query)
+    if dataframe.shape[0] == 0:
+        return pandas.DataFrame(columns=[column.name for column in select_query.selected_columns])
+    return dataframe
+
+
+def flag_column(trips: pandas.DataFrame, column: str) -> pandas.Series:
+    """boolean column of trips, with null values as False"""
+    return trips[column].astype("boolean").fillna(False).astype(bool)
+
+
+def left_join(
+    left: pandas.DataFrame,
+    right: pandas.DataFrame,
+    on: List[str],
+    suffix: str = "",
+) -> pandas.DataFrame:
+    """
+    left join of two dataframes, if right is empty its columns are added to
+    left as null values
+    """
+    if right.shape[0] == 0:
+        left = left.copy()
+        for column in right.columns:
+            if column in on:
+                continue
+            left[f"{column}{suffix}" if column in left.columns else column] = None
+        return left
+
+    return left.merge(right, on=on, how="left", suffixes=("", suffix))
+
+
+# pylint: disable=R0914
+# pylint too many local variables (more than 15)
+def derive_trip_columns(
+    trips: pandas.DataFrame,
+    trip_events: pandas.DataFrame,
+    static_trip_times: pandas.DataFrame,
+    static_directions: pandas.DataFrame,
+) -> pandas.DataFrame:
+    """
+    compute derived vehicle_trips columns for the working set of trips
+
+    every working set trip is moved to the latest static_version_key of its
+    service date. trips flagged as "touched" are also assigned branch / trunk
+    route_id's, stop counts, exact static trip matches, start times and
+    directions, following the same rules as the individual l1_rt_trips update
+    functions. columns of trips without new values keep their current value.
+
+    :return dataframe with the same records as trips, with derived columns
+    """
+    trips = trips.copy()
+    trips["static_version_key"] = trips["max_version_key"]
+
+    trips = left_join(trips, trip_events, on=["pm_trip_id"])
+    trips = left_join(trips, static_trip_times, on=["static_version_key", "trip_id"], suffix="_schedule")
+    trips = left_join(trips, static_directions, on=["static_version_key", "route_id", "direction_id"])
+    for column in (*INTEGER_TRIP_COLUMNS, *INTEGER_LOOKUP_COLUMNS):
+        trips[column] = pandas.to_numeric(trips[column]).astype("Int64")
+
+    touched = flag_column(trips, "touched")
+    route_id = trips["route_id"].astype(str)
+    is_green = route_id.str.startswith("Green")
+    is_red = route_id == "Red"
+
+    # trunk_route_id is "Green" for all Green line branches, branch_route_id
+    # is the Green line route_id or the Red line branch of the trip
+    trunk_route_id = trips["route_id"].mask(is_green, "Green")
+    branch_route_id = (
+        pandas.Series(None, index=trips.index, dtype=object)
+        .mask(is_red & flag_column(trips, "braintree_stop"), "Red-B")
+        .mask(is_red & flag_column(trips, "ashmont_stop"), "Red-A")
+        .mask(is_green, trips["route_id"])
+    )
+    trips["trunk_route_id"] = trunk_route_id.where(touched, trips["trunk_route_id"])
+    trips["branch_route_id"] = branch_route_id.where(touched, trips["branch_route_id"])
+
+    # stop_count is only updated for trips with vehicle position events
+    has_stop_count = touched & (trips["event_stop_count"].fillna(0) > 0)
+    trips["stop_count"] = trips["event_stop_count"].where(has_stop_count, trips["stop_count"])
+
+    # exact matches have a start_time in the real time feed and a trip_id
+    # that exists in the static schedule
+    exact_match = touched & trips["temp_start_time"].notna() & flag_column(trips, "static_trip_exists")
+    trips.loc[exact_match, "static_trip_id_guess"] = trips.loc[exact_match, "trip_id"]
+    trips.loc[exact_match, "first_last_station_match"] = True
+    trips.loc[exact_match, "static_stop_count"] = trips.loc[exact_match, "static_stop_count_schedule"]
+    trips.loc[exact_match, "static_start_time"] = trips.loc[exact_match, "temp_start_time"]
+
+    # start times of scheduled trips are the earliest static departure_time,
+    # added trips use the earliest event timestamp, converted to seconds
+    # after midnight
+    missing_start_time = touched & flag_column(trips, "temp_missing_start_time") & trips["start_time"].isna()
+    scheduled_start = missing_start_time & trips["schedule_start_time"].notna()
+    unscheduled_start = missing_start_time & ~scheduled_start & trips["first_event_timestamp"].notna()
+    trips.loc[scheduled_start, "start_time"] = trips.loc[scheduled_start, "schedule_start_time"]
+    if unscheduled_start.any():
+        trips.loc[unscheduled_start, "start_time"] = start_timestamps_to_seconds(
+            trips.loc[unscheduled_start, "first_event_timestamp"].astype("int64")
+        ).to_numpy()
+
+    has_direction = touched & trips["static_direction"].notna()
+    trips.loc[has_direction, "direction"] = trips.loc[has_direction, "static_direction"]
+    trips.loc[has_direction, "direction_destination"] = trips.loc[has_direction, "static_direction_destination"]
+
+    trips["first_last_station_match"] = flag_column(trips, "first_last_station_match")
+
+    return trips
+
+
+# pylint: enable=R0914
+
+
+def backup_match_candidates(trips: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    trips with new events that did not have an exact static trip match
+    """
+    return trips[flag_column(trips, "touched") & ~trips["first_last_station_match"]]
+
+
+def match_backup_trips(trips: pandas.DataFrame, static_summary: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    perform "backup" match of trips without an exact static trip match
+
+    this matches an RT trip to a static trip of the same service date with the
+    same branch_route_id or trunk_route_id if branch is null and direction
+    with the closest start_time
+
+    :return dataframe of trips with backup matched static trip columns
+    """
+    candidates = backup_match_candidates(trips)
+    if candidates.shape[0] == 0 or static_summary.shape[0] == 0:
+        return trips
+
+    rt_trips = pandas.DataFrame(
+        {
+            "pm_trip_id": candidates["pm_trip_id"],
+            "service_date": candidates["service_date"],
+            "direction_id": candidates["direction_id"],
+            "route_id": candidates["branch_route_id"].fillna(candidates["trunk_route_id"]),
+            "start_time": candidates["start_time"].astype("float64"),
+        }
+    )
+    matches = rt_trips.merge(static_summary, on=["service_date", "direction_id", "route_id"], how="inner")
+    matches["start_time_diff"] = (matches["start_time"] - matches["static_start_time"].astype("float64")).abs()
+    matches = matches.sort_values(
+        ["pm_trip_id", "start_time_diff", "static_trip_id"],
+        na_position="last",
+    ).drop_duplicates(subset="pm_trip_id")
+    matches = matches.set_index("pm_trip_id")
+
+    trips = trips.copy()
+    matched = trips["pm_trip_id"].isin(matches.index)
+    matched_ids = trips.loc[matched, "pm_trip_id"]
+    trips.loc[matched, "static_trip_id_guess"] = matches.loc[matched_ids, "static_trip_id"].to_numpy()
+    trips.loc[matched, "static_start_time"] = matches.loc[matched_ids, "static_start_time"].to_numpy()
+    trips.loc[matched, "static_stop_count"] = matches.loc[matched_ids, "static_stop_count"].to_numpy()
+    trips.loc[matched, "first_last_station_match"] = False
+
+    return trips
+
+
+def changed_trips(current: pandas.DataFrame, derived: pandas.DataFrame) -> pandas.DataFrame:
+    """
+    select derived trip records with at least one column value that differs
+    from the current vehicle_trips record, nulls are treated as equal
+
+    :return dataframe of pm_trip_id, service_date and derived trip columns
+    """
+    columns = [column.name for column in DERIVED_TRIP_COLUMNS]
+    derived = derived.set_index("pm_trip_id")
+    current = current.set_index("pm_trip_id").loc[derived.index, columns]
+
+    changed = pandas.Series(False, index=derived.index)
+    for column in columns:
+        old_na = current[column].isna()
+        new_na = derived[column].isna()
+        # comparisons with nullable extension types are null where either
+        # value is null, those rows are decided by the null checks
+        values_differ = (current[column] != derived[column]).fillna(False).astype(bool)
+        changed |= (old_na != new_na) | (~old_na & ~new_na & values_differ)
+
+    return derived.loc[changed, ["service_date", *columns]].reset_index()
+
+
+def trip_update_rows(trips: pandas.DataFrame) -> List[Tuple[Any, ...]]:
+    """
+    convert trip records into tuples of python values, with None for nulls
+    """
+    trips = trips.astype(object).where(trips.notna(), None)
+    return list(trips.itertuples(index=False, name=None))
+
+
+def trips_update_statement(trips: pandas.DataFrame) -> sa.sql.dml.Update:
+    """
+    single UPDATE statement of vehicle_trips, joined to a VALUES list of all
+    changed trip records
+    """
+    value_columns = [
+        sa.column("pm_trip_id", sa.Integer),
+        sa.column("service_date", sa.Integer),
+        *[sa.column(column.name, column.type) for column in DERIVED_TRIP_COLUMNS],
+    ]
+    trip_values = (
+        sa.values(*value_columns, name="fused_trip_values")
+        .data(trip_update_rows(trips[[column.name for column in value_columns]]))
+        .alias("fused_trip_values")
+    )
+
+    # all null VALUES columns have no type, cast to the vehicle_trips types
+    return (
+        sa.update(VehicleTrips.__table__)
+        .where(
+            VehicleTrips.pm_trip_id == trip_values.c.pm_trip_id,
+            VehicleTrips.service_date == trip_values.c.service_date,
+        )
+        .values({column.name: sa.cast(trip_values.c[column.name], column.type) for column in DERIVED_TRIP_COLUMNS})
+    )
+
+
+def events_update_statement(trips: pandas.DataFrame) -> sa.sql.dml.Update:
+    """
+    single UPDATE statement of vehicle_events for all events of trips
+
+    sets previous / next trip stop pm_event_id's, and canonical / sync stop
+    sequences from static_route_patterns of each trip's static_version_key.
+    """
+    service_dates = sorted(int(service_date) for service_date in trips["service_date"].unique())
+    pm_trip_ids = [int(pm_trip_id) for pm_trip_id in trips["pm_trip_id"]]
+    static_version_keys = sorted(int(key) for key in trips["static_version_key"].dropna().unique())
+
+    trip_events = (
+        sa.select(
+            VehicleEvents.pm_event_id,
+            VehicleEvents.service_date,
+            VehicleEvents.parent_station,
+            sa.func.lead(VehicleEvents.pm_event_id)
+            .over(
+                partition_by=VehicleEvents.pm_trip_id,
+                order_by=VehicleEvents.stop_sequence,
+            )
+            .label("next_trip_stop_pm_event_id"),
+            sa.func.lag(VehicleEvents.pm_event_id)
+            .over(
+                partition_by=VehicleEvents.pm_trip_id,
+                order_by=VehicleEvents.stop_sequence,
+            )
+            .label("previous_trip_stop_pm_event_id"),
+            VehicleTrips.direction_id,
+            VehicleTrips.static_version_key,
+            VehicleTrips.trunk_route_id,
+            sa.func.coalesce(VehicleTrips.branch_route_id, VehicleTrips.trunk_route_id).label("route_id"),
+        )
+        .select_from(VehicleEvents)
+        .join(
+            VehicleTrips,
+            sa.and_(
+                VehicleEvents.service_date == VehicleTrips.service_date,
+                VehicleEvents.pm_trip_id == VehicleTrips.pm_trip_id,
+            ),
+        )
+        .where(
+            VehicleEvents.service_date.in_(service_dates),
+            VehicleEvents.pm_trip_id.in_(pm_trip_ids),
+        )
+        .subquery("fused_trip_events")
+    )
+
+    # canonical and sync stop sequences are built for one static_version_key
+    # at a time, sync values are normalized across a trunk of one key
+    canon_selects = []
+    sync_selects = []
+    for static_version_key in static_version_keys:
+        static_canon = static_canon_subquery(static_version_key)
+        canon_selects.append(sa.select(static_canon))
+        sync_selects.append(sa.select(sync_values_subquery(static_canon)))
+    static_canon_all = sa.union_all(*canon_selects).subquery("static_canon_all")
+    sync_values_all = sa.union_all(*sync_selects).subquery("sync_values_all")
+
+    event_updates = (
+        sa.select(
+            trip_events.c.pm_event_id,
+            trip_events.c.service_date,
+            trip_events.c.next_trip_stop_pm_event_id,
+            trip_events.c.previous_trip_stop_pm_event_id,
+            static_canon_all.c.stop_sequence.label("canonical_stop_sequence"),
+            sync_values_all.c.sync_stop_sequence,
+        )
+        .select_from(trip_events)
+        .outerjoin(
+            static_canon_all,
+            sa.and_(
+                trip_events.c.direction_id == static_canon_all.c.direction_id,
+                trip_events.c.route_id == static_canon_all.c.route_id,
+                trip_events.c.static_version_key == static_canon_all.c.static_version_key,
+                trip_events.c.parent_station == static_canon_all.c.parent_station,
+            ),
+        )
+        .outerjoin(
+            sync_values_all,
+            sa.and_(
+                trip_events.c.direction_id == sync_values_all.c.direction_id,
+                trip_events.c.trunk_route_id == sync_values_all.c.trunk_route_id,
+                trip_events.c.static_version_key == sync_values_all.c.static_version_key,
+                trip_events.c.parent_station == sync_values_all.c.parent_station,
+            ),
+        )
+        .subquery("fused_event_updates")
+    )
+
+    # events without a canonical or sync stop sequence match keep their
+    # current values
+    event_values = {
+        "next_trip_stop_pm_event_id": event_updates.c.next_trip_stop_pm_event_id,
+        "previous_trip_stop_pm_event_id": event_updates.c.previous_trip_stop_pm_event_id,
+        "canonical_stop_sequence": sa.func.coalesce(
+            event_updates.c.canonical_stop_sequence,
+            VehicleEvents.canonical_stop_sequence,
+        ),
+        "sync_stop_sequence": sa.func.coalesce(
+            event_updates.c.sync_stop_sequence,
+            VehicleEvents.sync_stop_sequence,
+        ),
+    }
+
+    # only update events with changed values
+    return (
+        sa.update(VehicleEvents.__table__)
+        .where(
+            VehicleEvents.pm_event_id == event_updates.c.pm_event_id,
+            VehicleEvents.service_date == event_updates.c.service_date,
+            sa.or_(
+                *[VehicleEvents.__table__.c[column].is_distinct_from(value) for column, value in event_values.items()]
+            ),
+        )
+        .values(event_values)
+    )
+
+
+def stage_logger(stage: str, **metadata: Any) -> ProcessLogger:
+    """started ProcessLogger for one stage of process_trips_fused"""
+    process_logger = ProcessLogger(f"l1_trips.fused.{stage}", **metadata)
+    process_logger.log_start()
+    return process_logger
+
+
+def process_trips_fused(db_manager: DatabaseManager) -> None:
+    """
+    update vehicle_trips and vehicle_events tables based on new events in
+    temp_event_compare
+
+    produces the same results as running the individual l1_rt_trips update
+    functions, but the affected trips are only loaded once. all derived trip
+    columns are computed in a working set dataframe and written with a single
+    UPDATE of vehicle_trips, followed by a single UPDATE of vehicle_events.
+    each stage is logged with its own duration.
+    """
+    process_logger = ProcessLogger("l1_trips.process_trips_fused")
+    process_logger.log_start()
+
+    # load working set of trips and everything needed to derive trip columns
+    stage_log = stage_logger("load_working_set")
+    trips = select_dataframe(db_manager, working_set_trips_query())
+    if trips.shape[0] == 0:
+        stage_log.add_metadata(trip_count=0)
+        stage_log.log_complete()
+        process_logger.add_metadata(trip_count=0)
+        process_logger.log_complete()
+        return
+
+    trip_events = select_dataframe(db_manager, trip_events_query())
+    static_trip_times = select_dataframe(db_manager, static_trip_times_query())
+    static_version_keys = sorted(int(key) for key in trips["max_version_key"].unique())
+    static_directions = select_dataframe(db_manager, static_directions_query(static_version_keys))
+    stage_log.add_metadata(
+        trip_count=trips.shape[0],
+        touched_trip_count=int(trips["touched"].sum()),
+    )
+    stage_log.log_complete()
+
+    stage_log = stage_logger("derive_trip_columns")
+    derived = derive_trip_columns(trips, trip_events, static_trip_times, static_directions)
+    stage_log.log_complete()
+
+    stage_log = stage_logger("backup_trip_match")
+    candidates = backup_match_candidates(derived)
+    date_keys: List[Tuple[int, int]] = sorted(
+        {
+            (int(service_date), int(static_version_key))
+            for service_date, static_version_key in zip(candidates["service_date"], candidates["static_version_key"])
+        }
+    )
+    if date_keys:
+        static_summary = select_dataframe(db_manager, static_trips_summary_query(date_keys))
+        derived = match_backup_trips(derived, static_summary)
+    stage_log.add_metadata(candidate_count=candidates.shape[0])
+    stage_log.log_complete()
+
+    stage_log = stage_logger("update_trips")
+    trip_updates = changed_trips(trips, derived)
+    if trip_updates.shape[0] > 0:
+        db_manager.execute(trips_update_statement(trip_updates), disable_trip_tigger=True)
+    stage_log.add_metadata(updated_trip_count=trip_updates.shape[0])
+    stage_log.log_complete()
+
+    stage_log = stage_logger("update_events")
+    result = db_manager.execute(events_update_statement(derived))
+    stage_log.add_metadata(updated_event_count=result.rowcount)
+    stage_log.log_complete()
+
+    process_logger.add_metadata(
+        trip_count=trips.shape[0],
+        updated_trip_count=trip_updates.shape[0],
+        updated_event_count=result.rowcount,
+    )
+    process_logger.log_complete()
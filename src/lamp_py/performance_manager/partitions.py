@@ -0,0 +1,171 @@
+from typing import Iterable, List, Tuple
+
+import sqlalchemy as sa
+
+from lamp_py.postgres.postgres_utils import DatabaseManager
+from lamp_py.postgres.rail_performance_manager_schema import (
+    TempEventCompare,
+    VehicleEvents,
+    VehicleTrips,
+)
+from lamp_py.runtime_utils.process_logger import ProcessLogger
+
+# tables that are range partitioned on service_date, with one partition per
+# calendar month named "{table_name}_{YYYYMM}"
+PARTITIONED_TABLES = (
+    VehicleEvents.__tablename__,
+    VehicleTrips.__tablename__,
+)
+
+
+def service_date_month(service_date: int) -> int:
+    """YYYYMM month of a YYYYMMDD service date"""
+    return int(service_date) // 100
+
+
+def month_bounds(month: int) -> Tuple[int, int]:
+    """
+    YYYYMMDD service date range of a YYYYMM month partition, lower bound is
+    inclusive and upper bound is exclusive
+    """
+    year, month_of_year = divmod(month, 100)
+    if month_of_year == 12:
+        next_month = (year + 1) * 100 + 1
+    else:
+        next_month = month + 1
+
+    return (month * 100 + 1, next_month * 100 + 1)
+
+
+def months_between(start_date: int, end_date: int) -> List[int]:
+    """all YYYYMM months from the month of start_date to the month of end_date"""
+    months = []
+    month = service_date_month(start_date)
+    while month <= service_date_month(end_date):
+        months.append(month)
+        month = month_bounds(month)[1] // 100
+
+    return months
+
+
+def partition_name(table_name: str, month: int) -> str:
+    """name of the partition of table_name that holds a YYYYMM month"""
+    return f"{table_name}_{month}"
+
+
+def create_partition_statement(table_name: str, month: int) -> str:
+    """sql statement to create a YYYYMM month partition of table_name"""
+    start_date, end_date = month_bounds(month)
+    return (
+        f"CREATE TABLE IF NOT EXISTS {partition_name(table_name, month)} "
+        f"PARTITION OF {table_name} "
+        f"FOR VALUES FROM ({start_date}) TO ({end_date});"
+    )
+
+
+def get_partitions(db_manager: DatabaseManager, table_name: str) -> List[str]:
+    """names of all partitions currently attached to table_name"""
+    pg_inherits = sa.table("pg_inherits", sa.column("inhparent"), sa.column("inhrelid"))
+    pg_class = sa.table("pg_class", sa.column("oid"), sa.column("relname"))
+    parent = pg_class.alias("parent")
+    child = pg_class.alias("child")
+
+    partition_query = (
+        sa.select(child.c.relname.label("partition_name"))
+        .select_from(pg_inherits)
+        .join(parent, pg_inherits.c.inhparent == parent.c.oid)
+        .join(child, pg_inherits.c.inhrelid == child.c.oid)
+        .where(parent.c.relname == table_name)
+        .order_by(child.c.relname)
+    )
+
+    return [row["partition_name"] for row in db_manager.select_as_list(partition_query)]
+
+
+def create_service_date_partitions(db_manager: DatabaseManager, service_dates: Iterable[int]) -> None:
+    """
+    create any missing month partitions of vehicle_events and vehicle_trips
+    needed to hold records for service_dates
+
+    inserts into a partitioned table fail if no partition holds the service
+    date, so this must run before new events and trips are inserted.
+    """
+    months = sorted({service_date_month(service_date) for service_date in service_dates})
+
+    process_logger = ProcessLogger("create_service_date_partitions", month_count=len(months))
+    process_logger.log_start()
+
+    created_count = 0
+    for table_name in PARTITIONED_TABLES:
+        existing = set(get_partitions(db_manager, table_name))
+        for month in months:
+            if partition_name(table_name, month) in existing:
+                continue
+            db_manager.execute(sa.text(create_partition_statement(table_name, month)))
+            created_count += 1
+
+    process_logger.add_metadata(created_count=created_count)
+    process_logger.log_complete()
+
+
+def temp_event_service_dates(db_manager: DatabaseManager) -> List[int]:
+    """distinct service dates of records in temp_event_compare"""
+    service_date_query = sa.select(TempEventCompare.service_date).distinct()
+
+    return [int(row["service_date"]) for row in db_manager.select_as_list(service_date_query)]
+
+
+def vacuum_analyze_partitions(db_manager: DatabaseManager, service_dates: Iterable[int]) -> None:
+    """
+    run VACUUM (ANALYZE) on the vehicle_events and vehicle_trips partitions
+    holding service_dates
+
+    running VACUUM on a partitioned table processes every partition, this
+    limits maintenance to the partitions modified by the current event loop.
+    """
+    months = sorted({service_date_month(service_date) for service_date in service_dates})
+
+    process_logger = ProcessLogger("vacuum_analyze_partitions", month_count=len(months))
+    process_logger.log_start()
+
+    for table_name in PARTITIONED_TABLES:
+        existing = set(get_partitions(db_manager, table_name))
+        for month in months:
+            name = partition_name(table_name, month)
+            if name not in existing:
+                continue
+            with db_manager.session.begin() as cursor:
+                cursor.execute(sa.text("END TRANSACTION;"))
+                cursor.execute(sa.text(f"VACUUM (ANALYZE) {name};"))
+
+    process_logger.log_complete()
+
+
+def detach_partitions_before(db_manager: DatabaseManager, service_date: int) -> List[str]:
+    """
+    detach all vehicle_events and vehicle_trips month partitions that only
+    hold service dates before the month of service_date
+
+    detached partitions remain in the database as stand alone tables, so they
+    can be archived and dropped. records in detached partitions are no longer
+    visible to the performance manager, flat file or tableau queries.
+
+    @return List[str] - names of detached partitions
+    """
+    process_logger = ProcessLogger("detach_partitions", service_date=service_date)
+    process_logger.log_start()
+
+    detach_month = service_date_month(service_date)
+    detached = []
+    for table_name in PARTITIONED_TABLES:
+        for name in get_partitions(db_manager, table_name):
+            month = name.removeprefix(f"{table_name}_")
+            if not month.isdigit() or int(month) >= detach_month:
+                continue
+            db_manager.execute(sa.text(f"ALTER TABLE {table_name} DETACH PARTITION {name};"))
+            detached.append(name)
+
+    process_logger.add_metadata(detached_count=len(detached))
+    process_logger.log_complete()
+
+    return detached
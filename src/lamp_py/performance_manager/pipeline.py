@@ -3,13 +3,12 @@
 import argparse
 import logging
 import os
-import sched
 import sys
-import time
 import signal
-from typing import List
+from functools import lru_cache
+from typing import List, Tuple
 
-from lamp_py.aws.ecs import handle_ecs_sigterm, check_for_sigterm
+from lamp_py.aws.ecs import handle_ecs_sigterm
 from lamp_py.postgres.postgres_utils import DatabaseManager, DatabaseIndex
 from lamp_py.runtime_utils.alembic_migration import alembic_upgrade_to_head
 from lamp_py.runtime_utils.env_validation import validate_environment
@@ -23,6 +22,8 @@ from .flat_file import write_flat_files
 from .l0_gtfs_rt_events import process_gtfs_rt_files
 from .l0_gtfs_static_load import process_static_tables
 from .alerts import process_alerts
+from .schedule_cache import static_schedule_cache
+from .stage_scheduler import Stage, StageScheduler
 
 logging.getLogger().setLevel("INFO")
 
@@ -59,53 +60,78 @@ def run_on_app_start() -> None:
     on_app_start_log.log_complete()
 
 
+@lru_cache
+def db_managers(verbose: bool) -> Tuple[DatabaseManager, DatabaseManager]:
+    """
+    rail performance manager and metadata database managers, created once in
+    each stage worker process
+    """
+    rpm_db_manager = DatabaseManager(db_index=DatabaseIndex.RAIL_PERFORMANCE_MANAGER, verbose=verbose)
+    md_db_manager = DatabaseManager(db_index=DatabaseIndex.METADATA, verbose=verbose)
+    return rpm_db_manager, md_db_manager
+
+
+def run_static_stage(verbose: bool) -> None:
+    """load new static schedules"""
+    rpm_db_manager, md_db_manager = db_managers(verbose)
+    process_static_tables(rpm_db_manager, md_db_manager)
+
+
+def run_rt_stage(verbose: bool) -> None:
+    """process new gtfs-rt files into vehicle events"""
+    rpm_db_manager, md_db_manager = db_managers(verbose)
+    static_schedule_cache.validate(rpm_db_manager, force=True)
+    process_gtfs_rt_files(rpm_db_manager, md_db_manager)
+
+
+def run_flat_file_stage(verbose: bool) -> None:
+    """write flat files for service dates with new events"""
+    rpm_db_manager, _ = db_managers(verbose)
+    static_schedule_cache.validate(rpm_db_manager, force=True)
+    write_flat_files(rpm_db_manager)
+
+
+def run_alerts_stage(verbose: bool) -> None:
+    """process new alerts"""
+    _, md_db_manager = db_managers(verbose)
+    process_alerts(md_db_manager)
+
+
+def run_parquet_stage(verbose: bool) -> None:
+    """rebuild tableau parquet files"""
+    rpm_db_manager, _ = db_managers(verbose)
+    start_parquet_updates(rpm_db_manager)
+
+
+def pipeline_stages(args: argparse.Namespace) -> List[Stage]:
+    """
+    stages of the performance manager event loop
+
+    static schedules are loaded before gtfs-rt files are processed, and flat
+    files are written after gtfs-rt files are processed. each worker process
+    has its own static schedule cache, so stages that read it validate it
+    against static_feed_info at the start of every run. the static stage has
+    no deadline as it pauses indefinitely on a failed load.
+    """
+    kwargs = {"verbose": args.verbose}
+    return [
+        Stage("static", run_static_stage, kwargs, interval=int(args.interval), worker="events"),
+        Stage("rt", run_rt_stage, kwargs, depends_on=["static"], worker="events", deadline=60 * 60),
+        Stage("flat_files", run_flat_file_stage, kwargs, depends_on=["rt"], deadline=30 * 60),
+        Stage("alerts", run_alerts_stage, kwargs, interval=int(args.interval), deadline=15 * 60),
+        Stage("parquet", run_parquet_stage, kwargs, interval=30 * 60, deadline=60 * 60),
+    ]
+
+
 def main(args: argparse.Namespace) -> None:
     """entrypoint into performance manager event loop"""
     main_process_logger = ProcessLogger("main", **vars(args))
     main_process_logger.log_start()
 
-    # get the engine that manages sessions that read and write to the db
-    rpm_db_manager = DatabaseManager(db_index=DatabaseIndex.RAIL_PERFORMANCE_MANAGER, verbose=args.verbose)
-    md_db_manager = DatabaseManager(db_index=DatabaseIndex.METADATA, verbose=args.verbose)
-
-    # schedule object that will control the "event loop"
-    scheduler = sched.scheduler(time.monotonic, time.sleep)
-
-    def fast_iter() -> None:
-        """function to invoke a fast scheduled routine"""
-        check_for_sigterm()
-        process_logger = ProcessLogger("fast_event_loop")
-        process_logger.log_start()
-        try:
-            process_static_tables(rpm_db_manager, md_db_manager)
-            process_gtfs_rt_files(rpm_db_manager, md_db_manager)
-            write_flat_files(rpm_db_manager)
-            process_alerts(md_db_manager)
-
-            process_logger.log_complete()
-        except Exception as exception:
-            process_logger.log_failure(exception)
-        finally:
-            scheduler.enter(int(args.interval), 2, fast_iter)
-
-    def slow_iter() -> None:
-        """function to invoke a slow scheduled routine"""
-        check_for_sigterm()
-        process_logger = ProcessLogger("slow_event_loop")
-        process_logger.log_start()
-        try:
-            start_parquet_updates(rpm_db_manager)
-
-            process_logger.log_complete()
-        except Exception as exception:
-            process_logger.log_failure(exception)
-        finally:
-            # re-schedule every 30 minutes
-            scheduler.enter(60 * 30, 1, slow_iter)
-
-    # schedule the initial loop and start the scheduler
-    scheduler.enter(0, 1, fast_iter)
-    scheduler.enter(0, 2, slow_iter)
+    # each stage runs in a worker process, independent stages run
+    # concurrently so a slow parquet rebuild or alerts update doesn't delay
+    # gtfs-rt processing
+    scheduler = StageScheduler(pipeline_stages(args))
     scheduler.run()
 
 
@@ -125,7 +151,7 @@ def start() -> None:
             "SERVICE_NAME",
             "ALEMBIC_RPM_DB_NAME",
         ],
-        optional_variables=["PUBLIC_ARCHIVE_BUCKET"],
+        optional_variables=["PUBLIC_ARCHIVE_BUCKET", "RPM_FUSED_TRIPS"],
         db_prefixes=["RPM", "MD"],
     )
 
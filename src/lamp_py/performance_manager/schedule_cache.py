@@ -0,0 +1,259 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import pyarrow
+import pyarrow.compute as pc
+import sqlalchemy as sa
+
+from lamp_py.postgres.postgres_utils import DatabaseManager
+from lamp_py.postgres.rail_performance_manager_schema import (
+    StaticFeedInfo,
+    StaticRoutes,
+    StaticStops,
+)
+
+# seconds between checks of static_feed_info for newly loaded schedules
+VALIDATION_SECONDS = 60.0
+
+
+# pylint: disable=R0902
+# pylint too many instance attributes (more than 7)
+class StaticScheduleCache:
+    """
+    process local cache of static schedule lookups used on every event loop.
+
+    feed info ranges are cached as a single arrow table, rail route ids and
+    stop to parent station maps are cached per static_version_key. schedules
+    only change when a new static schedule is loaded. lookups validate the
+    cache against static_feed_info, so schedules loaded by another process
+    are picked up within VALIDATION_SECONDS. a process loading a schedule
+    calls invalidate directly.
+
+    the cache is shared by the threads of a process, e.g. the flat file
+    writers. validation, invalidation and counts are guarded by a lock, and
+    lookups return the values they fetched instead of re-reading the cache,
+    which may have been invalidated by another thread in the meantime.
+    values fetched while the cache was invalidated are returned, not stored.
+
+    hits and misses are counted for each lookup type.
+    """
+
+    def __init__(self) -> None:
+        self.feed_info: Optional[pyarrow.Table] = None
+        self.version_keys: Dict[int, int] = {}
+        self.rail_route_ids: Dict[int, pyarrow.Table] = {}
+        self.parent_stations: Dict[int, pyarrow.Table] = {}
+
+        # max static_version_key and row count of static_feed_info at the
+        # last validation
+        self.feed_info_version: Optional[Tuple[Optional[int], int]] = None
+        self.validated_at: Optional[float] = None
+
+        self.hits: Dict[str, int] = {}
+        self.misses: Dict[str, int] = {}
+
+        # incremented on every invalidation, values fetched before an
+        # invalidation are not stored
+        self.generation = 0
+        self.lock = threading.RLock()
+
+    def _count(self, lookup: str, hit: bool) -> None:
+        with self.lock:
+            counter = self.hits if hit else self.misses
+            counter[lookup] = counter.get(lookup, 0) + 1
+
+    def invalidate(self) -> None:
+        """drop all cached schedule data, hit and miss counts are kept"""
+        with self.lock:
+            self.generation += 1
+            self.feed_info = None
+            self.version_keys.clear()
+            self.rail_route_ids.clear()
+            self.parent_stations.clear()
+
+    def validate(self, db_manager: DatabaseManager, force: bool = False) -> None:
+        """
+        invalidate the cache if static_feed_info changed since the last
+        validation. the check is a single aggregate query, run at most once
+        every VALIDATION_SECONDS unless forced.
+        """
+        with self.lock:
+            now = time.monotonic()
+            if not force and self.validated_at is not None and now - self.validated_at < VALIDATION_SECONDS:
+                return
+
+            version_query = sa.select(
+                sa.func.max(StaticFeedInfo.static_version_key).label("max_static_version_key"),
+                # pylint: disable-next=E1102
+                sa.func.count(StaticFeedInfo.static_version_key).label("feed_info_count"),
+            )
+            version = db_manager.select_as_list(version_query)[0]
+            feed_info_version = (version["max_static_version_key"], int(version["feed_info_count"]))
+
+            self._count("validation", feed_info_version == self.feed_info_version)
+            if feed_info_version != self.feed_info_version:
+                self.invalidate()
+
+            self.feed_info_version = feed_info_version
+            self.validated_at = now
+
+    def stats(self) -> Dict[str, int]:
+        """hit and miss counts of each lookup type, for process logger metadata"""
+        stats: Dict[str, int] = {}
+        for lookup in sorted(set(self.hits) | set(self.misses)):
+            stats[f"cache_{lookup}_hits"] = self.hits.get(lookup, 0)
+            stats[f"cache_{lookup}_misses"] = self.misses.get(lookup, 0)
+        return stats
+
+    def _store(self, generation: int, cache: Dict[int, Any], key: int, value: Any) -> None:
+        with self.lock:
+            if generation == self.generation:
+                cache[key] = value
+
+    def _get_feed_info(self, db_manager: DatabaseManager) -> pyarrow.Table:
+        generation = self.generation
+        feed_info = self.feed_info
+        if feed_info is None:
+            feed_info_query = sa.select(
+                StaticFeedInfo.static_version_key,
+                StaticFeedInfo.feed_start_date,
+                StaticFeedInfo.feed_end_date,
+                StaticFeedInfo.feed_active_date,
+                StaticFeedInfo.created_on,
+            )
+            feed_info = pyarrow.Table.from_pylist(
+                db_manager.select_as_list(feed_info_query),
+                schema=pyarrow.schema(
+                    [
+                        ("static_version_key", pyarrow.int64()),
+                        ("feed_start_date", pyarrow.int64()),
+                        ("feed_end_date", pyarrow.int64()),
+                        ("feed_active_date", pyarrow.int64()),
+                        ("created_on", pyarrow.timestamp("us", tz="UTC")),
+                    ]
+                ),
+            )
+            with self.lock:
+                if generation == self.generation:
+                    self.feed_info = feed_info
+        return feed_info
+
+    def static_version_key(self, service_date: int, db_manager: DatabaseManager) -> int:
+        """
+        for a given service date, determine the correct static schedule to use
+
+        the service date must be between "feed_start_date" and "feed_end_date"
+        and be greater than or equal to "feed_active_date". matches are
+        ordered by "feed_active_date" and then "created_on", descending, to
+        handle multiple static schedules being issued for the same service
+        day.
+
+        "feed_start_date" and "feed_end_date" are modified for archived GTFS
+        Schedule files, if there is no live match, the latest
+        "feed_start_date" that includes the service date is used instead.
+
+        :raises IndexError if no schedule matches the service date
+        """
+        self.validate(db_manager)
+        generation = self.generation
+        static_version_key = self.version_keys.get(service_date)
+        self._count("static_version_key", static_version_key is not None)
+        if static_version_key is not None:
+            return static_version_key
+
+        feed_info = self._get_feed_info(db_manager)
+        in_range = feed_info.filter(
+            pc.and_(
+                pc.less_equal(feed_info["feed_start_date"], service_date),
+                pc.greater_equal(feed_info["feed_end_date"], service_date),
+            )
+        )
+        live_match = in_range.filter(pc.less_equal(in_range["feed_active_date"], service_date)).sort_by(
+            [("feed_active_date", "descending"), ("created_on", "descending")]
+        )
+        archive_match = in_range.sort_by([("feed_start_date", "descending"), ("created_on", "descending")])
+
+        if live_match.num_rows > 0:
+            static_version_key = live_match["static_version_key"][0].as_py()
+        elif archive_match.num_rows > 0:
+            static_version_key = archive_match["static_version_key"][0].as_py()
+        else:
+            # no static schedule info exists for this service date, the data
+            # should not be processed until valid static schedule data exists
+            raise IndexError(f"StaticFeedInfo table has no matching schedule for service_date={service_date}")
+
+        self._store(generation, self.version_keys, service_date, int(static_version_key))
+        return int(static_version_key)
+
+    def rail_routes(self, static_version_key: int, db_manager: DatabaseManager) -> List[str]:
+        """
+        route ids of all rail routes (route type 0, 1 or 2) in a static
+        schedule version
+        """
+        self.validate(db_manager)
+        generation = self.generation
+        routes = self.rail_route_ids.get(static_version_key)
+        self._count("rail_routes", routes is not None)
+        if routes is None:
+            route_query = sa.select(StaticRoutes.route_id).where(
+                StaticRoutes.route_type.in_([0, 1, 2]),
+                StaticRoutes.static_version_key == static_version_key,
+            )
+            routes = pyarrow.Table.from_pylist(
+                db_manager.select_as_list(route_query),
+                schema=pyarrow.schema([("route_id", pyarrow.string())]),
+            )
+            self._store(generation, self.rail_route_ids, static_version_key, routes)
+
+        return routes["route_id"].to_pylist()
+
+    def stop_parent_stations(self, static_version_keys: List[int], db_manager: DatabaseManager) -> pyarrow.Table:
+        """
+        static_version_key, stop_id and parent_station of every stop in a list
+        of static schedule versions
+        """
+        self.validate(db_manager)
+        generation = self.generation
+        parent_stations: Dict[int, pyarrow.Table] = {}
+        missing_keys = []
+        for static_version_key in static_version_keys:
+            stations = self.parent_stations.get(static_version_key)
+            self._count("parent_stations", stations is not None)
+            if stations is None:
+                missing_keys.append(static_version_key)
+            else:
+                parent_stations[static_version_key] = stations
+
+        schema = pyarrow.schema(
+            [
+                ("static_version_key", pyarrow.int64()),
+                ("stop_id", pyarrow.string()),
+                ("parent_station", pyarrow.string()),
+            ]
+        )
+        if len(static_version_keys) == 0:
+            return schema.empty_table()
+
+        if missing_keys:
+            parent_station_query = sa.select(
+                StaticStops.static_version_key,
+                StaticStops.stop_id,
+                StaticStops.parent_station,
+            ).where(StaticStops.static_version_key.in_(missing_keys))
+            stops = pyarrow.Table.from_pylist(db_manager.select_as_list(parent_station_query), schema=schema)
+            for static_version_key in missing_keys:
+                parent_stations[static_version_key] = stops.filter(
+                    pc.equal(stops["static_version_key"], static_version_key)
+                )
+                self._store(generation, self.parent_stations, static_version_key, parent_stations[static_version_key])
+
+        return pyarrow.concat_tables(
+            [parent_stations[static_version_key] for static_version_key in static_version_keys]
+        )
+
+
+# pylint: enable=R0902
+
+# shared by all static schedule lookups in this process
+static_schedule_cache = StaticScheduleCache()
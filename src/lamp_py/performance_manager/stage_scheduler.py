@@ -0,0 +1,340 @@
+import os
+import signal
+import time
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from multiprocessing.process import BaseProcess
+from multiprocessing.queues import Queue
+from queue import Empty
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
+
+from lamp_py.aws.ecs import check_for_sigterm, handle_ecs_sigterm
+from lamp_py.runtime_utils.process_logger import ProcessLogger
+
+
+@dataclass
+class Stage:
+    """
+    a unit of work run by the StageScheduler
+
+    name: unique name of the stage, used in logs and dependency lists
+    target: top level function run by the stage. it is called in a spawned
+        worker process, so it must be importable.
+    kwargs: keyword arguments passed to target
+    interval: seconds between the starts of runs, for stages without
+        dependencies
+    depends_on: stages that must complete successfully after this stage last
+        started for it to run again
+    worker: worker process the stage is run in, defaults to the stage name.
+        stages sharing a worker never run concurrently and share process local
+        state, like caches.
+    deadline: seconds a run may take before its worker is killed and
+        restarted. None if a run may take any amount of time.
+    """
+
+    name: str
+    target: Callable[..., None]
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    interval: Optional[float] = None
+    depends_on: List[str] = field(default_factory=list)
+    worker: Optional[str] = None
+    deadline: Optional[float] = None
+
+    @property
+    def worker_name(self) -> str:
+        """name of the worker process that runs this stage"""
+        return self.worker if self.worker is not None else self.name
+
+
+@dataclass
+class StageState:
+    """
+    run history of a stage, in StageScheduler clock seconds
+
+    last_start: when the last run of the stage was started
+    last_success: when the last successful run of the stage completed
+    running_since: when the current run started, None if not running
+    """
+
+    last_start: Optional[float] = None
+    last_success: Optional[float] = None
+    running_since: Optional[float] = None
+
+
+def run_stage_worker(
+    stages: Dict[str, Stage],
+    tasks: "Queue[Optional[str]]",
+    results: "Queue[Tuple[str, bool]]",
+) -> None:
+    """
+    worker process loop. run the stages named on the tasks queue, reporting if
+    each succeeded on the results queue, until a None task is received.
+
+    SIGTERM sets the same flag as in the main process, so stages that check
+    for it can stop at a safe point when the scheduler shuts down.
+    """
+    signal.signal(signal.SIGTERM, handle_ecs_sigterm)
+
+    while True:
+        stage_name = tasks.get()
+        if stage_name is None:
+            return
+
+        stage = stages[stage_name]
+        process_logger = ProcessLogger("pm_stage_run", stage=stage.name, worker=stage.worker_name)
+        process_logger.log_start()
+        try:
+            stage.target(**stage.kwargs)
+            process_logger.log_complete()
+            results.put((stage_name, True))
+        except Exception as exception:
+            process_logger.log_failure(exception)
+            results.put((stage_name, False))
+
+        check_for_sigterm()
+
+
+class StageScheduler:
+    """
+    Run pipeline stages concurrently in worker processes.
+
+    Stages without dependencies are run every interval seconds. Stages with
+    dependencies are run after every dependency has completed successfully
+    since the stage last started, and never while a dependency is running.
+    Each worker runs one stage at a time, so a stage that is due waits for its
+    worker. That wait is reported as queue lag when the stage is started.
+
+    Runs that take longer than their stage deadline have their worker killed
+    and restarted, and are treated as failures.
+    """
+
+    def __init__(
+        self,
+        stages: List[Stage],
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.stages: Dict[str, Stage] = {stage.name: stage for stage in stages}
+        self.state: Dict[str, StageState] = {stage.name: StageState() for stage in stages}
+        self.clock = clock
+
+        for stage in stages:
+            if len(stage.depends_on) == 0 and stage.interval is None:
+                raise ValueError(f"Stage {stage.name} needs an interval or dependencies")
+            for dependency in stage.depends_on:
+                if dependency not in self.stages:
+                    raise ValueError(f"Stage {stage.name} depends on unknown stage {dependency}")
+
+        self.workers: Dict[str, BaseProcess] = {}
+        self.task_queues: Dict[str, "Queue[Optional[str]]"] = {}
+        self.result_queues: Dict[str, "Queue[Tuple[str, bool]]"] = {}
+        self.loggers: Dict[str, ProcessLogger] = {}
+
+    def due_since(self, stage_name: str) -> Optional[float]:
+        """
+        when a stage became due to run, or None if it is running or not due
+        """
+        stage = self.stages[stage_name]
+        state = self.state[stage_name]
+
+        if state.running_since is not None:
+            return None
+
+        if len(stage.depends_on) == 0:
+            assert stage.interval is not None
+            if state.last_start is None:
+                return 0.0
+            return state.last_start + stage.interval
+
+        dependency_states = [self.state[dependency] for dependency in stage.depends_on]
+        if any(dependency.running_since is not None for dependency in dependency_states):
+            return None
+
+        completed: List[float] = []
+        for dependency in dependency_states:
+            if dependency.last_success is None:
+                return None
+            if state.last_start is not None and dependency.last_success <= state.last_start:
+                return None
+            completed.append(dependency.last_success)
+
+        return max(completed)
+
+    def runnable(self, now: float) -> List[str]:
+        """
+        stages that are due and whose worker is idle, at most one per worker.
+        when several stages of a worker are due, the one listed first is run.
+        """
+        busy_workers = {
+            self.stages[stage_name].worker_name
+            for stage_name, state in self.state.items()
+            if state.running_since is not None
+        }
+
+        stage_names: List[str] = []
+        for stage_name, stage in self.stages.items():
+            due_since = self.due_since(stage_name)
+            if due_since is None or due_since > now or stage.worker_name in busy_workers:
+                continue
+            busy_workers.add(stage.worker_name)
+            stage_names.append(stage_name)
+
+        return stage_names
+
+    def mark_started(self, stage_name: str, now: float) -> float:
+        """
+        record the start of a stage run
+
+        :return queue lag, seconds between the stage becoming due and its start
+        """
+        due_since = self.due_since(stage_name)
+        state = self.state[stage_name]
+
+        # stages without dependencies are due from the start of the scheduler
+        first_interval_run = len(self.stages[stage_name].depends_on) == 0 and state.last_start is None
+
+        state.last_start = now
+        state.running_since = now
+
+        if due_since is None or first_interval_run:
+            return 0.0
+        return max(0.0, now - due_since)
+
+    def mark_finished(self, stage_name: str, now: float, success: bool) -> None:
+        """record the end of a stage run"""
+        state = self.state[stage_name]
+        state.running_since = None
+        if success:
+            state.last_success = now
+
+    def overdue(self, now: float) -> List[str]:
+        """running stages that have passed their deadline"""
+        return [
+            stage_name
+            for stage_name, state in self.state.items()
+            if state.running_since is not None
+            and self.stages[stage_name].deadline is not None
+            and now - state.running_since > self.stages[stage_name].deadline  # type: ignore[operator]
+        ]
+
+    def start_worker(self, worker_name: str) -> None:
+        """start a spawned worker process for all stages of a worker"""
+        context = get_context("spawn")
+        self.task_queues[worker_name] = context.Queue()
+        self.result_queues[worker_name] = context.Queue()
+
+        worker_stages = {name: stage for name, stage in self.stages.items() if stage.worker_name == worker_name}
+        worker = context.Process(
+            target=run_stage_worker,
+            args=(worker_stages, self.task_queues[worker_name], self.result_queues[worker_name]),
+            name=f"pm_stage_{worker_name}",
+        )
+        worker.start()
+        self.workers[worker_name] = worker
+
+    def start(self, stage_name: str) -> None:
+        """send a stage to its worker"""
+        stage = self.stages[stage_name]
+        queue_lag = self.mark_started(stage_name, self.clock())
+
+        process_logger = ProcessLogger(
+            "pm_stage",
+            stage=stage_name,
+            worker=stage.worker_name,
+            queue_lag_seconds=f"{queue_lag:.2f}",
+        )
+        process_logger.log_start()
+        self.loggers[stage_name] = process_logger
+
+        self.task_queues[stage.worker_name].put(stage_name)
+
+    def finish(self, stage_name: str, success: bool, exception: Optional[Exception] = None) -> None:
+        """record a completed stage run and log its result"""
+        self.mark_finished(stage_name, self.clock(), success)
+
+        process_logger = self.loggers.pop(stage_name)
+        if success:
+            process_logger.log_complete()
+        else:
+            process_logger.log_failure(exception or RuntimeError(f"Stage {stage_name} failed"))
+
+    def collect_results(self) -> None:
+        """record the results of all stages that have finished"""
+        for worker_name, result_queue in self.result_queues.items():
+            try:
+                while True:
+                    stage_name, success = result_queue.get_nowait()
+                    self.finish(stage_name, success)
+            except Empty:
+                pass
+
+            # a worker that died without reporting fails its running stage
+            if not self.workers[worker_name].is_alive():
+                for stage_name in self.running(worker_name):
+                    self.finish(stage_name, False, RuntimeError(f"Worker {worker_name} exited"))
+                self.start_worker(worker_name)
+
+    def running(self, worker_name: str) -> List[str]:
+        """stages currently running in a worker"""
+        return [
+            stage_name
+            for stage_name, state in self.state.items()
+            if state.running_since is not None and self.stages[stage_name].worker_name == worker_name
+        ]
+
+    def enforce_deadlines(self) -> None:
+        """kill and restart the workers of stages that passed their deadline"""
+        for stage_name in self.overdue(self.clock()):
+            worker_name = self.stages[stage_name].worker_name
+            worker = self.workers[worker_name]
+            worker.kill()
+            worker.join()
+
+            self.finish(
+                stage_name,
+                False,
+                TimeoutError(f"Stage {stage_name} passed its {self.stages[stage_name].deadline}s deadline"),
+            )
+            self.start_worker(worker_name)
+
+    def shutdown(self, timeout: float = 20.0) -> None:
+        """
+        stop all workers. workers finish their current stage unless it checks
+        for SIGTERM first, and are killed if they have not exited by timeout.
+        """
+        for worker_name, worker in self.workers.items():
+            self.task_queues[worker_name].put(None)
+            worker.terminate()
+
+        stop_by = time.monotonic() + timeout
+        for worker in self.workers.values():
+            worker.join(max(0.0, stop_by - time.monotonic()))
+            if worker.is_alive():
+                worker.kill()
+                worker.join()
+
+    def run(self, tick: float = 1.0) -> None:
+        """
+        start a worker process for each worker and run stages as they become
+        due until SIGTERM is received
+        """
+        for worker_name in {stage.worker_name for stage in self.stages.values()}:
+            self.start_worker(worker_name)
+
+        while True:
+            if os.environ.get("GOT_SIGTERM") is not None:
+                self.shutdown()
+                check_for_sigterm()
+
+            self.collect_results()
+            self.enforce_deadlines()
+            for stage_name in self.runnable(self.clock()):
+                self.start(stage_name)
+
+            time.sleep(tick)
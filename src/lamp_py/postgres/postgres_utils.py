@@ -2,9 +2,11 @@ import os
 import time
 import urllib.parse as urlparse
 from enum import Enum, auto
-from queue import Queue
+from io import BytesIO
+from queue import Empty, Queue
 from multiprocessing import Manager, Process
-from typing import Any, Dict, List, Optional, Tuple, Union, Callable
+from threading import Thread
+from typing import Any, Dict, IO, List, Optional, Tuple, Union, Callable
 
 import boto3
 import pandas
@@ -13,8 +15,11 @@ from sqlalchemy.sql.functions import now
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.orm import sessionmaker
 import pyarrow
+import pyarrow.compute as pc
+import pyarrow.csv
 import pyarrow.parquet as pq
 
+from lamp_py.aws.day_manifest import day_path_from_fragment
 from lamp_py.aws.s3 import dt_from_obj_path
 from lamp_py.runtime_utils.process_logger import ProcessLogger
 
@@ -243,6 +248,166 @@ def generate_update_db_password_func(psql_args: PsqlArgs) -> Callable:
 # https://github.com/python/mypy/issues/2477
 
 
+def query_to_sql(select_query: Union[sa.sql.selectable.Select, sa.sql.elements.TextClause]) -> str:
+    """
+    render a query as a single postgres sql string, with bound parameters
+    rendered inline and without a trailing semicolon, so it can be wrapped
+    in a COPY statement
+
+    raises a ValueError if the query has parameters without a value
+    """
+    # the named paramstyle keeps literal percent signs from being escaped
+    dialect = postgresql.dialect(paramstyle="named")
+
+    unbound = [name for name, bind in select_query.compile(dialect=dialect).binds.items() if bind.required]
+    if unbound:
+        raise ValueError(f"query parameters without a value can not be rendered: {unbound}")
+
+    sql = str(select_query.compile(dialect=dialect, compile_kwargs={"literal_binds": True}))
+
+    return sql.strip().rstrip(";")
+
+
+def _cast_copy_batch(batch: pyarrow.RecordBatch, schema: pyarrow.schema) -> pyarrow.RecordBatch:
+    """
+    cast timestamp columns, read as strings from COPY csv output, to schema
+
+    timestamptz values are written with a utc offset, these are converted to
+    utc before dropping the timezone, matching how pyarrow stores timezone
+    aware datetimes in timezone naive columns. timestamp values are written
+    without an offset and are cast directly.
+    """
+    columns = []
+    for field in schema:
+        column = batch.column(field.name)
+        if pyarrow.types.is_timestamp(field.type) and field.type.tz is None:
+            try:
+                column = pc.cast(column, pyarrow.timestamp(field.type.unit, tz="UTC")).cast(field.type)
+            except pyarrow.ArrowInvalid:
+                column = pc.cast(column, field.type)
+        elif pyarrow.types.is_timestamp(field.type):
+            column = pc.cast(column, field.type)
+        columns.append(column)
+
+    return pyarrow.RecordBatch.from_arrays(columns, schema=schema)
+
+
+# arrow types used to load sqlalchemy column types with COPY, subclasses are
+# listed before the types they extend
+COPY_ARROW_TYPES: List[Tuple[Any, pyarrow.DataType]] = [
+    (sa.Boolean, pyarrow.bool_()),
+    (sa.SmallInteger, pyarrow.int16()),
+    (sa.BigInteger, pyarrow.int64()),
+    (sa.Integer, pyarrow.int32()),
+    (sa.Float, pyarrow.float64()),
+    (sa.Date, pyarrow.date32()),
+    (sa.String, pyarrow.string()),
+]
+
+
+def arrow_type_from_column(column: sa.Column) -> pyarrow.DataType:
+    """
+    arrow type used to load values for a sqlalchemy column with COPY
+
+    raises a TypeError for column types without an arrow type
+    """
+    if isinstance(column.type, sa.DateTime):
+        return pyarrow.timestamp("us", tz="UTC" if column.type.timezone else None)
+
+    for column_type, arrow_type in COPY_ARROW_TYPES:
+        if isinstance(column.type, column_type):
+            return arrow_type
+
+    raise TypeError(f"no COPY arrow type for column {column.name} of type {column.type}")
+
+
+def dataframe_to_copy_table(dataframe: pandas.DataFrame, insert_table: sa.Table) -> pyarrow.Table:
+    """
+    convert a dataframe into an arrow table matching the columns of
+    insert_table, ready to be written as csv for COPY ... FROM STDIN
+
+    dataframe columns that are not in insert_table are dropped. table columns
+    missing from the dataframe, that have a scalar python side default, are
+    filled with that default, as sqlalchemy would on insert. values are cast
+    to the types of the table columns, so integer columns holding NaN in
+    pandas are loaded as integers with nulls.
+
+    string columns accept string, integer and all null values. raises a
+    TypeError for other values in string columns, and a pyarrow error for
+    values that can not be cast safely to the column type.
+    """
+    columns = []
+    names = []
+    for column in insert_table.columns:
+        arrow_type = arrow_type_from_column(column)
+        if column.name in dataframe.columns:
+            values = pyarrow.Array.from_pandas(dataframe[column.name])
+            if pyarrow.types.is_string(arrow_type) and not (
+                pyarrow.types.is_string(values.type)
+                or pyarrow.types.is_large_string(values.type)
+                or pyarrow.types.is_integer(values.type)
+                or pyarrow.types.is_null(values.type)
+            ):
+                raise TypeError(f"can not load {values.type} values into string column {column.name}")
+            columns.append(values.cast(arrow_type))
+        elif isinstance(column.default, sa.ColumnDefault) and column.default.is_scalar:
+            columns.append(pyarrow.array([column.default.arg] * dataframe.shape[0], arrow_type))
+        else:
+            continue
+        names.append(column.name)
+
+    return pyarrow.Table.from_arrays(columns, names=names)
+
+
+def copy_csv_to_parquet(
+    csv_file: IO[bytes],
+    write_path: str,
+    schema: pyarrow.schema,
+    batch_size: int = 1024 * 1024,
+) -> int:
+    """
+    parse the output of a postgres COPY ... TO STDOUT WITH (FORMAT csv, HEADER
+    true) statement straight into arrow batches and write them to a parquet
+    file, in row groups of batch_size rows
+
+    postgres writes NULL as an unquoted empty value and empty strings as "",
+    and booleans as t and f.
+
+    :return number of rows written
+    """
+    read_types = {
+        field.name: pyarrow.string() if pyarrow.types.is_timestamp(field.type) else field.type for field in schema
+    }
+    reader = pyarrow.csv.open_csv(
+        csv_file,
+        read_options=pyarrow.csv.ReadOptions(block_size=16 * 1024 * 1024),
+        parse_options=pyarrow.csv.ParseOptions(newlines_in_values=True),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types=read_types,
+            include_columns=schema.names,
+            null_values=[""],
+            strings_can_be_null=True,
+            quoted_strings_can_be_null=False,
+            true_values=["t"],
+            false_values=["f"],
+        ),
+    )
+
+    row_count = 0
+    batches: List[pyarrow.RecordBatch] = []
+    with pq.ParquetWriter(write_path, schema=schema) as pq_writer:
+        for batch in reader:
+            batches.append(_cast_copy_batch(batch, schema))
+            row_count += batch.num_rows
+            if sum(b.num_rows for b in batches) >= batch_size:
+                pq_writer.write_table(pyarrow.Table.from_batches(batches, schema=schema), row_group_size=batch_size)
+                batches = []
+        if batches:
+            pq_writer.write_table(pyarrow.Table.from_batches(batches, schema=schema), row_group_size=batch_size)
+
+    return row_count
+
+
 class DatabaseManager:
     """
     manager class for rds application operations
@@ -343,13 +508,57 @@ class DatabaseManager:
         """
         insert data into db table from pandas dataframe
         """
+        self.copy_from_dataframe(dataframe, insert_table)
+
+    def copy_from_dataframe(
+        self,
+        dataframe: pandas.DataFrame,
+        insert_table: Any,
+        batch_size: int = 500_000,
+    ) -> None:
+        """
+        bulk load a pandas dataframe into a db table with COPY ... FROM STDIN
+
+        the dataframe is converted to arrow, with types mapped from the
+        sqlalchemy table definition, and written as csv in batches of
+        batch_size rows. all batches are loaded in a single transaction.
+
+        :param dataframe: records to insert, columns named after table columns
+        :param insert_table: sqlalchemy table or declarative model
+        :param batch_size: number of rows written to the db per COPY
+        """
         insert_as = self._get_schema_table(insert_table)
 
-        with self.session.begin() as cursor:
-            cursor.execute(
-                sa.insert(insert_as),
-                dataframe.to_dict(orient="records"),
-            )
+        process_logger = ProcessLogger(
+            "postgres_copy_from_dataframe",
+            table_name=insert_as.name,
+            row_count=dataframe.shape[0],
+        )
+        process_logger.log_start()
+
+        copy_table = dataframe_to_copy_table(dataframe, insert_as)
+        column_names = ", ".join(f'"{name}"' for name in copy_table.column_names)
+        copy_sql = f"COPY {insert_as.fullname} ({column_names}) FROM STDIN WITH (FORMAT csv, HEADER true)"
+
+        connection = self.engine.raw_connection()
+        try:
+            # psycopg2 cursor, copy_expert is not part of the dbapi
+            cursor: Any = connection.cursor()
+            for batch in copy_table.to_batches(max_chunksize=batch_size):
+                csv_buffer = BytesIO()
+                pyarrow.csv.write_csv(batch, csv_buffer)
+                csv_buffer.seek(0)
+                cursor.copy_expert(copy_sql, csv_buffer)
+            cursor.close()
+            connection.commit()
+        except Exception as exception:
+            connection.rollback()
+            process_logger.log_failure(exception)
+            raise exception
+        finally:
+            connection.close()
+
+        process_logger.log_complete()
 
     def select_as_dataframe(self, select_query: sa.sql.selectable.Select) -> pandas.DataFrame:
         """
@@ -367,7 +576,7 @@ class DatabaseManager:
 
     def write_to_parquet(
         self,
-        select_query: sa.sql.selectable.Select,
+        select_query: Union[sa.sql.selectable.Select, sa.sql.elements.TextClause],
         write_path: str,
         schema: pyarrow.schema,
         batch_size: int = 1024 * 1024,
@@ -409,6 +618,85 @@ class DatabaseManager:
 
         process_logger.log_complete()
 
+    # pylint: disable=R0914
+    # pylint too many local variables (more than 15)
+    def copy_to_parquet(
+        self,
+        select_query: Union[sa.sql.selectable.Select, sa.sql.elements.TextClause],
+        write_path: str,
+        schema: pyarrow.schema,
+        batch_size: int = 1024 * 1024,
+    ) -> None:
+        """
+        stream db query results to parquet file with COPY ... TO STDOUT
+
+        query results are written by postgres as csv and parsed directly into
+        arrow batches, avoiding the python objects created for each row by
+        write_to_parquet. the copy is read on a background thread and piped to
+        the csv reader, so memory usage is limited to batch_size rows.
+
+        if the copy export fails, the file is rewritten with write_to_parquet
+
+        :param select_query: query to execute
+        :param write_path: local file path for resulting parquet file
+        :param schema: schema of parquet file from select query, column names
+            must match the query
+        :param batch_size: number of records per parquet row group
+        """
+        process_logger = ProcessLogger(
+            "postgres_copy_to_parquet",
+            batch_size=batch_size,
+            write_path=write_path,
+        )
+        process_logger.log_start()
+
+        copy_sql = f"COPY ({query_to_sql(select_query)}) TO STDOUT WITH (FORMAT csv, HEADER true)"
+        copy_errors: List[Exception] = []
+        read_fd, write_fd = os.pipe()
+        connection = self.engine.raw_connection()
+
+        def copy_out() -> None:
+            try:
+                with open(write_fd, "wb") as copy_file:
+                    # psycopg2 cursor, copy_expert is not part of the dbapi
+                    cursor: Any = connection.cursor()
+                    try:
+                        cursor.copy_expert(copy_sql, copy_file)
+                    finally:
+                        cursor.close()
+            except Exception as exception:
+                copy_errors.append(exception)
+
+        copy_thread = Thread(target=copy_out)
+        copy_thread.start()
+        start_time = time.monotonic()
+        try:
+            # closing the read end stops the copy if parsing fails
+            with open(read_fd, "rb") as csv_file:
+                row_count = copy_csv_to_parquet(csv_file, write_path, schema, batch_size)
+            copy_thread.join()
+            if copy_errors:
+                raise copy_errors[0]
+
+        except Exception as exception:
+            copy_thread.join()
+            process_logger.log_failure(exception)
+            self.write_to_parquet(select_query, write_path, schema, batch_size)
+            return
+
+        finally:
+            connection.rollback()
+            connection.close()
+
+        duration = time.monotonic() - start_time
+        process_logger.add_metadata(
+            row_count=row_count,
+            rows_per_second=int(row_count / max(duration, 1e-6)),
+        )
+        process_logger.log_complete()
+
+    # pylint: enable=R0914
+
     def truncate_table(
         self,
         table_to_truncate: Any,
@@ -492,6 +780,9 @@ def get_unprocessed_files(
     groups files into batches of similar partition paths
     sorts partition paths from oldest to most recent
 
+    paths of fragments appended to a daily gtfs-rt file are returned as the
+    path of the day file, which is read together with its fragments
+
     returns sorted list of path dictionaries with following layout:
     {
         "ids": [metadata table ids],
@@ -508,13 +799,16 @@ def get_unprocessed_files(
         )
         for path_record in db_manager.select_as_list(read_md_log):
             path_id = path_record.get("pk_id")
-            path = str(path_record.get("path"))
+            # fragments of a daily gtfs-rt file are loaded through the day
+            # file and its manifest
+            path = day_path_from_fragment(str(path_record.get("path")))
             path_timestamp = dt_from_obj_path(path).timestamp()
 
             if path_timestamp not in paths_to_load:
                 paths_to_load[path_timestamp] = {"ids": [], "paths": []}
             paths_to_load[path_timestamp]["ids"].append(path_id)
-            paths_to_load[path_timestamp]["paths"].append(path)
+            if path not in paths_to_load[path_timestamp]["paths"]:
+                paths_to_load[path_timestamp]["paths"].append(path)
 
         paths_found = len(paths_to_load)
         paths_returned = paths_found
@@ -531,11 +825,74 @@ def get_unprocessed_files(
     return [paths_to_load[timestamp] for timestamp in sorted(paths_to_load.keys())][:file_limit]
 
 
-def _rds_writer_process(metadata_queue: Queue[Optional[str]]) -> None:
+def drain_metadata_queue(
+    metadata_queue: Queue[Optional[str]],
+    max_paths: int = 500,
+    max_wait_ms: int = 500,
+) -> Tuple[List[str], bool]:
+    """
+    block until a path is available on metadata_queue, then keep collecting
+    paths until max_paths have been received or max_wait_ms has passed since
+    the first one
+
+    :return tuple of (unique paths in order received, True if None was
+        received and the writer should exit after writing the paths)
+    """
+    paths: Dict[str, None] = {}
+
+    metadata_path = metadata_queue.get()
+    deadline = time.monotonic() + max_wait_ms / 1000
+
+    while metadata_path is not None:
+        paths[metadata_path] = None
+        remaining = deadline - time.monotonic()
+        if len(paths) >= max_paths or remaining <= 0:
+            return (list(paths), False)
+        try:
+            metadata_path = metadata_queue.get(timeout=remaining)
+        except Empty:
+            return (list(paths), False)
+
+    return (list(paths), True)
+
+
+def metadata_upsert_statement(metadata_paths: List[str]) -> sa.Insert:
+    """
+    multi-row upsert of paths into the metadata table, existing paths are
+    reset to unprocessed
+
+    paths must be unique, postgres can not update the same row twice in a
+    single INSERT ... ON CONFLICT statement
+    """
+    return (
+        postgresql.insert(MetadataLog.__table__)
+        .values([{"path": metadata_path} for metadata_path in metadata_paths])
+        .on_conflict_do_update(
+            index_elements=[MetadataLog.path],
+            set_={
+                "rail_pm_processed": sa.false(),
+                "rail_pm_process_fail": sa.false(),
+                "created_on": now(),
+            },
+        )
+    )
+
+
+def _rds_writer_process(
+    metadata_queue: Queue[Optional[str]],
+    max_paths: int = 500,
+    max_wait_ms: int = 500,
+    max_backoff_seconds: int = 60,
+) -> None:
     """
     process for writing matadata paths recieved from metadata_queue
 
-    if None recieved from queue, process will exit
+    paths are written in batches of up to max_paths, collected for at most
+    max_wait_ms, with a single multi-row upsert. paths added while a batch is
+    being written wait on the queue for the next batch.
+
+    if None recieved from queue, process will exit after writing the paths
+    received before it
     """
     process_logger = ProcessLogger("rds_writer_process")
     process_logger.log_start()
@@ -550,41 +907,39 @@ def _rds_writer_process(metadata_queue: Queue[Optional[str]]) -> None:
         generate_update_db_password_func(psql_args),
     )
 
-    while True:
-        metadata_path = metadata_queue.get()
-
-        if metadata_path is None:
-            break
-
-        insert_statement = (
-            postgresql.insert(MetadataLog.__table__)
-            .values(path=metadata_path)
-            .on_conflict_do_update(
-                index_elements=[MetadataLog.path],
-                set_={
-                    "rail_pm_processed": sa.false(),
-                    "rail_pm_process_fail": sa.false(),
-                    "created_on": now(),
-                },
-            )
+    exit_writer = False
+    while not exit_writer:
+        metadata_paths, exit_writer = drain_metadata_queue(metadata_queue, max_paths, max_wait_ms)
+
+        if len(metadata_paths) == 0:
+            continue
+
+        insert_statement = metadata_upsert_statement(metadata_paths)
+        insert_logger = ProcessLogger(
+            "metadata_insert",
+            path_count=len(metadata_paths),
+            queue_depth=metadata_queue.qsize(),
         )
-        insert_logger = ProcessLogger("metadata_insert", filepath=metadata_path)
         insert_logger.log_start()
+        flush_start = time.monotonic()
         retry_attempt = 0
 
-        # All metatdata_insert attempts must succeed, keep attempting until success
+        # All metatdata_insert attempts must succeed, keep attempting until
+        # success, backing off exponentially to let gremlins disappear
         while True:
             try:
                 with engine.begin() as cursor:
                     cursor.execute(insert_statement)
 
             except Exception as _:
+                time.sleep(min(max_backoff_seconds, 2**retry_attempt))
                 retry_attempt += 1
-                # wait for gremlins to disappear
-                time.sleep(15)
 
             else:
-                insert_logger.add_metadata(retry_attempts=retry_attempt)
+                insert_logger.add_metadata(
+                    retry_attempts=retry_attempt,
+                    flush_latency_ms=int((time.monotonic() - flush_start) * 1000),
+                )
                 insert_logger.log_complete()
                 break
 
@@ -15,14 +15,16 @@ class VehicleEvents(RpmSqlBase):  # pylint: disable=too-few-public-methods
     Store all of the information that identifies a trip and a stop. Then tie that
     information with timestamp events when a vehicle begins moring to the stop and
     when it arrived at the stop ()
+
+    Range partitioned by month on service_date
     """
 
     __tablename__ = "vehicle_events"
 
-    pm_event_id = sa.Column(sa.Integer, primary_key=True)
+    pm_event_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
 
     # trip identifiers
-    service_date = sa.Column(sa.Integer, nullable=False)
+    service_date = sa.Column(sa.Integer, primary_key=True, nullable=False)
     pm_trip_id = sa.Column(sa.Integer, nullable=False)
 
     # stop identifiers
@@ -49,6 +51,8 @@ class VehicleEvents(RpmSqlBase):  # pylint: disable=too-few-public-methods
 
     updated_on = sa.Column(sa.TIMESTAMP, server_default=now())
 
+    __table_args__ = {"postgresql_partition_by": "RANGE (service_date)"}
+
 
 sa.Index(
     "ix_vehicle_events_composite_1",
@@ -80,14 +84,16 @@ sa.Index(
 class VehicleTrips(RpmSqlBase):  # pylint: disable=too-few-public-methods
     """
     Table that holds GTFS-RT Trips
+
+    Range partitioned by month on service_date
     """
 
     __tablename__ = "vehicle_trips"
 
-    pm_trip_id = sa.Column(sa.Integer, primary_key=True)
+    pm_trip_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
 
     # trip identifiers
-    service_date = sa.Column(sa.Integer, nullable=False)
+    service_date = sa.Column(sa.Integer, primary_key=True, nullable=False)
     trip_id = sa.Column(sa.String(512), nullable=False)
 
     # additional trip information
@@ -126,6 +132,7 @@ class VehicleTrips(RpmSqlBase):  # pylint: disable=too-few-public-methods
             trip_id,
             name="vehicle_trips_unique_trip",
         ),
+        {"postgresql_partition_by": "RANGE (service_date)"},
     )
 
 
@@ -179,6 +186,29 @@ class TempEventCompare(RpmSqlBase):  # pylint: disable=too-few-public-methods
     )
 
 
+class FlatFileDates(RpmSqlBase):  # pylint: disable=too-few-public-methods
+    """
+    Track service dates written to the public flat file archive
+
+    A service date is marked dirty when new events are processed for it, and
+    is cleared when its flat file is written, unless it was marked again
+    during the write (dirty_since holds the time of the latest mark). The
+    content fingerprint of the last written file (see content_fingerprint in
+    flat_file.py) is used to skip uploads of unchanged service dates.
+    """
+
+    __tablename__ = "flat_file_dates"
+
+    service_date = sa.Column(sa.Integer, primary_key=True)
+    dirty = sa.Column(sa.Boolean, nullable=False, default=sa.true())
+    dirty_since = sa.Column(sa.DateTime(timezone=True), nullable=True)
+
+    # details of the last written flat file, used for the archive index
+    content_hash = sa.Column(sa.String(32), nullable=True)
+    last_written = sa.Column(sa.DateTime(timezone=True), nullable=True)
+    size_bytes = sa.Column(sa.BigInteger, nullable=True)
+
+
 class StaticFeedInfo(RpmSqlBase):  # pylint: disable=too-few-public-methods
     """Table for GTFS feed info"""
 
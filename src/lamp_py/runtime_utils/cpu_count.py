@@ -0,0 +1,13 @@
+import os
+
+
+def available_cpu_count() -> int:
+    """
+    number of cores this process may run on. uses the cpu affinity of the
+    process where it is supported (linux), otherwise the number of cores of
+    the machine.
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+
+    return os.cpu_count() or 1
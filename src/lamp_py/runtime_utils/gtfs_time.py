@@ -0,0 +1,154 @@
+from typing import Callable, Union
+
+import numpy
+import pandas
+import polars as pl
+import pyarrow
+
+# timezone service days are defined in, "EST5EDT" has the same rules as
+# "America/New_York" since 2007 and is what existing scalar conversions use
+BOSTON_TZ_NAME = "EST5EDT"
+
+# service days start at 3am local time, times before 3am belong to the
+# previous day's service
+SERVICE_DAY_START_HOUR = 3
+
+# column types accepted by the array level conversions. results are returned
+# with the same type as the input.
+TimeArray = Union[
+    numpy.ndarray,
+    pyarrow.Array,
+    pyarrow.ChunkedArray,
+    pl.Series,
+    pandas.Series,
+]
+
+
+def timestamp_to_local_datetime_expr(timestamp: pl.Expr) -> pl.Expr:
+    """
+    convert a unix timestamp into a naive datetime of the local wall clock time
+    """
+    utc_time = pl.from_epoch(timestamp.cast(pl.Int64), time_unit="s").dt.replace_time_zone("UTC")
+    return utc_time.dt.convert_time_zone(BOSTON_TZ_NAME).dt.replace_time_zone(None)
+
+
+def service_date_from_timestamp_expr(timestamp: pl.Expr) -> pl.Expr:
+    """
+    generate the service date, as a YYYYMMDD int64, from a unix timestamp.
+
+    the local wall clock time is shifted back to the start of the service
+    day, so times before 3am fall on the previous day's service. shifting
+    the wall clock, instead of the timestamp, handles daylight savings
+    transitions.
+    """
+    local_time = timestamp_to_local_datetime_expr(timestamp) - pl.duration(hours=SERVICE_DAY_START_HOUR)
+    return (
+        local_time.dt.year().cast(pl.Int64) * 10000
+        + local_time.dt.month().cast(pl.Int64) * 100
+        + local_time.dt.day().cast(pl.Int64)
+    )
+
+
+def gtfs_time_to_seconds_expr(gtfs_time: pl.Expr) -> pl.Expr:
+    """
+    convert "HH:MM:SS" gtfs time strings to seconds after midnight as int64.
+    hours past 24 are allowed, for trips that run past midnight.
+
+    some older files have the time already formatted as seconds after
+    midnight, those are passed through. values that can not be parsed are
+    null.
+    """
+    gtfs_time = gtfs_time.cast(pl.String)
+    parts = gtfs_time.str.split(":")
+    return (
+        pl.when(parts.list.len() == 3)
+        .then(
+            parts.list.get(0, null_on_oob=True).cast(pl.Int64, strict=False) * 3600
+            + parts.list.get(1, null_on_oob=True).cast(pl.Int64, strict=False) * 60
+            + parts.list.get(2, null_on_oob=True).cast(pl.Int64, strict=False)
+        )
+        .otherwise(gtfs_time.cast(pl.Int64, strict=False))
+    )
+
+
+def service_date_to_datetime_expr(service_date: pl.Expr) -> pl.Expr:
+    """
+    convert a YYYYMMDD service date, as an int or string, to a naive
+    datetime at midnight of the service date
+    """
+    return service_date.cast(pl.String).str.to_datetime("%Y%m%d", time_unit="us")
+
+
+def seconds_to_datetime_expr(service_date: pl.Expr, seconds: pl.Expr) -> pl.Expr:
+    """
+    convert seconds after midnight of a YYYYMMDD service date to a naive
+    local datetime
+    """
+    return service_date_to_datetime_expr(service_date) + pl.duration(seconds=seconds)
+
+
+def start_timestamp_to_seconds_expr(start_timestamp: pl.Expr) -> pl.Expr:
+    """
+    convert a unix timestamp into seconds after local midnight of its service
+    date. seconds are elapsed time, so they include daylight savings
+    transitions between midnight and the timestamp.
+    """
+    start_of_service_day = (
+        service_date_to_datetime_expr(service_date_from_timestamp_expr(start_timestamp))
+        .dt.replace_time_zone(BOSTON_TZ_NAME)
+        .dt.epoch(time_unit="s")
+    )
+    return start_timestamp.cast(pl.Int64) - start_of_service_day
+
+
+def _apply_expr(values: TimeArray, expr: Callable[[pl.Expr], pl.Expr]) -> TimeArray:
+    """
+    evaluate a polars expression on a numpy, arrow, polars or pandas column
+    and return the result as the same type of column
+    """
+    series = values if isinstance(values, pl.Series) else pl.Series(values=values)
+
+    result = pl.DataFrame({"values": series}).select(expr(pl.col("values"))).to_series()
+
+    if isinstance(values, pl.Series):
+        return result.alias(values.name)
+    if isinstance(values, pyarrow.ChunkedArray):
+        return pyarrow.chunked_array([result.to_arrow()])
+    if isinstance(values, pyarrow.Array):
+        return result.to_arrow()
+    if isinstance(values, pandas.Series):
+        converted = result.to_pandas()
+        if result.dtype == pl.Int64:
+            converted = converted.astype("Int64")
+        converted.index = values.index
+        converted.name = values.name
+        return converted
+    return result.to_numpy()
+
+
+def service_dates_from_timestamps(timestamps: TimeArray) -> TimeArray:
+    """array version of service_date_from_timestamp_expr"""
+    return _apply_expr(timestamps, service_date_from_timestamp_expr)
+
+
+def timestamps_to_local_datetimes(timestamps: TimeArray) -> TimeArray:
+    """array version of timestamp_to_local_datetime_expr"""
+    return _apply_expr(timestamps, timestamp_to_local_datetime_expr)
+
+
+def gtfs_times_to_seconds(gtfs_times: TimeArray) -> TimeArray:
+    """array version of gtfs_time_to_seconds_expr"""
+    return _apply_expr(gtfs_times, gtfs_time_to_seconds_expr)
+
+
+def start_timestamps_to_seconds(start_timestamps: TimeArray) -> TimeArray:
+    """array version of start_timestamp_to_seconds_expr"""
+    return _apply_expr(start_timestamps, start_timestamp_to_seconds_expr)
+
+
+def seconds_to_datetimes(service_date: Union[int, str], seconds: TimeArray) -> TimeArray:
+    """
+    array version of seconds_to_datetime_expr, for seconds after midnight of
+    a single service date
+    """
+    return _apply_expr(seconds, lambda column: seconds_to_datetime_expr(pl.lit(str(service_date)), column))
@@ -114,6 +114,10 @@ public_alerts_file = S3Location(
     bucket=S3_PUBLIC,
     prefix=os.path.join(TABLEAU, "alerts", "LAMP_RT_ALERTS.parquet"),
 )
+public_alerts_dataset = S3Location(
+    bucket=S3_PUBLIC,
+    prefix=os.path.join(TABLEAU, "alerts", "LAMP_RT_ALERTS"),
+)
 tableau_rail = S3Location(
     bucket=S3_PUBLIC,
     prefix=os.path.join(TABLEAU, "rail"),
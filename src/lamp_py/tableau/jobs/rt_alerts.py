@@ -1,13 +1,18 @@
 import pyarrow
+from pyarrow import fs
 
-from lamp_py.aws.s3 import download_file
-from lamp_py.performance_manager.alerts import AlertsS3Info
+from lamp_py.performance_manager.alerts import AlertsS3Info, write_alerts_single_file
 from lamp_py.postgres.postgres_utils import DatabaseManager
 from lamp_py.tableau.hyper import HyperJob
 
 
 class HyperRtAlerts(HyperJob):
-    """HyperJob for LAMP Alerts dataset"""
+    """
+    HyperJob for LAMP Alerts dataset
+
+    alerts are published as a month partitioned dataset. this job combines
+    the partitions into the single parquet file used by tableau.
+    """
 
     def __init__(self) -> None:
         HyperJob.__init__(
@@ -22,11 +27,16 @@ class HyperRtAlerts(HyperJob):
         return AlertsS3Info.parquet_schema
 
     def create_parquet(self, _: DatabaseManager) -> None:
-        raise NotImplementedError("Alerts Hyper Job does not create parquet file")
+        write_alerts_single_file(self.local_parquet_path)
 
     def update_parquet(self, _: DatabaseManager) -> bool:
-        download_file(
-            object_path=self.remote_parquet_path,
-            file_name=self.local_parquet_path,
-        )
-        return False
+        # only rebuild the single file if the dataset manifest was updated
+        # after the single file was last written
+        manifest_info = self.remote_fs.get_file_info(AlertsS3Info.manifest_path.replace("s3://", ""))
+        parquet_info = self.remote_fs.get_file_info(self.remote_parquet_path)
+
+        if manifest_info.type == fs.FileType.NotFound or manifest_info.mtime < parquet_info.mtime:
+            return False
+
+        write_alerts_single_file(self.local_parquet_path)
+        return True
@@ -178,7 +178,7 @@ class HyperRtRail(HyperJob):
         if os.path.exists(self.local_parquet_path):
             os.remove(self.local_parquet_path)
 
-        db_manager.write_to_parquet(
+        db_manager.copy_to_parquet(
             select_query=sa.text(create_query),
             write_path=self.local_parquet_path,
             schema=self.parquet_schema,
@@ -77,6 +77,7 @@ def start_parquet_updates(db_manager: DatabaseManager) -> None:
         HyperStaticStops(),
         HyperStaticStopTimes(),
         HyperStaticTrips(),
+        HyperRtAlerts(),
     ]
 
     for job in parquet_update_jobs:
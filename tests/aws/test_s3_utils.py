@@ -13,9 +13,13 @@ import pytest
 
 from botocore.stub import Stubber
 from botocore.stub import ANY
+from moto import mock_aws
 
+from lamp_py.aws.s3 import S3_DELETE_BATCH_SIZE
+from lamp_py.aws.s3 import _jittered_backoff
 from lamp_py.aws.s3 import file_list_from_s3
 from lamp_py.aws.s3 import move_s3_objects
+from lamp_py.aws.s3 import move_s3_objects_async
 
 from ..test_resources import incoming_dir
 
@@ -133,3 +137,51 @@ def test_move_bad_objects(s3_stub, caplog):  # type: ignore
             found_error = True
 
     assert found_error
+
+
+def test_move_s3_objects(monkeypatch):  # type: ignore
+    """
+    test that objects are moved between buckets against a moto s3 stand in,
+    including multiple delete_objects batches and missing source objects
+    """
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    with mock_aws():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket="incoming")
+        s3_client.create_bucket(Bucket="archive")
+
+        keys = [f"lamp/RT_VEHICLE_POSITIONS/{i}.json.gz" for i in range(S3_DELETE_BATCH_SIZE + 50)]
+        for key in keys:
+            s3_client.put_object(Bucket="incoming", Key=key, Body=key.encode())
+
+        missing = "s3://incoming/lamp/RT_VEHICLE_POSITIONS/missing.json.gz"
+        files = [f"s3://incoming/{key}" for key in keys] + [missing]
+
+        with patch("lamp_py.aws.s3._jittered_backoff") as backoff:
+            failed = move_s3_objects(files, "archive/lamp")
+
+        # only the missing object failed, after being retried with backoff
+        assert failed == [missing]
+        assert backoff.call_count == 3
+
+        assert not file_list_from_s3("incoming", "lamp")
+        archived = file_list_from_s3("archive", "lamp")
+        assert sorted(archived) == sorted(f"s3://archive/{key}" for key in keys)
+        assert s3_client.get_object(Bucket="archive", Key=keys[0])["Body"].read() == keys[0].encode()
+
+        # move in the background
+        s3_client.put_object(Bucket="incoming", Key=keys[0], Body=b"")
+        assert move_s3_objects_async([f"s3://incoming/{keys[0]}"], "archive").result() == []
+
+
+def test_jittered_backoff() -> None:
+    """
+    test that the retries of the default max_attempts wait for a window
+    comparable to the previous 3 x 15 second move retries
+    """
+    with patch("lamp_py.aws.s3.time.sleep") as sleep:
+        for retry_attempt in range(3):
+            _jittered_backoff(retry_attempt)
+
+    total_seconds = sum(call.args[0] for call in sleep.call_args_list)
+    assert 26.25 <= total_seconds <= 52.5
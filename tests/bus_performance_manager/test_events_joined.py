@@ -0,0 +1,74 @@
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+import polars as pl
+
+from lamp_py.bus_performance_manager.events_joined import match_plan_trips
+
+SERVICE_START = datetime(2024, 8, 1, 8)
+
+
+def trips_frame(trips: List[Tuple[str, Optional[str], int, int, List[str]]], plan: bool) -> pl.DataFrame:
+    """
+    build a stop level frame from (trip_id, route_id, direction_id, start
+    minute after 8am, stop_ids) tuples, with schedule or RT column names
+    """
+    trip_column = "plan_trip_id" if plan else "trip_id"
+    start_column = "plan_start_dt" if plan else "start_dt"
+    return pl.DataFrame(
+        [
+            {
+                trip_column: trip_id,
+                "route_id": route_id,
+                "direction_id": direction_id,
+                start_column: SERVICE_START.replace(minute=start_minute),
+                "stop_id": stop_id,
+                "stop_sequence": stop_sequence,
+            }
+            for trip_id, route_id, direction_id, start_minute, stop_ids in trips
+            for stop_sequence, stop_id in enumerate(stop_ids)
+        ]
+    )
+
+
+def test_match_plan_trips() -> None:
+    """
+    test that RT trips are matched to plan trips by trip_id, by first stop and
+    closest start, and finally by most stops in common and closest start
+    """
+    schedule = trips_frame(
+        [
+            ("exact", "1", 0, 0, ["a", "b", "c"]),
+            ("first_stop", "1", 0, 10, ["a", "b", "c"]),
+            ("near_few_stops", "2", 0, 20, ["x", "b", "y"]),
+            ("far_many_stops", "2", 0, 40, ["x", "b", "c"]),
+            ("loop", "3", 1, 30, ["l", "m", "l"]),
+        ],
+        plan=True,
+    )
+
+    gtfs = trips_frame(
+        [
+            ("exact", "1", 0, 5, ["a", "b", "c"]),
+            ("added_1", "1", 0, 12, ["a", "c"]),
+            # no shared first stop, most stops in common wins over start time
+            ("added_2", "2", 0, 21, ["b", "c"]),
+            ("added_3", "2", 0, 59, ["c", "b"]),
+            ("added_4", "3", 1, 31, ["z"]),
+            ("no_route", None, 0, 20, ["b", "c"]),
+            ("wrong_direction", "2", 1, 20, ["b", "c"]),
+        ],
+        plan=False,
+    )
+
+    matches = dict(match_plan_trips(gtfs, schedule).iter_rows())
+
+    assert matches == {
+        "exact": "exact",
+        "added_1": "first_stop",
+        "added_2": "far_many_stops",
+        "added_3": "far_many_stops",
+        "added_4": None,
+        "no_route": None,
+        "wrong_direction": None,
+    }
@@ -1,9 +1,17 @@
 from datetime import date
 from unittest import mock
 
+import polars as pl
+import polars.testing as pl_test
+from _pytest.monkeypatch import MonkeyPatch
+
+from lamp_py.bus_performance_manager import gtfs_utils
 from lamp_py.bus_performance_manager.gtfs_utils import (
+    GtfsDateCache,
     bus_routes_for_service_date,
+    gtfs_from_parquet,
 )
+from lamp_py.runtime_utils.remote_files import compressed_gtfs
 
 
 @mock.patch("lamp_py.bus_performance_manager.gtfs_utils.object_exists")
@@ -55,3 +63,38 @@ def test_bus_routes_for_service_date(exists_patch: mock.MagicMock) -> None:
 
     for route in known_routes:
         assert route in bus_routes
+
+
+@mock.patch("lamp_py.bus_performance_manager.gtfs_utils.object_exists")
+def test_gtfs_from_parquet(exists_patch: mock.MagicMock, monkeypatch: MonkeyPatch) -> None:
+    """
+    Test that the active date predicate pushed into the scan returns the same
+    records as filtering the full file, and that tables are read once per
+    service date
+    """
+    exists_patch.return_value = True
+    monkeypatch.setattr(gtfs_utils, "gtfs_date_cache", GtfsDateCache())
+    scan_patch = mock.Mock(wraps=gtfs_utils.scan_gtfs_parquet)
+    monkeypatch.setattr(gtfs_utils, "scan_gtfs_parquet", scan_patch)
+
+    service_date = date(year=2023, month=2, day=1)
+    routes = gtfs_from_parquet("routes", service_date)
+
+    expected = (
+        pl.read_parquet(compressed_gtfs.parquet_path(2023, "routes").s3_uri)
+        .filter(
+            (pl.col("gtfs_active_date") <= 20230201),
+            (pl.col("gtfs_end_date") >= 20230201),
+        )
+        .drop(["gtfs_active_date", "gtfs_end_date"])
+    )
+    assert routes.shape[0] > 0
+    pl_test.assert_frame_equal(routes, expected)
+
+    # bus routes reuse the routes table read for the service date
+    bus_routes_for_service_date(service_date)
+    assert scan_patch.call_count == 1
+
+    # tables of a new service date are read again
+    gtfs_from_parquet("routes", date(year=2023, month=2, day=2))
+    assert scan_patch.call_count == 2
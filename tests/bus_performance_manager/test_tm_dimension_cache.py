@@ -0,0 +1,62 @@
+import os
+import pathlib
+from typing import List
+
+from _pytest.monkeypatch import MonkeyPatch
+
+from lamp_py.bus_performance_manager import tm_dimension_cache as cache_module
+from lamp_py.bus_performance_manager.tm_dimension_cache import TmDimensionCache
+
+ROUTE_FILE = "s3://springboard/TM/TMMAIN_ROUTE.parquet"
+
+
+def test_tm_dimension_cache(monkeypatch: MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """
+    test that dimension files are downloaded at most once per run, are only
+    downloaded again when their s3 version changes, and that lookups are
+    counted
+    """
+    versions = {ROUTE_FILE: "etag-1"}
+    downloads: List[str] = []
+
+    def mock__download_file(object_path: str, file_name: str) -> bool:
+        downloads.append(object_path)
+        with open(file_name, "w", encoding="utf8") as download:
+            download.write(versions[object_path])
+        return True
+
+    monkeypatch.setattr(cache_module, "object_version", versions.get)
+    monkeypatch.setattr(cache_module, "download_file", mock__download_file)
+
+    cache = TmDimensionCache(cache_dir=os.path.join(tmp_path, "tm_dimensions"))
+
+    # first run downloads the file once
+    cache.start_run()
+    local_path = cache.local_path(ROUTE_FILE)
+    assert cache.local_path(ROUTE_FILE) == local_path
+    assert downloads == [ROUTE_FILE]
+
+    # a new run revalidates the unchanged file without downloading it, a
+    # second cache in another process of the same run reuses it
+    cache.start_run()
+    cache.local_path(ROUTE_FILE)
+    other_process_cache = TmDimensionCache(cache_dir=cache.cache_dir)
+    assert other_process_cache.local_path(ROUTE_FILE) == local_path
+    assert other_process_cache.stats.hits == 1
+    assert downloads == [ROUTE_FILE]
+
+    # a changed file is downloaded again in the next run
+    versions[ROUTE_FILE] = "etag-2"
+    cache.local_path(ROUTE_FILE)
+    assert downloads == [ROUTE_FILE]
+    cache.start_run()
+    cache.local_path(ROUTE_FILE)
+    assert downloads == [ROUTE_FILE, ROUTE_FILE]
+    assert pathlib.Path(local_path).read_text(encoding="utf8") == "etag-2"
+
+    assert (cache.stats.hits, cache.stats.revalidated, cache.stats.misses) == (2, 1, 2)
+    assert cache.stats.hit_rate == 3 / 5
+
+    # local files are not cached
+    assert cache.local_path("/tmp/TMMAIN_ROUTE.parquet") == "/tmp/TMMAIN_ROUTE.parquet"
+    assert cache.stats.lookups == 5
@@ -0,0 +1,106 @@
+import os
+import pathlib
+import signal
+import time
+from datetime import date
+from typing import Dict, List, Optional
+
+import polars as pl
+from _pytest.monkeypatch import MonkeyPatch
+
+from lamp_py.bus_performance_manager import write_events
+from lamp_py.bus_performance_manager.write_events import write_service_date, write_service_dates
+
+OUTPUT_DIR_VAR = "TEST_BUS_METRICS_OUTPUT_DIR"
+
+# memory limit of the service date processes, above the memory used by a
+# spawned process importing lamp_py
+MEMORY_LIMIT_MB = 256
+
+
+def write_date_file(service_date: date, gtfs_files: List[str], tm_files: List[str]) -> bool:
+    """
+    fake service date writer. writes the files it was called with, fails for
+    dates without gtfs files, crashes on the 2nd and uses too much memory on
+    the 3rd of the month.
+    """
+    if service_date.day == 2:
+        os.kill(os.getpid(), signal.SIGKILL)
+    if service_date.day == 3:
+        _ = bytearray(2 * MEMORY_LIMIT_MB * 1024 * 1024)
+        time.sleep(60)
+    if len(gtfs_files) == 0:
+        return False
+
+    output_path = os.path.join(os.environ[OUTPUT_DIR_VAR], f"{service_date.strftime('%Y%m%d')}.txt")
+    with open(output_path, "w", encoding="utf8") as output_file:
+        output_file.write("\n".join(gtfs_files + tm_files))
+    return True
+
+
+def event_files(days: List[int]) -> Dict[date, Dict[str, List[str]]]:
+    """event files for service dates in january 2024"""
+    return {
+        date(2024, 1, day): {
+            "gtfs_rt": [f"rt/{day}/{hour}.parquet" for hour in range(day % 4)],
+            "transit_master": [f"tm/{day}.parquet"],
+        }
+        for day in days
+    }
+
+
+def written_files(output_dir: pathlib.Path) -> Dict[str, str]:
+    """contents of every file written by write_date_file"""
+    return {path.name: path.read_text(encoding="utf8") for path in output_dir.iterdir()}
+
+
+def test_write_service_dates(monkeypatch: MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """
+    test that writing service dates in parallel matches writing them serially
+    and that failing, crashing and oversized service dates don't impact the
+    others
+    """
+    serial_dir = tmp_path / "serial"
+    parallel_dir = tmp_path / "parallel"
+    serial_dir.mkdir()
+    parallel_dir.mkdir()
+
+    files = event_files([1, 4, 5, 6, 7, 8, 9])
+
+    monkeypatch.setenv(OUTPUT_DIR_VAR, str(serial_dir))
+    serial_failed = [
+        service_date
+        for service_date, date_files in files.items()
+        if not write_date_file(service_date, date_files["gtfs_rt"], date_files["transit_master"])
+    ]
+
+    monkeypatch.setenv(OUTPUT_DIR_VAR, str(parallel_dir))
+    parallel_failed = write_service_dates(
+        event_files([1, 2, 3, 4, 5, 6, 7, 8, 9]),
+        process_count=3,
+        memory_limit_mb=MEMORY_LIMIT_MB,
+        write_date=write_date_file,
+    )
+
+    assert serial_failed == [date(2024, 1, 4), date(2024, 1, 8)]
+    assert parallel_failed == [date(2024, 1, day) for day in (2, 3, 4, 8)]
+    assert written_files(parallel_dir) == written_files(serial_dir)
+    assert len(written_files(serial_dir)) == 5
+
+
+def test_write_service_date_failed_upload(monkeypatch: MonkeyPatch) -> None:
+    """
+    test that a service date whose file could not be uploaded is failed
+    """
+    uploads: List[str] = []
+
+    def mock__upload_file(file_name: str, object_path: str, extra_args: Optional[Dict] = None) -> bool:
+        _ = (file_name, extra_args)
+        uploads.append(os.path.basename(object_path))
+        return False
+
+    monkeypatch.setattr(write_events, "bus_performance_metrics", lambda *_: pl.DataFrame({"route_id": ["1"]}))
+    monkeypatch.setattr(write_events, "upload_file", mock__upload_file)
+
+    assert not write_service_date(date(2024, 1, 1), ["rt/1/0.parquet"], ["tm/1.parquet"])
+    assert uploads == ["20240101.parquet"]
@@ -18,6 +18,27 @@ import pyarrow.dataset as pd
 from .test_resources import LocalS3Location
 
 
+def pytest_addoption(parser: pytest.Parser) -> None:
+    """add an option to run the tests marked as benchmarks"""
+    parser.addoption(
+        "--benchmark",
+        action="store_true",
+        default=False,
+        help="run slow performance benchmarks",
+    )
+
+
+def pytest_collection_modifyitems(config: pytest.Config, items: List[pytest.Item]) -> None:
+    """skip tests marked as benchmarks unless --benchmark is set"""
+    if config.getoption("--benchmark"):
+        return
+
+    skip_benchmark = pytest.mark.skip(reason="benchmark, run with --benchmark")
+    for item in items:
+        if "benchmark" in item.keywords:
+            item.add_marker(skip_benchmark)
+
+
 @pytest.fixture(autouse=True, name="get_pyarrow_dataset_patch")
 def fixture_get_pyarrow_dataset_patch(
     monkeypatch: MonkeyPatch,
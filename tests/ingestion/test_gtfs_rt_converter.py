@@ -1,13 +1,31 @@
+import gzip
+import json
 import os
+import shutil
+import time
 from queue import Queue
 from unittest.mock import patch
 
+import pyarrow
 from pyarrow import fs
+import pyarrow.compute as pc
+import pyarrow.dataset as pd
+import pyarrow.parquet as pq
 import pandas
 
+from lamp_py.aws.day_manifest import (
+    SUPERSEDED_GRACE_SECONDS,
+    expand_day_paths,
+    read_day_manifest,
+)
 from lamp_py.ingestion.convert_gtfs_rt import GtfsRtConverter
 from lamp_py.ingestion.converter import ConfigType
-from lamp_py.ingestion.utils import flatten_schema
+from lamp_py.ingestion.utils import (
+    GTFS_RT_HASH_COL,
+    flatten_schema,
+    has_current_gtfs_rt_hash,
+    hash_gtfs_rt_table,
+)
 
 from ..test_resources import (
     incoming_dir,
@@ -101,6 +119,46 @@ def drop_list_columns(table: pandas.DataFrame) -> pandas.DataFrame:
     return table
 
 
+def test_decode_feed_matches_pylist() -> None:
+    """
+    test that decoding feeds with the pyarrow json reader produces the same
+    tables as loading them with the json module and pyarrow.Table.from_pylist
+    """
+    feeds = {
+        ConfigType.RT_VEHICLE_POSITIONS: "2022-01-01T00:00:03Z_https_cdn.mbta.com_realtime_VehiclePositions_enhanced.json.gz",
+        ConfigType.RT_ALERTS: "2022-05-04T15:59:48Z_https_cdn.mbta.com_realtime_Alerts_enhanced.json.gz",
+        ConfigType.RT_TRIP_UPDATES: "2022-05-08T06:04:57Z_https_cdn.mbta.com_realtime_TripUpdates_enhanced.json.gz",
+        ConfigType.BUS_VEHICLE_POSITIONS: "2022-05-05T16_00_15Z_https_mbta_busloc_s3.s3.amazonaws.com_prod_VehiclePositions_enhanced.json.gz",
+        ConfigType.BUS_TRIP_UPDATES: "2022-06-28T10_03_18Z_https_mbta_busloc_s3.s3.amazonaws.com_prod_TripUpdates_enhanced.json.gz",
+    }
+
+    for config_type, feed_file in feeds.items():
+        converter = GtfsRtConverter(config_type, metadata_queue=Queue())
+
+        with gzip.open(os.path.join(incoming_dir, feed_file), "rb") as file:
+            feed_bytes = file.read()
+
+        json_data = json.loads(feed_bytes)
+        expected = pyarrow.Table.from_pylist(json_data["entity"], schema=converter.detail.import_schema)
+
+        feed_timestamp, table = converter.decode_feed(feed_bytes)
+
+        assert feed_timestamp == json_data["header"]["timestamp"]
+        assert table.schema.equals(expected.schema)
+        assert table.equals(expected)
+
+    # values that only from_pylist will coerce fall back to the json module
+    converter = GtfsRtConverter(ConfigType.RT_VEHICLE_POSITIONS, metadata_queue=Queue())
+    feed_bytes = json.dumps(
+        {
+            "header": {"timestamp": 1640995202},
+            "entity": [{"id": "1", "vehicle": {"current_stop_sequence": 4.0}}],
+        }
+    ).encode()
+    _, table = converter.decode_feed(feed_bytes)
+    assert table.column("vehicle").to_pylist()[0]["current_stop_sequence"] == 4
+
+
 def test_vehicle_positions_file_conversion() -> None:
     """
     TODO - convert a dummy json data to parquet and check that the new file
@@ -330,3 +388,242 @@ def test_bus_trip_updates_file_conversion() -> None:
 
     compare_result = np_df.compare(parquet_df, align_axis=1)
     assert compare_result.shape[0] == 0, f"{compare_result}"
+
+
+def test_write_local_pq_dedup(tmp_path: str) -> None:
+    """
+    test that writing the same records to a local parquet file twice does not
+    duplicate them, and that local files hashed with an older hash scheme are
+    re-hashed before being merged
+    """
+    gtfs_rt_file = os.path.join(
+        incoming_dir,
+        "2022-05-08T06:04:57Z_https_cdn.mbta.com_realtime_TripUpdates_enhanced.json.gz",
+    )
+    converter = GtfsRtConverter(ConfigType.RT_TRIP_UPDATES, metadata_queue=Queue())
+    converter.thread_init()
+    _, _, table = converter.gz_to_pyarrow(gtfs_rt_file)
+    table = converter.detail.transform_for_write(table).drop_columns(["year", "month", "day"])
+
+    local_path = os.path.join(tmp_path, "day.parquet")
+
+    with (
+        patch("lamp_py.ingestion.convert_gtfs_rt.file_list_from_s3", return_value=[]),
+        patch("lamp_py.ingestion.convert_gtfs_rt.upload_file"),
+    ):
+        converter.write_local_pq(table, local_path)
+        assert has_current_gtfs_rt_hash(pq.read_schema(local_path))
+        assert pq.read_metadata(local_path).num_rows == table.num_rows
+
+        # same records from a later feed are de-duplicated
+        later_table = table.set_column(
+            table.column_names.index("feed_timestamp"),
+            "feed_timestamp",
+            pc.add(table.column("feed_timestamp"), pyarrow.scalar(30, pyarrow.uint64())),
+        )
+        converter.write_local_pq(later_table, local_path)
+        assert pq.read_metadata(local_path).num_rows == table.num_rows
+
+        # replace hashes with unversioned legacy values, they should be
+        # migrated when the file is next loaded
+        legacy = pq.read_table(local_path).drop_columns(GTFS_RT_HASH_COL)
+        legacy = legacy.append_column(
+            GTFS_RT_HASH_COL,
+            pyarrow.array([str(i).encode() for i in range(legacy.num_rows)], pyarrow.large_binary()),
+        )
+        pq.write_table(legacy, local_path)
+        assert not has_current_gtfs_rt_hash(pq.read_schema(local_path))
+
+        converter.write_local_pq(later_table, local_path)
+        assert has_current_gtfs_rt_hash(pq.read_schema(local_path))
+        assert pq.read_metadata(local_path).num_rows == table.num_rows
+
+
+def test_hash_gtfs_rt_table() -> None:
+    """
+    test that record hashes ignore feed_timestamp and detect changes in nested
+    columns
+    """
+    trip = pyarrow.struct([("trip_id", pyarrow.string()), ("stops", pyarrow.list_(pyarrow.string()))])
+    table = pyarrow.table(
+        {
+            "id": ["a", "a", "a", "b"],
+            "trip": pyarrow.array(
+                [
+                    {"trip_id": "1", "stops": ["x", "y"]},
+                    {"trip_id": "1", "stops": ["x", "y"]},
+                    {"trip_id": "1", "stops": ["x"]},
+                    None,
+                ],
+                trip,
+            ),
+            "feed_timestamp": pyarrow.array([1, 2, 1, 1], pyarrow.uint64()),
+        }
+    )
+
+    hashes = hash_gtfs_rt_table(table).column(GTFS_RT_HASH_COL).to_pylist()
+
+    assert hashes[0] == hashes[1]
+    assert len(set(hashes)) == 3
+    assert all(len(row_hash) == 16 for row_hash in hashes)
+
+    # already hashed tables are returned unchanged
+    hashed = hash_gtfs_rt_table(table)
+    assert hash_gtfs_rt_table(hashed) is hashed
+
+
+# pylint: disable=R0915
+# pylint Too many statements (more than 50)
+def test_append_and_compact_fragments(tmp_path: str) -> None:
+    """
+    test that records are appended to a day as de-duplicated fragments, listed
+    in the day manifest, and that cold fragments are compacted into the day
+    file
+    """
+    springboard = os.path.join(tmp_path, "springboard")
+
+    def local_upload(file_name: str, object_path: str) -> bool:
+        os.makedirs(os.path.dirname(object_path), exist_ok=True)
+        shutil.copy(file_name, object_path)
+        return True
+
+    def local_download(object_path: str, file_name: str) -> bool:
+        shutil.copy(object_path, file_name)
+        return True
+
+    def local_delete(del_obj: str) -> bool:
+        os.remove(del_obj)
+        return True
+
+    gtfs_rt_file = os.path.join(
+        incoming_dir,
+        "2022-05-08T06:04:57Z_https_cdn.mbta.com_realtime_TripUpdates_enhanced.json.gz",
+    )
+    converter = GtfsRtConverter(ConfigType.RT_TRIP_UPDATES, metadata_queue=Queue())
+    converter.tmp_folder = os.path.join(tmp_path, "local")
+    converter.thread_init()
+    _, _, table = converter.gz_to_pyarrow(gtfs_rt_file)
+    table = converter.detail.transform_for_write(table).drop_columns(["year", "month", "day"])
+    table = table.filter(pc.field(converter.detail.partition_column).is_valid())
+
+    def shift_feed_timestamp(seconds: int) -> pyarrow.Table:
+        return table.set_column(
+            table.column_names.index("feed_timestamp"),
+            "feed_timestamp",
+            pc.add(table.column("feed_timestamp"), pyarrow.scalar(seconds, pyarrow.uint64())),
+        )
+
+    day_file = os.path.join("lamp", "RT_TRIP_UPDATES", "year=2022", "month=5", "day=8", "2022-05-08T00:00:00.parquet")
+    local_path = os.path.join(converter.tmp_folder, day_file)
+    s3_path = os.path.join(springboard, day_file)
+
+    with (
+        patch("lamp_py.ingestion.convert_gtfs_rt.S3_SPRINGBOARD", springboard),
+        patch("lamp_py.ingestion.convert_gtfs_rt.file_list_from_s3", return_value=[]),
+        patch("lamp_py.ingestion.convert_gtfs_rt.upload_file", side_effect=local_upload),
+        patch("lamp_py.ingestion.convert_gtfs_rt.download_file", side_effect=local_download),
+        patch("lamp_py.ingestion.convert_gtfs_rt.delete_object", side_effect=local_delete),
+    ):
+        converter.append_local_fragment(table, local_path)
+        # duplicate records inside of the unique window are not appended
+        converter.append_local_fragment(shift_feed_timestamp(60), local_path)
+        # duplicate records outside of the unique window are appended
+        converter.append_local_fragment(shift_feed_timestamp(60 * 60 * 2), local_path)
+
+        manifest = read_day_manifest(s3_path)
+        assert manifest is not None
+        assert not manifest.compacted
+        assert [f.num_rows for f in manifest.fragments] == [table.num_rows, table.num_rows]
+
+        fragment_paths = expand_day_paths([s3_path])
+        assert len(fragment_paths) == 2
+        assert expand_day_paths(fragment_paths) == fragment_paths
+        assert pd.dataset(fragment_paths).count_rows() == table.num_rows * 2
+
+        # every fragment is cold, so the whole day is compacted
+        converter.compact_days()
+
+        manifest = read_day_manifest(s3_path)
+        assert manifest is not None
+        assert manifest.compacted
+        assert not manifest.fragments
+        assert expand_day_paths(fragment_paths) == [s3_path]
+        assert pq.read_metadata(s3_path).num_rows == table.num_rows * 2
+        assert GTFS_RT_HASH_COL not in pq.read_schema(s3_path).names
+
+        # compacted fragments stay on s3 for readers of the previous manifest
+        # until the grace period is over
+        assert [f.name for f in manifest.superseded] == [os.path.basename(path) for path in fragment_paths]
+        converter.compact_days()
+        assert all(os.path.exists(path) for path in fragment_paths)
+
+        with patch("time.time", return_value=time.time() + SUPERSEDED_GRACE_SECONDS + 1):
+            converter.compact_days()
+        manifest = read_day_manifest(s3_path)
+        assert manifest is not None
+        assert not manifest.superseded
+        assert not any(os.path.exists(path) for path in fragment_paths)
+
+        # a fresh local folder is synced from the remote day files
+        shutil.rmtree(converter.tmp_folder)
+        converter.append_local_fragment(shift_feed_timestamp(60 * 60 * 2 + 60), local_path)
+        manifest = read_day_manifest(s3_path)
+        assert manifest is not None
+        assert not manifest.fragments
+
+    # fragments appended while the day file is rewritten stay in the manifest
+    def append_during_upload(file_name: str, object_path: str) -> bool:
+        if object_path == s3_path:
+            converter.append_local_fragment(shift_feed_timestamp(60 * 60 * 6), local_path)
+        return local_upload(file_name, object_path)
+
+    with (
+        patch("lamp_py.ingestion.convert_gtfs_rt.S3_SPRINGBOARD", springboard),
+        patch("lamp_py.ingestion.convert_gtfs_rt.file_list_from_s3", return_value=[]),
+        patch("lamp_py.ingestion.convert_gtfs_rt.upload_file", side_effect=append_during_upload),
+        patch("lamp_py.ingestion.convert_gtfs_rt.download_file", side_effect=local_download),
+        patch("lamp_py.ingestion.convert_gtfs_rt.delete_object", side_effect=local_delete),
+    ):
+        converter.append_local_fragment(shift_feed_timestamp(60 * 60 * 4), local_path)
+        converter.compact_days()
+
+        manifest = read_day_manifest(s3_path)
+        assert manifest is not None
+        assert [f.num_rows for f in manifest.fragments] == [table.num_rows]
+        assert pq.read_metadata(s3_path).num_rows == table.num_rows * 3
+
+
+# pylint: enable=R0915
+
+
+def test_process_pool_decode() -> None:
+    """
+    test that decoding files in a process pool produces the same tables, and
+    the same error files, as decoding them in a thread pool
+    """
+    files = [
+        os.path.join(
+            incoming_dir,
+            "2022-01-01T00:00:03Z_https_cdn.mbta.com_realtime_VehiclePositions_enhanced.json.gz",
+        ),
+        "badfile",
+        os.path.join(
+            incoming_dir,
+            "2022-07-05T12:35:16Z_https_cdn.mbta.com_realtime_VehiclePositions_enhanced.json.gz",
+        ),
+    ]
+
+    tables = {}
+    error_files = {}
+    for decode_processes in (1, 2):
+        converter = GtfsRtConverter(ConfigType.RT_VEHICLE_POSITIONS, metadata_queue=Queue())
+        converter.decode_processes = decode_processes
+        converter.add_files(files)
+
+        tables[decode_processes] = list(converter.process_files())
+        error_files[decode_processes] = converter.error_files
+
+    assert error_files[1] == error_files[2] == ["badfile"]
+    assert len(tables[1]) == len(tables[2]) == 2
+    for thread_table, process_table in zip(tables[1], tables[2]):
+        assert thread_table.equals(process_table)
@@ -3,13 +3,22 @@
 # fixtures work. https://stackoverflow.com/q/59664605
 
 import os
+import pathlib
 from queue import Queue
+from unittest import mock
 import pytest
+from _pytest.monkeypatch import MonkeyPatch
 
+from lamp_py.ingestion import ingest_gtfs
 from lamp_py.ingestion.converter import ConfigType
 from lamp_py.ingestion.error import NoImplException
 from lamp_py.ingestion.error import IgnoreIngestion
 from lamp_py.ingestion.convert_gtfs_rt import GtfsRtConverter
+from lamp_py.ingestion.conversion_scheduler import (
+    ConversionPlan,
+    ConversionScheduler,
+    ConversionStats,
+)
 
 
 TEST_FILE_DIR = os.path.join(os.path.dirname(__file__), "test_files")
@@ -43,3 +52,82 @@ def test_each_config_type() -> None:
 
     with pytest.raises(IgnoreIngestion):
         converter = GtfsRtConverter(ConfigType.LIGHT_RAIL, Queue())
+
+
+def test_conversion_scheduler(tmp_path: pathlib.Path) -> None:
+    """
+    test that conversion plans follow observed rows per file, available
+    memory and the number of files waiting to be converted
+    """
+    scheduler = ConversionScheduler(str(tmp_path))
+    config_type = ConfigType.RT_VEHICLE_POSITIONS
+
+    # defaults are used before any conversions are recorded
+    assert scheduler.stats(config_type) == ConversionStats()
+
+    # 10,000 rows per file at 500 bytes per row, repeated until the moving
+    # averages settle
+    for _ in range(50):
+        scheduler.record(config_type, file_count=10, row_count=100_000, byte_count=50_000_000)
+    stats = scheduler.stats(config_type)
+    assert stats.rows_per_file == pytest.approx(10_000, rel=0.01)
+    assert stats.bytes_per_row == pytest.approx(500, rel=0.01)
+
+    gigabyte = 1024 * 1024 * 1024
+    with mock.patch.object(ConversionScheduler, "memory_budget", return_value=16 * gigabyte):
+        # plenty of memory, tables use the largest size and a backlog raises
+        # the number of tables converted
+        assert scheduler.plan(config_type, 100, 2) == ConversionPlan()
+        plan = scheduler.plan(config_type, 10_000, 2)
+        assert plan.max_table_rows == ConversionScheduler.max_table_rows
+        assert plan.max_tables == 50
+
+        waves = scheduler.schedule({config_type: 10_000, ConfigType.RT_ALERTS: 10})
+        assert waves == [[config_type, ConfigType.RT_ALERTS]]
+        assert scheduler.plans[config_type] == plan
+
+    with mock.patch.object(ConversionScheduler, "memory_budget", return_value=gigabyte):
+        # little memory, tables are shrunk and converters run one at a time
+        plan = scheduler.plan(config_type, 100, 2)
+        assert plan.max_table_rows < ConversionScheduler.max_table_rows
+
+        waves = scheduler.schedule({config_type: 10_000, ConfigType.RT_ALERTS: 10})
+        assert waves == [[config_type], [ConfigType.RT_ALERTS]]
+
+
+def test_start_background_compaction(monkeypatch: MonkeyPatch) -> None:
+    """
+    test that background compactions are started on their own cadence, and
+    never while the previous one is still running
+    """
+    compaction = mock.Mock()
+    compaction.is_alive.return_value = True
+    context = mock.Mock()
+    context.Process.return_value = compaction
+    clock = mock.Mock(return_value=1000.0)
+
+    monkeypatch.setattr(ingest_gtfs, "get_context", mock.Mock(return_value=context))
+    monkeypatch.setattr(ingest_gtfs.time, "monotonic", clock)
+    monkeypatch.setattr(ingest_gtfs, "_compaction_process", None)
+    monkeypatch.setattr(ingest_gtfs, "_compaction_started", None)
+
+    ingest_gtfs.start_background_compaction()
+    assert context.Process.call_count == 1
+    compaction.start.assert_called_once()
+
+    # still running after the interval
+    clock.return_value += ingest_gtfs.COMPACTION_INTERVAL_SECONDS
+    ingest_gtfs.start_background_compaction()
+    assert context.Process.call_count == 1
+
+    # finished before the interval
+    compaction.is_alive.return_value = False
+    clock.return_value = 1000.0 + ingest_gtfs.COMPACTION_INTERVAL_SECONDS / 2
+    ingest_gtfs.start_background_compaction()
+    assert context.Process.call_count == 1
+    compaction.join.assert_called_once()
+
+    # finished, and the interval passed
+    clock.return_value = 1000.0 + ingest_gtfs.COMPACTION_INTERVAL_SECONDS
+    ingest_gtfs.start_background_compaction()
+    assert context.Process.call_count == 2
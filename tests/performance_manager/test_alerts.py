@@ -2,17 +2,32 @@ import random
 import json
 import datetime
 import os
+import pathlib
+import shutil
 
 from typing import List, Tuple, Dict, Optional, Union
+from unittest import mock
 
+import numpy
 import pandas
+import pyarrow
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from _pytest.monkeypatch import MonkeyPatch
 
+from lamp_py.performance_manager import alerts as alerts_module
 from lamp_py.performance_manager.alerts import (
+    AlertIdIndex,
+    AlertParquetHandler,
+    AlertsS3Info,
+    alert_partition_names,
+    write_alerts_single_file,
     extract_alerts,
     transform_translations,
     transform_timestamps,
     explode_active_periods,
     explode_informed_entity,
+    process_alerts,
 )
 from lamp_py.performance_manager.gtfs_utils import BOSTON_TZ
 
@@ -363,37 +378,191 @@ def test_explode_informed_entity() -> None:
             assert set(values) == set(options), f"{column} has different values"
 
 
+ALERTS_TEST_FILE = os.path.join(
+    springboard_dir,
+    "RT_ALERTS",
+    "year=2020",
+    "month=2",
+    "day=9",
+    "hour=1",
+    "6ef6922c20064cb9a8f09a3b3b1d2783-0.parquet",
+)
+
+
 def test_etl() -> None:
     """
     Test that the entire ETL pipeline can be used without throwing and that it
     will be impacted by existing alerts that are passed into the extract_alerts
     function that kicks it off.
     """
-    test_file = os.path.join(
-        springboard_dir,
-        "RT_ALERTS",
-        "year=2020",
-        "month=2",
-        "day=9",
-        "hour=1",
-        "6ef6922c20064cb9a8f09a3b3b1d2783-0.parquet",
-    )
-
-    key_columns = ["id", "last_modified_timestamp"]
-    existing = pandas.DataFrame(columns=key_columns)
+    test_file = ALERTS_TEST_FILE
 
-    alerts = extract_alerts(alert_files=[test_file], existing_id_timestamp_pairs=existing)
+    alerts = extract_alerts(alert_files=[test_file], id_index=AlertIdIndex())
     alerts = transform_translations(alerts)
     alerts = transform_timestamps(alerts)
     alerts = explode_active_periods(alerts)
     alerts = explode_informed_entity(alerts)
 
     # process it a second time with some of the id / lm timestamp pairs to filter against.
-    existing = alerts[key_columns].drop_duplicates().head(5)
-    alerts_2 = extract_alerts(alert_files=[test_file], existing_id_timestamp_pairs=existing)
+    id_index = AlertIdIndex.from_frame(alerts.drop_duplicates(subset=["id", "last_modified_timestamp"]).head(5))
+    alerts_2 = extract_alerts(alert_files=[test_file], id_index=id_index)
     alerts_2 = transform_translations(alerts_2)
     alerts_2 = transform_timestamps(alerts_2)
     alerts_2 = explode_active_periods(alerts_2)
     alerts_2 = explode_informed_entity(alerts_2)
 
     assert len(alerts) > len(alerts_2)
+
+
+def test_alert_id_index(tmp_path: pathlib.Path) -> None:
+    """
+    test that the id index finds new id / last modified timestamp pairs, stays
+    sorted and unique as pairs are added, and round trips through parquet
+    """
+    existing = pandas.DataFrame(
+        {
+            "id": [3, 1, 1, 2, 1],
+            "last_modified_timestamp": pandas.array([30, 10, 11, None, 10], dtype="Int64"),
+        }
+    )
+    id_index = AlertIdIndex.from_frame(existing)
+    assert len(id_index) == 4
+
+    alerts = pandas.DataFrame(
+        {
+            "id": [1, 1, 2, 2, 4],
+            "last_modified_timestamp": pandas.array([11, 12, None, 20, 40], dtype="Int64"),
+        }
+    )
+    assert id_index.is_new(alerts).tolist() == [False, True, False, True, True]
+
+    id_index.add(alerts)
+    assert len(id_index) == 7
+    assert not id_index.is_new(alerts).any()
+    assert (numpy.sort(id_index.pairs) == id_index.pairs).all()
+
+    index_path = os.path.join(tmp_path, "id_index.parquet")
+    id_index.write(index_path)
+    assert (AlertIdIndex.read(index_path).pairs == id_index.pairs).all()
+
+
+def test_alerts_dataset(monkeypatch: MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """
+    test that appending alerts only downloads and uploads the month partitions
+    they belong to, and that the partitions can be combined into a single file
+    """
+    remote_dataset = os.path.join(tmp_path, "remote", "LAMP_RT_ALERTS")
+    os.makedirs(remote_dataset)
+    monkeypatch.setattr(AlertsS3Info, "dataset_path", remote_dataset)
+    monkeypatch.setattr(AlertsS3Info, "manifest_path", os.path.join(remote_dataset, "manifest.json"))
+    monkeypatch.setattr(AlertsS3Info, "id_index_path", os.path.join(remote_dataset, "id_index.parquet"))
+
+    downloads: List[str] = []
+    uploads: List[str] = []
+
+    def mock__download_file(object_path: str, file_name: str) -> bool:
+        if not os.path.exists(object_path):
+            return False
+        downloads.append(os.path.basename(object_path))
+        shutil.copyfile(object_path, file_name)
+        return True
+
+    def mock__upload_file(file_name: str, object_path: str, extra_args: Optional[Dict] = None) -> bool:
+        assert extra_args == {"Metadata": {AlertsS3Info.version_key: AlertsS3Info.file_version}}
+        uploads.append(os.path.basename(object_path))
+        shutil.copyfile(file_name, object_path)
+        return True
+
+    monkeypatch.setattr(alerts_module, "download_file", mock__download_file)
+    monkeypatch.setattr(alerts_module, "upload_file", mock__upload_file)
+
+    alerts = extract_alerts(alert_files=[ALERTS_TEST_FILE], id_index=AlertIdIndex())
+    alerts = transform_translations(alerts)
+    alerts = transform_timestamps(alerts)
+    alerts = explode_active_periods(alerts)
+    alerts = explode_informed_entity(alerts).reset_index(drop=True)
+
+    partition_names = alert_partition_names(
+        pyarrow.Table.from_pandas(alerts, schema=AlertsS3Info.parquet_schema)
+    ).to_pylist()
+    all_partitions = set(partition_names)
+    assert len(all_partitions) > 1
+
+    # write all alerts to an empty dataset
+    handler = AlertParquetHandler(update_alerts=True)
+    handler.append_new_records(alerts)
+    handler.upload_data()
+
+    assert set(uploads) == {f"{name}.parquet" for name in all_partitions} | {"id_index.parquet", "manifest.json"}
+    assert uploads[-1] == "manifest.json"
+
+    # append updated alerts in a single month
+    touched = sorted(all_partitions)[0]
+    new_alerts = alerts[[name == touched for name in partition_names]].copy()
+    new_alerts["last_modified_timestamp"] = new_alerts["last_modified_timestamp"] + 1
+
+    downloads.clear()
+    uploads.clear()
+    handler = AlertParquetHandler(update_alerts=True)
+    assert len(handler.id_index) == len(alerts[["id", "last_modified_timestamp"]].drop_duplicates())
+    handler.append_new_records(new_alerts)
+    handler.upload_data()
+
+    assert downloads == ["manifest.json", "id_index.parquet", f"{touched}.parquet"]
+    assert uploads == [f"{touched}.parquet", "id_index.parquet", "manifest.json"]
+
+    # an index out of sync with the manifest is rebuilt from the partitions
+    os.remove(os.path.join(remote_dataset, "id_index.parquet"))
+    handler = AlertParquetHandler(update_alerts=True)
+    assert len(handler.id_index) == len(alerts[["id", "last_modified_timestamp"]].drop_duplicates()) + len(
+        new_alerts[["id", "last_modified_timestamp"]].drop_duplicates()
+    )
+
+    # combine partitions into a single file, a row group for each month
+    single_file = os.path.join(tmp_path, "single", "alerts.parquet")
+    os.makedirs(os.path.dirname(single_file))
+    assert write_alerts_single_file(single_file) == len(alerts) + len(new_alerts)
+
+    single_table = pq.read_table(single_file)
+    assert single_table.schema.equals(AlertsS3Info.parquet_schema)
+    assert pq.ParquetFile(single_file).metadata.num_row_groups == len(all_partitions)
+    assert pc.count(pc.unique(single_table.column("id"))).as_py() == alerts["id"].nunique()
+
+
+def test_process_alerts_upload(monkeypatch: MonkeyPatch, tmp_path: pathlib.Path) -> None:
+    """
+    test that alerts files are only marked as processed after the dataset,
+    including its manifest, was uploaded
+    """
+    remote_dataset = os.path.join(tmp_path, "remote", "LAMP_RT_ALERTS")
+    monkeypatch.setattr(AlertsS3Info, "dataset_path", remote_dataset)
+    monkeypatch.setattr(AlertsS3Info, "manifest_path", os.path.join(remote_dataset, "manifest.json"))
+    monkeypatch.setattr(AlertsS3Info, "id_index_path", os.path.join(remote_dataset, "id_index.parquet"))
+
+    monkeypatch.setattr(alerts_module, "version_check", mock.Mock(return_value=True))
+    monkeypatch.setattr(
+        alerts_module,
+        "get_alert_files",
+        mock.Mock(return_value=[{"pk_id": 1, "path": ALERTS_TEST_FILE}]),
+    )
+    monkeypatch.setattr(alerts_module, "download_file", mock.Mock(return_value=False))
+
+    # a failed manifest upload leaves the files unprocessed
+    manifest_uploaded = False
+
+    def mock__upload_file(file_name: str, object_path: str, extra_args: Optional[Dict] = None) -> bool:
+        _ = (file_name, extra_args)
+        return manifest_uploaded or object_path != AlertsS3Info.manifest_path
+
+    monkeypatch.setattr(alerts_module, "upload_file", mock__upload_file)
+
+    md_db_manager = mock.Mock()
+    process_alerts(md_db_manager)
+    md_db_manager.execute.assert_not_called()
+
+    manifest_uploaded = True
+    process_alerts(md_db_manager)
+    md_db_manager.execute.assert_called_once()
+    update_params = md_db_manager.execute.call_args.args[0].compile().params
+    assert update_params["rail_pm_processed"] is True
+    assert update_params["pk_id_1"] == [1]
@@ -0,0 +1,86 @@
+import logging
+import os
+import pathlib
+import time
+from typing import List
+
+import numpy
+import pandas
+import pyarrow
+import pyarrow.parquet as pq
+import pytest
+
+from lamp_py.performance_manager.alerts import AlertIdIndex
+
+# a year of alerts, ~600 active alerts updated every ~10 minutes, each
+# exploded into ~8 records by active period and informed entity
+YEAR_START = 1_672_531_200
+MONTH_SECONDS = 30 * 24 * 60 * 60
+PAIRS_PER_MONTH = 600 * 6 * 24 * 30 // 12
+RECORDS_PER_PAIR = 8
+NEW_ALERT_COUNT = 5000
+
+
+def write_year_of_alerts(dataset_path: str, rng: numpy.random.Generator) -> List[str]:
+    """write a monthly partition of synthetic id / timestamp records for a year"""
+    partitions = []
+    for month in range(12):
+        ids = rng.integers(100_000, 700_000, PAIRS_PER_MONTH)
+        timestamps = YEAR_START + month * MONTH_SECONDS + rng.integers(0, MONTH_SECONDS, PAIRS_PER_MONTH)
+        rows = numpy.repeat(numpy.arange(PAIRS_PER_MONTH), RECORDS_PER_PAIR)
+
+        partition = os.path.join(dataset_path, f"{month:02}.parquet")
+        pq.write_table(
+            pyarrow.table({"id": ids[rows], "last_modified_timestamp": timestamps[rows]}),
+            partition,
+        )
+        partitions.append(partition)
+
+    return partitions
+
+
+@pytest.mark.benchmark
+def test_alert_id_index_benchmark(tmp_path: pathlib.Path) -> None:
+    """
+    compare finding new alerts with the id index against scanning the id and
+    timestamp columns of every partition and merging, over a year of
+    synthetic alerts. the index has to find the same new alerts, faster.
+    """
+    rng = numpy.random.default_rng(0)
+    partitions = write_year_of_alerts(str(tmp_path), rng)
+    new_alerts = pandas.DataFrame(
+        {
+            "id": rng.integers(100_000, 700_000, NEW_ALERT_COUNT),
+            "last_modified_timestamp": pandas.array(
+                YEAR_START + rng.integers(0, 12 * MONTH_SECONDS, NEW_ALERT_COUNT), dtype="Int64"
+            ),
+        }
+    )
+
+    # full scan of the dataset, merged with the new alerts
+    scan_start = time.perf_counter()
+    existing = pq.read_table(partitions, columns=["id", "last_modified_timestamp"]).to_pandas().drop_duplicates()
+    merged = pandas.merge(new_alerts, existing, on=["id", "last_modified_timestamp"], how="left", indicator=True)
+    scan_is_new = (merged["_merge"] == "left_only").to_numpy()
+    scan_seconds = time.perf_counter() - scan_start
+
+    index_path = os.path.join(tmp_path, "id_index.parquet")
+    AlertIdIndex.from_frame(existing).write(index_path)
+
+    # id index read, lookup and update
+    index_start = time.perf_counter()
+    id_index = AlertIdIndex.read(index_path)
+    index_is_new = id_index.is_new(new_alerts)
+    id_index.add(new_alerts[index_is_new])
+    index_seconds = time.perf_counter() - index_start
+
+    logging.info(
+        "alerts benchmark: %d records, %d id / timestamp pairs, full scan and merge %.2fs, id index %.3fs",
+        sum(pq.ParquetFile(partition).metadata.num_rows for partition in partitions),
+        len(existing),
+        scan_seconds,
+        index_seconds,
+    )
+
+    assert (index_is_new == scan_is_new).all()
+    assert index_seconds < scan_seconds
@@ -0,0 +1,185 @@
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from unittest import mock
+
+import pandas
+import pytest
+from _pytest.monkeypatch import MonkeyPatch
+
+from lamp_py.performance_manager import flat_file
+from lamp_py.performance_manager.flat_file import (
+    S3Archive,
+    content_fingerprint,
+    write_csv_index,
+    write_flat_files,
+    write_service_date,
+)
+
+
+@pytest.fixture(name="archive_bucket")
+def fixture_archive_bucket(monkeypatch: MonkeyPatch) -> None:
+    """set a public archive bucket name"""
+    monkeypatch.setattr(S3Archive, "BUCKET_NAME", "TEST_GTFS_PUBLIC")
+
+
+def tracked_db_manager(tracked: List[Dict[str, Any]]) -> mock.Mock:
+    """db manager returning tracked flat_file_dates records"""
+    db_manager = mock.Mock()
+    db_manager.select_as_list.return_value = tracked
+    return db_manager
+
+
+def update_values(db_manager: mock.Mock) -> List[Dict[str, Any]]:
+    """values of the flat_file_dates update statements"""
+    return [call.args[0].compile().params for call in db_manager.execute.call_args_list]
+
+
+def test_write_service_date_unchanged(monkeypatch: MonkeyPatch) -> None:
+    """
+    test that a service date with unchanged content is not rewritten
+    """
+    monkeypatch.setattr(flat_file, "daily_table_query", mock.Mock())
+    monkeypatch.setattr(flat_file, "content_fingerprint", mock.Mock(return_value="abc"))
+    write_daily_table = mock.Mock(return_value=1024)
+    monkeypatch.setattr(flat_file, "write_daily_table", write_daily_table)
+
+    dirty_since = datetime(2024, 1, 3, tzinfo=timezone.utc)
+    db_manager = tracked_db_manager(
+        [{"content_hash": "abc", "last_written": datetime(2024, 1, 2), "dirty_since": dirty_since}]
+    )
+
+    assert not write_service_date(db_manager, datetime(2024, 1, 1))
+    write_daily_table.assert_not_called()
+
+    # only the dirty flag is cleared, if the date was not marked again
+    (values,) = update_values(db_manager)
+    assert values["dirty"] is False
+    assert values["dirty_since"] is None
+    assert values["dirty_since_1"] == dirty_since
+    assert "content_hash" not in values
+
+
+def test_write_service_date_changed(monkeypatch: MonkeyPatch) -> None:
+    """
+    test that a service date with changed content is rewritten and its new
+    hash and file size are recorded
+    """
+    monkeypatch.setattr(flat_file, "daily_table_query", mock.Mock())
+    monkeypatch.setattr(flat_file, "content_fingerprint", mock.Mock(return_value="def"))
+    write_daily_table = mock.Mock(return_value=1024)
+    monkeypatch.setattr(flat_file, "write_daily_table", write_daily_table)
+
+    db_manager = tracked_db_manager(
+        [{"content_hash": "abc", "last_written": datetime(2024, 1, 2), "dirty_since": None}]
+    )
+
+    assert write_service_date(db_manager, datetime(2024, 1, 1))
+    write_daily_table.assert_called_once()
+    written_values, dirty_values = update_values(db_manager)
+    assert written_values["content_hash"] == "def"
+    assert written_values["size_bytes"] == 1024
+    assert written_values["last_written"] is not None
+    assert "dirty" not in written_values
+    assert dirty_values["dirty"] is False
+
+
+def test_content_fingerprint(monkeypatch: MonkeyPatch) -> None:
+    """
+    test that the content fingerprint changes with the static version key and
+    with the record counts and latest updates of events and trips
+    """
+    static_version_key = mock.Mock(return_value=1)
+    monkeypatch.setattr(flat_file, "static_version_key_from_service_date", static_version_key)
+
+    record = {
+        "event_count": 100,
+        "events_updated_on": datetime(2024, 1, 2, 3, 4, 5),
+        "trip_count": 10,
+        "trips_updated_on": datetime(2024, 1, 2, 3, 4, 5),
+    }
+    fingerprint = content_fingerprint(tracked_db_manager([record]), 20240101)
+
+    assert len(fingerprint) == 32
+    assert content_fingerprint(tracked_db_manager([dict(record)]), 20240101) == fingerprint
+
+    changes: List[Dict[str, Any]] = [
+        {"event_count": 99},
+        {"events_updated_on": datetime(2024, 1, 2, 3, 4, 6)},
+        {"trip_count": 11},
+        {"trips_updated_on": None},
+    ]
+    for change in changes:
+        assert content_fingerprint(tracked_db_manager([{**record, **change}]), 20240101) != fingerprint
+
+    static_version_key.return_value = 2
+    assert content_fingerprint(tracked_db_manager([record]), 20240101) != fingerprint
+
+
+def test_write_csv_index(monkeypatch: MonkeyPatch, archive_bucket: None) -> None:
+    """
+    test that the index csv is built from tracked service dates
+    """
+    _ = archive_bucket
+    db_manager = tracked_db_manager(
+        [
+            {
+                "service_date": 20240101,
+                "size_bytes": 1024,
+                "last_written": datetime(2024, 1, 2, tzinfo=timezone.utc),
+            },
+            {
+                "service_date": 20240102,
+                "size_bytes": 2048,
+                "last_written": datetime(2024, 1, 3, tzinfo=timezone.utc),
+            },
+        ]
+    )
+
+    def mock__upload_file(file_name: str, object_path: str, extra_args: Optional[Dict] = None) -> bool:
+        assert object_path == "TEST_GTFS_PUBLIC/lamp/subway-on-time-performance-v1/index.csv"
+        assert extra_args == {"Metadata": {S3Archive.VERSION_KEY: S3Archive.RPM_VERSION}}
+
+        index_data = pandas.read_csv(file_name)
+        assert list(index_data.columns) == ["size_bytes", "last_modified", "service_date", "file_url"]
+        assert list(index_data["service_date"]) == ["2024-01-01", "2024-01-02"]
+        assert list(index_data["size_bytes"]) == [1024, 2048]
+        assert index_data["file_url"][0] == (
+            "https://performancedata.mbta.com/lamp/subway-on-time-performance-v1/"
+            "2024-01-01-subway-on-time-performance-v1.parquet"
+        )
+        return True
+
+    monkeypatch.setattr(flat_file, "upload_file", mock__upload_file)
+
+    write_csv_index(db_manager)
+
+
+@pytest.mark.parametrize("written,index_count", [([False, True, False], 1), ([False, False, False], 0)])
+def test_write_flat_files(
+    monkeypatch: MonkeyPatch,
+    archive_bucket: None,
+    written: List[bool],
+    index_count: int,
+) -> None:
+    """
+    test that every dirty service date is written, and the index is only
+    rewritten when a flat file was uploaded
+    """
+    _ = archive_bucket
+    service_dates = {datetime(2024, 1, day) for day in (1, 2, 3)}
+
+    monkeypatch.setattr(flat_file, "check_version", mock.Mock())
+    monkeypatch.setattr(flat_file, "seed_flat_file_dates", mock.Mock())
+    monkeypatch.setattr(flat_file, "mark_untracked_dates_dirty", mock.Mock())
+    monkeypatch.setattr(flat_file, "dates_to_update", mock.Mock(return_value=service_dates))
+
+    written_dates = dict(zip(sorted(service_dates), written))
+    write_date = mock.Mock(side_effect=lambda _, service_date: written_dates[service_date])
+    monkeypatch.setattr(flat_file, "write_service_date", write_date)
+    write_index = mock.Mock()
+    monkeypatch.setattr(flat_file, "write_csv_index", write_index)
+
+    write_flat_files(mock.Mock())
+
+    assert {call.args[1] for call in write_date.call_args_list} == service_dates
+    assert write_index.call_count == index_count
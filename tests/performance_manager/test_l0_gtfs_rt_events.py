@@ -1,13 +1,28 @@
 import os
 import pathlib
 
+import pandas
+import polars as pl
+import pyarrow.compute as pc
+
 from lamp_py.performance_manager.l0_rt_vehicle_positions import (
     get_vp_dataframe,
+    get_vp_frame,
     transform_vp_datatypes,
+    transform_vp_frame_datatypes,
+    transform_vp_frame_timestamps,
+    transform_vp_timestamps,
+    vp_frame_to_dataframe,
 )
 from lamp_py.performance_manager.l0_rt_trip_updates import (
+    TRIP_UPDATE_COLUMNS,
     get_and_unwrap_tu_dataframe,
+    latest_trip_updates,
+    merge_latest_trip_updates,
+    reduce_trip_updates,
+    unwrap_tu_batch,
 )
+from lamp_py.aws.s3 import read_parquet_batches
 from lamp_py.performance_manager.gtfs_utils import (
     add_missing_service_dates,
     service_date_from_timestamp,
@@ -54,6 +69,23 @@ def test_service_date_from_timestamp() -> None:
         for timestamp in timestamps:
             assert service_date == service_date_from_timestamp(timestamp)
 
+    # the polars vehicle position transform must agree with the python version
+    vehicle_positions = pl.DataFrame(
+        {
+            "current_status": "STOPPED_AT",
+            "current_stop_sequence": 1,
+            "vehicle_timestamp": [ts for timestamps in dst_expected.values() for ts in timestamps],
+            "start_date": None,
+            "start_time": None,
+            "direction_id": 0,
+            "revenue": None,
+            "vehicle_consist": None,
+            "multi_carriage_details": None,
+        }
+    )
+    service_dates = transform_vp_frame_datatypes(vehicle_positions).get_column("service_date").to_list()
+    assert service_dates == [service_date for service_date, ts in dst_expected.items() for _ in ts]
+
 
 def test_vp_missing_service_date(tmp_path: pathlib.Path) -> None:
     """
@@ -82,6 +114,40 @@ def test_vp_missing_service_date(tmp_path: pathlib.Path) -> None:
     assert not events["service_date"].hasnans
 
 
+def test_vp_frame_transform(tmp_path: pathlib.Path) -> None:
+    """
+    test that the polars vehicle position transform produces the same events
+    as the pandas transform
+    """
+    csv_file = os.path.join(test_files_dir, "vehicle_positions_flat_input.csv")
+
+    parquet_folder = tmp_path.joinpath("RT_VEHICLE_POSITIONS/year=2023/month=5/day=8/hour=11")
+    parquet_folder.mkdir(parents=True)
+    parquet_file = str(parquet_folder.joinpath("flat_file.parquet"))
+
+    csv_to_vp_parquet(csv_file, parquet_file)
+
+    # static schedule columns require a database, use stop ids as parent
+    # stations for both transforms
+    events = get_vp_dataframe(to_load=[parquet_file], route_ids=["Blue"])
+    events = transform_vp_datatypes(events)
+    events = add_missing_service_dates(events, timestamp_key="vehicle_timestamp")
+    events["static_version_key"] = 1
+    events["parent_station"] = events["stop_id"]
+    events = transform_vp_timestamps(events)
+
+    frame = get_vp_frame(to_load=[parquet_file], route_ids=["Blue"])
+    frame = transform_vp_frame_datatypes(frame)
+    frame = frame.with_columns(
+        pl.lit(1, dtype=pl.Int64).alias("static_version_key"),
+        pl.col("stop_id").alias("parent_station"),
+    )
+    frame_events = vp_frame_to_dataframe(transform_vp_frame_timestamps(frame))
+
+    assert frame_events.shape[0] > 0
+    pandas.testing.assert_frame_equal(events[frame_events.columns], frame_events)
+
+
 def test_tu_missing_service_date() -> None:
     """
     test that trip update gtfs data with missing service dates can be processed
@@ -98,3 +164,62 @@ def test_tu_missing_service_date() -> None:
     # check that all service dates exist and are the same
     assert not events["service_date"].hasnans
     assert len(events["service_date"].unique()) == 1
+
+
+def test_tu_batch_unwrap() -> None:
+    """
+    test that the polars trip update unwrap produces the same records as the
+    pandas unwrap, including backfilled service dates
+    """
+    parquet_file = os.path.join(test_files_dir, "tu_missing_start_date.parquet")
+
+    events = get_and_unwrap_tu_dataframe([parquet_file], route_ids=["Blue"])
+    events = add_missing_service_dates(events_dataframe=events, timestamp_key="timestamp")
+
+    filters = pc.field("trip_update.trip.route_id").isin(["Blue"])
+    frame = pl.concat(
+        unwrap_tu_batch(batch)
+        for batch in read_parquet_batches([parquet_file], columns=TRIP_UPDATE_COLUMNS, filters=filters)
+    )
+
+    columns = list(frame.columns)
+    events = events[columns].sort_values(by=columns, ignore_index=True)
+    frame_events = frame.sort(columns).to_pandas().astype(events.dtypes.to_dict())
+
+    assert frame_events.shape[0] > 0
+    pandas.testing.assert_frame_equal(events.astype({"timestamp": "int64"}), frame_events)
+
+
+def test_latest_trip_updates() -> None:
+    """
+    test that reducing trip updates chunk by chunk and reducing them all at
+    once keep the latest prediction for each trip / stop, with ties on
+    timestamp won by the first record read
+    """
+    trip_updates = pl.DataFrame(
+        {
+            "service_date": [20230508] * 6,
+            "route_id": ["Blue"] * 6,
+            "trip_id": ["a", "a", "a", "a", "b", "b"],
+            "parent_station": ["place-wondl"] * 6,
+            "timestamp": [1, 3, 3, 3, 5, 2],
+            "tu_stop_timestamp": [10, 30, 31, 32, 50, 20],
+        }
+    )
+
+    expected = {"a": 30, "b": 50}
+
+    # reduced in a single pass
+    reduced = latest_trip_updates(trip_updates)
+    assert dict(zip(reduced["trip_id"], reduced["tu_stop_timestamp"])) == expected
+
+    # reduced as a running state over chunks
+    latest = None
+    for offset in range(trip_updates.height):
+        latest = merge_latest_trip_updates(latest, latest_trip_updates(trip_updates.slice(offset, 1)))
+    assert latest is not None
+    assert dict(zip(latest["trip_id"], latest["tu_stop_timestamp"])) == expected
+
+    # reduced with pandas
+    reduced_df = reduce_trip_updates(trip_updates.to_pandas())
+    assert dict(zip(reduced_df["trip_id"], reduced_df["tu_stop_timestamp"])) == expected
@@ -0,0 +1,287 @@
+from typing import Any, Dict, List
+
+import pandas
+from _pytest.monkeypatch import MonkeyPatch
+
+from lamp_py.performance_manager import l1_rt_trips
+from lamp_py.performance_manager.l1_rt_trips_fused import (
+    changed_trips,
+    derive_trip_columns,
+    match_backup_trips,
+)
+from lamp_py.runtime_utils.gtfs_time import start_timestamps_to_seconds
+
+
+def trip_record(pm_trip_id: int, route_id: str, **values: Any) -> Dict[str, Any]:
+    """working set trip record with defaults for an untouched trip"""
+    record = {
+        "pm_trip_id": pm_trip_id,
+        "service_date": 20240115,
+        "route_id": route_id,
+        "direction_id": False,
+        "trip_id": f"trip_{pm_trip_id}",
+        "static_version_key": 1,
+        "branch_route_id": None,
+        "trunk_route_id": None,
+        "stop_count": None,
+        "start_time": None,
+        "static_trip_id_guess": None,
+        "static_start_time": None,
+        "static_stop_count": None,
+        "first_last_station_match": False,
+        "direction": None,
+        "direction_destination": None,
+        "max_version_key": 2,
+        "touched": True,
+        "temp_start_time": None,
+        "temp_missing_start_time": True,
+    }
+    record.update(values)
+    return record
+
+
+def working_set() -> pandas.DataFrame:
+    """working set of trips covering each derived column rule"""
+    return pandas.DataFrame(
+        [
+            # scheduled red line trip with exact static match
+            trip_record(1, "Red", temp_start_time=36000, temp_missing_start_time=False, start_time=36000),
+            # added green line trip, no static match
+            trip_record(2, "Green-B", trip_id="ADDED-1"),
+            # scheduled blue line trip without a start time
+            trip_record(3, "Blue"),
+            # trip on the service date without new events
+            trip_record(4, "Orange", touched=False, temp_missing_start_time=None, stop_count=12),
+        ]
+    )
+
+
+def trip_events() -> pandas.DataFrame:
+    """per trip event aggregates"""
+    return pandas.DataFrame(
+        [
+            {
+                "pm_trip_id": 1,
+                "event_stop_count": 10,
+                "first_event_timestamp": 1705330800,
+                "ashmont_stop": True,
+                "braintree_stop": False,
+            },
+            {
+                "pm_trip_id": 2,
+                "event_stop_count": 0,
+                "first_event_timestamp": 1705334400,
+                "ashmont_stop": False,
+                "braintree_stop": False,
+            },
+            {
+                "pm_trip_id": 3,
+                "event_stop_count": 5,
+                "first_event_timestamp": 1705338000,
+                "ashmont_stop": False,
+                "braintree_stop": False,
+            },
+        ]
+    )
+
+
+def static_trip_times() -> pandas.DataFrame:
+    """static schedule trip times"""
+    return pandas.DataFrame(
+        [
+            {
+                "static_version_key": 2,
+                "trip_id": "trip_1",
+                "static_stop_count": 17,
+                "schedule_start_time": 35900,
+                "static_trip_exists": True,
+            },
+            {
+                "static_version_key": 2,
+                "trip_id": "trip_3",
+                "static_stop_count": 12,
+                "schedule_start_time": 40000,
+                "static_trip_exists": True,
+            },
+        ]
+    )
+
+
+def static_directions() -> pandas.DataFrame:
+    """static directions"""
+    return pandas.DataFrame(
+        [
+            {
+                "static_version_key": 2,
+                "route_id": "Red",
+                "direction_id": False,
+                "static_direction": "South",
+                "static_direction_destination": "Ashmont/Braintree",
+            },
+        ]
+    )
+
+
+def test_derive_trip_columns() -> None:
+    """
+    test that derived trip columns follow the individual update function rules
+    """
+    derived = derive_trip_columns(working_set(), trip_events(), static_trip_times(), static_directions())
+    derived = derived.set_index("pm_trip_id")
+
+    # every trip uses the latest static_version_key of its service date
+    assert (derived["static_version_key"] == 2).all()
+
+    # branch and trunk route_id's
+    assert derived.loc[1, "branch_route_id"] == "Red-A"
+    assert derived.loc[1, "trunk_route_id"] == "Red"
+    assert derived.loc[2, "branch_route_id"] == "Green-B"
+    assert derived.loc[2, "trunk_route_id"] == "Green"
+    assert pandas.isna(derived.loc[3, "branch_route_id"])
+    assert derived.loc[3, "trunk_route_id"] == "Blue"
+
+    # stop counts only for trips with vehicle position events
+    assert derived.loc[1, "stop_count"] == 10
+    assert pandas.isna(derived.loc[2, "stop_count"])
+    assert derived.loc[4, "stop_count"] == 12
+
+    # exact match uses real time start time and static stop count
+    assert derived.loc[1, "static_trip_id_guess"] == "trip_1"
+    assert derived.loc[1, "first_last_station_match"]
+    assert derived.loc[1, "static_stop_count"] == 17
+    assert derived.loc[1, "static_start_time"] == 36000
+    assert not derived.loc[3, "first_last_station_match"]
+
+    # start times from the static schedule, or the first event of added trips
+    assert derived.loc[1, "start_time"] == 36000
+    assert derived.loc[3, "start_time"] == 40000
+    assert derived.loc[2, "start_time"] == start_timestamps_to_seconds(pandas.Series([1705334400]))[0]
+
+    assert derived.loc[1, "direction"] == "South"
+    assert derived.loc[1, "direction_destination"] == "Ashmont/Braintree"
+    assert pandas.isna(derived.loc[3, "direction"])
+
+    # trips without new events keep all other values
+    assert pandas.isna(derived.loc[4, "trunk_route_id"])
+    assert pandas.isna(derived.loc[4, "start_time"])
+
+
+def test_derive_trip_columns_without_lookups() -> None:
+    """
+    test that trip columns can be derived without any events or static data
+    """
+    empty_events = pandas.DataFrame(columns=trip_events().columns)
+    empty_times = pandas.DataFrame(columns=static_trip_times().columns)
+    empty_directions = pandas.DataFrame(columns=static_directions().columns)
+
+    derived = derive_trip_columns(working_set(), empty_events, empty_times, empty_directions)
+    derived = derived.set_index("pm_trip_id")
+
+    assert pandas.isna(derived.loc[1, "branch_route_id"])
+    assert not derived.loc[1, "first_last_station_match"]
+    assert pandas.isna(derived.loc[3, "start_time"])
+
+
+def test_match_backup_trips() -> None:
+    """
+    test that backup matches pick the closest static start time on the same
+    route and direction
+    """
+    derived = derive_trip_columns(working_set(), trip_events(), static_trip_times(), static_directions())
+    static_summary = pandas.DataFrame(
+        [
+            {
+                "service_date": 20240115,
+                "static_trip_id": "blue_early",
+                "route_id": "Blue",
+                "direction_id": False,
+                "static_start_time": 30000,
+                "static_stop_count": 12,
+            },
+            {
+                "service_date": 20240115,
+                "static_trip_id": "blue_close",
+                "route_id": "Blue",
+                "direction_id": False,
+                "static_start_time": 40100,
+                "static_stop_count": 11,
+            },
+            {
+                "service_date": 20240115,
+                "static_trip_id": "blue_other_direction",
+                "route_id": "Blue",
+                "direction_id": True,
+                "static_start_time": 40000,
+                "static_stop_count": 12,
+            },
+            {
+                "service_date": 20240115,
+                "static_trip_id": "red_trip",
+                "route_id": "Red-A",
+                "direction_id": False,
+                "static_start_time": 36000,
+                "static_stop_count": 17,
+            },
+        ]
+    )
+
+    matched = match_backup_trips(derived, static_summary).set_index("pm_trip_id")
+
+    assert matched.loc[3, "static_trip_id_guess"] == "blue_close"
+    assert matched.loc[3, "static_start_time"] == 40100
+    assert matched.loc[3, "static_stop_count"] == 11
+    assert not matched.loc[3, "first_last_station_match"]
+
+    # exact matches and trips without new events are not backup matched
+    assert matched.loc[1, "static_trip_id_guess"] == "trip_1"
+    assert pandas.isna(matched.loc[4, "static_trip_id_guess"])
+    # no static trips on the added trip route
+    assert pandas.isna(matched.loc[2, "static_trip_id_guess"])
+
+
+def test_changed_trips() -> None:
+    """
+    test that only trips with changed derived columns are updated
+    """
+    current = working_set()
+    current["static_version_key"] = 2
+    derived = derive_trip_columns(current, trip_events(), static_trip_times(), static_directions())
+
+    updates = changed_trips(current, derived)
+    assert sorted(updates["pm_trip_id"]) == [1, 2, 3]
+
+    # applying the derived values leaves nothing to update
+    assert changed_trips(derived, derived).shape[0] == 0
+
+
+def test_process_trips_switch(monkeypatch: MonkeyPatch) -> None:
+    """
+    test that the RPM_FUSED_TRIPS environment variable picks the fused or
+    the sequential trip path, and that an explicit fused argument wins
+    """
+    calls: List[str] = []
+    monkeypatch.setattr(l1_rt_trips, "process_trips_fused", lambda _: calls.append("fused"))
+    monkeypatch.setattr(l1_rt_trips, "update_static_version_key", lambda _: calls.append("sequential"))
+    for update_function in [
+        "update_branch_trunk_route_id",
+        "update_trip_stop_counts",
+        "update_prev_next_trip_stop",
+        "update_static_trip_id_guess_exact",
+        "update_start_times",
+        "update_directions",
+        "update_stop_sequence",
+        "update_backup_static_trip_id",
+    ]:
+        monkeypatch.setattr(l1_rt_trips, update_function, lambda _: None)
+
+    monkeypatch.delenv("RPM_FUSED_TRIPS", raising=False)
+    l1_rt_trips.process_trips(None)
+
+    monkeypatch.setenv("RPM_FUSED_TRIPS", "true")
+    l1_rt_trips.process_trips(None)
+    l1_rt_trips.process_trips(None, fused=False)
+
+    monkeypatch.setenv("RPM_FUSED_TRIPS", "false")
+    l1_rt_trips.process_trips(None)
+
+    assert calls == ["sequential", "fused", "sequential", "sequential"]
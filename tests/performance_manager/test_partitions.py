@@ -0,0 +1,84 @@
+from typing import Any, Dict, List
+from unittest import mock
+
+from lamp_py.performance_manager.partitions import (
+    create_partition_statement,
+    create_service_date_partitions,
+    detach_partitions_before,
+    month_bounds,
+    months_between,
+    partition_name,
+    service_date_month,
+)
+
+
+def test_month_bounds() -> None:
+    """
+    test that month partitions cover every service date of the month
+    """
+    assert service_date_month(20240229) == 202402
+    assert month_bounds(202402) == (20240201, 20240301)
+    assert month_bounds(202312) == (20231201, 20240101)
+
+    assert months_between(20231115, 20240203) == [202311, 202312, 202401, 202402]
+    assert months_between(20240203, 20240203) == [202402]
+    assert not months_between(20240301, 20240203)
+
+    assert partition_name("vehicle_events", 202402) == "vehicle_events_202402"
+    assert create_partition_statement("vehicle_trips", 202312) == (
+        "CREATE TABLE IF NOT EXISTS vehicle_trips_202312 "
+        "PARTITION OF vehicle_trips "
+        "FOR VALUES FROM (20231201) TO (20240101);"
+    )
+
+
+def fake_partitions(existing: List[str]) -> Any:
+    """build a select_as_list replacement returning existing partition names"""
+
+    def select_as_list(select_query: Any) -> List[Dict[str, Any]]:
+        table_name = select_query.whereclause.right.value
+        return [{"partition_name": name} for name in existing if name.startswith(f"{table_name}_2")]
+
+    return select_as_list
+
+
+def test_create_service_date_partitions() -> None:
+    """
+    test that only missing partitions are created
+    """
+    db_manager = mock.Mock()
+    db_manager.select_as_list.side_effect = fake_partitions(["vehicle_events_202402", "vehicle_trips_202402"])
+
+    create_service_date_partitions(db_manager, [20240201, 20240229, 20240301])
+
+    statements = [str(call.args[0]) for call in db_manager.execute.call_args_list]
+    assert statements == [
+        create_partition_statement("vehicle_events", 202403),
+        create_partition_statement("vehicle_trips", 202403),
+    ]
+
+
+def test_detach_partitions_before() -> None:
+    """
+    test that only partitions holding earlier months are detached
+    """
+    db_manager = mock.Mock()
+    db_manager.select_as_list.side_effect = fake_partitions(
+        [
+            "vehicle_events_202311",
+            "vehicle_events_202312",
+            "vehicle_events_202401",
+            "vehicle_trips_202312",
+            "vehicle_trips_202401",
+        ]
+    )
+
+    detached = detach_partitions_before(db_manager, 20240115)
+
+    assert detached == ["vehicle_events_202311", "vehicle_events_202312", "vehicle_trips_202312"]
+    statements = [str(call.args[0]) for call in db_manager.execute.call_args_list]
+    assert statements == [
+        "ALTER TABLE vehicle_events DETACH PARTITION vehicle_events_202311;",
+        "ALTER TABLE vehicle_events DETACH PARTITION vehicle_events_202312;",
+        "ALTER TABLE vehicle_trips DETACH PARTITION vehicle_trips_202312;",
+    ]
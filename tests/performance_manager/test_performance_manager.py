@@ -41,8 +41,11 @@ from lamp_py.performance_manager.l0_rt_vehicle_positions import (
     transform_vp_timestamps,
     process_vp_files,
 )
+from lamp_py.performance_manager.l1_rt_metrics import update_metrics_columns
+from lamp_py.performance_manager.l1_rt_trips import process_trips
 from lamp_py.postgres.metadata_schema import MetadataLog
 from lamp_py.postgres.rail_performance_manager_schema import (
+    FlatFileDates,
     StaticCalendar,
     StaticRoutes,
     StaticStops,
@@ -69,6 +72,7 @@ from lamp_py.performance_manager.gtfs_utils import (
     add_parent_station_column,
     rail_routes_from_filepath,
 )
+from lamp_py.performance_manager.schedule_cache import static_schedule_cache
 
 from ..test_resources import springboard_dir, test_files_dir, csv_to_vp_parquet
 
@@ -125,6 +129,8 @@ def fixture_rpm_db_manager() -> DatabaseManager:
     db_name = os.getenv("ALEMBIC_DB_NAME", "performance_manager_prod")
     alembic_downgrade_to_base(db_name)
     alembic_upgrade_to_head(db_name)
+    # schedule lookups cached against a previous database are no longer valid
+    static_schedule_cache.invalidate()
     return db_manager
 
 
@@ -243,7 +249,7 @@ def fixture_flat_file_s3_patch(monkeypatch: MonkeyPatch) -> Iterator[None]:
 
     def mock__file_list_from_s3_with_details(bucket_name: str, file_prefix: str) -> List[Dict]:
         """
-        this is used to write the index csv in the flat file
+        this is used to seed the flat file dates table from the archive
         """
         assert bucket_name == test_archive_value
         assert file_prefix == "lamp/subway-on-time-performance-v1"
@@ -279,7 +285,14 @@ def fixture_flat_file_s3_patch(monkeypatch: MonkeyPatch) -> Iterator[None]:
                 index_data["file_url"].str.endswith("index.csv")
             ).any(), 'Found a record with filepath value "index.csv"'
 
-            assert len(index_data) == 2, "index.csv has incorrect length"
+            # archived dates seed the flat file dates table, and remain in the index
+            # alongside the newly written service date
+            assert len(index_data) == 3, "index.csv has incorrect length"
+            assert set(index_data["service_date"]) == {
+                "2023-04-06",
+                "2023-04-07",
+                "2023-05-08",
+            }, "index.csv has incorrect service dates"
 
         def inspect_parquet(filepath: str) -> None:
             flat_data = pandas.read_parquet(filepath)
@@ -502,6 +515,7 @@ def test_gtfs_rt_processing(
     caplog.set_level(logging.INFO)
     rpm_db_manager.truncate_table(VehicleEvents, restart_identity=True)
     rpm_db_manager.truncate_table(VehicleTrips, restart_identity=True)
+    rpm_db_manager.truncate_table(FlatFileDates)
 
     md_db_manager.execute(sa.delete(MetadataLog.__table__).where(~MetadataLog.path.contains("FEED_INFO")))
 
@@ -666,6 +680,94 @@ def test_vp_and_tu(
     check_logs(caplog)
 
 
+def test_incremental_metrics(
+    rpm_db_manager: DatabaseManager,
+    md_db_manager: DatabaseManager,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    """
+    test that metrics updated incrementally over multiple event loops match
+    a full recompute of each service date
+    """
+    caplog.set_level(logging.INFO)
+
+    rpm_db_manager.truncate_table(VehicleEvents, restart_identity=True)
+    rpm_db_manager.truncate_table(VehicleTrips, restart_identity=True)
+    md_db_manager.execute(sa.delete(MetadataLog.__table__).where(~MetadataLog.path.contains("FEED_INFO")))
+
+    # process each hour of files in a separate event loop
+    for hour in ("hour=12", "hour=13"):
+        seed_metadata(md_db_manager, [p for p in test_files() if hour in p])
+        process_gtfs_rt_files(rpm_db_manager=rpm_db_manager, md_db_manager=md_db_manager)
+
+    metrics_select = sa.select(
+        VehicleEvents.pm_event_id,
+        VehicleEvents.travel_time_seconds,
+        VehicleEvents.dwell_time_seconds,
+        VehicleEvents.headway_branch_seconds,
+        VehicleEvents.headway_trunk_seconds,
+    ).order_by(VehicleEvents.pm_event_id)
+    incremental_metrics = rpm_db_manager.select_as_list(metrics_select)
+    assert len(incremental_metrics) > 0
+
+    service_date_query = sa.select(
+        VehicleTrips.service_date,
+        VehicleTrips.static_version_key,
+    ).distinct()
+    for result in rpm_db_manager.select_as_list(service_date_query):
+        update_metrics_columns(
+            db_manager=rpm_db_manager,
+            seed_service_date=int(result["service_date"]),
+            static_version_key=int(result["static_version_key"]),
+            incremental=False,
+        )
+
+    assert incremental_metrics == rpm_db_manager.select_as_list(metrics_select)
+
+    check_logs(caplog)
+
+
+def test_fused_process_trips(
+    rpm_db_manager: DatabaseManager,
+    md_db_manager: DatabaseManager,
+    caplog: pytest.LogCaptureFixture,
+) -> None:
+    """
+    test that trips and events processed by each individual trip update
+    function are not changed by running process_trips_fused
+    """
+    caplog.set_level(logging.INFO)
+
+    rpm_db_manager.truncate_table(VehicleEvents, restart_identity=True)
+    rpm_db_manager.truncate_table(VehicleTrips, restart_identity=True)
+    md_db_manager.execute(sa.delete(MetadataLog.__table__).where(~MetadataLog.path.contains("FEED_INFO")))
+
+    seed_metadata(md_db_manager, [p for p in test_files() if "hour=12" in p])
+    process_gtfs_rt_files(rpm_db_manager=rpm_db_manager, md_db_manager=md_db_manager)
+
+    trips_select = sa.select(VehicleTrips.__table__).order_by(VehicleTrips.pm_trip_id)
+    events_select = sa.select(
+        VehicleEvents.pm_event_id,
+        VehicleEvents.previous_trip_stop_pm_event_id,
+        VehicleEvents.next_trip_stop_pm_event_id,
+        VehicleEvents.canonical_stop_sequence,
+        VehicleEvents.sync_stop_sequence,
+    ).order_by(VehicleEvents.pm_event_id)
+
+    staged_trips = rpm_db_manager.select_as_dataframe(trips_select).drop(columns=["updated_on"])
+    staged_events = rpm_db_manager.select_as_list(events_select)
+    assert staged_trips.shape[0] > 0
+
+    # temp_event_compare still holds the events of the last processed files
+    process_trips(rpm_db_manager, fused=True)
+
+    fused_trips = rpm_db_manager.select_as_dataframe(trips_select).drop(columns=["updated_on"])
+    pandas.testing.assert_frame_equal(staged_trips, fused_trips)
+    assert staged_events == rpm_db_manager.select_as_list(events_select)
+
+    check_logs(caplog)
+
+
 def test_missing_start_time(
     rpm_db_manager: DatabaseManager,
     md_db_manager: DatabaseManager,
@@ -0,0 +1,182 @@
+from datetime import datetime
+from typing import Any, Dict, List
+from unittest import mock
+
+import pytest
+
+from lamp_py.performance_manager.schedule_cache import StaticScheduleCache
+
+FEED_INFO: List[Dict[str, Any]] = [
+    # archived schedule, feed_active_date after its feed_start_date
+    {
+        "static_version_key": 1,
+        "feed_start_date": 20240101,
+        "feed_end_date": 20240331,
+        "feed_active_date": 20240201,
+        "created_on": datetime(2024, 1, 1),
+    },
+    {
+        "static_version_key": 2,
+        "feed_start_date": 20240301,
+        "feed_end_date": 20240531,
+        "feed_active_date": 20240305,
+        "created_on": datetime(2024, 3, 1),
+    },
+    # reissue of the same schedule, created later
+    {
+        "static_version_key": 3,
+        "feed_start_date": 20240301,
+        "feed_end_date": 20240531,
+        "feed_active_date": 20240305,
+        "created_on": datetime(2024, 3, 2),
+    },
+]
+
+STOPS = [
+    {"static_version_key": 2, "stop_id": "70061", "parent_station": "place-alfcl"},
+    {"static_version_key": 3, "stop_id": "70061", "parent_station": "place-alfcl"},
+    {"static_version_key": 3, "stop_id": "Alewife-01", "parent_station": None},
+]
+
+
+def fake_select_as_list(select_query: Any) -> List[Dict[str, Any]]:
+    """return rows for the table a cache query selects from"""
+    if "feed_info_count" in select_query.selected_columns.keys():
+        return [
+            {
+                "max_static_version_key": max(row["static_version_key"] for row in FEED_INFO),
+                "feed_info_count": len(FEED_INFO),
+            }
+        ]
+
+    table_name = select_query.get_final_froms()[0].name
+    if table_name == "static_feed_info":
+        return FEED_INFO
+    if table_name == "static_routes":
+        return [{"route_id": "Red"}, {"route_id": "Blue"}]
+
+    keys = select_query.whereclause.right.value
+    return [stop for stop in STOPS if stop["static_version_key"] in keys]
+
+
+def test_static_version_key() -> None:
+    """
+    test that static version keys are matched from cached feed info with the
+    live and archive rules, and that the feed info is only validated and
+    selected once
+    """
+    cache = StaticScheduleCache()
+    db_manager = mock.Mock()
+    db_manager.select_as_list.side_effect = fake_select_as_list
+
+    # live match, latest created_on for the same active date
+    assert cache.static_version_key(20240310, db_manager) == 3
+    # live match, only schedule with an active date before the service date
+    assert cache.static_version_key(20240215, db_manager) == 1
+    # archive match, no schedule active yet
+    assert cache.static_version_key(20240110, db_manager) == 1
+    assert cache.static_version_key(20240310, db_manager) == 3
+
+    with pytest.raises(IndexError):
+        cache.static_version_key(20250101, db_manager)
+
+    assert db_manager.select_as_list.call_count == 2
+    assert cache.stats() == {
+        "cache_static_version_key_hits": 1,
+        "cache_static_version_key_misses": 4,
+        "cache_validation_hits": 0,
+        "cache_validation_misses": 1,
+    }
+
+    # invalidating drops cached data, but keeps the counts
+    cache.invalidate()
+    assert cache.static_version_key(20240310, db_manager) == 3
+    assert db_manager.select_as_list.call_count == 3
+    assert cache.misses["static_version_key"] == 5
+
+
+def test_validate() -> None:
+    """
+    test that the cache is dropped when a schedule is loaded by another
+    process, and kept while static_feed_info is unchanged
+    """
+    cache = StaticScheduleCache()
+    db_manager = mock.Mock()
+    db_manager.select_as_list.side_effect = fake_select_as_list
+
+    assert cache.static_version_key(20240310, db_manager) == 3
+
+    # unchanged feed info keeps cached lookups
+    cache.validate(db_manager, force=True)
+    assert cache.version_keys == {20240310: 3}
+
+    # checks are skipped within VALIDATION_SECONDS
+    new_schedule = {**FEED_INFO[2], "static_version_key": 4, "created_on": datetime(2024, 3, 3)}
+    with mock.patch.dict(FEED_INFO[2], new_schedule):
+        assert cache.static_version_key(20240310, db_manager) == 3
+
+        cache.validate(db_manager, force=True)
+        assert not cache.version_keys
+        assert cache.static_version_key(20240310, db_manager) == 4
+
+    assert cache.hits["validation"] == 1
+    assert cache.misses["validation"] == 2
+
+
+def test_rail_routes_and_parent_stations() -> None:
+    """
+    test that route ids and parent stations are cached per static version key
+    """
+    cache = StaticScheduleCache()
+    db_manager = mock.Mock()
+    db_manager.select_as_list.side_effect = fake_select_as_list
+
+    assert cache.rail_routes(3, db_manager) == ["Red", "Blue"]
+    assert cache.rail_routes(3, db_manager) == ["Red", "Blue"]
+    assert db_manager.select_as_list.call_count == 2
+
+    assert cache.stop_parent_stations([3], db_manager).to_pylist() == STOPS[1:]
+    # only the missing version key is selected
+    assert cache.stop_parent_stations([2, 3], db_manager).to_pylist() == STOPS
+    assert db_manager.select_as_list.call_count == 4
+    assert cache.stop_parent_stations([], db_manager).num_rows == 0
+
+    assert cache.stats() == {
+        "cache_parent_stations_hits": 1,
+        "cache_parent_stations_misses": 2,
+        "cache_rail_routes_hits": 1,
+        "cache_rail_routes_misses": 1,
+        "cache_validation_hits": 0,
+        "cache_validation_misses": 1,
+    }
+
+
+def test_invalidate_during_lookup() -> None:
+    """
+    test that lookups return what they fetched when another thread
+    invalidates the cache while they select from the database, and that
+    values fetched during an invalidation are not stored
+    """
+    cache = StaticScheduleCache()
+    db_manager = mock.Mock()
+    db_manager.select_as_list.side_effect = fake_select_as_list
+
+    assert cache.stop_parent_stations([3], db_manager).to_pylist() == STOPS[1:]
+
+    def invalidating_select_as_list(select_query: Any) -> List[Dict[str, Any]]:
+        rows = fake_select_as_list(select_query)
+        if "feed_info_count" not in select_query.selected_columns.keys():
+            cache.invalidate()
+        return rows
+
+    db_manager.select_as_list.side_effect = invalidating_select_as_list
+
+    # the cached version key 3 is dropped while version key 2 is selected
+    assert cache.stop_parent_stations([2, 3], db_manager).to_pylist() == STOPS
+    assert cache.static_version_key(20240310, db_manager) == 3
+    assert cache.rail_routes(3, db_manager) == ["Red", "Blue"]
+
+    assert cache.feed_info is None
+    assert not cache.version_keys
+    assert not cache.rail_route_ids
+    assert not cache.parent_stations
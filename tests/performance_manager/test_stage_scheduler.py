@@ -0,0 +1,148 @@
+import time
+from typing import List
+
+import pytest
+
+from lamp_py.performance_manager.stage_scheduler import Stage, StageScheduler
+
+
+def noop() -> None:
+    """stage target that does nothing"""
+
+
+def fail() -> None:
+    """stage target that raises"""
+    raise ValueError("stage failure")
+
+
+def sleep(seconds: float) -> None:
+    """stage target that takes a while"""
+    time.sleep(seconds)
+
+
+def fast_loop_stages() -> List[Stage]:
+    """stages mirroring the performance manager fast loop"""
+    return [
+        Stage("static", noop, interval=60, worker="events"),
+        Stage("rt", noop, depends_on=["static"], worker="events", deadline=600),
+        Stage("flat_files", noop, depends_on=["rt"]),
+        Stage("alerts", noop, interval=60),
+    ]
+
+
+def test_stage_validation() -> None:
+    """
+    test that stages need an interval or dependencies on known stages
+    """
+    with pytest.raises(ValueError):
+        StageScheduler([Stage("no_schedule", noop)])
+
+    with pytest.raises(ValueError):
+        StageScheduler([Stage("rt", noop, depends_on=["static"])])
+
+
+def test_dependency_order() -> None:
+    """
+    test that stages run after their dependencies and independent stages run
+    concurrently
+    """
+    scheduler = StageScheduler(fast_loop_stages())
+
+    # static and rt share a worker, only stages without dependencies start
+    assert scheduler.runnable(0) == ["static", "alerts"]
+    scheduler.mark_started("static", 0)
+    scheduler.mark_started("alerts", 0)
+    assert not scheduler.runnable(1)
+
+    # a failed dependency doesn't start its dependents
+    scheduler.mark_finished("static", 5, success=False)
+    assert not scheduler.runnable(5)
+
+    scheduler.mark_started("static", 60)
+    scheduler.mark_finished("static", 65, success=True)
+    assert scheduler.runnable(65) == ["rt"]
+    scheduler.mark_started("rt", 65)
+
+    # flat files wait for rt, alerts keep their own cadence
+    scheduler.mark_finished("alerts", 100, success=True)
+    assert scheduler.runnable(100) == ["alerts"]
+    scheduler.mark_started("alerts", 100)
+    scheduler.mark_finished("rt", 110, success=True)
+    assert scheduler.runnable(110) == ["flat_files"]
+    scheduler.mark_started("flat_files", 110)
+
+    # rt runs again after the next static run, while flat files are written
+    assert scheduler.runnable(120) == ["static"]
+    scheduler.mark_started("static", 120)
+    scheduler.mark_finished("static", 121, success=True)
+    assert scheduler.runnable(121) == ["rt"]
+
+
+def test_queue_lag() -> None:
+    """
+    test that the time a stage waits for its worker is reported as queue lag
+    """
+    scheduler = StageScheduler(fast_loop_stages()[:2])
+
+    assert scheduler.mark_started("static", 0) == 0.0
+    scheduler.mark_finished("static", 10, success=True)
+    scheduler.mark_started("rt", 10)
+
+    # static is due at 60, but its worker is busy with rt until 90
+    assert not scheduler.runnable(60)
+    scheduler.mark_finished("rt", 90, success=True)
+    assert scheduler.runnable(90) == ["static"]
+    assert scheduler.mark_started("static", 90) == 30.0
+
+
+def test_deadlines() -> None:
+    """
+    test that stages past their deadline are reported as overdue
+    """
+    scheduler = StageScheduler(fast_loop_stages())
+    scheduler.mark_started("static", 0)
+    scheduler.mark_finished("static", 1, success=True)
+    scheduler.mark_started("rt", 1)
+
+    assert not scheduler.overdue(600)
+    assert scheduler.overdue(602) == ["rt"]
+
+
+def test_worker_processes() -> None:
+    """
+    test that stages run in worker processes and that stages past their
+    deadline have their worker restarted
+    """
+    scheduler = StageScheduler(
+        [
+            Stage("noop", noop, interval=60),
+            Stage("fail", fail, interval=60),
+            Stage("slow", sleep, {"seconds": 60}, interval=60, deadline=1),
+        ]
+    )
+
+    try:
+        for worker_name in ("noop", "fail", "slow"):
+            scheduler.start_worker(worker_name)
+        for stage_name in scheduler.runnable(scheduler.clock()):
+            scheduler.start(stage_name)
+
+        slow_worker = scheduler.workers["slow"]
+        wait_until = time.monotonic() + 60
+        while time.monotonic() < wait_until and any(
+            state.running_since is not None for state in scheduler.state.values()
+        ):
+            time.sleep(0.25)
+            scheduler.collect_results()
+            scheduler.enforce_deadlines()
+
+        assert scheduler.state["noop"].last_success is not None
+        assert scheduler.state["fail"].last_success is None
+        assert scheduler.state["slow"].last_success is None
+        assert scheduler.state["fail"].running_since is None
+        assert scheduler.state["slow"].running_since is None
+
+        assert not slow_worker.is_alive()
+        assert scheduler.workers["slow"].is_alive()
+    finally:
+        scheduler.shutdown(timeout=10)
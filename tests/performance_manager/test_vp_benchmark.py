@@ -0,0 +1,98 @@
+import logging
+import os
+import pathlib
+import shutil
+import time
+from typing import List
+
+import pandas
+import polars as pl
+import pytest
+
+from lamp_py.performance_manager.l0_rt_vehicle_positions import (
+    get_vp_dataframe,
+    get_vp_frame,
+    transform_vp_datatypes,
+    transform_vp_frame_datatypes,
+    transform_vp_frame_timestamps,
+    transform_vp_timestamps,
+    vp_frame_to_dataframe,
+)
+from lamp_py.performance_manager.gtfs_utils import add_missing_service_dates
+
+from ..test_resources import springboard_dir
+
+RAIL_ROUTES = [
+    "Blue",
+    "Green-B",
+    "Green-C",
+    "Green-D",
+    "Green-E",
+    "Mattapan",
+    "Orange",
+    "Red",
+]
+
+# each springboard vehicle position file is an hour of rail vehicle
+# positions, copy them to get closer to the size of a full day
+FILE_COPIES = 6
+
+
+def copy_springboard_vp_files(tmp_path: pathlib.Path) -> List[str]:
+    """copy the springboard vehicle position files into tmp_path FILE_COPIES times"""
+    vp_dir = os.path.join(springboard_dir, "RT_VEHICLE_POSITIONS")
+    paths = []
+    for root, _, files in os.walk(vp_dir):
+        for filename in files:
+            hour_folder = tmp_path.joinpath(os.path.relpath(root, springboard_dir))
+            hour_folder.mkdir(parents=True, exist_ok=True)
+            for copy in range(FILE_COPIES):
+                path = str(hour_folder.joinpath(f"{copy}-{filename}"))
+                shutil.copyfile(os.path.join(root, filename), path)
+                paths.append(path)
+
+    return sorted(paths)
+
+
+@pytest.mark.benchmark
+def test_vp_transform_benchmark(tmp_path: pathlib.Path) -> None:
+    """
+    compare building vehicle events from the springboard vehicle position
+    files with the pandas and polars transforms. static schedule columns
+    require a database, stop ids are used as parent stations for both. the
+    polars transform has to build the same events, faster.
+    """
+    paths = copy_springboard_vp_files(tmp_path)
+
+    pandas_start = time.perf_counter()
+    events = get_vp_dataframe(to_load=paths, route_ids=RAIL_ROUTES)
+    vp_count = events.shape[0]
+    events = transform_vp_datatypes(events)
+    events = add_missing_service_dates(events, timestamp_key="vehicle_timestamp")
+    events["static_version_key"] = 1
+    events["parent_station"] = events["stop_id"]
+    events = transform_vp_timestamps(events)
+    pandas_seconds = time.perf_counter() - pandas_start
+
+    polars_start = time.perf_counter()
+    frame = get_vp_frame(to_load=paths, route_ids=RAIL_ROUTES)
+    frame = transform_vp_frame_datatypes(frame)
+    frame = frame.with_columns(
+        pl.lit(1, dtype=pl.Int64).alias("static_version_key"),
+        pl.col("stop_id").alias("parent_station"),
+    )
+    frame_events = vp_frame_to_dataframe(transform_vp_frame_timestamps(frame))
+    polars_seconds = time.perf_counter() - polars_start
+
+    logging.info(
+        "vehicle positions benchmark: %d files, %d vehicle positions, %d events, pandas %.2fs, polars %.2fs",
+        len(paths),
+        vp_count,
+        frame_events.shape[0],
+        pandas_seconds,
+        polars_seconds,
+    )
+
+    assert frame_events.shape[0] > 0
+    pandas.testing.assert_frame_equal(events[frame_events.columns], frame_events)
+    assert polars_seconds < pandas_seconds
@@ -0,0 +1,217 @@
+import io
+import pathlib
+from datetime import date, datetime
+from queue import Queue
+from typing import Optional
+
+import numpy
+import pandas
+import pyarrow
+import pyarrow.csv
+import pyarrow.parquet as pq
+import pytest
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from lamp_py.postgres.metadata_schema import MetadataLog
+from lamp_py.postgres.rail_performance_manager_schema import TempEventCompare
+from lamp_py.postgres.postgres_utils import (
+    copy_csv_to_parquet,
+    dataframe_to_copy_table,
+    drain_metadata_queue,
+    metadata_upsert_statement,
+    query_to_sql,
+)
+
+
+def test_drain_metadata_queue() -> None:
+    """
+    test that metadata paths are drained from the queue in batches, without
+    duplicates, until the None sentinel is received
+    """
+    metadata_queue: Queue[Optional[str]] = Queue()
+    for path in ["a", "b", "a", "c", "d", "e"]:
+        metadata_queue.put(path)
+
+    # batch size limit
+    assert drain_metadata_queue(metadata_queue, max_paths=3) == (["a", "b", "c"], False)
+
+    # queue emptied before the wait time limit
+    assert drain_metadata_queue(metadata_queue, max_wait_ms=10) == (["d", "e"], False)
+
+    # paths received before the sentinel are still returned
+    metadata_queue.put("f")
+    metadata_queue.put(None)
+    metadata_queue.put("g")
+    assert drain_metadata_queue(metadata_queue) == (["f"], True)
+
+    metadata_queue = Queue()
+    metadata_queue.put(None)
+    assert drain_metadata_queue(metadata_queue) == ([], True)
+
+
+def test_metadata_upsert_statement() -> None:
+    """
+    test that a batch of paths is written in a single upsert statement
+    """
+    statement = metadata_upsert_statement(["a", "b", "c"])
+    compiled = statement.compile(dialect=postgresql.dialect())
+
+    assert str(compiled).count("INSERT INTO") == 1
+    assert "ON CONFLICT (path) DO UPDATE" in str(compiled)
+    assert [compiled.params[f"path_m{i}"] for i in range(3)] == ["a", "b", "c"]
+
+
+def test_copy_csv_to_parquet(tmp_path: pathlib.Path) -> None:
+    """
+    test that postgres COPY csv output is parsed into the parquet schema,
+    matching the values of the row by row export
+    """
+    schema = pyarrow.schema(
+        [
+            ("service_date", pyarrow.date32()),
+            ("start_datetime", pyarrow.timestamp("us")),
+            ("static_datetime", pyarrow.timestamp("us")),
+            ("stop_sequence", pyarrow.int16()),
+            ("stop_id", pyarrow.string()),
+            ("direction", pyarrow.bool_()),
+        ]
+    )
+    # columns are out of schema order, and include one not in the schema
+    copy_output = (
+        b"stop_id,service_date,extra,start_datetime,static_datetime,stop_sequence,direction\n"
+        b'"70061",2024-05-08,1,2024-05-08 16:00:00+00,2024-05-08 12:00:00,1,t\n'
+        b'"",2024-05-08,2,2024-05-08 16:00:01.5-04,,,f\n'
+        b'"line\nbreak",2024-05-09,3,,2024-05-09 00:00:00,3,\n'
+    )
+    write_path = str(tmp_path.joinpath("copy.parquet"))
+
+    row_count = copy_csv_to_parquet(io.BytesIO(copy_output), write_path, schema, batch_size=2)
+    table = pq.read_table(write_path)
+
+    assert row_count == 3
+    assert table.schema == schema
+    assert table.to_pylist() == [
+        {
+            "service_date": date(2024, 5, 8),
+            "start_datetime": datetime(2024, 5, 8, 16, 0, 0),
+            "static_datetime": datetime(2024, 5, 8, 12, 0, 0),
+            "stop_sequence": 1,
+            "stop_id": "70061",
+            "direction": True,
+        },
+        {
+            "service_date": date(2024, 5, 8),
+            "start_datetime": datetime(2024, 5, 8, 20, 0, 1, 500000),
+            "static_datetime": None,
+            "stop_sequence": None,
+            "stop_id": "",
+            "direction": False,
+        },
+        {
+            "service_date": date(2024, 5, 9),
+            "start_datetime": None,
+            "static_datetime": datetime(2024, 5, 9, 0, 0, 0),
+            "stop_sequence": 3,
+            "stop_id": "line\nbreak",
+            "direction": None,
+        },
+    ]
+
+    # rows are written in row groups of batch_size
+    assert pq.ParquetFile(write_path).metadata.num_row_groups == 2
+
+
+def test_query_to_sql() -> None:
+    """
+    test that queries are rendered for COPY with inline parameters and
+    without trailing semicolons
+    """
+    assert query_to_sql(sa.text(" SELECT * FROM metadata_log WHERE path LIKE '%parquet';\n")) == (
+        "SELECT * FROM metadata_log WHERE path LIKE '%parquet'"
+    )
+
+    select_query = sa.select(MetadataLog.path).where(
+        MetadataLog.path.like("%RT_ALERTS%"),
+        MetadataLog.rail_pm_processed == sa.false(),
+    )
+    sql = query_to_sql(select_query)
+    assert "LIKE '%RT_ALERTS%'" in sql
+    assert "rail_pm_processed = false" in sql
+
+    text_query = sa.text("SELECT * FROM metadata_log WHERE path = :path").bindparams(path="a'b.parquet")
+    assert query_to_sql(text_query) == "SELECT * FROM metadata_log WHERE path = 'a''b.parquet'"
+
+    with pytest.raises(ValueError):
+        query_to_sql(sa.text("SELECT * FROM metadata_log WHERE path = :path"))
+
+
+def test_dataframe_to_copy_table() -> None:
+    """
+    test that dataframes are converted to the column types of their table
+    for COPY, with python side defaults filled in
+    """
+    events = pandas.DataFrame(
+        {
+            "service_date": [20240508, 20240508],
+            "trip_id": ["trip_1", "trip_2"],
+            "stop_sequence": [1.0, numpy.nan],
+            "stop_id": ["70061", "70063"],
+            "parent_station": ["place-alfcl", ""],
+            "vp_move_timestamp": pandas.Series([1715184000, None], dtype="Int64"),
+            "direction_id": [True, False],
+            "vehicle_consist": ["1234|1235", None],
+            "not_a_column": [1, 2],
+        }
+    )
+
+    copy_table = dataframe_to_copy_table(events, TempEventCompare.__table__)
+
+    # defaults for do_update, do_insert and new_trip are filled in, pk_id
+    # is left to its sequence and extra columns are dropped
+    assert copy_table.column_names == [
+        "do_update",
+        "do_insert",
+        "new_trip",
+        "service_date",
+        "trip_id",
+        "stop_sequence",
+        "stop_id",
+        "parent_station",
+        "vp_move_timestamp",
+        "direction_id",
+        "vehicle_consist",
+    ]
+    assert copy_table.schema.field("stop_sequence").type == pyarrow.int16()
+    assert copy_table.schema.field("service_date").type == pyarrow.int32()
+    assert copy_table.to_pylist()[1] == {
+        "do_update": False,
+        "do_insert": False,
+        "new_trip": False,
+        "service_date": 20240508,
+        "trip_id": "trip_2",
+        "stop_sequence": None,
+        "stop_id": "70063",
+        "parent_station": "",
+        "vp_move_timestamp": None,
+        "direction_id": False,
+        "vehicle_consist": None,
+    }
+
+    # nulls are written as empty values and empty strings are quoted, which
+    # is how COPY csv tells them apart
+    csv_buffer = io.BytesIO()
+    pyarrow.csv.write_csv(copy_table, csv_buffer)
+    assert csv_buffer.getvalue().decode().split("\n")[2] == ('false,false,false,20240508,"trip_2",,"70063","",,false,')
+
+    # integer and all null values are loaded into string columns, floats are
+    # not written as their text representation
+    events["trip_id"] = [1, 2]
+    events["vehicle_consist"] = [None, None]
+    copy_table = dataframe_to_copy_table(events, TempEventCompare.__table__)
+    assert copy_table.column("trip_id").to_pylist() == ["1", "2"]
+    assert copy_table.column("vehicle_consist").to_pylist() == [None, None]
+
+    events["trip_id"] = [1.0, numpy.nan]
+    with pytest.raises(TypeError):
+        dataframe_to_copy_table(events, TempEventCompare.__table__)
@@ -0,0 +1,107 @@
+from datetime import datetime, timezone
+
+import numpy
+import pandas
+import polars as pl
+import pyarrow
+
+from lamp_py.performance_manager.gtfs_utils import (
+    BOSTON_TZ,
+    service_date_from_timestamp,
+)
+from lamp_py.runtime_utils.gtfs_time import (
+    gtfs_times_to_seconds,
+    seconds_to_datetimes,
+    service_dates_from_timestamps,
+    start_timestamps_to_seconds,
+    timestamps_to_local_datetimes,
+)
+
+# timestamps every 10 minutes through both 2020 daylight savings transitions
+# and a few ordinary days
+TIMESTAMPS = [
+    timestamp
+    for start in (1583625600, 1604188800, 1683547153, 1717200000)
+    for timestamp in range(start, start + 2 * 24 * 3600, 600)
+]
+
+
+def test_service_dates_from_timestamps() -> None:
+    """
+    test that vectorized service dates match the scalar conversion for every
+    supported column type, and that the column type is preserved
+    """
+    expected = [service_date_from_timestamp(timestamp) for timestamp in TIMESTAMPS]
+
+    columns = [
+        numpy.array(TIMESTAMPS),
+        pyarrow.array(TIMESTAMPS),
+        pyarrow.chunked_array([TIMESTAMPS]),
+        pl.Series(TIMESTAMPS),
+        pandas.Series(TIMESTAMPS, dtype="uint64"),
+        pandas.Series(TIMESTAMPS, dtype="Int64"),
+    ]
+    for column in columns:
+        service_dates = service_dates_from_timestamps(column)
+        assert isinstance(service_dates, type(column))
+        assert pl.Series(service_dates).to_list() == expected
+
+    # index is kept for pandas columns
+    timestamps = pandas.Series(TIMESTAMPS, index=range(10, 10 + len(TIMESTAMPS)))
+    assert service_dates_from_timestamps(timestamps).index.equals(timestamps.index)
+
+
+def test_timestamps_to_local_datetimes() -> None:
+    """
+    test that vectorized local datetimes match the scalar timezone conversion
+    and that nulls are kept
+    """
+    expected = [
+        datetime.fromtimestamp(timestamp, tz=timezone.utc).astimezone(BOSTON_TZ).replace(tzinfo=None)
+        for timestamp in TIMESTAMPS
+    ]
+
+    local_datetimes = timestamps_to_local_datetimes(pandas.Series(TIMESTAMPS + [None], dtype="Int64"))
+    assert [value.to_pydatetime() for value in local_datetimes[:-1]] == expected
+    assert pandas.isna(local_datetimes.iloc[-1])
+
+
+def test_start_timestamps_to_seconds() -> None:
+    """
+    test that vectorized seconds after the start of the service day match
+    the seconds since local midnight of the service date
+    """
+    expected = []
+    for timestamp in TIMESTAMPS:
+        service_date = datetime.strptime(str(service_date_from_timestamp(timestamp)), "%Y%m%d")
+        expected.append(timestamp - int(BOSTON_TZ.localize(service_date).timestamp()))
+    assert start_timestamps_to_seconds(pandas.Series(TIMESTAMPS)).tolist() == expected
+
+
+def test_gtfs_times_to_seconds() -> None:
+    """
+    test conversion of gtfs time strings, including times past 24 hours,
+    times already stored as seconds and nulls
+    """
+    gtfs_times = ["07:38:00", "25:10:05", "00:00:00", "4:05:09", "36000", None]
+    expected = [27480, 90605, 0, 14709, 36000, None]
+
+    seconds = gtfs_times_to_seconds(pandas.Series(gtfs_times))
+    assert seconds.dtype == "Int64"
+    assert [None if pandas.isna(value) else value for value in seconds] == expected
+
+    assert gtfs_times_to_seconds(pl.Series(gtfs_times)).to_list() == expected
+
+
+def test_seconds_to_datetimes() -> None:
+    """
+    test conversion of seconds after midnight of a service date to local
+    datetimes
+    """
+    datetimes = seconds_to_datetimes(20240310, pl.Series([0, 36000, 90000]))
+
+    assert datetimes.to_list() == [
+        datetime(2024, 3, 10, 0, 0),
+        datetime(2024, 3, 10, 10, 0),
+        datetime(2024, 3, 11, 1, 0),
+    ]